@@ -1,22 +1,46 @@
-from flask import Flask, render_template, request, jsonify, session, redirect
+from flask import Flask, make_response, render_template, request, jsonify, session, redirect
 import json
 import os
-import secrets
 from flask_cors import CORS
 from routes.api import api_bp
+from routes.bootstrap import bootstrap_json
+from routes.compression import init_compression
+from routes.profiling import init_profiling
+from routes.tracing import init_tracing
+from routes.json_provider import FastJSONProvider
+from routes.state import init_state
+from routes.warmup import init_warmup
 
 app = Flask(__name__)
-# Set a secret key for session management
-app.secret_key = secrets.token_hex(16)
+# Share the session secret key and metrics across workers
+init_state(app)
+# Use the fast JSON serializer for all jsonify() responses
+app.json = FastJSONProvider(app)
 # Enable CORS
-CORS(app, supports_credentials=True)
+CORS(app, supports_credentials=True, expose_headers=['X-Conversation-Id', 'X-Request-Id', 'X-Result-Id', 'X-Profile-Id',
+                                                    'X-Trace-Id', 'traceparent',
+                                                    'X-Dedup-Match', 'X-Dedup-Similarity', 'X-Dedup-Served', 'Retry-After'])
+# Trace every request and put trace ids in logs and response headers
+init_tracing(app)
+# Profile requests when asked by an admin or sampled (registered first so compression is included)
+init_profiling(app)
+# Compress large API responses
+init_compression(app)
+# Pre-resolve and connect to provider hosts if AISPECTRUM_WARMUP is set
+init_warmup(app)
 
 # Register API blueprint
 app.register_blueprint(api_bp)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    # The model catalog and auth state are inlined, so the page can start without API calls
+    response = make_response(render_template('index.html', bootstrap=bootstrap_json()))
+    # Revalidated on every load; an unchanged page (same catalog and session) is a 304
+    response.add_etag()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
 
 @app.route('/login')
 def login_page():
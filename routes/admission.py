@@ -0,0 +1,314 @@
+"""
+Admission control and load shedding for expensive endpoints.
+Each worker admits a limited number of concurrent queries. The limit adapts
+to observed latency: it grows while latency stays near its long-run
+baseline and shrinks when latency climbs, which signals queuing upstream
+or in this process. Requests over the limit wait in a bounded queue per
+priority class and are rejected fast with 503 and Retry-After when the
+queue is full or the wait runs out, instead of piling up until the front
+proxy times them out. Optionally, each caller also gets a rate limit held
+in the shared state backend, so it applies across every worker.
+"""
+import collections
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import jsonify, request
+
+from .auth import may_raise_priority, request_owner
+from .error_handler import ERROR_TYPES
+from .metrics import metrics
+from .state import TokenBucket
+from .tracing import current_trace_id
+
+logger = logging.getLogger('aiSpectrum')
+
+# Priority classes, highest first, with the number of requests each may queue
+PRIORITIES = ('high', 'normal', 'low')
+QUEUE_LIMITS = {
+    'high': int(os.environ.get('AISPECTRUM_QUEUE_HIGH', 50)),
+    'normal': int(os.environ.get('AISPECTRUM_QUEUE_NORMAL', 50)),
+    'low': int(os.environ.get('AISPECTRUM_QUEUE_LOW', 10))
+}
+DEFAULT_PRIORITY = 'normal'
+# Longest a request waits in the queue before it is shed
+MAX_QUEUE_WAIT_SECONDS = float(os.environ.get('AISPECTRUM_MAX_QUEUE_WAIT', 10))
+INITIAL_LIMIT = int(os.environ.get('AISPECTRUM_CONCURRENCY_LIMIT', 20))
+MIN_LIMIT = int(os.environ.get('AISPECTRUM_CONCURRENCY_MIN', 2))
+MAX_LIMIT = int(os.environ.get('AISPECTRUM_CONCURRENCY_MAX', 200))
+# Queries each caller may start per minute, across all workers; 0 turns the rate limit off
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('AISPECTRUM_RATE_LIMIT', 0))
+# Queries a caller may start back to back before the per-minute rate applies
+RATE_LIMIT_BURST = int(os.environ.get('AISPECTRUM_RATE_BURST', 10))
+
+
+class OverloadedError(Exception):
+    """Raised when a request is shed instead of admitted."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Request shed ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit driven by the latency gradient
+
+    The long-run average latency is the baseline. Each completed request
+    moves the limit towards limit * baseline / latency (never growing from
+    this term) plus a sqrt(limit) allowance for queueing, so the limit
+    creeps up while latency is steady and backs off when it rises.
+    """
+
+    def __init__(self, initial=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT,
+                 tolerance=1.5, smoothing=0.2, baseline_alpha=0.05):
+        """
+        Initialize the limit
+
+        Args:
+            initial (int): Starting limit
+            min_limit (int): Lowest limit
+            max_limit (int): Highest limit
+            tolerance (float): Latency increase over the baseline tolerated before backing off
+            smoothing (float): Weight of each new estimate in the limit
+            baseline_alpha (float): Weight of each sample in the baseline average
+        """
+        self.value = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_alpha = baseline_alpha
+        self.baseline = None
+
+    def update(self, latency):
+        """
+        Adjust the limit after a request completes
+
+        Args:
+            latency (float): The request's latency in seconds
+
+        Returns:
+            int: The new limit
+        """
+        latency = max(latency, 1e-3)
+        if self.baseline is None:
+            self.baseline = latency
+        else:
+            self.baseline += self.baseline_alpha * (latency - self.baseline)
+        gradient = max(0.5, min(1.0, self.tolerance * self.baseline / latency))
+        estimate = self.value * gradient + math.sqrt(self.value)
+        self.value = self.value * (1 - self.smoothing) + estimate * self.smoothing
+        self.value = max(self.min_limit, min(self.max_limit, self.value))
+        return int(self.value)
+
+    def __int__(self):
+        return int(self.value)
+
+
+class AdmissionController:
+    """Per-worker admission with priority queues and an adaptive concurrency limit."""
+
+    def __init__(self, limit=None, queue_limits=None, max_queue_wait=MAX_QUEUE_WAIT_SECONDS, name='query'):
+        """
+        Initialize the controller
+
+        Args:
+            limit (AdaptiveLimit): Concurrency limit; a new adaptive limit by default
+            queue_limits (dict): Priority -> maximum queued requests
+            max_queue_wait (float): Seconds a request may wait before it is shed
+            name (str): Label for the controller's metrics
+        """
+        self.limit = limit or AdaptiveLimit()
+        self.queue_limits = dict(queue_limits or QUEUE_LIMITS)
+        self.max_queue_wait = max_queue_wait
+        self.name = name
+        self.in_flight = 0
+        self._queues = {priority: collections.deque() for priority in PRIORITIES}
+        self._lock = threading.Lock()
+        self._avg_latency = None
+
+    def _retry_after(self):
+        """Estimate when a shed client should retry, in whole seconds (lock held)."""
+        queued = sum(len(q) for q in self._queues.values())
+        avg = self._avg_latency or 1.0
+        return max(1, min(60, math.ceil((queued + 1) * avg / max(int(self.limit), 1))))
+
+    def _report(self):
+        """Publish the controller's gauges (lock held)."""
+        metrics.set_gauge('admission_in_flight', self.in_flight, controller=self.name)
+        metrics.set_gauge('admission_limit', int(self.limit), controller=self.name)
+        for priority, queue in self._queues.items():
+            metrics.set_gauge('admission_queue_depth', len(queue), controller=self.name, priority=priority)
+
+    def _shed(self, priority, reason):
+        """Count a shed request and build its error (lock held)."""
+        metrics.inc('admission_shed_total', controller=self.name, priority=priority, reason=reason)
+        logger.warning(f"Shedding {priority} {self.name} request: {reason} "
+                       f"(in flight {self.in_flight}, limit {int(self.limit)})")
+        return OverloadedError(reason, self._retry_after())
+
+    def acquire(self, priority=DEFAULT_PRIORITY):
+        """
+        Admit a request, waiting in its priority queue if the limit is reached
+
+        Args:
+            priority (str): 'high', 'normal' or 'low'
+
+        Raises:
+            OverloadedError: If the queue is full or the wait times out
+        """
+        if priority not in self._queues:
+            priority = DEFAULT_PRIORITY
+        start = time.monotonic()
+        with self._lock:
+            if self.in_flight < int(self.limit) and not any(self._queues.values()):
+                self.in_flight += 1
+                metrics.inc('admission_admitted_total', controller=self.name, priority=priority)
+                self._report()
+                return
+            if len(self._queues[priority]) >= self.queue_limits.get(priority, 0):
+                raise self._shed(priority, 'queue_full')
+            waiter = {'event': threading.Event(), 'admitted': False}
+            self._queues[priority].append(waiter)
+            self._report()
+
+        waiter['event'].wait(self.max_queue_wait)
+        with self._lock:
+            if not waiter['admitted']:
+                self._queues[priority].remove(waiter)
+                self._report()
+                raise self._shed(priority, 'queue_timeout')
+        metrics.observe('admission_queue_wait_ms', (time.monotonic() - start) * 1000,
+                        controller=self.name, priority=priority)
+        metrics.inc('admission_admitted_total', controller=self.name, priority=priority)
+
+    def release(self, latency=None):
+        """
+        Free a slot, feed the latency to the limit and admit queued requests
+
+        Args:
+            latency (float): Seconds the request took, or None if it should not
+                influence the limit (e.g. it was cancelled)
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if latency is not None:
+                self.limit.update(latency)
+                self._avg_latency = latency if self._avg_latency is None else \
+                    0.9 * self._avg_latency + 0.1 * latency
+            # Hand free slots to the oldest waiter of the highest priority
+            for priority in PRIORITIES:
+                queue = self._queues[priority]
+                while queue and self.in_flight < int(self.limit):
+                    waiter = queue.popleft()
+                    waiter['admitted'] = True
+                    self.in_flight += 1
+                    waiter['event'].set()
+            self._report()
+
+
+def request_priority():
+    """
+    Read the priority class of the current request from X-Priority or the body
+
+    Anyone may lower their own priority, but only admins (X-Admin-Token) and
+    the users in AISPECTRUM_PRIORITY_USERS may raise it above the default.
+    """
+    priority = request.headers.get('X-Priority')
+    if not priority and request.is_json:
+        priority = (request.get_json(silent=True) or {}).get('priority')
+    if priority not in PRIORITIES:
+        return DEFAULT_PRIORITY
+    if PRIORITIES.index(priority) < PRIORITIES.index(DEFAULT_PRIORITY) and not may_raise_priority():
+        return DEFAULT_PRIORITY
+    return priority
+
+
+def overloaded_response(error):
+    """Build the 503 response for a shed request."""
+    overloaded = ERROR_TYPES['OVERLOADED']
+    response = jsonify({
+        'error': overloaded['message'],
+        'error_code': overloaded['code'],
+        'retry_after': error.retry_after,
+        'timestamp': int(time.time()),
+        'request_id': current_trace_id() or str(uuid.uuid4())
+    })
+    response.status_code = overloaded['status_code']
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+def rate_limited_response(retry_after):
+    """Build the 429 response for a caller over its rate limit."""
+    rate_limit = ERROR_TYPES['RATE_LIMIT']
+    response = jsonify({
+        'error': rate_limit['message'],
+        'error_code': rate_limit['code'],
+        'retry_after': retry_after,
+        'timestamp': int(time.time()),
+        'request_id': current_trace_id() or str(uuid.uuid4())
+    })
+    response.status_code = rate_limit['status_code']
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def rate_limited(name):
+    """
+    Decorator limiting how often each caller may call a view
+
+    Callers are told apart by request_owner (signed-in user or a hash of the
+    provider keys sent), falling back to the client address. The buckets
+    live in the shared state backend. Off unless AISPECTRUM_RATE_LIMIT is set.
+
+    Args:
+        name (str): Name of the limit, so views can be limited separately
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if RATE_LIMIT_PER_MINUTE > 0:
+                data = request.get_json(silent=True) if request.is_json else None
+                caller = request_owner((data or {}).get('api_keys')) or f"addr:{request.remote_addr}"
+                bucket = TokenBucket(f"{name}:{caller}", RATE_LIMIT_PER_MINUTE / 60, RATE_LIMIT_BURST)
+                if not bucket.acquire():
+                    metrics.inc('rate_limited_total', endpoint=name)
+                    return rate_limited_response(math.ceil(60 / RATE_LIMIT_PER_MINUTE))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def admission_controlled(controller):
+    """
+    Decorator admitting each call of a view through an AdmissionController
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            try:
+                controller.acquire(request_priority())
+            except OverloadedError as e:
+                return overloaded_response(e)
+            start = time.monotonic()
+            latency = None
+            try:
+                response = f(*args, **kwargs)
+                latency = time.monotonic() - start
+                return response
+            finally:
+                controller.release(latency)
+        return decorated_function
+    return decorator
+
+
+# Admission for /api/query in this worker
+query_admission = AdmissionController()
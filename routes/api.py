@@ -1,18 +1,49 @@
-from flask import Blueprint, request, jsonify, session
-import anthropic
-import openai
-import requests
+from flask import Blueprint, Response, request, jsonify, session
+import functools
+import hashlib
 import json
 import os
 import time
 import uuid
 import logging
+from . import tracing
+from .metrics import metrics
+from .admission import admission_controlled, query_admission, rate_limited
+from .warmup import warmup_state
+from .profiling import is_admin, list_profiles, load_profile, to_folded
+from .state import CircuitBreaker, cluster_metrics
+from .providers import get_provider
+from .dispatch import (plan_targets, make_plan, apply_budget, run_all, call_samples, positive_number,
+                       validate_budget)
+from .conversations import conversations, DEFAULT_HISTORY_TOKEN_BUDGET
+from .tokens import estimate_tokens
+from .results import result_store
+from .limits import cap_result
+from .rendering import code_css, render_histories, render_results, request_render
+from .latency import latency_key, provider_latency
+from .stats import DEFAULT_WINDOW, check_options, provider_stats
+from .bulkhead import bulkheads
+from .scheduler import request_lane, request_user, scheduler
+from .dedup import answer_params, dedup_index, request_mode, DEFAULT_THRESHOLD as DEDUP_THRESHOLD
+from .error_handler import ERROR_TYPES, handle_api_error, api_error_handler, is_upstream_failure
+from .cancellation import QueryCancelledError, cancellations, cancelled_result, client_disconnected, current_token
 
 # Set up logging
 logger = logging.getLogger('aiSpectrum')
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Consecutive provider failures before calls to it are paused, and for how long
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('AISPECTRUM_BREAKER_FAILURES', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('AISPECTRUM_BREAKER_RESET_SECONDS', 30))
+
+# Query modes: wait for every provider, return after the first k successes,
+# or send a duplicate request for providers slower than their rolling p95
+QUERY_MODES = ('all', 'first_k', 'hedged')
+DEFAULT_FIRST_K = 2
+# Most responses a query may ask for from each provider
+MAX_SAMPLES = int(os.environ.get('AISPECTRUM_MAX_SAMPLES', 8))
+
 # List of available AI models with their specs
 AVAILABLE_MODELS = {
     'openai': {
@@ -143,17 +174,87 @@ AVAILABLE_MODELS = {
     }
 }
 
+# Content hash of the catalog, used as its ETag and in the index page's bootstrap data
+MODEL_CATALOG_VERSION = hashlib.sha256(json.dumps(AVAILABLE_MODELS, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
 @api_bp.route('/models', methods=['GET'])
 def get_models():
     """Return list of available AI models"""
-    return jsonify(AVAILABLE_MODELS)
+    response = jsonify(AVAILABLE_MODELS)
+    response.set_etag(MODEL_CATALOG_VERSION)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response.make_conditional(request)
 
-from .summarizer import summarize_responses, ResponseSummarizer
+@api_bp.route('/health', methods=['GET'])
+def health():
+    """Liveness check: the worker is up and serving requests"""
+    return jsonify({'status': 'ok'})
 
-from .error_handler import handle_api_error, api_error_handler
+@api_bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness check: 503 until this worker's connections are warmed up"""
+    report = warmup_state.as_dict()
+    return jsonify(report), (200 if warmup_state.ready else 503)
+
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Return a snapshot of this worker's metrics, or of every worker with ?scope=cluster"""
+    if request.args.get('scope') == 'cluster':
+        return jsonify(cluster_metrics())
+    return jsonify(dict(metrics.snapshot(), latency=provider_latency.snapshot(),
+                        bulkheads=bulkheads.snapshot(), scheduler=scheduler.snapshot()))
+
+@api_bp.route('/stats', methods=['GET'])
+@api_error_handler
+def get_stats():
+    """
+    Return the provider leaderboard of a rolling window
+
+    Query parameters: window (1h, 24h, 7d or 30d), provider to limit the rows
+    to one target, sort to rank by another column and hourly=1 to add the
+    hourly rollups. Answers 503 when pandas is not available.
+    """
+    window, sort = request.args.get('window', DEFAULT_WINDOW), request.args.get('sort')
+    try:
+        check_options(window, sort)
+    except ValueError as e:
+        return jsonify(handle_api_error(ValueError(f"Invalid request: {e}"), 'stats')), 400
+    try:
+        stats = provider_stats.leaderboard(window=window, provider=request.args.get('provider'), sort=sort,
+                                           hourly=request.args.get('hourly') in ('1', 'true'))
+    except ImportError as e:
+        return jsonify(handle_api_error(e, 'stats')), ERROR_TYPES['DEPENDENCY_UNAVAILABLE']['status_code']
+    return jsonify(dict(stats, status='success'))
+
+@api_bp.route('/admin/profiles', methods=['GET'])
+def get_profiles():
+    """List this worker's recent request profiles (requires X-Admin-Token)"""
+    if not is_admin():
+        return jsonify({'error': 'Admin token required', 'status': 'error'}), 403
+    return jsonify({'profiles': list_profiles(), 'status': 'success'})
+
+@api_bp.route('/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """Download a profile as speedscope JSON, or ?format=folded&kind=cpu|alloc for flamegraph.pl"""
+    if not is_admin():
+        return jsonify({'error': 'Admin token required', 'status': 'error'}), 403
+    profile = load_profile(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found', 'status': 'error'}), 404
+    if request.args.get('format') == 'folded':
+        kind = request.args.get('kind', 'cpu')
+        return Response(to_folded(profile, kind), mimetype='text/plain', headers={
+            'Content-Disposition': f'attachment; filename="{profile_id}.{kind}.folded"'})
+    response = jsonify(profile)
+    response.headers['Content-Disposition'] = f'attachment; filename="{profile_id}.speedscope.json"'
+    return response
+
+from .summarizer import summarize_responses, ResponseSummarizer
 
 @api_bp.route('/query', methods=['POST'])
 @api_error_handler
+@rate_limited('query')
+@admission_controlled(query_admission)
 def query_models():
     logger.info("\n===== API QUERY REQUEST =====")
     data = request.json
@@ -165,336 +266,101 @@ def query_models():
     logger.info(f"API Keys provided for models: {list(api_keys.keys())}")
     logger.info(f"Summarize enabled: {summarize}")
     
-    results = {}
-    
-    # OpenAI
-    if api_keys.get('openai'):
-        logger.info("Attempting OpenAI API call...")
-        try:
-            # Input validation
-            if not query:
-                raise ValueError("Query parameter is required")
-                
-            # Don't pass proxies parameter
-            openai_client = openai.OpenAI(api_key=api_keys['openai']['key'])
-            openai_model = api_keys['openai'].get('model', 'gpt-4o')
-            logger.info(f"Using OpenAI model: {openai_model}")
-            
-            logger.info("Sending request to OpenAI API...")
-            openai_response = openai_client.chat.completions.create(
-                model=openai_model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": query}
-                ]
-            )
-            logger.info("OpenAI API call successful!")
-            
-            results['openai'] = {
-                'content': openai_response.choices[0].message.content,
-                'model': openai_model,
-                'status': 'success'
-            }
-            logger.info(f"OpenAI response length: {len(openai_response.choices[0].message.content)} chars")
-        except Exception as e:
-            logger.error(f"OpenAI API call failed with error: {str(e)}")
-            results['openai'] = handle_api_error(e, 'openai', 'OpenAI')
-    
-    # Anthropic
-    if api_keys.get('anthropic'):
-        logger.info("Attempting Anthropic API call...")
-        try:
-            # Input validation
-            if not query:
-                raise ValueError("Query parameter is required")
-                
-            # Direct API call for Anthropic instead of client
-            api_key = api_keys['anthropic']['key']
-            anthropic_model = api_keys['anthropic'].get('model', 'claude-3-opus-20240229')
-            logger.info(f"Using Anthropic model: {anthropic_model}")
-            
-            url = "https://api.anthropic.com/v1/messages"
-            headers = {
-                "x-api-key": api_key,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json"
-            }
-            
-            payload = {
-                "model": anthropic_model,
-                "max_tokens": 4096,
-                "messages": [
-                    {"role": "user", "content": query}
-                ]
-            }
-            
-            logger.info("Sending request to Anthropic API...")
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            logger.info("Anthropic API call successful!")
-            
-            results['anthropic'] = {
-                'content': response_data['content'][0]['text'],
-                'model': anthropic_model,
-                'status': 'success'
-            }
-            logger.info(f"Anthropic response length: {len(response_data['content'][0]['text'])} chars")
-        except Exception as e:
-            logger.error(f"Anthropic API call failed with error: {str(e)}")
-            results['anthropic'] = handle_api_error(e, 'anthropic', 'Anthropic')
-            
-    # DeepSeek - using requests directly
-    if api_keys.get('deepseek'):
-        logger.info("Attempting DeepSeek API call...")
-        try:
-            # Input validation
-            if not query:
-                raise ValueError("Query parameter is required")
-                
-            api_key = api_keys['deepseek']['key']
-            deepseek_model = api_keys['deepseek'].get('model', 'deepseek-llm-67b-chat')
-            
-            # DeepSeek API endpoint (using deepseek.ai)
-            url = "https://api.deepseek.ai/v1/chat/completions"
-            
-            # Request headers
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            }
-            
-            # Request payload
-            payload = {
-                "model": deepseek_model,
-                "messages": [
-                    {"role": "user", "content": query}
-                ]
-            }
-            
-            # Make the API request
-            logger.info(f"Sending request to DeepSeek API with model {deepseek_model}")
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()  # Raise an exception for HTTP errors
-            
-            response_data = response.json()
-            
-            results['deepseek'] = {
-                'content': response_data['choices'][0]['message']['content'],
-                'model': deepseek_model,
-                'status': 'success'
-            }
-            logger.info(f"DeepSeek response length: {len(response_data['choices'][0]['message']['content'])} chars")
-        except Exception as e:
-            logger.error(f"DeepSeek API call failed with error: {str(e)}")
-            results['deepseek'] = handle_api_error(e, 'deepseek', 'DeepSeek')
-            
-    # Mistral (if present)
-    if api_keys.get('mistral'):
-        logger.info("Attempting Mistral API call...")
-        try:
-            # Input validation
-            if not query:
-                raise ValueError("Query parameter is required")
-                
-            api_key = api_keys['mistral']['key']
-            mistral_model = api_keys['mistral'].get('model', 'mistral-large-latest')
-            
-            url = "https://api.mistral.ai/v1/chat/completions"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            }
-            
-            payload = {
-                "model": mistral_model,
-                "messages": [
-                    {"role": "user", "content": query}
-                ]
-            }
-            
-            logger.info(f"Sending request to Mistral API with model {mistral_model}")
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            
-            results['mistral'] = {
-                'content': response_data['choices'][0]['message']['content'],
-                'model': mistral_model,
-                'status': 'success'
-            }
-            logger.info(f"Mistral response length: {len(response_data['choices'][0]['message']['content'])} chars")
-        except Exception as e:
-            logger.error(f"Mistral API call failed with error: {str(e)}")
-            results['mistral'] = handle_api_error(e, 'mistral', 'Mistral AI')
-
-    # Google Gemini (if present)
-    if api_keys.get('gemini'):
-        logger.info("Attempting Google Gemini API call...")
-        try:
-            # Input validation
-            if not query:
-                raise ValueError("Query parameter is required")
-                
-            api_key = api_keys['gemini']['key']
-            
-            # Try multiple models in case the selected one doesn't work
-            gemini_models = [
-                api_keys['gemini'].get('model', 'gemini-1.5-flash'),
-                "gemini-1.5-flash",
-                "gemini-pro",
-                "gemini-pro-latest"
-            ]
-            
-            # Remove duplicates while preserving order
-            gemini_models = list(dict.fromkeys(gemini_models))
-            
-            success = False
-            model_errors = []
-            
-            for gemini_model in gemini_models:
-                try:
-                    logger.info(f"Trying Gemini model: {gemini_model}")
-                    
-                    url = f"https://generativelanguage.googleapis.com/v1beta/models/{gemini_model}:generateContent?key={api_key}"
-                    headers = {
-                        "Content-Type": "application/json"
-                    }
-                    
-                    payload = {
-                        "contents": [
-                            {"parts": [{"text": query}]}
-                        ],
-                        "generationConfig": {
-                            "temperature": 0.7,
-                            "topK": 40,
-                            "topP": 0.95,
-                            "maxOutputTokens": 2048
-                        }
-                    }
-                    
-                    logger.info(f"Sending request to Gemini API with model {gemini_model}")
-                    response = requests.post(url, headers=headers, json=payload)
-                    response.raise_for_status()
-                    response_data = response.json()
-                    logger.info(f"Gemini API call successful with model {gemini_model}!")
-                    
-                    text_content = ""
-                    if "candidates" in response_data and len(response_data["candidates"]) > 0:
-                        parts = response_data["candidates"][0]["content"]["parts"]
-                        for part in parts:
-                            if "text" in part:
-                                text_content += part["text"]
-                    
-                    results['gemini'] = {
-                        'content': text_content,
-                        'model': gemini_model,
-                        'status': 'success'
-                    }
-                    logger.info(f"Gemini response length: {len(text_content)} chars")
-                    success = True
-                    break
-                    
-                except Exception as model_error:
-                    model_errors.append(f"{gemini_model}: {str(model_error)}")
-                    logger.warning(f"Failed with model {gemini_model}: {str(model_error)}")
-                    continue
-            
-            if not success:
-                error_msg = f"All Gemini models failed to generate a response. Errors: {', '.join(model_errors)}"
-                raise Exception(error_msg)
-                
-        except Exception as e:
-            logger.error(f"Gemini API call failed with error: {str(e)}")
-            results['gemini'] = handle_api_error(e, 'gemini', 'Google Gemini')
-    
-    # Cohere (if present)
-    if api_keys.get('cohere'):
-        logger.info("Attempting Cohere API call...")
-        try:
-            # Input validation
-            if not query:
-                raise ValueError("Query parameter is required")
-                
-            api_key = api_keys['cohere']['key']
-            cohere_model = api_keys['cohere'].get('model', 'command-r')
-            
-            url = "https://api.cohere.ai/v1/chat"
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            }
-            
-            payload = {
-                "model": cohere_model,
-                "message": query,
-                "temperature": 0.7
-            }
-            
-            logger.info(f"Sending request to Cohere API with model {cohere_model}")
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            
-            results['cohere'] = {
-                'content': response_data['text'],
-                'model': cohere_model,
-                'status': 'success'
-            }
-            logger.info(f"Cohere response length: {len(response_data['text'])} chars")
-        except Exception as e:
-            logger.error(f"Cohere API call failed with error: {str(e)}")
-            results['cohere'] = handle_api_error(e, 'cohere', 'Cohere')
-            
-    # Azure OpenAI (if present)
-    if api_keys.get('azure'):
-        logger.info("Attempting Azure OpenAI API call...")
-        try:
-            # Input validation
-            if not query:
-                raise ValueError("Query parameter is required")
-                
-            api_key = api_keys['azure']['key']
-            endpoint = api_keys['azure'].get('endpoint', '')
-            azure_model = api_keys['azure'].get('model', 'gpt-4')
-            deployment_name = api_keys['azure'].get('deployment', 'gpt4')
-            
-            # Validate endpoint URL
-            if not endpoint or not endpoint.startswith(('http://', 'https://')):
-                raise ValueError("Invalid or missing Azure OpenAI endpoint URL")
-            
-            url = f"{endpoint}/openai/deployments/{deployment_name}/chat/completions?api-version=2023-05-15"
-            headers = {
-                "Content-Type": "application/json",
-                "api-key": api_key
-            }
-            
-            payload = {
-                "messages": [
-                    {"role": "system", "content": "You are a helpful assistant."},
-                    {"role": "user", "content": query}
-                ],
-                "temperature": 0.7,
-                "max_tokens": 2048
-            }
-            
-            logger.info(f"Sending request to Azure OpenAI API with deployment {deployment_name}")
-            response = requests.post(url, headers=headers, json=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            
-            results['azure'] = {
-                'content': response_data['choices'][0]['message']['content'],
-                'model': azure_model,
-                'status': 'success'
-            }
-            logger.info(f"Azure OpenAI response length: {len(response_data['choices'][0]['message']['content'])} chars")
-        except Exception as e:
-            logger.error(f"Azure OpenAI API call failed with error: {str(e)}")
-            results['azure'] = handle_api_error(e, 'azure', 'Azure OpenAI')
+    mode = data.get('mode', 'all')
+    try:
+        if mode not in QUERY_MODES:
+            raise ValueError(f"mode must be one of {', '.join(QUERY_MODES)}")
+        k = int(data.get('k', DEFAULT_FIRST_K))
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        on_rest = data.get('on_rest', 'cancel')
+        if on_rest not in ('cancel', 'deliver'):
+            raise ValueError("on_rest must be 'cancel' or 'deliver'")
+        validate_request(data)
+    except (TypeError, ValueError) as e:
+        return jsonify(handle_api_error(ValueError(f"Invalid request: {e}"), 'query')), 400
+    
+    # A new query from the same client replaces the one it supersedes; request ids
+    # are chosen by clients, so they only name queries of the same caller
+    caller = request_user(api_keys)
+    if data.get('supersedes'):
+        cancellations.cancel(data['supersedes'], caller)
+    request_id = data.get('request_id') or request.headers.get('X-Request-ID') or str(uuid.uuid4())
+    token = cancellations.start(request_id, caller)
+    environ = request.environ
+    
+    # Multi-turn: continue an existing conversation or start a new one
+    conversation = None
+    if data.get('conversation_id') or data.get('conversation'):
+        conversation = conversations.get(data.get('conversation_id'))
+        if conversation is None:
+            conversation = conversations.create()
+        logger.info(f"Conversation: {conversation['id']} (turn {conversation['turns'] + 1})")
+    
+    plans = build_plans(data, conversation)
+    
+    # Pre-flight: reject, trim or skip targets that do not fit the request budget
+    runnable, excluded = apply_budget(plans, data.get('budget'))
+    
+    # Near-duplicate detection; follow-ups depend on their history, so only standalone
+    # queries, and only among the earlier queries of the same user or API keys
+    owner = request_owner(api_keys)
+    dedup_mode = None if conversation or owner is None else request_mode(data.get('dedup'))
+    match, similarity = None, 0.0
+    if dedup_mode and runnable and query:
+        match, similarity = dedup_index.find(query, owner, float(data.get('dedup_threshold', DEDUP_THRESHOLD)),
+                                             prefer=lambda entry: dedup_index.covers(entry, runnable))
+        metrics.inc('dedup_lookups_total', hit=match is not None)
+    served = match is not None and dedup_mode == 'serve' and dedup_index.covers(match, runnable)
+    
+    # Query the remaining providers (and each local endpoint) concurrently,
+    # until they finish or the query is cancelled
+    tasks = {plan['result_key']: functools.partial(call_provider, plan) for plan in runnable}
+    until, on_late, hedges, result_id = None, None, None, None
+    if mode == 'first_k':
+        until = lambda done: sum(1 for r in done.values() if r.get('status') == 'success') >= k
+        if on_rest == 'deliver':
+            # Providers still running are merged into the stored results as they finish
+            result_id = result_store.save(query, {})
+            on_late = lambda key, result: result_store.merge_results(result_id, {key: result})
+    elif mode == 'hedged':
+        hedges = {plan['result_key']: (provider_latency.hedge_delay(plan),
+                                       functools.partial(call_provider, hedge_plan(plan)))
+                  for plan in runnable}
+    try:
+        if served:
+            logger.info(f"Serving earlier responses of near-duplicate query {match['id']} ({similarity:.2f})")
+            completed = {key: dict(match['results'][key], deduplicated=True) for key in tasks}
+        else:
+            # Each provider's calls wait for a fair share of the scheduler's slots (never
+            # more than its bulkhead runs at once), then run on their provider's own pool
+            lane = request_lane()
+            executors = {plan['result_key']: scheduler.executor(bulkheads.executor(plan['provider_id']), caller, lane,
+                                                                bulkheads.provider(plan['provider_id']))
+                         for plan in runnable}
+            completed = run_all(tasks, token, lambda: client_disconnected(environ),
+                                until=until, on_late=on_late, hedges=hedges, executors=executors)
+    finally:
+        cancellations.finish(request_id, caller, token)
+    
+    if dedup_mode and not served and not token.cancelled:
+        successes = {key: completed[key] for key in tasks if completed[key].get('status') == 'success'}
+        if successes:
+            dedup_index.add(query, successes, {plan['result_key']: answer_params(plan) for plan in runnable
+                                               if plan['result_key'] in successes}, owner)
+    completed.update(excluded)
+    results = {plan['result_key']: completed[plan['result_key']] for plan in plans}
+    
+    # Each history gets the one answer the query returns, not every hedged or late attempt
+    if conversation and not token.cancelled:
+        for plan in runnable:
+            result = results[plan['result_key']]
+            if result.get('status') == 'success':
+                conversations.append_turn(conversation['id'], plan['result_key'], plan['query'], result['content'],
+                                          plan['history'])
     
     # Generate meta-summary if requested and if we have OpenAI or Gemini API key for summarization
-    if summarize and (api_keys.get('openai') or api_keys.get('gemini')):
+    if summarize and not token.cancelled and (api_keys.get('openai') or api_keys.get('gemini')):
         print("Generating summary of responses...")
         summarizer_key = api_keys.get('openai', {}).get('key') or api_keys.get('gemini', {}).get('key')
         summary = summarize_responses(query, results, summarizer_key)
@@ -504,10 +370,326 @@ def query_models():
     print(f"Final results contain responses for: {list(results.keys())}")
     print("=== END OF API QUERY PROCESSING ===\n")
     
-    return jsonify(results)
+    # Optionally pre-render the markdown; the stored results keep the raw content only
+    response = jsonify(render_results(results) if request_render() else results)
+    response.headers['X-Request-Id'] = request_id
+    # Later summarize/export calls refer to these results by id instead of re-uploading them
+    if result_id:
+        result_store.merge_results(result_id, results)
+        response.headers['X-Result-Id'] = result_id
+    elif not token.cancelled:
+        response.headers['X-Result-Id'] = result_store.save(query, results)
+    if conversation:
+        conversations.finish_turn(conversation['id'])
+        response.headers['X-Conversation-Id'] = conversation['id']
+    if match is not None:
+        response.headers['X-Dedup-Match'] = match['id']
+        response.headers['X-Dedup-Similarity'] = f"{similarity:.3f}"
+        response.headers['X-Dedup-Served'] = 'true' if served else 'false'
+    return response
+
+def build_plans(data, conversation=None):
+    """
+    Plan every provider target of a query request, with token estimates
+    
+    Args:
+        data: The request body (query, api_keys, max_tokens, samples, history_token_budget)
+        conversation: Optional conversation supplying per-provider history
+        
+    Returns:
+        list: Plans from make_plan, in query order
+    """
+    query = data.get('query')
+    samples = request_samples(data)
+    history_budget = int(data.get('history_token_budget', DEFAULT_HISTORY_TOKEN_BUDGET)) - estimate_tokens(query)
+    plans = []
+    for result_key, provider_id, config in plan_targets(data.get('api_keys', {})):
+        history = conversations.history(conversation['id'], result_key, history_budget) if conversation else None
+        plans.append(make_plan(result_key, provider_id, config, query, history, data.get('max_tokens'), samples))
+    return plans
+
+def request_samples(data):
+    """
+    Read the number of responses a request asks for from each provider
+    
+    Args:
+        data: The request body
+        
+    Returns:
+        int: The 'samples' option, 1 when absent
+        
+    Raises:
+        ValueError: If it is not a whole number between 1 and MAX_SAMPLES
+    """
+    samples = data.get('samples', 1)
+    if isinstance(samples, bool) or not isinstance(samples, int) or not 1 <= samples <= MAX_SAMPLES:
+        raise ValueError(f"samples must be a whole number between 1 and {MAX_SAMPLES}")
+    return samples
+
+def validate_request(data):
+    """
+    Check the options of a query or estimate request before planning it
+    
+    Args:
+        data: The request body
+        
+    Raises:
+        ValueError: If samples, max_tokens, history_token_budget,
+            dedup_threshold, the budget or a target's response caps are invalid
+    """
+    request_samples(data)
+    for field in ('max_tokens', 'history_token_budget'):
+        if data.get(field) is not None:
+            positive_number(data[field], field, whole=True)
+    if data.get('dedup_threshold') is not None:
+        if positive_number(data['dedup_threshold'], 'dedup_threshold') > 1:
+            raise ValueError("dedup_threshold must be at most 1")
+    validate_budget(data.get('budget'))
+    api_keys = data.get('api_keys', {})
+    if not isinstance(api_keys, dict):
+        raise ValueError("api_keys must map each provider to its settings")
+    for provider_id, config in api_keys.items():
+        if config and not isinstance(config, dict):
+            raise ValueError(f"api_keys.{provider_id} must be an object")
+        for field in ('max_response_bytes', 'max_response_tokens'):
+            if config and config.get(field) is not None:
+                positive_number(config[field], f"api_keys.{provider_id}.{field}", whole=True)
+
+def hedge_plan(plan):
+    """
+    Plan the duplicate request a hedged query sends for a slow target
+    
+    Args:
+        plan: Target plan from make_plan
+        
+    Returns:
+        dict: Plan for the target's 'backup' settings (another model, endpoint
+            or key) when its config has them, otherwise the same target again
+    """
+    config = dict(plan['config'])
+    config.update(config.pop('backup', None) or {})
+    return make_plan(plan['result_key'], plan['provider_id'], config, plan['query'], plan['history'],
+                     plan['max_tokens'], plan['samples'])
+
+def provider_breaker(plan):
+    """
+    Return the shared circuit breaker guarding a plan's provider endpoint
+    
+    Args:
+        plan: Target plan from make_plan
+        
+    Returns:
+        CircuitBreaker: Breaker keyed by provider, plus endpoint for self-hosted ones
+    """
+    endpoint = plan['config'].get('endpoint')
+    name = f"{plan['provider_id']}:{endpoint}" if endpoint else plan['provider_id']
+    return CircuitBreaker(name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_SECONDS)
+
+def call_provider(plan):
+    """
+    Query a single provider target inside its own trace span
+    
+    Args:
+        plan: Target plan from make_plan (result key, provider, config, query, history)
+        
+    Returns:
+        dict: Result with content, model and status
+    """
+    attributes = {'provider': plan['provider_id'], 'result_key': plan['result_key'], 'model': plan['model']}
+    with tracing.start_span(f"provider {plan['result_key']}", attributes=attributes) as span:
+        started = time.perf_counter()
+        result = _call_provider(plan)
+        elapsed = time.perf_counter() - started
+        if result.get('status') == 'success':
+            provider_latency.record(latency_key(plan), elapsed)
+        provider_stats.record(plan, result, elapsed)
+        span.set_attribute('result.status', result.get('status'))
+        span.set_attribute('result.model', result.get('model'))
+        if result.get('status') == 'error':
+            span.set_error(result.get('error_details') or result.get('error_code'))
+        return result
+
+def _call_provider(plan):
+    """
+    Query a single provider target, converting failures into error results
+    
+    Args:
+        plan: Target plan from make_plan (result key, provider, config, query, history)
+        
+    Returns:
+        dict: Result with content, model and status
+    """
+    result_key = plan['result_key']
+    query = plan['query']
+    # Provider modules (and their SDKs) are imported on first use
+    provider = get_provider(plan['provider_id'])
+    logger.info(f"Attempting {provider.DISPLAY_NAME} API call for {result_key}...")
+    breaker = provider_breaker(plan)
+    try:
+        # Input validation
+        if not query:
+            raise ValueError("Query parameter is required")
+        # A slow provider (or key) only uses up its own bulkhead's slots
+        with bulkheads.slot(plan):
+            if not breaker.allow():
+                metrics.inc('circuit_breaker_rejected_total', breaker=breaker.name)
+                raise RuntimeError(f"{provider.DISPLAY_NAME} is unavailable (circuit open)")
+            
+            try:
+                if plan['samples'] > 1:
+                    result = call_samples(plan, bulkheads.spare_slot)
+                else:
+                    result = provider.call(query, plan['config'], history=plan['history'])
+            except Exception as e:
+                token = current_token()
+                if is_upstream_failure(e) and not (token is not None and token.cancelled):
+                    breaker.record_failure()
+                raise
+            breaker.record_success()
+        # Only capped content is kept in results, conversations and stores
+        return cap_result(result, plan)
+    except QueryCancelledError:
+        logger.info(f"{provider.DISPLAY_NAME} call for {result_key} cancelled")
+        return cancelled_result(result_key, plan['model'])
+    except Exception as e:
+        token = current_token()
+        if token is not None and token.cancelled:
+            # Closing a cancelled stream surfaces as a read error; it is not a provider failure
+            logger.info(f"{provider.DISPLAY_NAME} call for {result_key} cancelled")
+            return cancelled_result(result_key, plan['model'])
+        logger.error(f"{provider.DISPLAY_NAME} API call failed with error: {str(e)}")
+        return handle_api_error(e, result_key, provider.DISPLAY_NAME)
+
+@api_bp.route('/cancel/<request_id>', methods=['POST'])
+def cancel_query(request_id):
+    """Cancel an in-flight query by its request id; the caller must send the query's api_keys or session"""
+    caller = request_user((request.get_json(silent=True) or {}).get('api_keys'))
+    cancelled = cancellations.cancel(request_id, caller)
+    return jsonify({'cancelled': cancelled, 'request_id': request_id}), (200 if cancelled else 404)
+
+@api_bp.route('/estimate', methods=['POST'])
+@api_error_handler
+def estimate_query():
+    """Estimate tokens, cost and latency of a query without calling any provider"""
+    data = request.json
+    try:
+        validate_request(data)
+    except ValueError as e:
+        return jsonify(handle_api_error(ValueError(f"Invalid request: {e}"), 'estimate')), 400
+    conversation = conversations.get(data['conversation_id']) if data.get('conversation_id') else None
+    plans = build_plans(data, conversation)
+    runnable, excluded = apply_budget(plans, data.get('budget'))
+    # Trimmed targets carry a fresh estimate for the shortened query
+    run_estimates = {plan['result_key']: plan['estimate'] for plan in runnable}
+    
+    estimates = {}
+    for plan in plans:
+        result_key = plan['result_key']
+        if result_key in run_estimates:
+            estimates[result_key] = dict(run_estimates[result_key], plan='run')
+        else:
+            estimates[result_key] = dict(plan['estimate'], plan=excluded[result_key]['status'],
+                                         reason=excluded[result_key].get('error_details') or excluded[result_key]['content'])
+    
+    selected = [plan['estimate'] for plan in runnable]
+    return jsonify({
+        'estimates': estimates,
+        'totals': {
+            'prompt_tokens': sum(e['prompt_tokens'] for e in selected),
+            'estimated_cost': round(sum(e['estimated_cost'] for e in selected), 6),
+            'max_cost': round(sum(e['max_cost'] for e in selected), 6),
+            # Providers run concurrently, so the slowest one bounds latency
+            'estimated_latency_s': max((e['estimated_latency_s'] for e in selected), default=0)
+        },
+        'status': 'success'
+    })
+
+@api_bp.route('/compare', methods=['POST'])
+@api_error_handler
+def compare():
+    """Compare responses: pairwise similarity, per-model agreement and diff hunks"""
+    # Imported here so numpy only loads once a comparison is requested
+    from .similarity import compare_responses, DEFAULT_SHINGLE_SIZE
+    data = request.json
+    responses = data.get('responses', {})
+    pairs = data.get('pairs')
+    try:
+        if not isinstance(responses, dict):
+            raise ValueError("responses must map each model to its result")
+        comparison = compare_responses(responses, pairs=pairs,
+                                       shingle_size=data.get('shingle_size', DEFAULT_SHINGLE_SIZE))
+    except ValueError as e:
+        return jsonify(handle_api_error(ValueError(f"Invalid request: {e}"), 'compare')), 400
+    metrics.observe('compare_ms', comparison['elapsed_ms'])
+    comparison['status'] = 'success'
+    return jsonify(comparison)
+
+@api_bp.route('/results/<result_id>', methods=['GET'])
+def get_results(result_id):
+    """Return stored query results, including late ones of a first_k query with on_rest=deliver"""
+    record = result_store.get(result_id)
+    if record is None:
+        return jsonify({'error': 'Result not found or expired', 'status': 'error'}), 404
+    results = dict(record['results'])
+    if record.get('summary') is not None:
+        results['summary'] = record['summary']
+    return jsonify({
+        'id': record['id'],
+        'query': record['query'],
+        'created': int(record['created']),
+        'results': render_results(results) if request_render() else results,
+        'pending': [key for key, result in record['results'].items() if result.get('status') == 'pending'],
+        'status': 'success'
+    })
+
+@api_bp.route('/render/code.css', methods=['GET'])
+def get_code_css():
+    """Return the stylesheet for code blocks highlighted by server-side rendering"""
+    response = Response(code_css(), mimetype='text/css')
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@api_bp.route('/dedup/<entry_id>', methods=['GET', 'POST'])
+def get_dedup_entry(entry_id):
+    """Return the earlier responses of a near-duplicate query offered by /api/query"""
+    # Only the signed-in user who asked it, or a POST with the same api_keys, can read an entry
+    entry = dedup_index.get(entry_id, request_owner((request.get_json(silent=True) or {}).get('api_keys')))
+    if entry is None:
+        return jsonify({'error': 'Query not found', 'status': 'error'}), 404
+    return jsonify({
+        'id': entry['id'],
+        'query': entry['query'],
+        'created': int(entry['created']),
+        'results': render_results(entry['results']) if request_render() else entry['results'],
+        'status': 'success'
+    })
+
+@api_bp.route('/conversations/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    """Return a conversation's per-provider message histories"""
+    conversation = conversations.get(conversation_id)
+    if conversation is None:
+        return jsonify({'error': 'Conversation not found', 'status': 'error'}), 404
+    histories = {k: list(v) for k, v in conversation['histories'].items()}
+    return jsonify({
+        'id': conversation['id'],
+        'created': int(conversation['created']),
+        'updated': int(conversation['updated']),
+        'turns': conversation['turns'],
+        'histories': render_histories(histories) if request_render() else histories,
+        'truncated_turns': dict(conversation['truncated_turns']),
+        'status': 'success'
+    })
+
+@api_bp.route('/conversations/<conversation_id>', methods=['DELETE'])
+def delete_conversation(conversation_id):
+    """End a conversation and discard its history"""
+    if not conversations.delete(conversation_id):
+        return jsonify({'error': 'Conversation not found', 'status': 'error'}), 404
+    return jsonify({'status': 'success'})
 
 # Import the auth helper
-from .auth import ApiAuth
+from .auth import ApiAuth, account_id, request_owner
 
 # Endpoint to validate API keys
 @api_bp.route('/validate-key', methods=['POST'])
@@ -546,7 +728,8 @@ def login():
         session['user'] = {
             'email': email,
             'name': email.split('@')[0],
-            'id': '12345'
+            # One id per account: identities (dedup, fair share) must never be shared between users
+            'id': account_id('local', email)
         }
         return jsonify({'success': True, 'user': session['user']})
     else:
@@ -564,7 +747,7 @@ def google_auth():
         session['user'] = {
             'email': 'dev@techspectra.io',
             'name': 'Alex Chen',
-            'id': 'google-12345',
+            'id': account_id('google', token),
             'picture': 'https://ui-avatars.com/api/?name=Alex+Chen&background=0D8ABC&color=fff',
             'given_name': 'Alex',
             'family_name': 'Chen',
@@ -583,14 +766,27 @@ def logout():
 
 @api_bp.route('/export', methods=['POST'])
 @api_error_handler
+@tracing.traced('export')
 def export_responses():
     """Export responses in various formats (JSON, CSV, Markdown)"""
     data = request.json
-    query = data.get('query', '')
-    responses = data.get('responses', {})
     format_type = data.get('format', 'json')
     include_summary = data.get('include_summary', True)
     
+    # Results stored by /api/query are referenced by id rather than re-uploaded
+    if data.get('result_id'):
+        record = result_store.get(data['result_id'])
+        if record is None:
+            return jsonify({
+                'error': 'Results not found or expired',
+                'status': 'error'
+            }), 404
+        query, responses, summary = record['query'], record['results'], record['summary']
+    else:
+        query = data.get('query', '')
+        responses = data.get('responses', {})
+        summary = data.get('summary')
+    
     if not query or not responses:
         return jsonify({
             'error': 'Query and responses are required',
@@ -617,8 +813,8 @@ def export_responses():
         export_data["responses"] = responses
         
         # If there's a summary and it should be included
-        if include_summary and data.get('summary'):
-            export_data["summary"] = data.get('summary')
+        if include_summary and summary:
+            export_data["summary"] = summary
             
         return jsonify({
             'data': export_data,
@@ -640,8 +836,7 @@ def export_responses():
                 markdown_text += "---\n\n"
         
         # Add summary if available
-        if include_summary and data.get('summary'):
-            summary = data.get('summary')
+        if include_summary and summary:
             if summary.get('status') == 'success':
                 markdown_text += "## Summary Insights\n\n"
                 markdown_text += f"{summary.get('content', '')}\n\n"
@@ -707,9 +902,24 @@ def summarize_insights():
     """Generate insights from multiple model responses"""
     logger.info("\n===== GENERATING INSIGHTS =====")
     data = request.json
-    query = data.get('query', '')
-    responses = data.get('responses', {})
     api_keys = data.get('api_keys', {})
+    result_id = data.get('result_id')
+    
+    # Summarize results stored by /api/query instead of an uploaded copy
+    if result_id:
+        record = result_store.get(result_id)
+        if record is None:
+            return jsonify({
+                'summary': handle_api_error(
+                    LookupError("Results not found or expired"),
+                    'meta-summarizer'
+                )
+            }), 404
+        query = record['query']
+        responses = {k: v for k, v in record['results'].items() if v.get('status') == 'success'}
+    else:
+        query = data.get('query', '')
+        responses = data.get('responses', {})
     
     logger.info(f"Query: {query}")
     logger.info(f"Responses from models: {list(responses.keys())}")
@@ -762,7 +972,8 @@ def summarize_insights():
     # Generate the summary
     try:
         summarizer = ResponseSummarizer(summarizer_key)
-        summary = summarizer.summarize(query, responses)
+        # refresh regenerates a summary that is already cached
+        summary = summarizer.summarize(query, responses, refresh=bool(data.get('refresh')))
         logger.info(f"Summarization status: {summary.get('status')}")
         
         # Add metadata about which model was used
@@ -771,6 +982,10 @@ def summarize_insights():
         summary['timestamp'] = int(time.time())
         summary['request_id'] = str(uuid.uuid4())
         
+        # Keep the summary with the stored results so exports can include it
+        if result_id:
+            result_store.set_summary(result_id, summary)
+        
         return jsonify({
             'summary': summary
         })
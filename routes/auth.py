@@ -1,5 +1,71 @@
-import requests
+import hashlib
 import json
+import os
+from flask import session
+from . import http_client
+from .profiling import is_admin
+from .providers import PROVIDER_MODULES
+
+# Emails of signed-in users who may raise their priority or lane, comma-separated (admins always may)
+PRIORITY_USERS = {email.strip().lower() for email in os.environ.get('AISPECTRUM_PRIORITY_USERS', '').split(',')
+                  if email.strip()}
+
+
+def account_id(provider, subject):
+    """
+    Stable id of a signed-in account, so each account gets its own identity
+
+    Args:
+        provider (str): How the user signed in, e.g. 'local' or 'google'
+        subject (str): What identifies the account there (email, token subject)
+
+    Returns:
+        str: '<provider>-<hash of the subject>'
+    """
+    digest = hashlib.sha256(subject.strip().lower().encode('utf-8')).hexdigest()[:16]
+    return f"{provider}-{digest}"
+
+
+def request_owner(api_keys=None):
+    """
+    Identify who the current request acts for, from its session or credentials
+
+    Client-supplied ids are never trusted: a signed-in user is known from the
+    session, anyone else by a hash of the provider keys they send. Only the
+    keys of known providers count, so entries that are never called (e.g. a
+    made-up provider with a random key) cannot mint a new identity.
+
+    Args:
+        api_keys (dict): The request's api_keys, used when no user is signed in
+
+    Returns:
+        str: 'user:<id>' for a signed-in user, 'key:<hash>' of the provider
+            keys otherwise, or None if the request carries neither
+    """
+    user = session.get('user')
+    if user and user.get('id'):
+        return f"user:{user['id']}"
+    keys = sorted((provider, config['key']) for provider, config in
+                  (api_keys.items() if isinstance(api_keys, dict) else ())
+                  if provider in PROVIDER_MODULES and isinstance(config, dict)
+                  and isinstance(config.get('key'), str) and config['key'])
+    if not keys:
+        return None
+    return f"key:{hashlib.sha256(json.dumps(keys).encode('utf-8')).hexdigest()[:32]}"
+
+
+def may_raise_priority():
+    """
+    Whether the current request may ask for more than the default priority or lane
+
+    Signing in alone is not enough, since anyone can sign in: only admins
+    (X-Admin-Token) and the users listed in AISPECTRUM_PRIORITY_USERS may.
+    """
+    if is_admin():
+        return True
+    user = session.get('user') or {}
+    return bool(user.get('id')) and (user.get('email') or '').lower() in PRIORITY_USERS
+
 
 class ApiAuth:
     """
@@ -19,7 +85,7 @@ class ApiAuth:
                 "messages": [{"role": "user", "content": "Hello"}],
                 "max_tokens": 5
             }
-            response = requests.post(
+            response = http_client.post(
                 "https://api.openai.com/v1/chat/completions",
                 headers=headers,
                 json=payload
@@ -43,7 +109,7 @@ class ApiAuth:
                 "max_tokens": 10,
                 "messages": [{"role": "user", "content": "Hello"}]
             }
-            response = requests.post(
+            response = http_client.post(
                 "https://api.anthropic.com/v1/messages",
                 headers=headers,
                 json=payload
@@ -71,7 +137,7 @@ class ApiAuth:
                     "generationConfig": {"maxOutputTokens": 10}
                 }
                 
-                response = requests.post(url, headers=headers, json=payload)
+                response = http_client.post(url, headers=headers, json=payload)
                 
                 if response.status_code == 200:
                     return True, f"Google Gemini API key is valid (working model: {model})"
@@ -93,7 +159,7 @@ class ApiAuth:
                 "messages": [{"role": "user", "content": "Hello"}],
                 "max_tokens": 10
             }
-            response = requests.post(
+            response = http_client.post(
                 "https://api.mistral.ai/v1/chat/completions",
                 headers=headers,
                 json=payload
@@ -0,0 +1,141 @@
+"""
+Batch execution backend for bulk, non-interactive queries.
+Providers whose modules implement submit_batch/poll_batch (OpenAI Batch
+API, Anthropic Message Batches) receive all queries of a run as one batch,
+which is polled until it finishes (or cancelled upstream once the wait
+times out); other providers are called live, as /api/query does, while
+the batches are processed. Either way each query ends up with the same
+per-provider results that /api/query returns.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .api import build_plans, call_provider
+from .dispatch import apply_budget
+from .error_handler import handle_api_error
+from .limits import cap_result
+from .metrics import metrics
+from .providers import get_provider
+
+logger = logging.getLogger('aiSpectrum')
+
+# How often submitted batches are checked, in seconds
+POLL_INTERVAL_SECONDS = float(os.environ.get('AISPECTRUM_BATCH_POLL', 30))
+# Longest to wait for a batch before its queries count as failed (providers allow 24 h)
+BATCH_TIMEOUT_SECONDS = float(os.environ.get('AISPECTRUM_BATCH_TIMEOUT', 86400))
+DEFAULT_LIVE_CONCURRENCY = 4
+
+
+def supports_batch(provider_id):
+    """Whether a provider can take queries through a batch API."""
+    provider = get_provider(provider_id)
+    return hasattr(provider, 'submit_batch') and hasattr(provider, 'poll_batch')
+
+
+def _cancel(provider, batch_id, config, result_key):
+    """Cancel a batch upstream, if its provider can, logging (not raising) failures."""
+    if not hasattr(provider, 'cancel_batch'):
+        return
+    try:
+        provider.cancel_batch(batch_id, config)
+        metrics.inc('batch_cancelled_total', provider=result_key)
+    except Exception as e:
+        logger.warning(f"Could not cancel {provider.DISPLAY_NAME} batch {batch_id}: {str(e)}")
+
+
+def run_batch(queries, api_keys, max_tokens=None, live_concurrency=DEFAULT_LIVE_CONCURRENCY,
+              poll_interval=POLL_INTERVAL_SECONDS, timeout=BATCH_TIMEOUT_SECONDS,
+              batch_ids=None, on_submitted=None):
+    """
+    Query every provider for a list of queries, using batch APIs where possible
+
+    Args:
+        queries (list): The queries
+        api_keys (dict): Provider configuration, as in a /api/query request
+        max_tokens (int): Optional output cap
+        live_concurrency (int): Live calls in flight for providers without batch support
+        poll_interval (float): Seconds between checks of the submitted batches
+        timeout (float): Seconds to wait for the batches; batches still running
+            then are cancelled and their queries count as failed
+        batch_ids (dict): Result key -> batch id already submitted for these
+            queries, e.g. by an interrupted run; those batches are not resubmitted
+        on_submitted (callable): Receives (result key, batch id) after each submission
+
+    Returns:
+        list: Result key -> result for each query, as /api/query returns them
+    """
+    batch_ids = dict(batch_ids or {})
+    results = [{} for _ in queries]
+    plans_by_query = []
+    groups = {}
+    for index, query in enumerate(queries):
+        plans = build_plans({'query': query, 'api_keys': api_keys, 'max_tokens': max_tokens})
+        runnable, excluded = apply_budget(plans, None)
+        results[index].update(excluded)
+        plans_by_query.append(plans)
+        for plan in runnable:
+            groups.setdefault(plan['result_key'], []).append((index, plan))
+
+    live, pending = [], {}
+    for result_key, items in groups.items():
+        first = items[0][1]
+        if not supports_batch(first['provider_id']):
+            live.extend(items)
+            continue
+        provider = get_provider(first['provider_id'])
+        batch_id = batch_ids.get(result_key)
+        if batch_id is None:
+            requests = [(f"req-{index}", plan['query'], plan['history'], plan['config']) for index, plan in items]
+            try:
+                batch_id = provider.submit_batch(requests, first['config'])
+            except Exception as e:
+                logger.warning(f"Could not submit a {provider.DISPLAY_NAME} batch, calling it live: {str(e)}")
+                metrics.inc('batch_submit_errors_total', provider=result_key)
+                live.extend(items)
+                continue
+            metrics.inc('batch_submitted_total', provider=result_key)
+            metrics.inc('batch_requests_total', len(requests), provider=result_key)
+            if on_submitted is not None:
+                on_submitted(result_key, batch_id)
+        pending[result_key] = (batch_id, provider, items)
+
+    with ThreadPoolExecutor(max_workers=live_concurrency, thread_name_prefix='batch-live') as pool:
+        live_calls = [(index, plan, pool.submit(call_provider, plan)) for index, plan in live]
+        deadline = time.monotonic() + timeout
+        while pending:
+            for result_key, (batch_id, provider, items) in list(pending.items()):
+                try:
+                    finished = provider.poll_batch(batch_id, items[0][1]['config'])
+                except Exception as e:
+                    # Polling failures are usually transient; the batch keeps running upstream
+                    logger.warning(f"Could not poll {provider.DISPLAY_NAME} batch {batch_id}: {str(e)}")
+                    continue
+                if finished is None:
+                    continue
+                for index, plan in items:
+                    result = finished.get(f"req-{index}")
+                    if result is None:
+                        result = Exception(f"Batch {batch_id} ended without a result for this query")
+                    if isinstance(result, Exception):
+                        result = handle_api_error(result, result_key, provider.DISPLAY_NAME)
+                    results[index][result_key] = dict(cap_result(result, plan), batch_id=batch_id)
+                del pending[result_key]
+            if not pending:
+                break
+            if time.monotonic() >= deadline:
+                for result_key, (batch_id, provider, items) in pending.items():
+                    # Nobody collects the results once the queries are failed, so stop paying for them
+                    _cancel(provider, batch_id, items[0][1]['config'], result_key)
+                    error = TimeoutError(f"Batch {batch_id} did not finish within {timeout:.0f}s and was cancelled")
+                    for index, plan in items:
+                        results[index][result_key] = dict(
+                            handle_api_error(error, result_key, provider.DISPLAY_NAME), batch_id=batch_id)
+                break
+            time.sleep(poll_interval)
+        for index, plan, future in live_calls:
+            results[index][plan['result_key']] = future.result()
+
+    return [{plan['result_key']: results[index][plan['result_key']] for plan in plans}
+            for index, plans in enumerate(plans_by_query)]
@@ -0,0 +1,261 @@
+"""
+Local stand-in for the OpenAI Batch and Anthropic Message Batches APIs.
+Implements just enough of both (file upload, batch creation, status,
+results and cancellation) to run the batch backend offline. Batches
+finish after a fixed delay, and each request is answered by a responder
+function, which by default echoes the model and the last user message.
+
+Usage:
+    python -m routes.batch_standin [--port 8089] [--delay 2]
+
+Then point a provider at it with 'batch_url' in its api_keys entry:
+    "openai": {"key": "test", "batch_url": "http://127.0.0.1:8089/openai/v1"}
+    "anthropic": {"key": "test", "batch_url": "http://127.0.0.1:8089/anthropic/v1/messages/batches"}
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def echo_responder(model, messages):
+    """Default answer: the model name and the last user message."""
+    return f"[{model}] {messages[-1]['content']}"
+
+
+class BatchStandIn:
+    """In-memory batch service shared by the request handlers."""
+
+    def __init__(self, delay=2.0, responder=echo_responder):
+        """
+        Initialize the service
+
+        Args:
+            delay (float): Seconds until a submitted batch has finished
+            responder (callable): (model, messages) -> answer text, or raises
+                to make that request fail
+        """
+        self.delay = delay
+        self.responder = responder
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+    def answer(self, model, messages, max_tokens=None):
+        """Run the responder for one request; returns (text, usage) or raises."""
+        text = self.responder(model, messages)
+        prompt_tokens = sum(len(str(m['content']).split()) for m in messages)
+        return text, {'prompt_tokens': prompt_tokens, 'completion_tokens': len(text.split())}
+
+    def finished(self, batch):
+        return batch.get('cancelled') or time.monotonic() >= batch['ready_at']
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json'):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def do_POST(self):
+        if self.path == '/openai/v1/files':
+            return self._openai_upload()
+        if self.path == '/openai/v1/batches':
+            return self._openai_create()
+        if self.path == '/anthropic/v1/messages/batches':
+            return self._anthropic_create()
+        match = re.fullmatch(r'/(openai)/v1/batches/([\w-]+)/cancel|/(anthropic)/v1/messages/batches/([\w-]+)/cancel',
+                             self.path)
+        if match:
+            return self._cancel(match.group(1) or match.group(3), match.group(2) or match.group(4))
+        self._send(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+    def do_GET(self):
+        match = re.fullmatch(r'/openai/v1/batches/([\w-]+)', self.path)
+        if match:
+            return self._openai_status(match.group(1))
+        match = re.fullmatch(r'/openai/v1/files/([\w-]+)/content', self.path)
+        if match:
+            return self._openai_file(match.group(1))
+        match = re.fullmatch(r'/anthropic/v1/messages/batches/([\w-]+)(/results)?', self.path)
+        if match:
+            return self._anthropic_results(match.group(1)) if match.group(2) else \
+                self._anthropic_status(match.group(1))
+        self._send(404, {'error': {'message': f'Unknown path {self.path}'}})
+
+    def _cancel(self, kind, batch_id):
+        with self.service.lock:
+            batch = self.service.batches.get(batch_id)
+            if batch is not None:
+                batch['cancelled'] = True
+        if batch is None:
+            return self._send(404, {'error': {'message': 'Unknown batch'}})
+        self._openai_status(batch_id) if kind == 'openai' else self._anthropic_status(batch_id)
+
+    # OpenAI: upload a JSONL file, create a batch over it, poll, download the output file
+
+    def _openai_upload(self):
+        raw = b'Content-Type: ' + self.headers['Content-Type'].encode() + b'\r\n\r\n' + self._body()
+        message = email.parser.BytesParser(policy=email.policy.default).parsebytes(raw)
+        content = next(part.get_payload(decode=True) for part in message.iter_parts()
+                       if part.get_param('name', header='content-disposition') == 'file')
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        with self.service.lock:
+            self.service.files[file_id] = content
+        self._send(200, {'id': file_id, 'object': 'file', 'purpose': 'batch'})
+
+    def _openai_create(self):
+        request = json.loads(self._body())
+        with self.service.lock:
+            content = self.service.files.get(request.get('input_file_id'))
+        if content is None:
+            return self._send(400, {'error': {'message': 'Unknown input_file_id'}})
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        with self.service.lock:
+            self.service.batches[batch_id] = {
+                'kind': 'openai',
+                'requests': [json.loads(line) for line in content.decode('utf-8').splitlines() if line.strip()],
+                'ready_at': time.monotonic() + self.service.delay
+            }
+        self._openai_status(batch_id)
+
+    def _openai_status(self, batch_id):
+        batch = self.service.batches.get(batch_id)
+        if batch is None:
+            return self._send(404, {'error': {'message': 'Unknown batch'}})
+        body = {'id': batch_id, 'object': 'batch', 'status': 'in_progress'}
+        if batch.get('cancelled'):
+            body.update(status='cancelled', output_file_id=None, error_file_id=None)
+        elif self.service.finished(batch):
+            if 'output_file_id' not in batch:
+                self._openai_complete(batch)
+            body.update(status='completed', output_file_id=batch['output_file_id'],
+                        error_file_id=batch['error_file_id'])
+        self._send(200, body)
+
+    def _openai_complete(self, batch):
+        output, errors = [], []
+        for item in batch['requests']:
+            request = item['body']
+            try:
+                text, usage = self.service.answer(request['model'], request['messages'], request.get('max_tokens'))
+            except Exception as e:
+                errors.append({'custom_id': item['custom_id'],
+                               'response': {'status_code': 500, 'body': {'error': {'message': str(e)}}}})
+                continue
+            output.append({'custom_id': item['custom_id'], 'response': {'status_code': 200, 'body': {
+                'model': request['model'],
+                'choices': [{'message': {'role': 'assistant', 'content': text}}],
+                'usage': dict(usage, total_tokens=sum(usage.values()))
+            }}})
+        with self.service.lock:
+            for field, lines in (('output_file_id', output), ('error_file_id', errors)):
+                file_id = f"file-{uuid.uuid4().hex[:12]}" if lines else None
+                if file_id:
+                    self.service.files[file_id] = ''.join(json.dumps(line) + '\n' for line in lines).encode()
+                batch[field] = file_id
+
+    def _openai_file(self, file_id):
+        content = self.service.files.get(file_id)
+        if content is None:
+            return self._send(404, {'error': {'message': 'Unknown file'}})
+        self._send(200, content, 'application/jsonl')
+
+    # Anthropic: create a batch from inline requests, poll, download results
+
+    def _anthropic_create(self):
+        request = json.loads(self._body())
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:12]}"
+        with self.service.lock:
+            self.service.batches[batch_id] = {
+                'kind': 'anthropic',
+                'requests': request['requests'],
+                'ready_at': time.monotonic() + self.service.delay
+            }
+        self._anthropic_status(batch_id)
+
+    def _anthropic_status(self, batch_id):
+        batch = self.service.batches.get(batch_id)
+        if batch is None:
+            return self._send(404, {'error': {'message': 'Unknown batch'}})
+        ended = self.service.finished(batch)
+        host = f"http://{self.headers['Host']}"
+        self._send(200, {
+            'id': batch_id,
+            'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'results_url': f"{host}/anthropic/v1/messages/batches/{batch_id}/results" if ended else None
+        })
+
+    def _anthropic_results(self, batch_id):
+        batch = self.service.batches.get(batch_id)
+        if batch is None or not self.service.finished(batch):
+            return self._send(404, {'error': {'message': 'Results not available'}})
+        lines = []
+        for item in batch['requests']:
+            params = item['params']
+            if batch.get('cancelled'):
+                lines.append({'custom_id': item['custom_id'], 'result': {'type': 'canceled'}})
+                continue
+            try:
+                text, usage = self.service.answer(params['model'], params['messages'], params.get('max_tokens'))
+                result = {'type': 'succeeded', 'message': {
+                    'model': params['model'],
+                    'content': [{'type': 'text', 'text': text}],
+                    'usage': {'input_tokens': usage['prompt_tokens'], 'output_tokens': usage['completion_tokens']}
+                }}
+            except Exception as e:
+                result = {'type': 'errored', 'error': {'type': 'error', 'error': {'message': str(e)}}}
+            lines.append({'custom_id': item['custom_id'], 'result': result})
+        self._send(200, ''.join(json.dumps(line) + '\n' for line in lines).encode(), 'application/jsonl')
+
+
+def serve(port=8089, delay=2.0, responder=echo_responder, host='127.0.0.1'):
+    """
+    Start the stand-in in a background thread
+
+    Returns:
+        ThreadingHTTPServer: The server; call shutdown() to stop it
+    """
+    service = BatchStandIn(delay, responder)
+    handler = type('BatchStandInHandler', (_Handler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.service = service
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI and Anthropic batch APIs")
+    parser.add_argument('--port', type=int, default=8089, help="Port to listen on")
+    parser.add_argument('--delay', type=float, default=2.0, help="Seconds until a batch finishes")
+    args = parser.parse_args(argv)
+    server = serve(args.port, args.delay)
+    print(f"Batch stand-in listening on http://127.0.0.1:{args.port} (openai: /openai/v1, "
+          f"anthropic: /anthropic/v1/messages/batches)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
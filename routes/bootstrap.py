@@ -0,0 +1,36 @@
+"""
+Bootstrap data inlined into the index page.
+The page needs the model catalog and the session's auth state before it
+can render anything interactive; embedding both saves the two API round
+trips it would otherwise make on load. The catalog is serialized once per
+worker and versioned by a hash of its content, so browsers and caches can
+tell when it changed.
+"""
+from flask import session
+from jinja2.utils import htmlsafe_json_dumps
+from markupsafe import Markup
+
+from .api import AVAILABLE_MODELS, MODEL_CATALOG_VERSION
+
+# Serialized once; escaped so the JSON is safe inside a <script> element
+MODEL_CATALOG_JSON = htmlsafe_json_dumps(AVAILABLE_MODELS, sort_keys=True)
+
+
+def auth_state():
+    """Return the session's auth state, as /api/auth/status reports it."""
+    if session.get('user'):
+        return {'authenticated': True, 'user': session['user']}
+    return {'authenticated': False}
+
+
+def bootstrap_json():
+    """
+    Build the bootstrap blob for the index page
+
+    Returns:
+        Markup: JSON with the model catalog, its version and the auth state,
+            safe to place inside <script type="application/json">
+    """
+    # The precomputed catalog is spliced in as-is; only the auth state is serialized per request
+    return Markup(f'{{"models": {MODEL_CATALOG_JSON}, "models_version": "{MODEL_CATALOG_VERSION}", '
+                  f'"auth": {htmlsafe_json_dumps(auth_state())}}}')
@@ -0,0 +1,337 @@
+"""
+Bulkheads isolating providers from each other.
+Each provider gets its own thread pool and concurrency limit, and each API
+key its own limit within the provider, so a provider that slows down (or
+one busy key) only ties up its own slots. Calls beyond a limit wait in a
+bounded queue and are rejected once it is full or the wait runs out,
+instead of holding threads that calls to healthy providers need.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from .metrics import metrics
+
+logger = logging.getLogger('aiSpectrum')
+
+# Concurrent calls per provider, and per API key within a provider
+PROVIDER_CONCURRENCY = int(os.environ.get('AISPECTRUM_BULKHEAD_PROVIDER', 8))
+KEY_CONCURRENCY = int(os.environ.get('AISPECTRUM_BULKHEAD_KEY', 4))
+# Per-provider overrides of PROVIDER_CONCURRENCY, e.g. "anthropic=4,local=2"
+PROVIDER_LIMITS = {
+    provider_id.strip(): int(limit)
+    for provider_id, limit in (item.split('=', 1) for item in
+                               filter(None, os.environ.get('AISPECTRUM_BULKHEAD_LIMITS', '').split(',')))
+}
+# Calls that may wait for a slot of a provider or key
+QUEUE_SIZE = int(os.environ.get('AISPECTRUM_BULKHEAD_QUEUE', 16))
+# Longest a call waits for its slots before it is rejected, in seconds
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('AISPECTRUM_BULKHEAD_QUEUE_TIMEOUT', 5))
+
+_local = threading.local()
+
+
+class BulkheadFullError(Exception):
+    """Raised when a call is rejected by a bulkhead."""
+
+    def __init__(self, name, reason):
+        super().__init__(f"Bulkhead full for {name} ({reason})")
+        self.name = name
+        self.reason = reason
+
+
+class Bulkhead:
+    """Concurrency limit with a bounded, time-limited wait queue."""
+
+    def __init__(self, name, max_concurrent, max_queue=QUEUE_SIZE):
+        """
+        Initialize the bulkhead
+
+        Args:
+            name (str): Label for logs and metrics
+            max_concurrent (int): Calls allowed to run at once
+            max_queue (int): Calls allowed to wait for a slot
+        """
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {'queue_full': 0, 'queue_timeout': 0}
+        self._cond = threading.Condition()
+
+    def _report(self):
+        """Publish the bulkhead's gauges (lock held)."""
+        metrics.set_gauge('bulkhead_active', self.active, bulkhead=self.name)
+        metrics.set_gauge('bulkhead_queued', self.queued, bulkhead=self.name)
+        metrics.set_gauge('bulkhead_utilization', round(self.active / self.max_concurrent, 3), bulkhead=self.name)
+
+    def _reject(self, reason):
+        """Count a rejected call and build its error (lock held)."""
+        self.rejected[reason] += 1
+        metrics.inc('bulkhead_rejected_total', bulkhead=self.name, reason=reason)
+        logger.warning(f"Bulkhead {self.name} rejected a call: {reason} "
+                       f"(active {self.active}/{self.max_concurrent}, queued {self.queued}/{self.max_queue})")
+        return BulkheadFullError(self.name, reason)
+
+    def acquire(self, timeout=QUEUE_TIMEOUT_SECONDS):
+        """
+        Take a slot, waiting in the queue if all slots are in use
+
+        Args:
+            timeout (float): Seconds to wait for a slot
+
+        Raises:
+            BulkheadFullError: If the queue is full or the wait times out
+        """
+        start = time.monotonic()
+        with self._cond:
+            if self.active >= self.max_concurrent or self.queued:
+                if self.queued >= self.max_queue or timeout <= 0:
+                    raise self._reject('queue_full' if self.queued >= self.max_queue else 'queue_timeout')
+                self.queued += 1
+                self._report()
+                try:
+                    admitted = self._cond.wait_for(lambda: self.active < self.max_concurrent, timeout)
+                finally:
+                    self.queued -= 1
+                if not admitted:
+                    self._report()
+                    raise self._reject('queue_timeout')
+                metrics.observe('bulkhead_queue_wait_ms', (time.monotonic() - start) * 1000, bulkhead=self.name)
+            self.active += 1
+            self.admitted += 1
+            self._report()
+
+    def try_acquire(self):
+        """Take a slot only if one is free and nobody is queued for it; returns whether it did."""
+        with self._cond:
+            if self.active >= self.max_concurrent or self.queued:
+                return False
+            self.active += 1
+            self.admitted += 1
+            self._report()
+            return True
+
+    def widen(self, max_concurrent, max_queue):
+        """Raise the limits to at least the given ones, admitting waiting calls that now fit."""
+        with self._cond:
+            self.max_concurrent = max(self.max_concurrent, max_concurrent)
+            self.max_queue = max(self.max_queue, max_queue)
+            self._report()
+            self._cond.notify_all()
+
+    def reject(self, reason):
+        """Reject a call without waiting, e.g. when the provider's pool is saturated."""
+        with self._cond:
+            return self._reject(reason)
+
+    def release(self):
+        """Free a slot and wake the next waiting call."""
+        with self._cond:
+            self.active -= 1
+            self._report()
+            self._cond.notify()
+
+    def snapshot(self):
+        """Return the bulkhead's limits, utilization and rejection counts."""
+        with self._cond:
+            return {
+                'active': self.active,
+                'queued': self.queued,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'utilization': round(self.active / self.max_concurrent, 3),
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected)
+            }
+
+
+class ProviderBulkheads:
+    """The bulkheads and thread pools of every provider and API key in this worker."""
+
+    def __init__(self, provider_limits=None, default_limit=PROVIDER_CONCURRENCY, key_limit=KEY_CONCURRENCY,
+                 max_queue=QUEUE_SIZE, queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        """
+        Initialize the registry
+
+        Args:
+            provider_limits (dict): Provider id -> concurrency limit overrides
+            default_limit (int): Concurrency limit of other providers
+            key_limit (int): Concurrency limit per API key
+            max_queue (int): Calls allowed to wait per provider and per key
+            queue_timeout (float): Seconds a call may wait for its slots in total
+        """
+        self.provider_limits = dict(PROVIDER_LIMITS if provider_limits is None else provider_limits)
+        self.default_limit = default_limit
+        self.key_limit = key_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._bulkheads = {}
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, limit):
+        with self._lock:
+            bulkhead = self._bulkheads.get(name)
+            if bulkhead is None:
+                bulkhead = self._bulkheads[name] = Bulkhead(name, limit, self.max_queue)
+            return bulkhead
+
+    def provider(self, provider_id):
+        """Return a provider's bulkhead."""
+        return self._get(provider_id, self.provider_limits.get(provider_id, self.default_limit))
+
+    def key(self, provider_id, api_key):
+        """Return the bulkhead of one API key of a provider (named by a hash, never the key itself)."""
+        digest = hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:8]
+        return self._get(f"{provider_id}/{digest}", self.key_limit)
+
+    def executor(self, provider_id):
+        """
+        Return a provider's own thread pool
+
+        The pool has a thread for every slot and queue place of the provider,
+        so calls waiting for a slow provider never occupy threads of others.
+        Calls submitted while every thread is taken are rejected at once.
+        """
+        with self._lock:
+            executor = self._executors.get(provider_id)
+            if executor is None:
+                limit = self.provider_limits.get(provider_id, self.default_limit)
+                executor = self._executors[provider_id] = _BulkheadExecutor(
+                    limit + self.max_queue, f"provider-{provider_id}")
+            return executor
+
+    def reserve(self, concurrency, queue_timeout):
+        """
+        Make room for a job keeping up to concurrency calls per provider and key in flight
+
+        Limits below concurrency are raised, also for bulkheads already in use;
+        providers with an explicit limit in provider_limits keep it, and their
+        calls wait for up to queue_timeout instead.
+
+        Args:
+            concurrency (int): Calls the job runs at once
+            queue_timeout (float): Seconds a call may wait for its slots
+        """
+        with self._lock:
+            self.default_limit = max(self.default_limit, concurrency)
+            self.key_limit = max(self.key_limit, concurrency)
+            self.max_queue = max(self.max_queue, concurrency)
+            self.queue_timeout = max(self.queue_timeout, queue_timeout)
+            existing = list(self._bulkheads.values())
+            # Pools are sized when they are created, so later calls get pools of the new size
+            self._executors.clear()
+        for bulkhead in existing:
+            bulkhead.widen(self.provider_limits.get(bulkhead.name, concurrency), self.max_queue)
+
+    @contextmanager
+    def slot(self, plan):
+        """
+        Hold a slot of the plan's provider and API key while the block runs
+
+        The queue timeout counts from when the call was submitted to the
+        provider's pool, so calls that waited for a thread are not kept longer.
+
+        Raises:
+            BulkheadFullError: If either bulkhead rejects the call
+        """
+        if getattr(_local, 'saturated', False):
+            raise self.provider(plan['provider_id']).reject('queue_full')
+        deadline = getattr(_local, 'queued_since', None) or time.monotonic()
+        deadline += self.queue_timeout
+        acquired = []
+        try:
+            for bulkhead in self._held(plan):
+                bulkhead.acquire(deadline - time.monotonic())
+                acquired.append(bulkhead)
+            yield
+        finally:
+            for bulkhead in reversed(acquired):
+                bulkhead.release()
+
+    @contextmanager
+    def spare_slot(self, plan):
+        """
+        Hold a slot of the plan's provider and API key if both are free right now
+
+        Unlike slot, this neither waits nor counts a rejection, for work that
+        can also run on the slots a call already holds (e.g. extra samples).
+
+        Yields:
+            bool: Whether the slots were taken
+        """
+        held, acquired = self._held(plan), []
+        try:
+            for bulkhead in held:
+                if not bulkhead.try_acquire():
+                    break
+                acquired.append(bulkhead)
+            yield len(acquired) == len(held)
+        finally:
+            for bulkhead in reversed(acquired):
+                bulkhead.release()
+
+    def _held(self, plan):
+        """Return the bulkheads a call of the plan takes a slot of: its provider's and its key's."""
+        held = [self.provider(plan['provider_id'])]
+        if plan['config'].get('key'):
+            held.append(self.key(plan['provider_id'], plan['config']['key']))
+        return held
+
+    def snapshot(self):
+        """Return the state of every bulkhead."""
+        with self._lock:
+            bulkheads = list(self._bulkheads.values())
+        return {bulkhead.name: bulkhead.snapshot() for bulkhead in bulkheads}
+
+
+class _BulkheadExecutor:
+    """Thread pool of one provider that records when each call was submitted."""
+
+    def __init__(self, max_workers, thread_name_prefix):
+        self.max_workers = max_workers
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run fn on the pool, or right away in the caller's thread if every pool
+        thread is taken; the call then finds its provider's bulkhead full
+        and returns its rejection without waiting for a thread.
+        """
+        with self._lock:
+            saturated = self.pending >= self.max_workers
+            if not saturated:
+                self.pending += 1
+        if not saturated:
+            return self._executor.submit(self._run, time.monotonic(), fn, args, kwargs)
+        future = Future()
+        _local.saturated = True
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            _local.saturated = False
+        return future
+
+    def _run(self, submitted, fn, args, kwargs):
+        _local.queued_since = submitted
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.queued_since = None
+            with self._lock:
+                self.pending -= 1
+
+
+# Shared provider bulkheads for this worker
+bulkheads = ProviderBulkheads()
@@ -0,0 +1,184 @@
+"""
+Cancellation of in-flight queries.
+Each /api/query registers a cancel token under its caller and request id,
+so only the caller that started a query can cancel or replace it.
+Cancelling the token (via /api/cancel, a superseding query or a client disconnect)
+stops waiting on the remaining providers and closes their open HTTP and
+streaming responses, returning the connections to the pool.
+"""
+import contextvars
+import logging
+import select
+import socket
+import threading
+
+from .error_handler import ERROR_TYPES
+
+logger = logging.getLogger('aiSpectrum')
+
+_current_token = contextvars.ContextVar('cancel_token', default=None)
+
+
+class QueryCancelledError(Exception):
+    """Raised inside a provider call once its query has been cancelled."""
+
+    def __init__(self, message="Query was cancelled"):
+        super().__init__(message)
+
+
+class CancelToken:
+    """Cancellation flag for one query, plus the resources to close on cancel."""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._closables = []
+        self._children = []
+
+    @property
+    def cancelled(self):
+        """True once cancel() has been called."""
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the query and close every registered response or stream."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            closables, self._closables = self._closables, []
+            children, self._children = self._children, []
+        for closable in closables:
+            try:
+                closable.close()
+            except Exception as e:
+                logger.debug(f"Error closing cancelled response: {str(e)}")
+        for child in children:
+            child.cancel()
+
+    def child(self):
+        """Return a token for one provider call, cancelled with the query but also on its own."""
+        child = CancelToken(self.request_id)
+        with self._lock:
+            if not self._event.is_set():
+                self._children.append(child)
+                return child
+        child.cancel()
+        return child
+
+    def register(self, closable):
+        """
+        Track an open response so cancel() can close it
+
+        Raises:
+            QueryCancelledError: If the query was already cancelled
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._closables.append(closable)
+                return closable
+        closable.close()
+        raise QueryCancelledError()
+
+    def unregister(self, closable):
+        """Stop tracking a response that has been read in full."""
+        with self._lock:
+            if closable in self._closables:
+                self._closables.remove(closable)
+
+    def raise_if_cancelled(self):
+        """Raise QueryCancelledError if the query has been cancelled."""
+        if self._event.is_set():
+            raise QueryCancelledError()
+
+
+class CancellationRegistry:
+    """Active cancel tokens keyed by caller and request id."""
+
+    def __init__(self):
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    def start(self, request_id, owner=None):
+        """
+        Register and return a token for a new query
+
+        Args:
+            request_id (str): The query's request id, chosen by the client
+            owner (str): Who started it (request_user); ids of other callers never collide with it
+        """
+        token = CancelToken(request_id)
+        with self._lock:
+            self._tokens[(owner, request_id)] = token
+        return token
+
+    def cancel(self, request_id, owner=None):
+        """Cancel an active query of owner, returning True if one was found."""
+        with self._lock:
+            token = self._tokens.get((owner, request_id))
+        if token is None:
+            return False
+        logger.info(f"Cancelling query {request_id}")
+        token.cancel()
+        return True
+
+    def finish(self, request_id, owner=None, token=None):
+        """Forget a query once it has completed, unless a newer query of owner took over its id."""
+        with self._lock:
+            if token is None or self._tokens.get((owner, request_id)) is token:
+                self._tokens.pop((owner, request_id), None)
+
+
+def current_token():
+    """Return the cancel token bound to the running provider call, if any."""
+    return _current_token.get()
+
+
+def run_with_token(token, task):
+    """Run a task with a cancel token bound for http_client and providers."""
+    _current_token.set(token)
+    return task()
+
+
+def cancelled_result(result_key, model=None):
+    """Standard result for a provider call abandoned because its query was cancelled."""
+    return {
+        'content': f"Error: {ERROR_TYPES['CANCELLED']['message']}",
+        'error_code': ERROR_TYPES['CANCELLED']['code'],
+        'model': model or result_key,
+        'status': 'cancelled'
+    }
+
+
+def client_disconnected(environ):
+    """
+    Check whether the client of a WSGI request has closed its connection
+
+    Works with servers that expose the client socket in the environ
+    (Werkzeug's 'werkzeug.socket', gunicorn's 'gunicorn.socket').
+
+    Args:
+        environ (dict): The WSGI environ of the request
+
+    Returns:
+        bool: True if the peer has closed the connection
+    """
+    sock = environ.get('werkzeug.socket') or environ.get('gunicorn.socket')
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        # A readable socket with nothing to peek means the peer hung up
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, ValueError):
+        # No data after all, or a TLS socket that cannot be peeked
+        return False
+    except OSError:
+        return True
+
+
+# Shared registry for the application
+cancellations = CancellationRegistry()
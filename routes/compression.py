@@ -0,0 +1,105 @@
+"""
+Response compression for the AI Spectrum API.
+Negotiates brotli or gzip from the client's Accept-Encoding header and
+compresses /api/* responses above a configurable size threshold.
+"""
+import gzip
+import logging
+import time
+from flask import current_app, request
+
+from .metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+logger = logging.getLogger('aiSpectrum')
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'text/html',
+    'text/plain',
+    'text/markdown',
+    'text/csv',
+    'application/javascript',
+    'text/css'
+}
+
+DEFAULT_CONFIG = {
+    'COMPRESS_PATH_PREFIX': '/api/',
+    'COMPRESS_MIN_SIZE': 1024,
+    'COMPRESS_GZIP_LEVEL': 6,
+    'COMPRESS_BROTLI_QUALITY': 4
+}
+
+
+def supported_encodings():
+    """Return the encodings this server can produce, most preferred first."""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def compress_body(data, encoding, config):
+    """
+    Compress a response body
+
+    Args:
+        data (bytes): The uncompressed body
+        encoding (str): 'br' or 'gzip'
+        config (dict): App config holding the compression levels
+
+    Returns:
+        bytes: The compressed body
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_GZIP_LEVEL'])
+
+
+def compress_response(response):
+    """after_request hook that compresses eligible API responses"""
+    config = current_app.config
+
+    if not request.path.startswith(config['COMPRESS_PATH_PREFIX']):
+        return response
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+
+    encoding = request.accept_encodings.best_match(supported_encodings())
+    if not encoding:
+        return response
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    start = time.perf_counter()
+    compressed = compress_body(data, encoding, config)
+    encode_ms = (time.perf_counter() - start) * 1000
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(compressed))
+
+    metrics.inc('compression_responses_total', encoding=encoding)
+    metrics.inc('compression_bytes_in_total', len(data), encoding=encoding)
+    metrics.inc('compression_bytes_out_total', len(compressed), encoding=encoding)
+    metrics.observe('compression_ratio', len(data) / max(len(compressed), 1), encoding=encoding)
+    metrics.observe('compression_encode_ms', encode_ms, encoding=encoding)
+    logger.debug(f"Compressed {request.path} with {encoding}: {len(data)} -> {len(compressed)} bytes in {encode_ms:.2f} ms")
+
+    return response
+
+
+def init_compression(app):
+    """Register the compression hook and its config defaults on the app."""
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+    app.after_request(compress_response)
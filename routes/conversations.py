@@ -0,0 +1,162 @@
+"""
+Server-side conversation sessions for multi-turn queries.
+Each conversation keeps a separate message history per provider, trimmed
+to a token budget so follow-up questions do not need to re-send context.
+"""
+import time
+import uuid
+
+from .state import MemoryBackend, state
+from .tokens import estimate_tokens
+
+# Default token budget for a provider's history, excluding the new query
+DEFAULT_HISTORY_TOKEN_BUDGET = 8000
+
+# When a history exceeds its budget it is trimmed down to this fraction of
+# the budget, so the retained prefix stays byte-identical for the next
+# several turns and provider prompt caches keep hitting.
+TRUNCATE_TARGET_RATIO = 0.75
+
+
+def history_tokens(messages):
+    """Estimate the total tokens in a list of chat messages."""
+    return sum(estimate_tokens(m['content']) for m in messages)
+
+
+def truncate_history(messages, token_budget):
+    """
+    Drop the oldest user/assistant turns until a history fits its budget
+
+    Args:
+        messages (list): Alternating user/assistant messages, oldest first
+        token_budget (int): Maximum estimated tokens for the history
+
+    Returns:
+        tuple: (retained messages, number of turns dropped)
+    """
+    if history_tokens(messages) <= token_budget:
+        return messages, 0
+
+    target = token_budget * TRUNCATE_TARGET_RATIO
+    retained = list(messages)
+    dropped = 0
+    while retained and history_tokens(retained) > target:
+        # Always drop whole turns so the history still starts with a user message
+        retained = retained[2:]
+        dropped += 1
+    return retained, dropped
+
+
+class ConversationStore:
+    """Conversations kept in a state backend, expiring after a period of inactivity."""
+
+    def __init__(self, ttl_seconds=3600, max_conversations=1000, backend=None):
+        """
+        Initialize the store
+
+        Args:
+            ttl_seconds (int): Idle time after which a conversation expires
+            max_conversations (int): Maximum number of conversations kept in memory
+            backend (StateBackend): Shared backend, so every worker sees the same
+                conversations; defaults to a private in-memory backend
+        """
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend or MemoryBackend(max_entries=max_conversations)
+
+    @staticmethod
+    def _key(conversation_id):
+        return f"conversation:{conversation_id}"
+
+    def _modify(self, conversation_id, fn):
+        """Apply fn to a stored conversation atomically, refreshing its expiry."""
+        def apply(conversation):
+            if conversation is not None:
+                fn(conversation)
+            return conversation
+        return self.backend.update(self._key(conversation_id), apply, self.ttl_seconds)
+
+    def create(self):
+        """Start a new conversation and return it."""
+        now = time.time()
+        conversation = {
+            'id': str(uuid.uuid4()),
+            'created': now,
+            'updated': now,
+            'turns': 0,
+            'histories': {},
+            'truncated_turns': {}
+        }
+        self.backend.set(self._key(conversation['id']), conversation, self.ttl_seconds)
+        return conversation
+
+    def get(self, conversation_id):
+        """Return a conversation by id, or None if it does not exist or expired."""
+        if not conversation_id:
+            return None
+        return self.backend.get(self._key(conversation_id))
+
+    def delete(self, conversation_id):
+        """Delete a conversation, returning True if it existed."""
+        return self.backend.delete(self._key(conversation_id))
+
+    def history(self, conversation_id, provider_id, token_budget=DEFAULT_HISTORY_TOKEN_BUDGET):
+        """
+        Return a provider's message history, trimmed to the token budget
+
+        The stored history is left as it is; the trimming is only kept once a
+        turn sent with it succeeds (see append_turn), so a query that is
+        rejected or only estimated never loses turns.
+
+        Args:
+            conversation_id (str): The conversation id
+            provider_id (str): The provider whose history to return
+            token_budget (int): Maximum estimated tokens for the history
+
+        Returns:
+            list: Messages (oldest first) to send before the new query
+        """
+        conversation = self.get(conversation_id)
+        if conversation is None:
+            return []
+        messages, _ = truncate_history(conversation['histories'].get(provider_id, []), max(token_budget, 0))
+        return list(messages)
+
+    def append_turn(self, conversation_id, provider_id, user_content, assistant_content, history=None):
+        """
+        Record a completed user/assistant exchange for one provider
+
+        Args:
+            conversation_id (str): The conversation id
+            provider_id (str): The provider that answered
+            user_content (str): The query
+            assistant_content (str): The answer
+            history (list): The history sent with the query, from history(); when
+                it is a trimmed tail of the stored history, the older turns are
+                dropped for good so the prefix stays stable on later turns
+        """
+        def append(conversation):
+            stored = conversation['histories'].setdefault(provider_id, [])
+            if history is not None and len(history) < len(stored) and stored[len(stored) - len(history):] == history:
+                dropped = (len(stored) - len(history)) // 2
+                del stored[:len(stored) - len(history)]
+                truncated = conversation['truncated_turns']
+                truncated[provider_id] = truncated.get(provider_id, 0) + dropped
+            stored.extend([
+                {'role': 'user', 'content': user_content},
+                {'role': 'assistant', 'content': assistant_content}
+            ])
+            conversation['updated'] = time.time()
+
+        self._modify(conversation_id, append)
+
+    def finish_turn(self, conversation_id):
+        """Mark one query round of a conversation as complete."""
+        def finish(conversation):
+            conversation['turns'] += 1
+            conversation['updated'] = time.time()
+
+        self._modify(conversation_id, finish)
+
+
+# Shared conversation store for the application
+conversations = ConversationStore(backend=state if not isinstance(state, MemoryBackend) else None)
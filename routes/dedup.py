@@ -0,0 +1,250 @@
+"""
+Near-duplicate query detection.
+Each answered query gets a MinHash signature over character shingles of
+its normalized text, indexed in LSH bands, so a new query
+that differs only in whitespace, casing, punctuation or small wording
+changes finds its earlier twin without scanning every past query.
+Entries live in the state backend, so every worker shares one index, and
+each belongs to the signed-in user or API key that asked it: a lookup
+only ever sees its owner's queries. Deduplication is opt-in per request.
+"""
+import logging
+import os
+import re
+import time
+import uuid
+import zlib
+
+from .state import MemoryBackend, state
+
+logger = logging.getLogger('aiSpectrum')
+
+# Minimum shingle Jaccard similarity for two queries to count as duplicates
+DEFAULT_THRESHOLD = float(os.environ.get('AISPECTRUM_DEDUP_THRESHOLD', 0.7))
+# Mode for requests without a 'dedup' field: 'off', 'offer' (report a match
+# alongside fresh results) or 'serve' (return the earlier results)
+DEFAULT_MODE = os.environ.get('AISPECTRUM_DEDUP_MODE', 'off')
+# Entries older than this expire and are no longer matched
+MAX_AGE_SECONDS = int(os.environ.get('AISPECTRUM_DEDUP_MAX_AGE', 24 * 3600))
+# Entries kept by the in-memory backend of a single worker
+MAX_ENTRIES = int(os.environ.get('AISPECTRUM_DEDUP_MAX_ENTRIES', 10000))
+
+SHINGLE_SIZE = 4
+SIGNATURE_SIZE = 64
+# 16 bands of 4 rows: queries with Jaccard 0.7 collide in some band ~99% of
+# the time, queries with Jaccard 0.2 about 2.5% of the time
+LSH_BANDS = 16
+BAND_ROWS = SIGNATURE_SIZE // LSH_BANDS
+# Most recent entries kept per LSH bucket; a crowded bucket forgets its oldest
+BUCKET_SIZE = 32
+# Provider settings a stored answer depends on; it is only served to a request with the same ones
+ANSWER_SETTINGS = ('max_tokens', 'max_response_tokens', 'max_response_bytes', 'endpoint', 'deployment')
+# Fixed seed so stored signatures stay comparable across workers and restarts
+HASH_SEED = 20240601
+MODES = ('offer', 'serve')
+
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize(text):
+    """Lowercase a query and collapse punctuation and whitespace to single spaces."""
+    return _NON_WORD_RE.sub(' ', text.lower()).strip()
+
+
+def shingles(normalized):
+    """Return the set of character shingles of a normalized query."""
+    if len(normalized) <= SHINGLE_SIZE:
+        return {normalized}
+    return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+
+
+def _hash_params():
+    """Return the (multiplier, offset) arrays of the MinHash hash family."""
+    global _params
+    if _params is None:
+        import numpy as np
+        rng = np.random.RandomState(HASH_SEED)
+        multipliers = rng.randint(1, 1 << 32, size=SIGNATURE_SIZE, dtype=np.uint64) << np.uint64(32)
+        offsets = rng.randint(0, 1 << 32, size=SIGNATURE_SIZE, dtype=np.uint64) << np.uint64(32)
+        # Odd multipliers keep multiply-shift hashing universal
+        _params = (multipliers | np.uint64(1), offsets)
+    return _params
+
+
+_params = None
+
+
+def minhash(features):
+    """
+    Compute the MinHash signature of a set of features
+
+    Args:
+        features (set): Shingles of a normalized query
+
+    Returns:
+        list: SIGNATURE_SIZE ints; the fraction of equal positions between
+            two signatures estimates the Jaccard similarity of their sets
+    """
+    # Imported here so numpy only loads once the first query is indexed
+    import numpy as np
+
+    if not features:
+        return [0] * SIGNATURE_SIZE
+    multipliers, offsets = _hash_params()
+    # crc32 rather than hash() so signatures are stable across processes
+    values = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint64, count=len(features))
+    # Multiply-shift hashing; uint64 arithmetic wraps modulo 2**64
+    hashed = (values[:, None] * multipliers + offsets) >> np.uint64(32)
+    return hashed.min(axis=0).tolist()
+
+
+def jaccard(a, b):
+    """Jaccard similarity of two shingle sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _bands(signature):
+    """Split a signature into its LSH band keys."""
+    return [(band, tuple(signature[band * BAND_ROWS:(band + 1) * BAND_ROWS])) for band in range(LSH_BANDS)]
+
+
+def request_mode(value):
+    """
+    Resolve a request's 'dedup' field to a mode
+
+    Args:
+        value: 'offer' or 'serve' to opt in, False/'off' to opt out, or None
+            for AISPECTRUM_DEDUP_MODE
+
+    Returns:
+        str: 'offer', 'serve', or None when deduplication is disabled
+    """
+    if value is False or value == 'off':
+        return None
+    if value in MODES:
+        return value
+    return DEFAULT_MODE if DEFAULT_MODE in MODES else None
+
+
+class DedupIndex:
+    """LSH index of answered queries kept in a state backend, scoped to the owner of each query."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_age_seconds=MAX_AGE_SECONDS, backend=None):
+        """
+        Initialize the index
+
+        Args:
+            max_entries (int): Maximum number of queries kept by the default backend
+            max_age_seconds (int): Age after which an entry expires
+            backend (StateBackend): Shared backend, so every worker sees the same
+                index; defaults to a private in-memory backend
+        """
+        self.max_age_seconds = max_age_seconds
+        # Each entry takes one key and a place in LSH_BANDS bucket keys
+        self.backend = backend or MemoryBackend(max_entries=max_entries * (LSH_BANDS + 1))
+
+    @staticmethod
+    def _entry_key(entry_id):
+        return f"dedup:entry:{entry_id}"
+
+    @staticmethod
+    def _bucket_key(owner, band):
+        index, rows = band
+        return f"dedup:bucket:{owner}:{index}:{'.'.join(map(str, rows))}"
+
+    def find(self, query, owner, threshold=DEFAULT_THRESHOLD, prefer=None):
+        """
+        Find the most similar earlier query of the same owner
+
+        Args:
+            query (str): The new query
+            owner (str): Who is asking, from request_owner
+            threshold (float): Minimum shingle Jaccard similarity
+            prefer (callable): Optional entry -> bool; matching entries for which
+                it is true win over more similar or newer ones
+
+        Returns:
+            tuple: (entry, similarity), or (None, 0.0) if nothing is close enough
+        """
+        normalized = normalize(query)
+        features = shingles(normalized)
+        candidate_ids = set()
+        for band in _bands(minhash(features)):
+            candidate_ids.update(self.backend.get(self._bucket_key(owner, band)) or ())
+
+        cutoff = time.time() - self.max_age_seconds
+        best, best_similarity, best_rank = None, 0.0, None
+        for entry_id in candidate_ids:
+            entry = self.backend.get(self._entry_key(entry_id))
+            if entry is None or entry['owner'] != owner or entry['created'] < cutoff:
+                continue
+            similarity = 1.0 if entry['normalized'] == normalized else jaccard(features, shingles(entry['normalized']))
+            if similarity < threshold:
+                continue
+            rank = (prefer is not None and prefer(entry), similarity, entry['created'])
+            if best_rank is None or rank > best_rank:
+                best, best_similarity, best_rank = entry, similarity, rank
+        return best, best_similarity
+
+    def add(self, query, results, params, owner):
+        """
+        Index an answered query
+
+        Args:
+            query (str): The query
+            results (dict): Result key -> successful provider result
+            params (dict): Result key -> answer_params of its plan, to match later requests
+            owner (str): Who asked it, from request_owner
+
+        Returns:
+            dict: The stored entry
+        """
+        normalized = normalize(query)
+        entry = {
+            'id': str(uuid.uuid4()),
+            'owner': owner,
+            'query': query,
+            'normalized': normalized,
+            'signature': minhash(shingles(normalized)),
+            'results': results,
+            'params': params,
+            'created': time.time()
+        }
+        try:
+            self.backend.set(self._entry_key(entry['id']), entry, self.max_age_seconds)
+            for band in _bands(entry['signature']):
+                self.backend.update(self._bucket_key(owner, band),
+                                    lambda ids: ((ids or []) + [entry['id']])[-BUCKET_SIZE:],
+                                    self.max_age_seconds)
+        except Exception as e:
+            # Deduplication must never fail the query it describes
+            logger.warning(f"Could not store dedup index entry: {str(e)}")
+        return entry
+
+    def get(self, entry_id, owner):
+        """Return a stored entry by id if it belongs to owner, or None."""
+        entry = self.backend.get(self._entry_key(entry_id))
+        if entry is None or entry['owner'] != owner:
+            return None
+        return entry
+
+    def covers(self, entry, plans):
+        """Check that an entry holds a successful result for every planned target, asked with the same parameters."""
+        params = entry.get('params') or {}
+        return bool(plans) and all(
+            plan['result_key'] in entry['results'] and params.get(plan['result_key']) == answer_params(plan)
+            for plan in plans
+        )
+
+
+def answer_params(plan):
+    """Return what a planned call's answer depends on besides the query: model, samples and ANSWER_SETTINGS."""
+    params = {name: plan['config'].get(name) for name in ANSWER_SETTINGS}
+    params.update(model=plan['model'], samples=plan['samples'])
+    return params
+
+
+# Shared index for the application, in the state backend when one is configured
+dedup_index = DedupIndex(backend=state if not isinstance(state, MemoryBackend) else None)
@@ -0,0 +1,472 @@
+"""
+Concurrent fan-out of provider calls.
+Every target of a query runs on a thread pool (a shared one, or its
+provider's own bulkhead pool), so a query costs roughly as long as its
+slowest provider instead of the sum of all of them.
+"""
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from . import tokens
+from .limits import response_limits
+from .bulkhead import BulkheadFullError
+from .cancellation import QueryCancelledError, cancelled_result, run_with_token
+from .error_handler import ERROR_TYPES, handle_api_error
+from .metrics import metrics
+from .profiling import bind_tasks
+from .providers import PROVIDER_MODULES, get_provider
+from .providers.common import sample_result
+
+logger = logging.getLogger('aiSpectrum')
+
+# Upper bound on provider calls in flight across all requests in this process
+MAX_WORKERS = int(os.environ.get('AISPECTRUM_DISPATCH_WORKERS', 32))
+# How often a waiting query checks for cancellation or client disconnect
+CANCEL_POLL_SECONDS = 0.25
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the shared provider-call thread pool, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='provider')
+    return _executor
+
+
+def plan_targets(api_keys):
+    """
+    List the provider calls a request asks for
+
+    Providers that support several endpoints (e.g. 'local') expand into
+    one target per endpoint.
+
+    Args:
+        api_keys (dict): The request's api_keys mapping
+
+    Returns:
+        list: (result_key, provider_id, config) tuples in query order
+    """
+    targets = []
+    for provider_id in PROVIDER_MODULES:
+        config = api_keys.get(provider_id)
+        if not config:
+            continue
+        provider = get_provider(provider_id)
+        if hasattr(provider, 'expand'):
+            targets.extend((key, provider_id, cfg) for key, cfg in provider.expand(provider_id, config))
+        else:
+            targets.append((provider_id, provider_id, config))
+    return targets
+
+
+def pending_result(result_key, model=None):
+    """Result for a provider call still running when a first_k query returned."""
+    return {
+        'content': '',
+        'model': model or result_key,
+        'status': 'pending'
+    }
+
+
+def _succeeded(result):
+    return isinstance(result, dict) and result.get('status') == 'success'
+
+
+def run_all(tasks, token=None, disconnected=None, until=None, on_late=None, hedges=None, executors=None):
+    """
+    Run callables concurrently and collect their results
+
+    With a cancel token, each task runs with its own child token bound so
+    its HTTP calls can be aborted, and waiting stops as soon as the token is
+    cancelled or the disconnected() check reports that the client went
+    away. Tasks still running at that point get a cancelled result.
+
+    Args:
+        tasks (dict): Result key -> zero-argument callable
+        token (CancelToken): Optional cancel token for the query
+        disconnected (callable): Optional check for a client disconnect
+        until (callable): Optional check on the results collected so far;
+            once it returns True, waiting stops and the remaining tasks are
+            cancelled, or left running if on_late is given
+        on_late (callable): Receives (key, result) for each task left running
+            by until, once it finishes; such tasks get a pending result
+        hedges (dict): Result key -> (delay in seconds, zero-argument callable).
+            If the task has not finished after the delay, the callable is
+            started as a duplicate and whichever succeeds first is the result
+        executors (dict): Result key -> executor to run that task on instead
+            of the shared pool, e.g. its provider's bulkhead pool
+
+    Returns:
+        dict: Result key -> return value, in the same order as tasks
+    """
+    hedges = hedges or {}
+    if token is None and len(tasks) <= 1 and not hedges:
+        return {key: task() for key, task in tasks.items()}
+
+    executors = executors or {}
+    started = time.monotonic()
+    lock = threading.Lock()
+
+    def submit(key, task):
+        task = bind_tasks({key: task})[key]
+        child = token.child() if token is not None else None
+        if child is not None:
+            task = functools.partial(run_with_token, child, task)
+        # Each task runs in a copy of the caller's context, so the current trace span follows it
+        executor = executors.get(key) or get_executor()
+        return executor.submit(contextvars.copy_context().run, task), child
+
+    def abandon(attempt):
+        future, child = attempt
+        future.cancel()
+        if child is not None:
+            child.cancel()
+
+    def settle(key):
+        """Return a task's result once an attempt succeeds or all have finished, else None."""
+        with lock:
+            attempts = list(attempts_by_key[key])
+        finished = [attempt for attempt in attempts if attempt[0].done()]
+        for attempt in finished:
+            try:
+                result = attempt[0].result()
+            except BulkheadFullError as e:
+                # Turned away before it started, e.g. after waiting too long for a scheduler slot
+                result = handle_api_error(e, key)
+            if _succeeded(result) or len(finished) == len(attempts):
+                for other in attempts:
+                    if other is not attempt:
+                        abandon(other)
+                if len(attempts) > 1:
+                    won = attempts.index(attempt) > 0
+                    metrics.inc('hedge_results_total', provider=key, winner='hedge' if won else 'primary')
+                    if isinstance(result, dict):
+                        result = dict(result, hedged=True, hedge_won=won)
+                return result
+        return None
+
+    attempts_by_key = {key: [submit(key, task)] for key, task in tasks.items()}
+    results = {}
+    while True:
+        for key in tasks:
+            if key not in results:
+                result = settle(key)
+                if result is not None:
+                    results[key] = result
+        remaining = [key for key in tasks if key not in results]
+        if not remaining or (until is not None and until(results)):
+            break
+
+        # Send a duplicate for each task still running past its hedge delay
+        now = time.monotonic()
+        next_hedge = CANCEL_POLL_SECONDS
+        for key in remaining:
+            if key in hedges and len(attempts_by_key[key]) == 1:
+                delay, backup = hedges[key]
+                if now - started >= delay:
+                    logger.info(f"{key} is slower than {delay:.2f}s, sending a hedged request")
+                    metrics.inc('hedges_sent_total', provider=key)
+                    with lock:
+                        attempts_by_key[key].append(submit(key, backup))
+                else:
+                    next_hedge = min(next_hedge, started + delay - now)
+
+        running = [attempt[0] for key in remaining for attempt in attempts_by_key[key]]
+        wait(running, timeout=max(next_hedge, 0.001), return_when=FIRST_COMPLETED)
+        if token is None:
+            continue
+        if not token.cancelled and disconnected is not None and disconnected():
+            logger.info(f"Client disconnected, cancelling query {token.request_id}")
+            metrics.inc('client_disconnects_total')
+            token.cancel()
+        if token.cancelled:
+            break
+
+    for key in tasks:
+        if key in results:
+            continue
+        if on_late is not None and not (token is not None and token.cancelled):
+            results[key] = pending_result(key)
+            _deliver_late(key, attempts_by_key[key], settle, on_late)
+        else:
+            for attempt in attempts_by_key[key]:
+                abandon(attempt)
+            results[key] = cancelled_result(key)
+    for key, result in results.items():
+        if isinstance(result, dict) and result.get('status') == 'cancelled':
+            metrics.inc('provider_cancelled_total', provider=key)
+    return {key: results[key] for key in tasks}
+
+
+def _deliver_late(key, attempts, settle, on_late):
+    """Hand a task's result to on_late once it settles."""
+    delivered = []
+    lock = threading.Lock()
+
+    def check(_):
+        result = settle(key)
+        with lock:
+            if result is None or delivered:
+                return
+            delivered.append(result)
+        metrics.inc('late_results_total', provider=key)
+        try:
+            on_late(key, result)
+        except Exception as e:
+            logger.error(f"Could not deliver late result for {key}: {str(e)}")
+
+    for future, _ in attempts:
+        future.add_done_callback(check)
+
+
+def make_plan(result_key, provider_id, config, query, history=None, max_tokens=None, samples=1):
+    """
+    Build the pre-flight plan for one provider target
+
+    Args:
+        result_key (str): Key of this target in the results dict
+        provider_id (str): Registry id of the provider
+        config (dict): The target's api_keys entry
+        query (str): The user query
+        history (list): Conversation history sent with the query
+        max_tokens (int): Output cap requested by the client
+        samples (int): Responses to draw from the target
+
+    Returns:
+        dict: Target details plus its token/cost/latency estimate
+    """
+    provider = get_provider(provider_id)
+    model = config.get('model') or getattr(provider, 'DEFAULT_MODEL', None)
+    estimate = tokens.estimate(query or '', provider_id, model, history, max_tokens,
+                               samples, shared_prompt=hasattr(provider, 'call_samples'))
+    config = dict(config)
+    if estimate['max_output_tokens']:
+        config['max_tokens'] = estimate['max_output_tokens']
+    # Providers stop reading a response past these caps
+    config['max_response_bytes'], config['max_response_tokens'] = response_limits(provider_id, config)
+    return {
+        'result_key': result_key,
+        'provider_id': provider_id,
+        'display_name': provider.DISPLAY_NAME,
+        'model': model,
+        'config': config,
+        'query': query,
+        'history': history,
+        'max_tokens': max_tokens,
+        'samples': samples,
+        'estimate': estimate
+    }
+
+
+def call_samples(plan, spare_slot=None):
+    """
+    Draw several responses from one provider target
+
+    Providers with a native multi-candidate parameter (OpenAI and Azure 'n',
+    Gemini 'candidateCount') implement call_samples and return every sample
+    from one request, so the prompt is only paid for once. Other providers
+    get one call per sample: the first on the bulkhead slot the call already
+    holds, and the others alongside it on every slot spare_slot can take
+    right away, or else one after another.
+
+    Args:
+        plan: Target plan from make_plan with samples > 1
+        spare_slot (callable): plan -> context manager yielding whether it
+            took a free bulkhead slot, e.g. ProviderBulkheads.spare_slot;
+            without it, samples run one after another
+
+    Returns:
+        dict: Result whose 'samples' list holds one result per sample, with
+            the first successful sample's content as 'content'
+
+    Raises:
+        Exception: The first sample's error if every sample failed
+    """
+    provider = get_provider(plan['provider_id'])
+    if hasattr(provider, 'call_samples'):
+        return provider.call_samples(plan['query'], plan['config'], plan['samples'], history=plan['history'])
+
+    outcomes = [None] * plan['samples']
+    indexes = iter(range(plan['samples']))
+    lock = threading.Lock()
+
+    def work():
+        """Draw samples until none are left."""
+        while True:
+            with lock:
+                index = next(indexes, None)
+            if index is None:
+                return
+            try:
+                outcomes[index] = provider.call(plan['query'], plan['config'], history=plan['history'])
+            except Exception as e:
+                outcomes[index] = e
+
+    with contextlib.ExitStack() as slots:
+        # Extra samples only run concurrently on slots of their own, never beyond the bulkhead
+        extra = 0
+        while spare_slot is not None and extra < plan['samples'] - 1 and slots.enter_context(spare_slot(plan)):
+            extra += 1
+        # The copied context carries the call's cancel token and trace span into each sample
+        with ThreadPoolExecutor(max_workers=max(extra, 1), thread_name_prefix='sample') as pool:
+            for _ in range(extra):
+                pool.submit(contextvars.copy_context().run, work)
+            work()
+    samples, errors = [], []
+    for outcome in outcomes:
+        if isinstance(outcome, QueryCancelledError):
+            raise outcome
+        if isinstance(outcome, Exception):
+            errors.append(outcome)
+            samples.append(handle_api_error(outcome, plan['result_key'], provider.DISPLAY_NAME))
+        else:
+            samples.append(outcome)
+    successes = [result for result in samples if result.get('status') == 'success']
+    if not successes:
+        raise errors[0]
+    # Every parallel call paid for its own prompt
+    usages = [result['usage'] for result in successes if result.get('usage')]
+    usage = {field: sum(u.get(field, 0) for u in usages)
+             for field in ('prompt_tokens', 'completion_tokens', 'cached_tokens')} if usages else None
+    return sample_result(samples, successes[0]['model'], usage, 'parallel')
+
+
+def _skipped(plan, reason):
+    """Result for a target left out to stay within the request budget."""
+    metrics.inc('budget_skipped_total', provider=plan['provider_id'])
+    return {
+        'content': f"Skipped: {reason}",
+        'model': plan['model'],
+        'status': 'skipped',
+        'error_code': ERROR_TYPES['BUDGET_EXCEEDED']['code'],
+        'estimate': plan['estimate']
+    }
+
+
+def positive_number(value, name, whole=False):
+    """
+    Check a numeric request option
+
+    Args:
+        value: The option as sent by the client
+        name (str): Its name, for the error message
+        whole (bool): Whether it must be a whole number
+
+    Returns:
+        The value, unchanged
+
+    Raises:
+        ValueError: If it is not a positive (whole) number
+    """
+    kinds = int if whole else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) or not value > 0:
+        raise ValueError(f"{name} must be a positive {'whole number' if whole else 'number'}")
+    return value
+
+
+def validate_budget(budget):
+    """
+    Check a request's budget before it is applied
+
+    Args:
+        budget (dict): Optional budget from the request body
+
+    Raises:
+        ValueError: For an unknown on_overflow or a limit that is not a positive number
+    """
+    if budget is None:
+        return
+    if not isinstance(budget, dict):
+        raise ValueError("budget must be an object")
+    if budget.get('on_overflow', 'reject') not in ('reject', 'trim'):
+        raise ValueError("budget.on_overflow must be 'reject' or 'trim'")
+    if budget.get('max_prompt_tokens') is not None:
+        positive_number(budget['max_prompt_tokens'], 'budget.max_prompt_tokens', whole=True)
+    for field in ('max_cost', 'max_latency_s'):
+        if budget.get(field) is not None:
+            positive_number(budget[field], f"budget.{field}")
+
+
+def apply_budget(plans, budget):
+    """
+    Enforce a request's token, cost and latency budget before dispatch
+
+    Prompts that do not fit are rejected or, with on_overflow='trim',
+    trimmed; a trimmed prompt that still does not fit is rejected. Targets
+    slower than max_latency_s are skipped, then the cheapest targets are
+    kept until max_cost is reached.
+
+    Args:
+        plans (list): Plans from make_plan, in query order
+        budget (dict): Optional max_prompt_tokens, max_cost, max_latency_s
+            and on_overflow ('reject' or 'trim'), checked by validate_budget
+
+    Returns:
+        tuple: (plans to run, dict of result key -> skipped/rejected result)
+    """
+    budget = budget or {}
+    on_overflow = budget.get('on_overflow', 'reject')
+    max_prompt_tokens = budget.get('max_prompt_tokens')
+    max_latency = budget.get('max_latency_s')
+    max_cost = budget.get('max_cost')
+
+    runnable, excluded = [], {}
+    for plan in plans:
+        estimate = plan['estimate']
+        output_reserve = estimate['max_output_tokens'] or tokens.EXPECTED_OUTPUT_TOKENS
+        limit = estimate['context_window'] - output_reserve
+        if max_prompt_tokens:
+            limit = min(limit, int(max_prompt_tokens))
+
+        try:
+            if estimate['prompt_tokens'] > limit:
+                if on_overflow != 'trim':
+                    raise tokens.BudgetExceededError(
+                        f"Prompt of ~{estimate['prompt_tokens']} tokens exceeds the token budget of {limit} for {plan['model']}"
+                    )
+                trimmed = tokens.trim_query(plan['query'], plan['provider_id'], plan['model'], limit, plan['history'])
+                logger.info(f"Trimmed query for {plan['result_key']} to fit {limit} prompt tokens")
+                plan = make_plan(plan['result_key'], plan['provider_id'], plan['config'], trimmed,
+                                 plan['history'], plan['max_tokens'], plan['samples'])
+                plan['estimate']['trimmed'] = True
+                # Truncation is approximate for heuristic tokenizers, so the new estimate is checked again
+                if plan['estimate']['prompt_tokens'] > limit:
+                    raise tokens.BudgetExceededError(
+                        f"Prompt of ~{plan['estimate']['prompt_tokens']} tokens still exceeds the token budget "
+                        f"of {limit} for {plan['model']} after trimming"
+                    )
+        except tokens.BudgetExceededError as e:
+            excluded[plan['result_key']] = handle_api_error(e, plan['result_key'], plan['display_name'])
+            continue
+
+        if max_latency and plan['estimate']['estimated_latency_s'] > float(max_latency):
+            excluded[plan['result_key']] = _skipped(
+                plan, f"estimated latency {plan['estimate']['estimated_latency_s']}s exceeds the budget of {max_latency}s"
+            )
+            continue
+        runnable.append(plan)
+
+    if max_cost is not None:
+        spent = 0.0
+        for plan in sorted(runnable, key=lambda p: p['estimate']['estimated_cost']):
+            cost = plan['estimate']['estimated_cost']
+            if spent + cost > float(max_cost):
+                excluded[plan['result_key']] = _skipped(
+                    plan, f"estimated cost ${cost:.4f} would exceed the request budget of ${float(max_cost):.4f}"
+                )
+            else:
+                spent += cost
+        runnable = [plan for plan in runnable if plan['result_key'] not in excluded]
+
+    return runnable, excluded
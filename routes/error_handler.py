@@ -9,6 +9,8 @@ import uuid
 from functools import wraps
 from flask import jsonify, request
 
+from .tracing import current_trace_id, record_error
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -47,6 +49,41 @@ ERROR_TYPES = {
         'code': 'api_error',
         'status_code': 502,
         'message': 'Error communicating with the AI provider API.'
+    },
+    'BUDGET_EXCEEDED': {
+        'code': 'budget_exceeded',
+        'status_code': 413,
+        'message': 'The request exceeds the token or cost budget for this model.'
+    },
+    'CANCELLED': {
+        'code': 'cancelled',
+        'status_code': 499,
+        'message': 'The query was cancelled before this model responded.'
+    },
+    'PROVIDER_UNAVAILABLE': {
+        'code': 'provider_unavailable',
+        'status_code': 503,
+        'message': 'The AI provider is failing repeatedly; calls to it are paused briefly.'
+    },
+    'PROVIDER_BUSY': {
+        'code': 'provider_busy',
+        'status_code': 503,
+        'message': 'Too many calls to this AI provider are in progress. Please try again shortly.'
+    },
+    'RESPONSE_TOO_LARGE': {
+        'code': 'response_too_large',
+        'status_code': 502,
+        'message': 'The AI provider sent a response larger than this server accepts.'
+    },
+    'DEPENDENCY_UNAVAILABLE': {
+        'code': 'dependency_unavailable',
+        'status_code': 503,
+        'message': 'A package this feature needs is not installed or failed to load on the server.'
+    },
+    'OVERLOADED': {
+        'code': 'overloaded',
+        'status_code': 503,
+        'message': 'The server is overloaded. Please retry after the indicated delay.'
     }
 }
 
@@ -65,13 +102,24 @@ def handle_api_error(error, model_id, api_provider=None):
     error_str = str(error)
     error_type = 'API_ERROR'
     error_details = error_str
-    request_id = str(uuid.uuid4())
+    # The trace id links the error to the request and provider call it belongs to
+    request_id = current_trace_id() or str(uuid.uuid4())
     
     # Determine error type based on error message
     if any(key in error_str.lower() for key in ['unauthorized', 'invalid key', 'authentication', 'auth']):
         error_type = 'AUTH_ERROR'
     elif any(key in error_str.lower() for key in ['rate limit', 'too many requests', 'quota']):
         error_type = 'RATE_LIMIT'
+    elif any(key in error_str.lower() for key in ['token budget', 'context length', 'context window']):
+        error_type = 'BUDGET_EXCEEDED'
+    elif 'circuit open' in error_str.lower():
+        error_type = 'PROVIDER_UNAVAILABLE'
+    elif 'bulkhead full' in error_str.lower():
+        error_type = 'PROVIDER_BUSY'
+    elif 'response too large' in error_str.lower():
+        error_type = 'RESPONSE_TOO_LARGE'
+    elif 'dependency unavailable' in error_str.lower():
+        error_type = 'DEPENDENCY_UNAVAILABLE'
     elif any(key in error_str.lower() for key in ['model not found', 'does not exist', 'invalid model']):
         error_type = 'MODEL_NOT_FOUND'
     elif any(key in error_str.lower() for key in ['bad request', 'invalid request', 'missing field']):
@@ -100,6 +148,27 @@ def handle_api_error(error, model_id, api_provider=None):
         'status': 'error'
     }
 
+def is_upstream_failure(error):
+    """
+    Check whether an error means the provider itself is failing
+
+    Server errors, timeouts and connection failures count; problems with
+    the request or the user's key do not, so one user's bad key cannot
+    trip a circuit breaker for everyone.
+
+    Args:
+        error: The exception raised by a provider call
+
+    Returns:
+        bool: True for provider-side failures
+    """
+    response = getattr(error, 'response', None)
+    status = getattr(error, 'status_code', None) or getattr(response, 'status_code', None)
+    if isinstance(status, int):
+        return status >= 500
+    name = type(error).__name__
+    return isinstance(error, (ConnectionError, TimeoutError)) or 'Timeout' in name or 'Connection' in name
+
 def api_error_handler(f):
     """
     Decorator for API routes to standardize error handling
@@ -111,11 +180,12 @@ def api_error_handler(f):
         except Exception as e:
             logger.error(f"Unhandled exception in API route: {str(e)}")
             logger.error(traceback.format_exc())
+            record_error(e)
             return jsonify({
                 'error': ERROR_TYPES['SERVER_ERROR']['message'],
                 'error_code': ERROR_TYPES['SERVER_ERROR']['code'],
                 'timestamp': int(time.time()),
-                'request_id': str(uuid.uuid4())
+                'request_id': current_trace_id() or str(uuid.uuid4())
             }), ERROR_TYPES['SERVER_ERROR']['status_code']
     
     return decorated_function
\ No newline at end of file
@@ -0,0 +1,385 @@
+"""
+Offline evaluation of a prompt dataset against several providers.
+Streams prompts from a CSV, JSONL or Parquet file, sends each one to every
+configured provider through the same provider calls as /api/query
+(optionally with a meta-summary), and writes one row per prompt. Rows are
+processed in chunks: each finished chunk is written out (a Parquet part
+file through pandas, or appended JSON lines) before the checkpoint moves
+past it, so an interrupted run resumes with the first unfinished chunk and
+memory use stays bounded by the chunk size. With --backend batch, each
+chunk goes to providers with a batch API as one batch (see routes.batch);
+the batch ids are checkpointed, so a resumed run picks up the batches
+already submitted instead of paying for them again.
+
+Usage:
+    python -m routes.evaluate prompts.jsonl --keys keys.json --output results/
+        [--concurrency 4] [--chunk-size 200] [--summarize] [--prompt-column prompt]
+        [--id-column id] [--max-tokens N] [--restart] [--backend live|batch] [--batch-poll 30]
+
+keys.json holds the same mapping as the api_keys of a /api/query request,
+e.g. {"openai": {"key": "sk-...", "model": "gpt-4o"}, "mistral": {"key": "..."}}.
+"""
+import argparse
+import csv
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .api import build_plans, call_provider
+from .batch import POLL_INTERVAL_SECONDS, run_batch
+from .bulkhead import bulkheads
+from .dispatch import apply_budget, plan_targets, run_all
+from .summarizer import ResponseSummarizer
+
+logger = logging.getLogger('aiSpectrum')
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_CHUNK_SIZE = 200
+BACKENDS = ('live', 'batch')
+# Per-provider result fields written as <result key>_<field> columns, with their pandas dtypes
+RESULT_COLUMNS = {
+    'status': 'string',
+    'model': 'string',
+    'content': 'string',
+    'error_code': 'string',
+    'latency_s': 'Float64',
+    'prompt_tokens': 'Int64',
+    'completion_tokens': 'Int64'
+}
+SUMMARY_COLUMNS = {'summary_status': 'string', 'summary_content': 'string'}
+# Longest a call waits for a provider slot; a run keeps the slots busy, so waiting is expected
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('AISPECTRUM_EVALUATE_QUEUE_TIMEOUT', 3600))
+# Attempts at a chunk whose first row keeps being turned away by a busy provider
+BUSY_RETRIES = 5
+BUSY_BACKOFF_SECONDS = 2.0
+
+
+def read_rows(path, prompt_column='prompt', id_column='id', batch_size=1000):
+    """
+    Stream prompts from a dataset file
+
+    Args:
+        path (str): A .csv, .jsonl/.ndjson or .parquet file
+        prompt_column (str): Column holding the prompt
+        id_column (str): Column holding the row id; the row number if absent
+        batch_size (int): Rows read at a time from Parquet files
+
+    Yields:
+        dict: {'id', 'prompt'} per row, in file order
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        def records():
+            with open(path, newline='', encoding='utf-8') as f:
+                yield from csv.DictReader(f)
+    elif extension in ('.jsonl', '.ndjson'):
+        def records():
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+    elif extension == '.parquet':
+        def records():
+            # Imported here so the app never loads pyarrow
+            import pyarrow.parquet as pq
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+                yield from batch.to_pylist()
+    else:
+        raise ValueError(f"Unsupported input format '{extension}' (use .csv, .jsonl or .parquet)")
+
+    for number, record in enumerate(records()):
+        if prompt_column not in record:
+            raise ValueError(f"Row {number} has no '{prompt_column}' column")
+        row_id = record.get(id_column)
+        yield {'id': str(row_id if row_id is not None else number), 'prompt': record[prompt_column]}
+
+
+class OutputWriter:
+    """Writes finished chunks either as Parquet part files or as JSON lines."""
+
+    def __init__(self, path):
+        """
+        Initialize the writer
+
+        Args:
+            path (str): A .jsonl file, or a directory (or *.parquet path) for Parquet parts
+        """
+        self.path = path
+        self.jsonl = os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson')
+        if not self.jsonl:
+            os.makedirs(path, exist_ok=True)
+
+    def position(self):
+        """Return where the next chunk starts: the file size for JSON lines, else 0."""
+        return os.path.getsize(self.path) if self.jsonl and os.path.exists(self.path) else 0
+
+    def rewind(self, position, parts):
+        """
+        Drop output written after the last checkpoint, e.g. by an interrupted run
+
+        Args:
+            position (int): Size of the JSON lines file at the checkpoint
+            parts (int): Parquet part files written at the checkpoint
+        """
+        if self.jsonl:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > position:
+                with open(self.path, 'r+b') as f:
+                    f.truncate(position)
+            return
+        for name in os.listdir(self.path):
+            if name.startswith('part-') and int(name[5:10]) >= parts:
+                os.remove(os.path.join(self.path, name))
+
+    def write(self, part, rows, columns):
+        """
+        Write one chunk of result rows
+
+        Args:
+            part (int): Chunk number, naming the Parquet part file
+            rows (list): Flat result rows
+            columns (dict): Column -> pandas dtype, fixing the schema of every part
+        """
+        if self.jsonl:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(row) + '\n' for row in rows))
+                f.flush()
+                os.fsync(f.fileno())
+            return
+        # Imported here so the app never loads pandas
+        import pandas as pd
+        frame = pd.DataFrame(rows, columns=list(columns)).astype(columns)
+        target = os.path.join(self.path, f"part-{part:05d}.parquet")
+        frame.to_parquet(target + '.tmp', index=False)
+        os.replace(target + '.tmp', target)
+
+
+def load_checkpoint(path):
+    """Return a saved checkpoint, or None."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, checkpoint):
+    """Write a checkpoint atomically."""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+def flatten(row, results, summary=None):
+    """
+    Turn one prompt's results into a flat output row
+
+    Args:
+        row (dict): The input row (id and prompt)
+        results (dict): Result key -> provider result
+        summary (dict): Optional meta-summary result
+
+    Returns:
+        dict: Columns id, prompt, <key>_<field> per provider and the summary
+    """
+    flat = {'id': row['id'], 'prompt': row['prompt']}
+    for key, result in results.items():
+        usage = result.get('usage') or {}
+        flat.update({
+            f"{key}_status": result.get('status'),
+            f"{key}_model": result.get('model'),
+            f"{key}_content": result.get('content'),
+            f"{key}_error_code": result.get('error_code'),
+            f"{key}_latency_s": result.get('latency_s'),
+            f"{key}_prompt_tokens": usage.get('prompt_tokens'),
+            f"{key}_completion_tokens": usage.get('completion_tokens')
+        })
+    if summary is not None:
+        flat['summary_status'] = summary.get('status')
+        flat['summary_content'] = summary.get('content')
+    return flat
+
+
+def _timed_call(plan):
+    """Call one provider target as /api/query does, adding its latency."""
+    started = time.perf_counter()
+    result = call_provider(plan)
+    return dict(result, latency_s=round(time.perf_counter() - started, 3))
+
+
+def evaluate_row(row, api_keys, summarizer=None, max_tokens=None):
+    """
+    Query every provider for one prompt
+
+    Args:
+        row (dict): The input row (id and prompt)
+        api_keys (dict): Provider configuration, as in a /api/query request
+        summarizer (ResponseSummarizer): Optional summarizer for a meta-summary
+        max_tokens (int): Optional output cap
+
+    Returns:
+        dict: The flat output row
+    """
+    plans = build_plans({'query': row['prompt'], 'api_keys': api_keys, 'max_tokens': max_tokens})
+    runnable, excluded = apply_budget(plans, None)
+    tasks = {plan['result_key']: functools.partial(_timed_call, plan) for plan in runnable}
+    executors = {plan['result_key']: bulkheads.executor(plan['provider_id']) for plan in runnable}
+    completed = run_all(tasks, executors=executors)
+    completed.update(excluded)
+    results = {plan['result_key']: completed[plan['result_key']] for plan in plans}
+    return summarize_row(row, results, summarizer)
+
+
+def _busy(flat_row):
+    """Whether a bulkhead turned away any of a row's provider calls."""
+    return any(column.endswith('_error_code') and value == 'provider_busy' for column, value in flat_row.items())
+
+
+def summarize_row(row, results, summarizer=None):
+    """Flatten one prompt's results, adding a meta-summary if a summarizer is given."""
+    summary = summarizer.summarize(row['prompt'], results) if summarizer is not None else None
+    return flatten(row, results, summary)
+
+
+def evaluate_chunk_batch(chunk, api_keys, pool, checkpoint, checkpoint_path, summarizer=None, max_tokens=None,
+                         concurrency=DEFAULT_CONCURRENCY, poll_interval=POLL_INTERVAL_SECONDS):
+    """
+    Evaluate a chunk through provider batch APIs, recording submitted batches in the checkpoint
+
+    Returns:
+        list: Flat output rows
+    """
+    def submitted(result_key, batch_id):
+        checkpoint['batches'][result_key] = batch_id
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    checkpoint.setdefault('batches', {})
+    results = run_batch([row['prompt'] for row in chunk], api_keys, max_tokens, live_concurrency=concurrency,
+                        poll_interval=poll_interval, batch_ids=checkpoint['batches'], on_submitted=submitted)
+    return list(pool.map(lambda pair: summarize_row(pair[0], pair[1], summarizer), zip(chunk, results)))
+
+
+def evaluate(input_path, output_path, api_keys, concurrency=DEFAULT_CONCURRENCY, chunk_size=DEFAULT_CHUNK_SIZE,
+             summarize=False, prompt_column='prompt', id_column='id', max_tokens=None, restart=False,
+             checkpoint_path=None, backend='live', poll_interval=POLL_INTERVAL_SECONDS):
+    """
+    Evaluate a dataset, resuming from its checkpoint
+
+    Args:
+        input_path (str): Dataset file
+        output_path (str): .jsonl file or Parquet directory
+        api_keys (dict): Provider configuration, as in a /api/query request
+        concurrency (int): Prompts evaluated at once
+        chunk_size (int): Prompts per output chunk and checkpoint
+        summarize (bool): Add a meta-summary (needs an openai or gemini key)
+        prompt_column (str): Input column holding the prompt
+        id_column (str): Input column holding the row id
+        max_tokens (int): Optional output cap
+        restart (bool): Ignore an existing checkpoint and start over
+        checkpoint_path (str): Checkpoint file; next to the output by default
+        backend (str): 'live' calls, or 'batch' APIs where providers have them
+        poll_interval (float): Seconds between batch status checks
+
+    Returns:
+        dict: The final checkpoint (rows done, chunks written)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+    checkpoint_path = checkpoint_path or output_path.rstrip('/\\') + '.checkpoint.json'
+    writer = OutputWriter(output_path)
+    checkpoint = None if restart else load_checkpoint(checkpoint_path)
+    if checkpoint is not None and checkpoint.get('input') != os.path.abspath(input_path):
+        raise ValueError(f"{checkpoint_path} belongs to {checkpoint.get('input')}; pass --restart to start over")
+    if checkpoint is None:
+        checkpoint = {'input': os.path.abspath(input_path), 'rows_done': 0, 'parts': 0, 'position': 0}
+    else:
+        logger.info(f"Resuming after {checkpoint['rows_done']} rows")
+    writer.rewind(checkpoint['position'], checkpoint['parts'])
+
+    summarizer = None
+    if summarize:
+        summarizer_key = (api_keys.get('openai') or {}).get('key') or (api_keys.get('gemini') or {}).get('key')
+        if not summarizer_key:
+            raise ValueError("--summarize needs an openai or gemini key")
+        summarizer = ResponseSummarizer(summarizer_key)
+
+    columns = {'id': 'string', 'prompt': 'string'}
+    for result_key, _, _ in plan_targets(api_keys):
+        columns.update({f"{result_key}_{field}": dtype for field, dtype in RESULT_COLUMNS.items()})
+    if summarizer is not None:
+        columns.update(SUMMARY_COLUMNS)
+
+    # Each prompt calls every provider and key once, so no bulkhead sees more than
+    # `concurrency` calls at a time; make room for them, and let calls wait where a limit is set
+    bulkheads.reserve(concurrency, QUEUE_TIMEOUT_SECONDS)
+
+    rows = itertools.islice(read_rows(input_path, prompt_column, id_column), checkpoint['rows_done'], None)
+    busy_attempts = 0
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='evaluate') as pool:
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            started = time.monotonic()
+            if backend == 'batch':
+                results = evaluate_chunk_batch(chunk, api_keys, pool, checkpoint, checkpoint_path, summarizer,
+                                               max_tokens, concurrency, poll_interval)
+            else:
+                results = list(pool.map(lambda row: evaluate_row(row, api_keys, summarizer, max_tokens), chunk))
+            # A row a busy provider turned away is not done: it and the rows after it are evaluated again
+            done = next((index for index, result in enumerate(results) if _busy(result)), len(results))
+            if done < len(chunk):
+                rows = itertools.chain(chunk[done:], rows)
+            if not done:
+                busy_attempts += 1
+                if busy_attempts > BUSY_RETRIES:
+                    raise RuntimeError(f"Providers stayed busy for row {chunk[0]['id']}; run again to resume")
+                logger.warning(f"Providers are busy, retrying row {chunk[0]['id']}")
+                time.sleep(BUSY_BACKOFF_SECONDS * busy_attempts)
+                continue
+            busy_attempts = 0
+            writer.write(checkpoint['parts'], results[:done], columns)
+            checkpoint['rows_done'] += done
+            checkpoint['parts'] += 1
+            checkpoint['position'] = writer.position()
+            checkpoint['batches'] = {}
+            save_checkpoint(checkpoint_path, checkpoint)
+            logger.info(f"{checkpoint['rows_done']} rows done "
+                        f"({done / max(time.monotonic() - started, 1e-6):.1f} rows/s)")
+    return checkpoint
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Evaluate a prompt dataset against several AI providers")
+    parser.add_argument('input', help="Dataset file (.csv, .jsonl or .parquet)")
+    parser.add_argument('--keys', required=True, help="JSON file with the api_keys mapping of /api/query")
+    parser.add_argument('--output', required=True, help="Output .jsonl file or Parquet directory")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Prompts evaluated at once")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Prompts per output chunk and checkpoint")
+    parser.add_argument('--summarize', action='store_true', help="Add a meta-summary of each prompt's responses")
+    parser.add_argument('--prompt-column', default='prompt', help="Input column holding the prompt")
+    parser.add_argument('--id-column', default='id', help="Input column holding the row id")
+    parser.add_argument('--max-tokens', type=int, help="Output token cap per response")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start over")
+    parser.add_argument('--backend', choices=BACKENDS, default='live',
+                        help="'batch' sends each chunk through provider batch APIs where available")
+    parser.add_argument('--batch-poll', type=float, default=POLL_INTERVAL_SECONDS,
+                        help="Seconds between batch status checks")
+    args = parser.parse_args(argv)
+
+    with open(args.keys) as f:
+        api_keys = json.load(f)
+    checkpoint = evaluate(args.input, args.output, api_keys, args.concurrency, args.chunk_size, args.summarize,
+                          args.prompt_column, args.id_column, args.max_tokens, args.restart,
+                          backend=args.backend, poll_interval=args.batch_poll)
+    print(f"Evaluated {checkpoint['rows_done']} prompts into {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,546 @@
+"""
+Shared HTTP helpers for provider calls.
+The requests library is imported on first use rather than at module load,
+so application startup does not pay for it. All calls share one pooled
+session, so connections to each provider host are kept alive and reused.
+Response bodies are read incrementally and abandoned past a byte cap, so
+a misbehaving endpoint cannot make a worker buffer an unbounded body.
+A request made under a cancel token can be aborted at any point: cancelling
+shuts down the socket it is waiting on, whether for headers or body.
+New connections to registered hosts (the warmed provider hosts) connect to
+cached addresses instead of resolving the name again.
+"""
+import contextvars
+import json
+import os
+import re
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+from . import tracing
+from .cancellation import QueryCancelledError, current_token
+from .metrics import metrics
+
+# Number of distinct hosts to keep connection pools for
+POOL_CONNECTIONS = int(os.environ.get('AISPECTRUM_HTTP_POOL_CONNECTIONS', 20))
+# Maximum keep-alive connections kept open per host
+POOL_MAXSIZE = int(os.environ.get('AISPECTRUM_HTTP_POOL_MAXSIZE', 20))
+# Largest response body read when a caller does not pass its own cap, in bytes
+MAX_RESPONSE_BYTES = int(os.environ.get('AISPECTRUM_MAX_RESPONSE_BYTES', 4 * 1024 * 1024))
+READ_CHUNK_BYTES = 64 * 1024
+# How long resolved addresses of registered hosts are reused
+DNS_TTL_SECONDS = float(os.environ.get('AISPECTRUM_DNS_TTL', 300))
+
+_session = None
+_session_lock = threading.Lock()
+# Abort handle of the request being sent by this thread, picked up by its pooled connection
+_in_flight = contextvars.ContextVar('http_in_flight', default=None)
+# A \uD800-\uDBFF escape (not itself escaped) at the end of a JSON string
+_HIGH_SURROGATE_RE = re.compile(r'(?<!\\)(?:\\\\)*\\u[dD][89abAB][0-9a-fA-F]{2}$')
+
+
+class ResponseTooLargeError(Exception):
+    """Raised when a response body exceeds its byte cap."""
+
+    def __init__(self, host, limit):
+        super().__init__(f"Response too large: {host} sent more than {limit} bytes")
+        self.host = host
+        self.limit = limit
+
+
+class _Abort:
+    """
+    Cancel hook for one request, registered with its cancel token
+
+    The pooled connection attaches itself once the request is sent; closing
+    the hook then shuts its socket down, which wakes a thread blocked
+    reading headers or body. After the response has released the
+    connection back to the pool the hook does nothing, so it can never cut
+    off another request that reuses the connection.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.response = None
+        self.aborted = False
+        self._lock = threading.Lock()
+
+    def attach(self, connection):
+        """Record the connection the request was sent on."""
+        with self._lock:
+            if self.aborted:
+                raise QueryCancelledError()
+            self.connection = connection
+
+    def close(self):
+        """Abort the request, closing its response if there is one."""
+        with self._lock:
+            self.aborted = True
+            connection, response = self.connection, self.response
+        raw = getattr(response, 'raw', None)
+        # A response that gave its connection back no longer owns the socket
+        if connection is not None and (raw is None or getattr(raw, '_connection', None) is connection):
+            sock = getattr(connection, 'sock', None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if response is not None:
+            response.close()
+
+
+class DNSCache:
+    """
+    Resolved addresses of registered hosts, reused for new pooled connections
+
+    Only hosts registered with add_host are cached, so connections to
+    anything else resolve exactly as before.
+    """
+
+    def __init__(self, ttl_seconds=DNS_TTL_SECONDS, resolver=socket.getaddrinfo):
+        """
+        Initialize the cache
+
+        Args:
+            ttl_seconds (float): How long a lookup is reused
+            resolver (callable): getaddrinfo-compatible function doing the lookups
+        """
+        self.ttl_seconds = ttl_seconds
+        self._resolver = resolver
+        self._hosts = set()
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def add_host(self, host):
+        """Start caching lookups of a host."""
+        with self._lock:
+            self._hosts.add(host)
+
+    def addresses(self, host, port, family=0):
+        """
+        Return the addresses of a registered host, resolving it when stale
+
+        Args:
+            host (str): Hostname
+            port (int): Port to resolve for
+            family (int): Address family, or 0 for any
+
+        Returns:
+            list: IP address strings, or None if the host is not registered
+
+        Raises:
+            OSError: If resolving the host fails
+        """
+        if host not in self._hosts:
+            return None
+        key = (host, port, family)
+        now = time.monotonic()
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] > now:
+            metrics.inc('dns_cache_hits_total')
+            return cached[1]
+        addresses = list(dict.fromkeys(info[4][0] for info in
+                                       self._resolver(host, port, family, socket.SOCK_STREAM)))
+        with self._lock:
+            self._entries[key] = (now + self.ttl_seconds, addresses)
+        return addresses
+
+
+def _abortable_pool_classes():
+    """
+    Connection pool classes whose connections attach to the thread's _Abort
+    hook, and connect registered hosts to their cached addresses
+    """
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+    from urllib3.util.connection import allowed_gai_family
+
+    class AbortableMixin:
+        def getresponse(self, *args, **kwargs):
+            abort = _in_flight.get()
+            if abort is not None:
+                abort.attach(self)
+            return super().getresponse(*args, **kwargs)
+
+        def _new_conn(self):
+            try:
+                addresses = dns_cache.addresses(self._dns_host, self.port, allowed_gai_family())
+            except OSError:
+                addresses = None
+            if not addresses:
+                return super()._new_conn()
+            # Connect to each address in turn; TLS and the Host header still use the hostname
+            host = self._dns_host
+            try:
+                for index, address in enumerate(addresses):
+                    self._dns_host = address
+                    try:
+                        return super()._new_conn()
+                    except (ConnectTimeoutError, NewConnectionError):
+                        if index == len(addresses) - 1:
+                            raise
+            finally:
+                self._dns_host = host
+
+    class AbortableHTTPConnection(AbortableMixin, HTTPConnection):
+        pass
+
+    class AbortableHTTPSConnection(AbortableMixin, HTTPSConnection):
+        pass
+
+    class AbortableHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = AbortableHTTPConnection
+
+    class AbortableHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = AbortableHTTPSConnection
+
+    return {'http': AbortableHTTPConnectionPool, 'https': AbortableHTTPSConnectionPool}
+
+
+def get_session():
+    """
+    Return the shared pooled session, creating it on first use
+
+    Returns:
+        requests.Session: Session with keep-alive pools for http and https
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from http.cookiejar import DefaultCookiePolicy
+                from requests.adapters import HTTPAdapter
+
+                pool_classes = _abortable_pool_classes()
+
+                class AbortableAdapter(HTTPAdapter):
+                    def init_poolmanager(self, *args, **kwargs):
+                        super().init_poolmanager(*args, **kwargs)
+                        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+                session = requests.Session()
+                # Never carry cookies from one user's provider call into another's
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = AbortableAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def _forget_session():
+    """Drop the pooled session in a forked child; its sockets belong to the parent."""
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_session)
+
+
+def request(method, url, **kwargs):
+    """
+    Send a request over the shared session
+
+    If the calling provider runs under a cancel token, the request is
+    refused once the query is cancelled. Cancelling while the request is
+    waiting for its response, or while a streamed body is being read,
+    shuts the connection down so the call returns at once.
+
+    Args:
+        method (str): HTTP method
+        url (str): The request URL
+        **kwargs: Passed through to requests.Session.request
+
+    Returns:
+        requests.Response: The response object
+    """
+    token = current_token()
+    abort = None
+    if token is not None:
+        # Registered before sending, so a cancel can interrupt the wait for headers
+        abort = token.register(_Abort())
+    parts = urlsplit(url)
+    # The query string is left out: some providers put the API key there
+    attributes = {'http.method': method, 'server.address': parts.hostname, 'url.path': parts.path}
+    with tracing.start_span(f"HTTP {method} {parts.hostname}", tracing.CLIENT, attributes) as span:
+        reset = _in_flight.set(abort)
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except Exception:
+            if abort is not None and abort.aborted:
+                raise QueryCancelledError()
+            raise
+        finally:
+            _in_flight.reset(reset)
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 400:
+            span.set_error(f"HTTP {response.status_code}")
+    if abort is not None:
+        if kwargs.get('stream'):
+            # The body is still to be read; the hook stays until the query ends
+            abort.response = response
+        else:
+            token.unregister(abort)
+        if abort.aborted:
+            response.close()
+            raise QueryCancelledError()
+    return response
+
+
+def post(url, **kwargs):
+    """Send a POST request over the shared session."""
+    return request('POST', url, **kwargs)
+
+
+def get(url, **kwargs):
+    """Send a GET request over the shared session."""
+    return request('GET', url, **kwargs)
+
+
+def post_json(url, max_bytes=None, **kwargs):
+    """
+    Send a POST request and decode its JSON response within a byte cap
+
+    Args:
+        url (str): The request URL
+        max_bytes (int): Byte cap on the response body, see read_json
+        **kwargs: Passed through to requests.Session.request
+
+    Returns:
+        The decoded JSON value
+
+    Raises:
+        requests.HTTPError: For 4xx/5xx responses
+        ResponseTooLargeError: If the body exceeds the cap
+    """
+    response = post(url, stream=True, **kwargs)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return read_json(response, max_bytes)
+
+
+def post_json_prefix(url, max_bytes=None, **kwargs):
+    """
+    Send a POST request and decode its JSON response, cutting it at a byte cap
+
+    Args:
+        url (str): The request URL
+        max_bytes (int): Byte cap on the response body, see read_json_prefix
+        **kwargs: Passed through to requests.Session.request
+
+    Returns:
+        tuple: (decoded JSON value, whether the body was cut at the cap)
+
+    Raises:
+        requests.HTTPError: For 4xx/5xx responses
+        ResponseTooLargeError: If the body exceeds the cap and its first part cannot be decoded
+    """
+    response = post(url, stream=True, **kwargs)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return read_json_prefix(response, max_bytes)
+
+
+def _host(response):
+    return urlsplit(response.url or '').hostname or 'unknown'
+
+
+def _read_capped(response, limit):
+    """Read a body up to limit bytes; returns (body, whether there was more)."""
+    body = bytearray()
+    for chunk in response.iter_content(READ_CHUNK_BYTES):
+        body += chunk
+        if len(body) > limit:
+            del body[limit:]
+            return body, True
+    return body, False
+
+
+def read_json(response, max_bytes=None):
+    """
+    Decode a JSON response body, reading at most max_bytes of it
+
+    The body is read in chunks, so with stream=True nothing beyond the cap
+    is ever buffered; the size is recorded as the http_response_bytes metric.
+
+    Args:
+        response (requests.Response): The response, ideally opened with stream=True
+        max_bytes (int): Byte cap, MAX_RESPONSE_BYTES if not given
+
+    Returns:
+        The decoded JSON value
+
+    Raises:
+        ResponseTooLargeError: If the body (or its Content-Length) exceeds the cap
+    """
+    limit = max_bytes or MAX_RESPONSE_BYTES
+    host = _host(response)
+    try:
+        declared = response.headers.get('Content-Length')
+        if declared and declared.isdigit() and int(declared) > limit:
+            metrics.inc('http_responses_too_large_total', host=host)
+            raise ResponseTooLargeError(host, limit)
+        body, cut = _read_capped(response, limit)
+        if cut:
+            metrics.inc('http_responses_too_large_total', host=host)
+            raise ResponseTooLargeError(host, limit)
+    finally:
+        response.close()
+    metrics.observe('http_response_bytes', len(body), host=host)
+    return json.loads(body)
+
+
+def read_json_prefix(response, max_bytes=None):
+    """
+    Decode a JSON response body, cutting it at max_bytes instead of failing
+
+    A body past the cap is read up to the cap, and the strings, arrays and
+    objects left open there are closed, so a completion that is too long
+    keeps the text received before the cap.
+
+    Args:
+        response (requests.Response): The response, ideally opened with stream=True
+        max_bytes (int): Byte cap, MAX_RESPONSE_BYTES if not given
+
+    Returns:
+        tuple: (decoded JSON value, whether the body was cut at the cap)
+
+    Raises:
+        ResponseTooLargeError: If the body was cut and what came before the cap
+            cannot be decoded
+    """
+    limit = max_bytes or MAX_RESPONSE_BYTES
+    host = _host(response)
+    try:
+        body, cut = _read_capped(response, limit)
+    finally:
+        response.close()
+    metrics.observe('http_response_bytes', len(body), host=host)
+    if not cut:
+        return json.loads(body), False
+    metrics.inc('http_responses_too_large_total', host=host)
+    value = close_json(body.decode('utf-8', errors='ignore'))
+    if value is None:
+        raise ResponseTooLargeError(host, limit)
+    return value, True
+
+
+def close_json(prefix):
+    """
+    Decode the start of a JSON document cut off at an arbitrary point
+
+    A string value open at the cut keeps the text received so far; a key,
+    number or literal open at the cut is dropped along with its member.
+
+    Args:
+        prefix (str): The text before the cut
+
+    Returns:
+        The decoded value, or None if the prefix holds no usable value
+    """
+    closers, expect_key = [], False
+    in_string = is_key = escaped = False
+    escape_at = None
+    # Last point before which everything is complete: (end, closers needed there)
+    complete = None
+    for index, char in enumerate(prefix):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped, escape_at = True, index
+            elif char == '"':
+                in_string = False
+                if not is_key:
+                    complete = (index + 1, ''.join(reversed(closers)))
+        elif char == '"':
+            in_string, is_key = True, bool(closers) and closers[-1] == '}' and expect_key
+        elif char in '{[':
+            closers.append('}' if char == '{' else ']')
+            expect_key = char == '{'
+        elif char in '}]':
+            if not closers:
+                return None
+            closers.pop()
+            expect_key = False
+            complete = (index + 1, ''.join(reversed(closers)))
+        elif char == ',':
+            expect_key = bool(closers) and closers[-1] == '}'
+            complete = (index, ''.join(reversed(closers)))
+        elif char == ':':
+            expect_key = False
+    if in_string and not is_key:
+        # An escape sequence cut in half is dropped, and so is the first half of a surrogate pair
+        if escaped or (escape_at is not None and prefix[escape_at + 1] == 'u' and len(prefix) - escape_at < 6):
+            prefix = prefix[:escape_at]
+        if _HIGH_SURROGATE_RE.search(prefix):
+            prefix = prefix[:-6]
+        candidate = prefix + '"' + ''.join(reversed(closers))
+    elif complete is not None:
+        candidate = prefix[:complete[0]] + complete[1]
+    else:
+        return None
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        return None
+
+
+def iter_sse(response, max_bytes=None):
+    """
+    Decode a server-sent events stream into JSON payloads
+
+    Reads the body incrementally, so the connection is returned to the pool
+    as soon as the stream ends or the caller stops iterating.
+
+    Args:
+        response (requests.Response): A response opened with stream=True
+        max_bytes (int): Byte cap, MAX_RESPONSE_BYTES if not given
+
+    Yields:
+        dict: Each decoded ``data:`` payload, stopping at ``[DONE]``
+
+    Raises:
+        ResponseTooLargeError: Once the stream passes the cap; the payloads
+            before it have already been yielded
+    """
+    # text/event-stream is always UTF-8; requests would otherwise assume latin-1
+    response.encoding = 'utf-8'
+    limit = max_bytes or MAX_RESPONSE_BYTES
+    token = current_token()
+    received = 0
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if token is not None and token.cancelled:
+                raise QueryCancelledError()
+            received += len(line.encode('utf-8')) + 1
+            if received > limit:
+                metrics.inc('http_responses_too_large_total', host=_host(response))
+                raise ResponseTooLargeError(_host(response), limit)
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            yield json.loads(data)
+    finally:
+        metrics.observe('http_response_bytes', received, host=_host(response))
+        response.close()
+
+
+
+# Cached lookups of the provider hosts, used by every pooled connection of this process
+dns_cache = DNSCache()
@@ -0,0 +1,138 @@
+"""
+Import-time report for tracking application startup cost.
+Runs a fresh interpreter with ``-X importtime`` and summarizes which
+modules dominate the cost of importing the app.
+
+Usage:
+    python -m routes.importtime [--target app] [--top 15] [--json] [--fail-on-sdk]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Provider SDKs that should only ever be loaded lazily
+PROVIDER_SDKS = ('openai', 'anthropic', 'requests')
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(output):
+    """
+    Parse the stderr produced by ``python -X importtime``
+
+    Args:
+        output (str): Raw stderr text
+
+    Returns:
+        list: Dicts with module, self_us, cumulative_us and depth
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue
+        module = name.rstrip()
+        stripped = module.lstrip()
+        entries.append({
+            'module': stripped,
+            'self_us': self_us,
+            'cumulative_us': cumulative_us,
+            'depth': (len(module) - len(stripped)) // 2
+        })
+    return entries
+
+
+def measure(target='app'):
+    """
+    Import a module in a fresh interpreter and collect import timings
+
+    Args:
+        target (str): Dotted module name to import
+
+    Returns:
+        list: Parsed import timing entries
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {target}'],
+        capture_output=True, text=True, cwd=REPO_ROOT
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {target} failed:\n{proc.stderr[-2000:]}")
+    return parse_importtime(proc.stderr)
+
+
+def build_report(entries, target='app', top=15):
+    """
+    Summarize import timings
+
+    Args:
+        entries (list): Parsed import timing entries
+        target (str): The module that was imported
+        top (int): Number of slowest top-level packages to include
+
+    Returns:
+        dict: Total time, slowest packages and any eagerly loaded provider SDKs
+    """
+    target_entry = next((e for e in reversed(entries) if e['module'] == target), None)
+    total_us = target_entry['cumulative_us'] if target_entry else sum(e['self_us'] for e in entries)
+
+    # Roll timings up to top-level packages, counting each module once
+    packages = {}
+    for entry in entries:
+        root = entry['module'].split('.')[0]
+        packages[root] = packages.get(root, 0) + entry['self_us']
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    imported = {e['module'] for e in entries}
+    return {
+        'target': target,
+        'total_ms': round(total_us / 1000, 2),
+        'module_count': len(entries),
+        'slowest_packages': [{'package': name, 'ms': round(us / 1000, 2)} for name, us in slowest],
+        'provider_sdks_loaded': [sdk for sdk in PROVIDER_SDKS if sdk in imported]
+    }
+
+
+def format_report(report):
+    """Render a report as plain text."""
+    lines = [
+        f"Import time for '{report['target']}': {report['total_ms']:.1f} ms ({report['module_count']} modules)",
+        "",
+        f"{'package':<32}{'ms':>10}"
+    ]
+    for item in report['slowest_packages']:
+        lines.append(f"{item['package']:<32}{item['ms']:>10.1f}")
+    lines.append("")
+    if report['provider_sdks_loaded']:
+        lines.append(f"Provider SDKs loaded at startup: {', '.join(report['provider_sdks_loaded'])}")
+    else:
+        lines.append("No provider SDKs loaded at startup")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Report import-time cost of the application")
+    parser.add_argument('--target', default='app', help="Module to import (default: app)")
+    parser.add_argument('--top', type=int, default=15, help="Number of packages to list")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    parser.add_argument('--fail-on-sdk', action='store_true',
+                        help="Exit non-zero if a provider SDK is imported at startup")
+    args = parser.parse_args(argv)
+
+    report = build_report(measure(args.target), args.target, args.top)
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+    if args.fail_on_sdk and report['provider_sdks_loaded']:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Pluggable JSON provider for the AI Spectrum application.
+Uses orjson when it is installed and falls back to the standard library
+json module otherwise, so API payloads serialize with the least CPU
+available on the host.
+"""
+import os
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by a fast serializer
+
+    The backend is selected with the JSON_BACKEND config value or the
+    AISPECTRUM_JSON_BACKEND environment variable ('auto', 'orjson' or
+    'stdlib'). 'auto' uses orjson when it is importable.
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        backend = app.config.get('JSON_BACKEND') or os.environ.get('AISPECTRUM_JSON_BACKEND', 'auto')
+        if backend == 'orjson' and orjson is None:
+            raise RuntimeError("JSON_BACKEND is 'orjson' but orjson is not installed")
+        self.backend = 'orjson' if backend in ('auto', 'orjson') and orjson is not None else 'stdlib'
+
+    def _orjson_options(self, indent=False):
+        """Translate provider settings into orjson option flags."""
+        # Let self.default handle datetimes so output matches the stdlib provider
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def _encode(self, obj, indent=False):
+        """Serialize to UTF-8 bytes, falling back to the stdlib on unsupported input."""
+        if self.backend == 'orjson':
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._orjson_options(indent))
+            except TypeError:
+                # e.g. integers wider than 64 bits
+                pass
+        dump_args = {'indent': 2} if indent else {'separators': (',', ':')}
+        return super().dumps(obj, **dump_args).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        """Serialize data as JSON to a string."""
+        if self.backend != 'orjson' or kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        """Deserialize data from a JSON string or bytes."""
+        if self.backend != 'orjson' or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Serialize the arguments as JSON and wrap them in a response."""
+        if self.backend != 'orjson':
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._encode(obj, indent) + b"\n", mimetype=self.mimetype)
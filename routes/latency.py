@@ -0,0 +1,107 @@
+"""
+Rolling latency statistics per provider target.
+Every successful provider call records how long it took. The recent samples
+of each provider/model give percentiles, which set the delay after which a
+hedged query sends a duplicate request.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from .metrics import metrics
+
+# Recent calls kept per target
+WINDOW = int(os.environ.get('AISPECTRUM_LATENCY_WINDOW', 200))
+# Samples older than this no longer count, in seconds
+MAX_AGE_SECONDS = float(os.environ.get('AISPECTRUM_LATENCY_MAX_AGE', 3600))
+# Samples needed before a target's own percentiles are trusted
+MIN_SAMPLES = int(os.environ.get('AISPECTRUM_LATENCY_MIN_SAMPLES', 20))
+# Percentile of a target's latency after which a hedge is sent
+HEDGE_PERCENTILE = float(os.environ.get('AISPECTRUM_HEDGE_PERCENTILE', 95))
+# Until a target has enough samples, hedge after this multiple of its estimated latency
+HEDGE_ESTIMATE_FACTOR = 2.0
+
+
+def latency_key(plan):
+    """Identify a provider target (result key and model) for latency statistics."""
+    return f"{plan['result_key']}/{plan['model']}"
+
+
+class LatencyStats:
+    """Sliding window of call durations per target."""
+
+    def __init__(self, window=WINDOW, max_age_seconds=MAX_AGE_SECONDS, min_samples=MIN_SAMPLES):
+        """
+        Initialize the statistics
+
+        Args:
+            window (int): Most recent samples kept per target
+            max_age_seconds (float): Age after which samples are ignored
+            min_samples (int): Samples required before percentiles are reported
+        """
+        self.window = window
+        self.max_age_seconds = max_age_seconds
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        """Record one call duration for a target."""
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = deque(maxlen=self.window)
+            samples.append((time.monotonic(), seconds))
+
+    def _recent(self, key):
+        """Return a target's durations within the maximum age (lock held)."""
+        cutoff = time.monotonic() - self.max_age_seconds
+        return [seconds for recorded, seconds in self._samples.get(key, ()) if recorded >= cutoff]
+
+    def percentile(self, key, q):
+        """
+        Return a percentile of a target's recent latency
+
+        Args:
+            key (str): Target key from latency_key()
+            q (float): Percentile between 0 and 100
+
+        Returns:
+            float: Seconds, or None with fewer than min_samples recent calls
+        """
+        with self._lock:
+            recent = sorted(self._recent(key))
+        if len(recent) < max(self.min_samples, 1):
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * q / 100))]
+
+    def snapshot(self):
+        """Return count and p50/p95/p99 latency for every target."""
+        with self._lock:
+            counts = {key: len(self._recent(key)) for key in self._samples}
+        return {key: {'count': count,
+                      'p50': self.percentile(key, 50),
+                      'p95': self.percentile(key, 95),
+                      'p99': self.percentile(key, 99)} for key, count in counts.items()}
+
+    def hedge_delay(self, plan):
+        """
+        Return how long to wait for a target before sending a hedge
+
+        Args:
+            plan (dict): Target plan from make_plan
+
+        Returns:
+            float: The target's rolling p95 (HEDGE_PERCENTILE), or a multiple of
+                its pre-flight latency estimate until enough calls are recorded
+        """
+        delay = self.percentile(latency_key(plan), HEDGE_PERCENTILE)
+        if delay is None:
+            return plan['estimate']['estimated_latency_s'] * HEDGE_ESTIMATE_FACTOR
+        metrics.set_gauge('hedge_delay_s', round(delay, 3), target=latency_key(plan))
+        return delay
+
+
+# Shared latency statistics for this worker
+provider_latency = LatencyStats()
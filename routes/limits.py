@@ -0,0 +1,87 @@
+"""
+Size caps on provider responses.
+Every provider call gets a byte cap on the response body it reads and a
+token cap on the content it keeps, so a misbehaving endpoint or a local
+model that keeps generating cannot push a worker's memory up. Streamed
+responses stop being read at either cap; results cut off by a cap are
+marked truncated.
+"""
+import os
+
+from . import tokens
+from .http_client import MAX_RESPONSE_BYTES
+from .metrics import metrics
+
+
+def _provider_limits(variable):
+    """Parse per-provider overrides such as "local=1048576,gemini=8388608"."""
+    return {
+        provider_id.strip(): int(limit)
+        for provider_id, limit in (item.split('=', 1) for item in
+                                   filter(None, os.environ.get(variable, '').split(',')))
+    }
+
+
+# Most output tokens kept from one response
+MAX_RESPONSE_TOKENS = int(os.environ.get('AISPECTRUM_MAX_RESPONSE_TOKENS', 32768))
+# Per-provider overrides of MAX_RESPONSE_BYTES (AISPECTRUM_MAX_RESPONSE_BYTES) and MAX_RESPONSE_TOKENS
+PROVIDER_BYTE_LIMITS = _provider_limits('AISPECTRUM_RESPONSE_BYTE_LIMITS')
+PROVIDER_TOKEN_LIMITS = _provider_limits('AISPECTRUM_RESPONSE_TOKEN_LIMITS')
+
+
+def response_limits(provider_id, config):
+    """
+    Resolve the response caps of one provider target
+
+    A request may lower the server's caps with 'max_response_bytes' and
+    'max_response_tokens' in the target's api_keys entry, but not raise them.
+
+    Args:
+        provider_id (str): Registry id of the provider
+        config (dict): The target's api_keys entry
+
+    Returns:
+        tuple: (max bytes, max tokens)
+    """
+    max_bytes = PROVIDER_BYTE_LIMITS.get(provider_id, MAX_RESPONSE_BYTES)
+    max_tokens = PROVIDER_TOKEN_LIMITS.get(provider_id, MAX_RESPONSE_TOKENS)
+    if config.get('max_response_bytes'):
+        max_bytes = min(max_bytes, int(config['max_response_bytes']))
+    if config.get('max_response_tokens'):
+        max_tokens = min(max_tokens, int(config['max_response_tokens']))
+    return max_bytes, max_tokens
+
+
+def cap_result(result, plan):
+    """
+    Enforce a target's token cap on a provider result and record its size
+
+    Args:
+        result (dict): The provider's result
+        plan (dict): Target plan from make_plan
+
+    Returns:
+        dict: The result, with content (and samples) cut to the cap and
+            'truncated' set if anything was cut or the provider stopped reading
+    """
+    if result.get('status') != 'success':
+        return result
+    max_tokens = plan['config'].get('max_response_tokens') or MAX_RESPONSE_TOKENS
+    tokenizer = tokens.get_tokenizer(tokens.model_family(plan['provider_id'], plan['model']))
+    metrics.observe('response_content_chars', len(result.get('content') or ''), provider=plan['result_key'])
+
+    def cap(text):
+        capped = tokenizer.truncate(text, max_tokens) if text else text
+        return capped, capped != text
+
+    result['content'], truncated = cap(result.get('content'))
+    for sample in result.get('samples') or []:
+        if sample.get('status') == 'success':
+            sample['content'], cut = cap(sample.get('content'))
+            if cut:
+                sample['truncated'] = True
+            truncated = truncated or cut
+    if truncated or result.get('truncated'):
+        result['truncated'] = True
+        metrics.inc('responses_truncated_total', provider=plan['result_key'])
+    return result
@@ -0,0 +1,121 @@
+"""
+Lightweight in-process metrics for the AI Spectrum application.
+Counters, gauges and timing observations are keyed by metric name and
+label set, and exposed as JSON through the /api/metrics endpoint.
+"""
+import threading
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters, gauges and observations."""
+
+    def __init__(self):
+        """Initialize empty metric tables."""
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._observations = {}
+
+    @staticmethod
+    def _key(name, labels):
+        """Build a hashable key from a metric name and its labels."""
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        """Increment a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        """Set a gauge to an absolute value."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        """Record a single observation (e.g. a duration or a ratio)."""
+        key = self._key(name, labels)
+        with self._lock:
+            stats = self._observations.get(key)
+            if stats is None:
+                self._observations[key] = {
+                    'count': 1, 'sum': value, 'min': value, 'max': value
+                }
+            else:
+                stats['count'] += 1
+                stats['sum'] += value
+                stats['min'] = min(stats['min'], value)
+                stats['max'] = max(stats['max'], value)
+
+    def snapshot(self):
+        """
+        Return a JSON-serializable copy of all metrics
+
+        Returns:
+            dict: Lists of counters, gauges and observations
+        """
+        with self._lock:
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in self._counters.items()
+            ]
+            gauges = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in self._gauges.items()
+            ]
+            observations = [
+                dict(stats, name=name, labels=dict(labels), avg=stats['sum'] / stats['count'])
+                for (name, labels), stats in self._observations.items()
+            ]
+        return {'counters': counters, 'gauges': gauges, 'observations': observations}
+
+    def reset(self):
+        """Clear all metrics."""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._observations.clear()
+
+
+def merge_snapshots(snapshots):
+    """
+    Combine snapshots from several workers into one
+
+    Counters and gauges with the same name and labels are summed, and
+    observations are pooled.
+
+    Args:
+        snapshots (list): Snapshots as returned by MetricsRegistry.snapshot()
+
+    Returns:
+        dict: A snapshot in the same format
+    """
+    counters, gauges, observations = {}, {}, {}
+    for snapshot in snapshots:
+        for table, merged in (('counters', counters), ('gauges', gauges)):
+            for metric in snapshot.get(table, []):
+                key = MetricsRegistry._key(metric['name'], metric['labels'])
+                merged[key] = merged.get(key, 0) + metric['value']
+        for metric in snapshot.get('observations', []):
+            key = MetricsRegistry._key(metric['name'], metric['labels'])
+            stats = observations.get(key)
+            if stats is None:
+                observations[key] = {k: metric[k] for k in ('count', 'sum', 'min', 'max')}
+            else:
+                stats['count'] += metric['count']
+                stats['sum'] += metric['sum']
+                stats['min'] = min(stats['min'], metric['min'])
+                stats['max'] = max(stats['max'], metric['max'])
+    return {
+        'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                     for (name, labels), value in counters.items()],
+        'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                   for (name, labels), value in gauges.items()],
+        'observations': [dict(stats, name=name, labels=dict(labels), avg=stats['sum'] / stats['count'])
+                         for (name, labels), stats in observations.items()]
+    }
+
+
+# Shared registry used throughout the application
+metrics = MetricsRegistry()
@@ -0,0 +1,397 @@
+"""
+Opt-in per-request profiling.
+A profiled request is sampled by a background thread that records the
+stacks of the request thread and of the provider threads working for it,
+and tracemalloc records where the memory still held at the end of the
+request was allocated. Both are written as a speedscope file, which can
+also be downloaded as folded stacks for flamegraph.pl. Profiling is chosen
+per request by an admin header or a sample rate; when neither is
+configured no hooks are installed, so it costs nothing.
+"""
+import contextvars
+import functools
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from flask import g, request
+
+from .metrics import metrics
+
+logger = logging.getLogger('aiSpectrum')
+
+# Fraction of API requests profiled automatically
+SAMPLE_RATE = float(os.environ.get('AISPECTRUM_PROFILE_SAMPLE_RATE', 0))
+# Token required in X-Admin-Token for admin endpoints and X-Profile requests
+ADMIN_TOKEN = os.environ.get('AISPECTRUM_ADMIN_TOKEN', '')
+# Seconds between stack samples
+SAMPLE_INTERVAL = float(os.environ.get('AISPECTRUM_PROFILE_INTERVAL', 0.005))
+# Frames kept per allocation traceback
+ALLOCATION_FRAMES = int(os.environ.get('AISPECTRUM_PROFILE_ALLOCATION_FRAMES', 16))
+# Allocation sites kept per profile
+ALLOCATION_SITES = 200
+# Number of recent profiles kept on disk
+KEEP_PROFILES = int(os.environ.get('AISPECTRUM_PROFILE_KEEP', 50))
+PROFILE_DIR = os.environ.get('AISPECTRUM_PROFILE_DIR') or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'profiles')
+
+_current_profile = contextvars.ContextVar('profile', default=None)
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_admin(req=None):
+    """Check the request's X-Admin-Token against AISPECTRUM_ADMIN_TOKEN."""
+    req = req or request
+    token = req.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def _short_path(filename):
+    """Shorten paths inside the application so stacks stay readable."""
+    if filename.startswith(_PACKAGE_ROOT):
+        return os.path.relpath(filename, _PACKAGE_ROOT)
+    return filename
+
+
+class FrameTable:
+    """Speedscope's shared frame list, indexed by (name, file, line)."""
+
+    def __init__(self):
+        self.frames = []
+        self._index = {}
+
+    def index(self, name, filename, line):
+        key = (name, filename, line)
+        if key not in self._index:
+            self._index[key] = len(self.frames)
+            self.frames.append({'name': name, 'file': filename, 'line': line})
+        return self._index[key]
+
+
+class RequestProfile:
+    """Samples the threads working on one request and records its allocations."""
+
+    def __init__(self, name, interval=SAMPLE_INTERVAL):
+        """
+        Initialize the profile
+
+        Args:
+            name (str): Label such as 'POST /api/query'
+            interval (float): Seconds between stack samples
+        """
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.interval = interval
+        self.threads = {threading.get_ident(): 'request'}
+        self.stacks = {}
+        self.samples = 0
+        self.started = None
+        self.finished = None
+        self.allocations = []
+        self.peak_bytes = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._lock = threading.Lock()
+
+    def track(self, label):
+        """Add the calling thread to the threads being sampled."""
+        with self._lock:
+            self.threads[threading.get_ident()] = label
+
+    def untrack(self):
+        """Stop sampling the calling thread."""
+        with self._lock:
+            self.threads.pop(threading.get_ident(), None)
+
+    def start(self):
+        """Start sampling and allocation tracing."""
+        self.started = time.perf_counter()
+        _start_tracemalloc()
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.id}", daemon=True)
+        self._sampler.start()
+
+    def _sample_loop(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            self._sample((now - last) * 1000)
+            last = now
+
+    def _sample(self, weight_ms):
+        """Record the current stack of every tracked thread."""
+        frames = sys._current_frames()
+        with self._lock:
+            threads = list(self.threads.items())
+        for ident, label in threads:
+            frame = frames.get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                # Functions rather than lines, so a function is one frame in the flamegraph
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if not stack:
+                continue
+            key = (label, tuple(reversed(stack)))
+            self.stacks[key] = self.stacks.get(key, 0) + weight_ms
+        self.samples += 1
+
+    def stop(self):
+        """Stop sampling and take the allocation snapshot."""
+        if self._sampler is None or self._stop.is_set():
+            return
+        self._stop.set()
+        self._sampler.join()
+        self.finished = time.perf_counter()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+        self.peak_bytes = tracemalloc.get_traced_memory()[1]
+        _stop_tracemalloc()
+        self.allocations = [
+            ([(frame.filename, frame.lineno) for frame in stat.traceback], stat.size)
+            for stat in snapshot.statistics('traceback')[:ALLOCATION_SITES]
+        ]
+
+    @property
+    def duration_ms(self):
+        return round(((self.finished or time.perf_counter()) - self.started) * 1000, 2)
+
+    def to_speedscope(self):
+        """
+        Return the profile in speedscope's file format
+
+        Returns:
+            dict: One sampled CPU profile per thread plus an allocation profile in bytes
+        """
+        table = FrameTable()
+        profiles = {}
+        for (label, stack), weight in self.stacks.items():
+            profile = profiles.setdefault(label, {
+                'type': 'sampled', 'name': f"{self.name} [{label}]", 'unit': 'milliseconds',
+                'startValue': 0, 'endValue': self.duration_ms, 'samples': [], 'weights': []
+            })
+            profile['samples'].append([table.index(name, _short_path(filename), line)
+                                       for name, filename, line in stack])
+            profile['weights'].append(round(weight, 3))
+
+        allocations = {
+            'type': 'sampled', 'name': f"{self.name} [allocations]", 'unit': 'bytes',
+            'startValue': 0, 'endValue': sum(size for _, size in self.allocations),
+            'samples': [], 'weights': []
+        }
+        for frames, size in self.allocations:
+            allocations['samples'].append([table.index(f"{_short_path(filename)}:{line}", _short_path(filename), line)
+                                           for filename, line in frames])
+            allocations['weights'].append(size)
+
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': self.name,
+            'exporter': 'aiSpectrum',
+            'activeProfileIndex': 0,
+            'shared': {'frames': table.frames},
+            'profiles': list(profiles.values()) + [allocations],
+            'metadata': {
+                'id': self.id,
+                'created': int(time.time()),
+                'duration_ms': self.duration_ms,
+                'samples': self.samples,
+                'interval_ms': self.interval * 1000,
+                'peak_traced_bytes': self.peak_bytes
+            }
+        }
+
+
+# tracemalloc is process-wide, so it runs while any profiled request does
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_owned = False
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOCATION_FRAMES)
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+
+
+def current_profile():
+    """Return the profile of the running request, if it is being profiled."""
+    return _current_profile.get()
+
+
+def run_profiled(profile, label, task):
+    """Run a task on another thread with that thread included in the profile."""
+    profile.track(label)
+    try:
+        return task()
+    finally:
+        profile.untrack()
+
+
+def bind_tasks(tasks):
+    """
+    Include the threads running a request's tasks in its profile
+
+    Args:
+        tasks (dict): Key -> zero-argument callable
+
+    Returns:
+        dict: The tasks, wrapped only when the request is being profiled
+    """
+    profile = current_profile()
+    if profile is None:
+        return tasks
+    return {key: functools.partial(run_profiled, profile, str(key), task) for key, task in tasks.items()}
+
+
+def save_profile(profile, directory=None):
+    """
+    Write a finished profile and prune old ones
+
+    Args:
+        profile (RequestProfile): The stopped profile
+        directory (str): Where profiles are kept
+
+    Returns:
+        str: Path of the written file
+    """
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{profile.id}.speedscope.json")
+    with open(path, 'w') as f:
+        json.dump(profile.to_speedscope(), f)
+    stored = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.speedscope.json')),
+                    key=lambda entry: entry.stat().st_mtime)
+    for entry in stored[:-KEEP_PROFILES]:
+        os.remove(entry.path)
+    return path
+
+
+def list_profiles(directory=None):
+    """Return metadata of the stored profiles, newest first."""
+    directory = directory or PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.speedscope.json'):
+            continue
+        with open(entry.path) as f:
+            data = json.load(f)
+        profiles.append(dict(data['metadata'], name=data['name'], size_bytes=entry.stat().st_size))
+    return sorted(profiles, key=lambda p: p['created'], reverse=True)
+
+
+def load_profile(profile_id, directory=None):
+    """Return a stored speedscope profile, or None if it does not exist."""
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(directory or PROFILE_DIR, f"{profile_id}.speedscope.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def to_folded(speedscope, which='cpu'):
+    """
+    Convert a speedscope profile to folded stacks for flamegraph.pl
+
+    Args:
+        speedscope (dict): A stored profile
+        which (str): 'cpu' for the thread samples (weights in microseconds)
+            or 'alloc' for allocations (weights in bytes)
+
+    Returns:
+        str: One 'frame;frame;frame weight' line per stack
+    """
+    frames = speedscope['shared']['frames']
+    lines = []
+    for profile in speedscope['profiles']:
+        if (profile['unit'] == 'bytes') != (which == 'alloc'):
+            continue
+        scale = 1 if which == 'alloc' else 1000
+        thread = profile['name'].rsplit('[', 1)[-1].rstrip(']')
+        for sample, weight in zip(profile['samples'], profile['weights']):
+            names = [thread] if which == 'cpu' else []
+            names += [f"{frames[i]['name']} ({frames[i]['file']}:{frames[i]['line']})"
+                      if which == 'cpu' else frames[i]['name'] for i in sample]
+            lines.append(f"{';'.join(name.replace(';', ':') for name in names)} {int(weight * scale)}")
+    return '\n'.join(lines) + '\n'
+
+
+def should_profile(req):
+    """Decide whether to profile a request: admin X-Profile header or the sample rate."""
+    if req.headers.get('X-Profile') and is_admin(req):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def _begin_profile():
+    if not request.path.startswith('/api/') or request.path.startswith('/api/admin/'):
+        return
+    if not should_profile(request):
+        return
+    profile = RequestProfile(f"{request.method} {request.path}")
+    g.profile = profile
+    g.profile_token = _current_profile.set(profile)
+    profile.start()
+
+
+def _end_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    profile.stop()
+    _current_profile.reset(g.pop('profile_token'))
+    try:
+        save_profile(profile)
+        response.headers['X-Profile-Id'] = profile.id
+        metrics.inc('profiles_recorded_total')
+        logger.info(f"Profiled {profile.name} in {profile.duration_ms}ms ({profile.samples} samples): {profile.id}")
+    except OSError as e:
+        logger.warning(f"Could not save profile {profile.id}: {str(e)}")
+    return response
+
+
+def _abandon_profile(exc=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.stop()
+        _current_profile.reset(g.pop('profile_token'))
+
+
+def init_profiling(app):
+    """
+    Install the profiling hooks when profiling can be requested
+
+    Without AISPECTRUM_PROFILE_SAMPLE_RATE or AISPECTRUM_ADMIN_TOKEN no hook
+    is registered, so requests run exactly as before.
+    """
+    app.config.setdefault('PROFILING_ENABLED', SAMPLE_RATE > 0 or bool(ADMIN_TOKEN))
+    if not app.config['PROFILING_ENABLED']:
+        return
+    app.before_request(_begin_profile)
+    app.after_request(_end_profile)
+    app.teardown_request(_abandon_profile)
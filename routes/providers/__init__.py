@@ -0,0 +1,60 @@
+"""
+Provider registry for the AI Spectrum query pipeline.
+Each provider lives in its own module, which is imported the first time a
+request for that provider arrives, so provider SDKs never load at startup.
+"""
+import importlib
+import logging
+import threading
+import time
+
+from ..metrics import metrics
+
+logger = logging.getLogger('aiSpectrum')
+
+# Provider id -> module name, in the order providers are queried
+PROVIDER_MODULES = {
+    'openai': 'openai_provider',
+    'anthropic': 'anthropic_provider',
+    'deepseek': 'deepseek_provider',
+    'mistral': 'mistral_provider',
+    'gemini': 'gemini_provider',
+    'cohere': 'cohere_provider',
+    'azure': 'azure_provider',
+    'local': 'local_provider'
+}
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def get_provider(provider_id):
+    """
+    Return the module implementing a provider, importing it on first use
+
+    Args:
+        provider_id (str): The provider identifier (e.g., 'openai')
+
+    Returns:
+        module: Provider module exposing DISPLAY_NAME and call(query, config, history),
+            and optionally expand(provider_id, config) for multi-endpoint providers
+    """
+    module = _loaded.get(provider_id)
+    if module is not None:
+        return module
+
+    with _lock:
+        module = _loaded.get(provider_id)
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(f".{PROVIDER_MODULES[provider_id]}", __name__)
+            import_ms = (time.perf_counter() - start) * 1000
+            metrics.observe('provider_import_ms', import_ms, provider=provider_id)
+            logger.info(f"Loaded provider {provider_id} in {import_ms:.1f} ms")
+            _loaded[provider_id] = module
+    return module
+
+
+def loaded_providers():
+    """Return the ids of providers whose modules have been imported."""
+    return list(_loaded)
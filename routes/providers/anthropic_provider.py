@@ -0,0 +1,187 @@
+"""
+Anthropic provider, calling the Messages API directly, or Message Batches
+for bulk work.
+"""
+import json
+import logging
+import os
+
+from .. import http_client
+from .common import build_messages, mark_truncated
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'Anthropic'
+DEFAULT_MODEL = 'claude-3-opus-20240229'
+API_URL = "https://api.anthropic.com/v1/messages"
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+# Message Batches endpoint; a config's 'batch_url' overrides it
+BATCH_URL = os.environ.get('AISPECTRUM_ANTHROPIC_BATCH_URL', "https://api.anthropic.com/v1/messages/batches")
+
+
+def call(query, config, history=None):
+    """
+    Send a query to Anthropic
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    # Direct API call for Anthropic instead of client
+    api_key = config['key']
+    anthropic_model = config.get('model', DEFAULT_MODEL)
+    logger.info(f"Using Anthropic model: {anthropic_model}")
+
+    headers = _headers(api_key)
+
+    messages = build_messages(query, history)
+    if history:
+        # Cache the conversation so far so it is not re-billed every turn
+        messages = with_cache_breakpoint(messages)
+        headers["anthropic-beta"] = PROMPT_CACHING_BETA
+
+    payload = {
+        "model": anthropic_model,
+        "max_tokens": config.get('max_tokens', 4096),
+        "messages": messages
+    }
+
+    logger.info("Sending request to Anthropic API...")
+    response_data, truncated = http_client.post_json_prefix(API_URL, config.get('max_response_bytes'),
+                                                            headers=headers, json=payload)
+    logger.info("Anthropic API call successful!")
+
+    result = mark_truncated(_result(response_data, anthropic_model), truncated)
+    logger.info(f"Anthropic response length: {len(result['content'])} chars")
+    return result
+
+
+def _headers(api_key):
+    return {
+        "x-api-key": api_key,
+        "anthropic-version": "2023-06-01",
+        "content-type": "application/json"
+    }
+
+
+def _result(message, model):
+    """Convert a Messages API response into a result."""
+    usage = message.get('usage') or {}
+    return {
+        'content': message['content'][0]['text'],
+        'model': model,
+        'status': 'success',
+        'usage': {
+            'prompt_tokens': usage.get('input_tokens', 0),
+            'completion_tokens': usage.get('output_tokens', 0),
+            'cached_tokens': usage.get('cache_read_input_tokens', 0),
+            'cache_write_tokens': usage.get('cache_creation_input_tokens', 0)
+        }
+    }
+
+
+def submit_batch(requests, config):
+    """
+    Submit queries as an Anthropic Message Batch
+
+    Args:
+        requests (list): (custom_id, query, history, config) per query
+        config (dict): The provider's entry from the api_keys (key, batch_url)
+
+    Returns:
+        str: The batch id
+    """
+    payload = {"requests": [{
+        "custom_id": custom_id,
+        "params": {
+            "model": request_config.get('model', DEFAULT_MODEL),
+            "max_tokens": request_config.get('max_tokens', 4096),
+            "messages": build_messages(query, history)
+        }
+    } for custom_id, query, history, request_config in requests]}
+    response = http_client.post(config.get('batch_url', BATCH_URL), headers=_headers(config['key']), json=payload)
+    response.raise_for_status()
+    logger.info(f"Submitted Anthropic batch {response.json()['id']} with {len(requests)} requests")
+    return response.json()['id']
+
+
+def poll_batch(batch_id, config):
+    """
+    Check an Anthropic Message Batch and collect its results once it has ended
+
+    Args:
+        batch_id (str): Id returned by submit_batch
+        config (dict): The provider's entry from the api_keys
+
+    Returns:
+        dict: custom_id -> result (or Exception for failed requests), or
+            None while the batch is still running
+    """
+    headers = _headers(config['key'])
+    response = http_client.get(f"{config.get('batch_url', BATCH_URL).rstrip('/')}/{batch_id}", headers=headers)
+    response.raise_for_status()
+    batch = response.json()
+    if batch['processing_status'] != 'ended':
+        return None
+    logger.info(f"Anthropic batch {batch_id} ended")
+
+    results = {}
+    if not batch.get('results_url'):
+        return results
+    content = http_client.get(batch['results_url'], headers=headers)
+    content.raise_for_status()
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        outcome = item['result']
+        if outcome['type'] == 'succeeded':
+            message = outcome['message']
+            results[item['custom_id']] = _result(message, message.get('model', DEFAULT_MODEL))
+        else:
+            error = (outcome.get('error') or {}).get('error') or outcome.get('error') or {}
+            results[item['custom_id']] = Exception(
+                f"Batch request {outcome['type']}: {error.get('message', outcome['type'])}")
+    return results
+
+
+def cancel_batch(batch_id, config):
+    """
+    Cancel an Anthropic Message Batch that is no longer waited for
+
+    Args:
+        batch_id (str): Id returned by submit_batch
+        config (dict): The provider's entry from the api_keys
+    """
+    response = http_client.post(f"{config.get('batch_url', BATCH_URL).rstrip('/')}/{batch_id}/cancel",
+                                headers=_headers(config['key']))
+    response.raise_for_status()
+    logger.info(f"Cancelled Anthropic batch {batch_id}")
+
+
+def with_cache_breakpoint(messages):
+    """
+    Mark the end of the conversation history as a prompt cache breakpoint
+
+    The breakpoint goes on the last message before the new query, so the
+    whole prior conversation is read from cache on the next turn.
+
+    Args:
+        messages (list): History followed by the new user message
+
+    Returns:
+        list: Messages with a cache_control block on the last history message
+    """
+    marked = list(messages)
+    last = marked[-2]
+    marked[-2] = {
+        "role": last["role"],
+        "content": [
+            {"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}
+        ]
+    }
+    return marked
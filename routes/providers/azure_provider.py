@@ -0,0 +1,88 @@
+"""
+Azure OpenAI provider, calling a chat completions deployment directly.
+"""
+import logging
+
+from .. import http_client
+from .common import SYSTEM_PROMPT, build_messages, chat_usage, mark_truncated, sample_result
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'Azure OpenAI'
+DEFAULT_MODEL = 'gpt-4'
+DEFAULT_DEPLOYMENT = 'gpt4'
+API_VERSION = '2023-05-15'
+
+
+def call(query, config, history=None):
+    """
+    Send a query to an Azure OpenAI deployment
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    response_data, azure_model, truncated = _complete(query, config, history)
+    content = response_data['choices'][0]['message']['content']
+    logger.info(f"Azure OpenAI response length: {len(content)} chars")
+    return mark_truncated({
+        'content': content,
+        'model': azure_model,
+        'status': 'success',
+        'usage': chat_usage(response_data)
+    }, truncated)
+
+
+def call_samples(query, config, samples, history=None):
+    """
+    Draw several responses to a query from one request, using the deployment's n
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        samples (int): Number of responses
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with the responses under 'samples'
+    """
+    response_data, azure_model, truncated = _complete(query, config, history, samples)
+    # A body cut at the byte cap may end inside a choice's message
+    contents = [(choice.get('message') or {}).get('content') for choice in response_data['choices']]
+    return mark_truncated(sample_result([content for content in contents if content is not None], azure_model,
+                                        chat_usage(response_data)), truncated)
+
+
+def _complete(query, config, history=None, samples=1):
+    """Send one chat completion request; returns (decoded response, model, whether it was cut at the byte cap)."""
+    api_key = config['key']
+    endpoint = config.get('endpoint', '')
+    azure_model = config.get('model', DEFAULT_MODEL)
+    deployment_name = config.get('deployment', DEFAULT_DEPLOYMENT)
+
+    # Validate endpoint URL
+    if not endpoint or not endpoint.startswith(('http://', 'https://')):
+        raise ValueError("Invalid or missing Azure OpenAI endpoint URL")
+
+    url = f"{endpoint}/openai/deployments/{deployment_name}/chat/completions?api-version={API_VERSION}"
+    headers = {
+        "Content-Type": "application/json",
+        "api-key": api_key
+    }
+
+    payload = {
+        "messages": build_messages(query, history, SYSTEM_PROMPT),
+        "temperature": 0.7,
+        "max_tokens": config.get('max_tokens', 2048)
+    }
+    if samples > 1:
+        payload["n"] = samples
+
+    logger.info(f"Sending request to Azure OpenAI API with deployment {deployment_name}")
+    response_data, truncated = http_client.post_json_prefix(url, config.get('max_response_bytes'),
+                                                            headers=headers, json=payload)
+    return response_data, azure_model, truncated
@@ -0,0 +1,72 @@
+"""
+Cohere provider, using the v1 chat REST API.
+"""
+import logging
+
+from .. import http_client
+from .common import mark_truncated
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'Cohere'
+DEFAULT_MODEL = 'command-r'
+API_URL = "https://api.cohere.ai/v1/chat"
+
+
+def call(query, config, history=None):
+    """
+    Send a query to Cohere
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    api_key = config['key']
+    cohere_model = config.get('model', DEFAULT_MODEL)
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+    payload = {
+        "model": cohere_model,
+        "message": query,
+        "temperature": 0.7
+    }
+    if config.get('max_tokens'):
+        payload["max_tokens"] = config['max_tokens']
+    if history:
+        payload["chat_history"] = [
+            {"role": "USER" if m["role"] == "user" else "CHATBOT", "message": m["content"]}
+            for m in history
+        ]
+
+    logger.info(f"Sending request to Cohere API with model {cohere_model}")
+    response_data, truncated = http_client.post_json_prefix(API_URL, config.get('max_response_bytes'),
+                                                            headers=headers, json=payload)
+
+    content = response_data['text']
+    logger.info(f"Cohere response length: {len(content)} chars")
+    return mark_truncated({
+        'content': content,
+        'model': cohere_model,
+        'status': 'success',
+        'usage': _usage(response_data)
+    }, truncated)
+
+
+def _usage(response_data):
+    """Extract billed token counts from a Cohere chat response."""
+    billed = (response_data.get('meta') or {}).get('billed_units') or {}
+    if not billed:
+        return None
+    return {
+        'prompt_tokens': billed.get('input_tokens', 0),
+        'completion_tokens': billed.get('output_tokens', 0),
+        'cached_tokens': 0
+    }
@@ -0,0 +1,84 @@
+"""
+Helpers shared by provider modules.
+"""
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+def build_messages(query, history=None, system_prompt=None):
+    """
+    Build an OpenAI-style message list
+
+    The system prompt and history come first and are never reordered, so
+    consecutive turns share a byte-identical prefix that providers with
+    automatic prefix caching can reuse.
+
+    Args:
+        query (str): The new user query
+        history (list): Prior user/assistant messages, oldest first
+        system_prompt (str): Optional system prompt
+
+    Returns:
+        list: Messages ready to send
+    """
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.extend({"role": m["role"], "content": m["content"]} for m in history or [])
+    messages.append({"role": "user", "content": query})
+    return messages
+
+
+def chat_usage(response_data):
+    """
+    Normalize the usage block of an OpenAI-compatible chat completion
+
+    Args:
+        response_data (dict): Decoded response body
+
+    Returns:
+        dict: prompt_tokens, completion_tokens and cached_tokens, or None
+    """
+    usage = response_data.get('usage')
+    if not usage:
+        return None
+    details = usage.get('prompt_tokens_details') or {}
+    return {
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+        # DeepSeek reports its context cache hits under its own key
+        'cached_tokens': details.get('cached_tokens', usage.get('prompt_cache_hit_tokens', 0)) or 0
+    }
+
+
+def mark_truncated(result, truncated):
+    """Flag a result whose response was cut off at its byte cap."""
+    if truncated:
+        result['truncated'] = True
+    return result
+
+
+def sample_result(samples, model, usage=None, sampling='native'):
+    """
+    Build the result of a multi-sample call
+
+    Args:
+        samples (list): Per-sample results, or the texts of successful samples
+        model (str): Model that produced them
+        usage (dict): Token usage of the whole call; a native multi-candidate
+            request reports its prompt tokens once for all samples
+        sampling (str): 'native' for one multi-candidate request, 'parallel'
+            for one call per sample
+
+    Returns:
+        dict: Result with the first successful sample as its content
+    """
+    samples = [{'content': s, 'status': 'success'} if isinstance(s, str) else s for s in samples]
+    return {
+        'content': next(s['content'] for s in samples if s.get('status') == 'success'),
+        'model': model,
+        'status': 'success',
+        'samples': samples,
+        'sampling': sampling,
+        'usage': usage
+    }
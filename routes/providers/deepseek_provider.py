@@ -0,0 +1,58 @@
+"""
+DeepSeek provider, using its OpenAI-compatible REST API directly.
+"""
+import logging
+
+from .. import http_client
+from .common import build_messages, chat_usage, mark_truncated
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'DeepSeek'
+DEFAULT_MODEL = 'deepseek-llm-67b-chat'
+# DeepSeek API endpoint (using deepseek.ai)
+API_URL = "https://api.deepseek.ai/v1/chat/completions"
+
+
+def call(query, config, history=None):
+    """
+    Send a query to DeepSeek
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    api_key = config['key']
+    deepseek_model = config.get('model', DEFAULT_MODEL)
+
+    # Request headers
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+    # Request payload
+    payload = {
+        "model": deepseek_model,
+        "messages": build_messages(query, history)
+    }
+    if config.get('max_tokens'):
+        payload["max_tokens"] = config['max_tokens']
+
+    # Make the API request
+    logger.info(f"Sending request to DeepSeek API with model {deepseek_model}")
+    response_data, truncated = http_client.post_json_prefix(API_URL, config.get('max_response_bytes'),
+                                                            headers=headers, json=payload)
+
+    content = response_data['choices'][0]['message']['content']
+    logger.info(f"DeepSeek response length: {len(content)} chars")
+    return mark_truncated({
+        'content': content,
+        'model': deepseek_model,
+        'status': 'success',
+        'usage': chat_usage(response_data)
+    }, truncated)
@@ -0,0 +1,146 @@
+"""
+Google Gemini provider, falling back through a chain of models when the
+selected one is unavailable.
+"""
+import logging
+
+from .. import http_client, tracing
+from ..cancellation import QueryCancelledError
+from .common import mark_truncated, sample_result
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'Google Gemini'
+DEFAULT_MODEL = 'gemini-1.5-flash'
+FALLBACK_MODELS = ["gemini-1.5-flash", "gemini-pro", "gemini-pro-latest"]
+API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={key}"
+
+
+def call(query, config, history=None):
+    """
+    Send a query to Google Gemini
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    response_data, gemini_model, texts, truncated = _generate(query, config, history)
+    text_content = texts[0] if texts else ""
+    logger.info(f"Gemini response length: {len(text_content)} chars")
+    return mark_truncated({
+        'content': text_content,
+        'model': gemini_model,
+        'status': 'success',
+        'usage': _usage(response_data)
+    }, truncated)
+
+
+def call_samples(query, config, samples, history=None):
+    """
+    Draw several responses to a query from one request, using Gemini's candidateCount
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        samples (int): Number of responses
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with the responses under 'samples'
+    """
+    response_data, gemini_model, texts, truncated = _generate(query, config, history, samples)
+    if not texts:
+        raise Exception(f"Gemini model {gemini_model} returned no candidates")
+    return mark_truncated(sample_result(texts, gemini_model, _usage(response_data)), truncated)
+
+
+def _generate(query, config, history=None, samples=1):
+    """
+    Send one generateContent request, falling back through models
+
+    Returns:
+        tuple: (decoded response, model, candidate texts, whether the body was cut at the byte cap)
+    """
+    api_key = config['key']
+
+    # Try multiple models in case the selected one doesn't work
+    gemini_models = [config.get('model', DEFAULT_MODEL)] + FALLBACK_MODELS
+
+    # Remove duplicates while preserving order
+    gemini_models = list(dict.fromkeys(gemini_models))
+
+    model_errors = []
+
+    for gemini_model in gemini_models:
+        # One span per attempt, so fallbacks show up in the trace
+        attributes = {'model': gemini_model, 'fallback': gemini_model != gemini_models[0]}
+        with tracing.start_span("gemini model attempt", attributes=attributes):
+            try:
+                logger.info(f"Trying Gemini model: {gemini_model}")
+
+                url = API_URL.format(model=gemini_model, key=api_key)
+                headers = {
+                    "Content-Type": "application/json"
+                }
+
+                payload = {
+                    "contents": build_contents(query, history),
+                    "generationConfig": {
+                        "temperature": 0.7,
+                        "topK": 40,
+                        "topP": 0.95,
+                        "maxOutputTokens": config.get('max_tokens', 2048)
+                    }
+                }
+                if samples > 1:
+                    payload["generationConfig"]["candidateCount"] = samples
+
+                logger.info(f"Sending request to Gemini API with model {gemini_model}")
+                response_data, truncated = http_client.post_json_prefix(url, config.get('max_response_bytes'),
+                                                                        headers=headers, json=payload)
+                logger.info(f"Gemini API call successful with model {gemini_model}!")
+                texts = [_candidate_text(candidate) for candidate in response_data.get("candidates") or []]
+                return response_data, gemini_model, texts, truncated
+
+            except QueryCancelledError:
+                raise
+            except Exception as model_error:
+                tracing.record_error(model_error)
+                model_errors.append(f"{gemini_model}: {str(model_error)}")
+                logger.warning(f"Failed with model {gemini_model}: {str(model_error)}")
+                continue
+
+    error_msg = f"All Gemini models failed to generate a response. Errors: {', '.join(model_errors)}"
+    raise Exception(error_msg)
+
+
+def _candidate_text(candidate):
+    """Join the text parts of one response candidate."""
+    # A body cut at the byte cap may end before a candidate's content
+    return "".join(part["text"] for part in (candidate.get("content") or {}).get("parts") or [] if "text" in part)
+
+
+def build_contents(query, history=None):
+    """Convert history and the new query into Gemini's contents format."""
+    contents = [
+        {"role": "user" if m["role"] == "user" else "model", "parts": [{"text": m["content"]}]}
+        for m in history or []
+    ]
+    contents.append({"role": "user", "parts": [{"text": query}]})
+    return contents
+
+
+def _usage(response_data):
+    """Extract token counts from Gemini's usageMetadata."""
+    usage = response_data.get('usageMetadata')
+    if not usage:
+        return None
+    return {
+        'prompt_tokens': usage.get('promptTokenCount', 0),
+        'completion_tokens': usage.get('candidatesTokenCount', 0),
+        'cached_tokens': usage.get('cachedContentTokenCount', 0)
+    }
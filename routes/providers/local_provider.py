@@ -0,0 +1,229 @@
+"""
+Local model provider for any OpenAI-compatible server (llama.cpp, vLLM,
+LocalAI, Ollama, ...). Responses are streamed over the shared keep-alive
+connection pool, and several endpoints can be compared side by side.
+"""
+import logging
+import os
+from urllib.parse import urlsplit
+
+from .. import http_client, tokens
+from ..state import SharedCache
+from .common import build_messages, chat_usage
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'Local Models'
+# Default endpoint(s) when the request does not name one, comma-separated
+DEFAULT_ENDPOINTS = os.environ.get('AISPECTRUM_LOCAL_ENDPOINTS', 'http://localhost:8080/v1')
+# Placeholder model id from AVAILABLE_MODELS meaning "whatever the server serves"
+PLACEHOLDER_MODEL = 'localhost'
+REQUEST_TIMEOUT = float(os.environ.get('AISPECTRUM_LOCAL_TIMEOUT', 300))
+# Hosts a request may point the local provider at, comma-separated, or "*" for any.
+# The server fetches these URLs itself, so by default only loopback and the default endpoints' hosts
+ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.environ.get(
+        'AISPECTRUM_LOCAL_ALLOWED_HOSTS',
+        ','.join(['localhost', '127.0.0.1', '::1'] +
+                 [urlsplit(endpoint.strip()).hostname or '' for endpoint in DEFAULT_ENDPOINTS.split(',')])
+    ).split(',') if host.strip()
+}
+
+# Model each endpoint serves by default, shared by every worker
+_served_models = SharedCache('local_models', ttl_seconds=300)
+
+
+def base_url(endpoint):
+    """
+    Normalize an endpoint to its OpenAI-compatible API base URL
+
+    Accepts 'http://host:port', 'http://host:port/v1' or a full
+    '.../chat/completions' URL.
+
+    Args:
+        endpoint (str): Endpoint as configured by the user
+
+    Returns:
+        str: Base URL ending in the API version path (e.g. '/v1')
+
+    Raises:
+        ValueError: For a malformed URL or a host outside ALLOWED_HOSTS
+    """
+    endpoint = endpoint.strip().rstrip('/')
+    parts = urlsplit(endpoint)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ValueError("Invalid or missing local model endpoint URL")
+    if '*' not in ALLOWED_HOSTS and parts.hostname.lower() not in ALLOWED_HOSTS:
+        raise ValueError(f"Invalid request: local endpoint host {parts.hostname} is not in "
+                         f"AISPECTRUM_LOCAL_ALLOWED_HOSTS")
+    if endpoint.endswith('/chat/completions'):
+        endpoint = endpoint[:-len('/chat/completions')]
+    if not urlsplit(endpoint).path:
+        endpoint += '/v1'
+    return endpoint
+
+
+def expand(provider_id, config):
+    """
+    Split a local config into one target per endpoint
+
+    A config may name a single 'endpoint' or a list of 'endpoints' (URLs or
+    dicts with url/model/name/key). With more than one endpoint, each gets
+    its own result key ('local:<name>') so they are compared as separate
+    models; a name used twice gets a '#2', '#3'... suffix.
+
+    Args:
+        provider_id (str): The registry id ('local')
+        config (dict): The provider's entry from the request's api_keys
+
+    Returns:
+        list: (result_key, endpoint_config) tuples
+    """
+    endpoints = config.get('endpoints')
+    if not endpoints:
+        endpoints = [config['endpoint']] if config.get('endpoint') else DEFAULT_ENDPOINTS.split(',')
+    targets, used = [], set()
+    for index, endpoint in enumerate(endpoints):
+        if isinstance(endpoint, str):
+            endpoint = {'url': endpoint}
+        endpoint_config = dict(config)
+        endpoint_config.pop('endpoints', None)
+        endpoint_config['endpoint'] = endpoint.get('url', '')
+        for field in ('model', 'key', 'stream'):
+            if field in endpoint:
+                endpoint_config[field] = endpoint[field]
+        if len(endpoints) == 1:
+            result_key = provider_id
+        else:
+            result_key = f"{provider_id}:{endpoint.get('name') or endpoint_config.get('model') or index + 1}"
+        # Two endpoints with one name would otherwise overwrite each other's result
+        base_key, copy = result_key, 1
+        while result_key in used:
+            copy += 1
+            result_key = f"{base_key}#{copy}"
+        used.add(result_key)
+        targets.append((result_key, endpoint_config))
+    return targets
+
+
+def _headers(config):
+    """Build request headers, adding a bearer token if the server needs one."""
+    headers = {"Content-Type": "application/json"}
+    if config.get('key'):
+        headers["Authorization"] = f"Bearer {config['key']}"
+    return headers
+
+
+def resolve_model(api_base, config):
+    """
+    Return the model to request, asking the server when none was chosen
+
+    Args:
+        api_base (str): Normalized API base URL
+        config (dict): Endpoint config
+
+    Returns:
+        str: Model id, or None to let the server use its default
+    """
+    model = config.get('model')
+    if model and model != PLACEHOLDER_MODEL:
+        return model
+
+    cached = _served_models.get(api_base)
+    if cached is not None:
+        return cached['model']
+    try:
+        with http_client.get(f"{api_base}/models", headers=_headers(config), timeout=5,
+                             allow_redirects=False) as response:
+            response.raise_for_status()
+            served = response.json().get('data') or []
+        model = served[0]['id'] if served else None
+    except Exception as e:
+        logger.warning(f"Could not list models at {api_base}: {str(e)}")
+        return None
+    _served_models.set(api_base, {'model': model})
+    return model
+
+
+def call(query, config, history=None):
+    """
+    Send a query to a local OpenAI-compatible endpoint
+
+    Args:
+        query (str): The user query
+        config (dict): Endpoint config with endpoint, optional model, key and stream
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    api_base = base_url(config.get('endpoint', ''))
+    model = resolve_model(api_base, config)
+    stream = config.get('stream', True)
+
+    payload = {
+        "messages": build_messages(query, history),
+        "stream": stream
+    }
+    if model:
+        payload["model"] = model
+    if config.get('max_tokens'):
+        payload["max_tokens"] = config['max_tokens']
+
+    logger.info(f"Sending request to local endpoint {api_base} with model {model or '(server default)'}")
+    response = http_client.post(
+        f"{api_base}/chat/completions",
+        headers=_headers(config),
+        json=payload,
+        stream=True,
+        timeout=REQUEST_TIMEOUT,
+        # A redirect could send the request to a host outside ALLOWED_HOSTS
+        allow_redirects=False
+    )
+
+    usage = None
+    truncated = False
+    # Closing the response returns (or drops) its pooled connection, also on errors
+    with response:
+        response.raise_for_status()
+        if stream:
+            # Stop reading a model that keeps generating once it passes the byte or token cap
+            max_tokens = config.get('max_response_tokens')
+            tokenizer = tokens.get_tokenizer(tokens.model_family('local', model))
+            chunks, generated = [], 0
+            events = http_client.iter_sse(response, config.get('max_response_bytes'))
+            try:
+                for event in events:
+                    for choice in event.get('choices') or []:
+                        delta = choice.get('delta') or {}
+                        if delta.get('content'):
+                            chunks.append(delta['content'])
+                            generated += tokenizer.count(delta['content'])
+                    usage = chat_usage(event) or usage
+                    model = model or event.get('model')
+                    if max_tokens and generated > max_tokens:
+                        truncated = True
+                        break
+            except http_client.ResponseTooLargeError:
+                truncated = True
+            finally:
+                events.close()
+            content = ''.join(chunks)
+        else:
+            response_data, truncated = http_client.read_json_prefix(response, config.get('max_response_bytes'))
+            content = response_data['choices'][0]['message']['content']
+            usage = chat_usage(response_data)
+            model = model or response_data.get('model')
+
+    logger.info(f"Local endpoint {api_base} response length: {len(content)} chars")
+    result = {
+        'content': content,
+        'model': model or PLACEHOLDER_MODEL,
+        'endpoint': api_base,
+        'status': 'success',
+        'usage': usage
+    }
+    if truncated:
+        logger.warning(f"Stopped reading the response of local endpoint {api_base} at its size cap")
+        result['truncated'] = True
+    return result
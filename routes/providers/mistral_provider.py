@@ -0,0 +1,54 @@
+"""
+Mistral AI provider, using its chat completions REST API.
+"""
+import logging
+
+from .. import http_client
+from .common import build_messages, chat_usage, mark_truncated
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'Mistral AI'
+DEFAULT_MODEL = 'mistral-large-latest'
+API_URL = "https://api.mistral.ai/v1/chat/completions"
+
+
+def call(query, config, history=None):
+    """
+    Send a query to Mistral AI
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    api_key = config['key']
+    mistral_model = config.get('model', DEFAULT_MODEL)
+
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
+
+    payload = {
+        "model": mistral_model,
+        "messages": build_messages(query, history)
+    }
+    if config.get('max_tokens'):
+        payload["max_tokens"] = config['max_tokens']
+
+    logger.info(f"Sending request to Mistral API with model {mistral_model}")
+    response_data, truncated = http_client.post_json_prefix(API_URL, config.get('max_response_bytes'),
+                                                            headers=headers, json=payload)
+
+    content = response_data['choices'][0]['message']['content']
+    logger.info(f"Mistral response length: {len(content)} chars")
+    return mark_truncated({
+        'content': content,
+        'model': mistral_model,
+        'status': 'success',
+        'usage': chat_usage(response_data)
+    }, truncated)
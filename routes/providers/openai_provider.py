@@ -0,0 +1,243 @@
+"""
+OpenAI provider, using the official SDK for live calls and the Batch API
+(over the shared HTTP session) for bulk work. Live calls are streamed, so a
+cancelled query, or one past its byte or token cap, stops reading (and
+closes the connection) between chunks instead of waiting for the whole
+completion.
+"""
+import json
+import logging
+import os
+import openai
+
+from .. import http_client, tokens
+from ..cancellation import current_token
+
+from .common import SYSTEM_PROMPT, build_messages, chat_usage, mark_truncated, sample_result
+
+logger = logging.getLogger('aiSpectrum')
+
+DISPLAY_NAME = 'OpenAI'
+DEFAULT_MODEL = 'gpt-4o'
+# Base URL of the API; a config's 'batch_url' overrides it for the Files and Batch APIs
+API_BASE = os.environ.get('AISPECTRUM_OPENAI_API_BASE', 'https://api.openai.com/v1')
+# Seconds the SDK waits to connect or for the next chunk of a response
+REQUEST_TIMEOUT = float(os.environ.get('AISPECTRUM_OPENAI_TIMEOUT', 120))
+BATCH_COMPLETION_WINDOW = '24h'
+# Batch states after which no more results will arrive
+BATCH_FINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+def call(query, config, history=None):
+    """
+    Send a query to OpenAI
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with content, model and status
+    """
+    contents, openai_model, usage, truncated = _complete(query, config, history)
+    content = contents[0]
+    logger.info(f"OpenAI response length: {len(content)} chars")
+    return mark_truncated({
+        'content': content,
+        'model': openai_model,
+        'status': 'success',
+        'usage': usage
+    }, truncated)
+
+
+def call_samples(query, config, samples, history=None):
+    """
+    Draw several responses to a query from one request, using OpenAI's n
+
+    Args:
+        query (str): The user query
+        config (dict): The provider's entry from the request's api_keys
+        samples (int): Number of responses
+        history (list): Prior user/assistant messages for multi-turn queries
+
+    Returns:
+        dict: Result with the responses under 'samples'
+    """
+    contents, openai_model, usage, truncated = _complete(query, config, history, samples)
+    return mark_truncated(sample_result(contents, openai_model, usage), truncated)
+
+
+def _complete(query, config, history=None, samples=1):
+    """
+    Stream one chat completion request
+
+    Returns:
+        tuple: (content of each choice, model, usage, whether reading stopped at the byte or token cap)
+    """
+    # Don't pass proxies parameter
+    openai_client = openai.OpenAI(api_key=config['key'], base_url=API_BASE, timeout=REQUEST_TIMEOUT)
+    openai_model = config.get('model', DEFAULT_MODEL)
+    logger.info(f"Using OpenAI model: {openai_model}")
+
+    options = {}
+    if config.get('max_tokens'):
+        options['max_tokens'] = config['max_tokens']
+    if samples > 1:
+        options['n'] = samples
+
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+    logger.info("Sending request to OpenAI API...")
+    stream = openai_client.chat.completions.create(
+        model=openai_model,
+        **options,
+        # OpenAI caches long prompt prefixes automatically; keeping the
+        # system prompt and history stable lets follow-up turns hit it
+        messages=build_messages(query, history, SYSTEM_PROMPT),
+        stream=True,
+        stream_options={'include_usage': True}
+    )
+    # Cancelling closes the stream, which ends the read it is blocked in
+    if token is not None:
+        token.register(stream)
+    # The SDK decodes the stream itself, so the caps apply to the content received
+    max_bytes = config.get('max_response_bytes') or http_client.MAX_RESPONSE_BYTES
+    max_tokens = config.get('max_response_tokens')
+    tokenizer = tokens.get_tokenizer(tokens.model_family('openai', openai_model))
+    chunks = [[] for _ in range(samples)]
+    usage = None
+    received = generated = 0
+    truncated = False
+    try:
+        for chunk in stream:
+            if token is not None:
+                token.raise_if_cancelled()
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    chunks[choice.index].append(choice.delta.content)
+                    received += len(choice.delta.content.encode('utf-8'))
+                    if max_tokens:
+                        generated += tokenizer.count(choice.delta.content)
+            usage = chunk.usage or usage
+            openai_model = chunk.model or openai_model
+            # Stop reading a completion that keeps generating once it passes either cap
+            if received > max_bytes or (max_tokens and generated > max_tokens * samples):
+                truncated = True
+                break
+    finally:
+        stream.close()
+    if truncated:
+        logger.warning("Stopped reading the OpenAI response at its size cap")
+    else:
+        logger.info("OpenAI API call successful!")
+    return [''.join(parts) for parts in chunks], openai_model, _usage(usage), truncated
+
+
+def _usage(usage):
+    """Convert the SDK's token usage, including cached prompt tokens, to a usage dict."""
+    if usage is None:
+        return None
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'prompt_tokens': usage.prompt_tokens,
+        'completion_tokens': usage.completion_tokens,
+        'cached_tokens': getattr(details, 'cached_tokens', 0) or 0
+    }
+
+
+def _batch_api(config):
+    return config.get('batch_url', API_BASE).rstrip('/'), {"Authorization": f"Bearer {config['key']}"}
+
+
+def submit_batch(requests, config):
+    """
+    Submit queries through the OpenAI Batch API
+
+    Args:
+        requests (list): (custom_id, query, history, config) per query
+        config (dict): The provider's entry from the api_keys (key, batch_url)
+
+    Returns:
+        str: The batch id
+    """
+    base, headers = _batch_api(config)
+    lines = []
+    for custom_id, query, history, request_config in requests:
+        body = {"model": request_config.get('model', DEFAULT_MODEL),
+                "messages": build_messages(query, history, SYSTEM_PROMPT)}
+        if request_config.get('max_tokens'):
+            body["max_tokens"] = request_config['max_tokens']
+        lines.append(json.dumps({"custom_id": custom_id, "method": "POST",
+                                 "url": "/v1/chat/completions", "body": body}))
+    upload = http_client.post(f"{base}/files", headers=headers, data={"purpose": "batch"},
+                              files={"file": ("batch.jsonl", "\n".join(lines).encode("utf-8"))})
+    upload.raise_for_status()
+    batch = http_client.post(f"{base}/batches", headers=headers, json={
+        "input_file_id": upload.json()['id'],
+        "endpoint": "/v1/chat/completions",
+        "completion_window": BATCH_COMPLETION_WINDOW
+    })
+    batch.raise_for_status()
+    logger.info(f"Submitted OpenAI batch {batch.json()['id']} with {len(lines)} requests")
+    return batch.json()['id']
+
+
+def poll_batch(batch_id, config):
+    """
+    Check an OpenAI batch and collect its results once it has finished
+
+    Args:
+        batch_id (str): Id returned by submit_batch
+        config (dict): The provider's entry from the api_keys
+
+    Returns:
+        dict: custom_id -> result (or Exception for failed requests), or
+            None while the batch is still running
+    """
+    base, headers = _batch_api(config)
+    response = http_client.get(f"{base}/batches/{batch_id}", headers=headers)
+    response.raise_for_status()
+    batch = response.json()
+    if batch['status'] not in BATCH_FINAL_STATES:
+        return None
+    logger.info(f"OpenAI batch {batch_id} {batch['status']}")
+
+    results = {}
+    for file_id in filter(None, (batch.get('output_file_id'), batch.get('error_file_id'))):
+        content = http_client.get(f"{base}/files/{file_id}/content", headers=headers)
+        content.raise_for_status()
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            reply = item.get('response') or {}
+            body = reply.get('body') or {}
+            if reply.get('status_code') == 200:
+                results[item['custom_id']] = {
+                    'content': body['choices'][0]['message']['content'],
+                    'model': body.get('model', DEFAULT_MODEL),
+                    'status': 'success',
+                    'usage': chat_usage(body)
+                }
+            else:
+                error = item.get('error') or body.get('error') or {}
+                results[item['custom_id']] = Exception(
+                    f"Batch request failed ({reply.get('status_code')}): {error.get('message', 'unknown error')}")
+    return results
+
+
+def cancel_batch(batch_id, config):
+    """
+    Cancel an OpenAI batch that is no longer waited for
+
+    Args:
+        batch_id (str): Id returned by submit_batch
+        config (dict): The provider's entry from the api_keys
+    """
+    base, headers = _batch_api(config)
+    response = http_client.post(f"{base}/batches/{batch_id}/cancel", headers=headers)
+    response.raise_for_status()
+    logger.info(f"Cancelled OpenAI batch {batch_id}")
@@ -0,0 +1,139 @@
+"""
+Server-side markdown rendering of provider responses.
+Responses are converted to HTML with markdown-it, with raw HTML disabled
+so a response cannot inject markup or scripts, and fenced code blocks are
+highlighted with Pygments. Rendered fragments are cached by a hash of the
+markdown, so showing the same response again is a cache lookup.
+"""
+import hashlib
+import html
+import os
+import threading
+import time
+
+from flask import request
+
+from .metrics import metrics
+from .state import MemoryBackend, SharedCache, state
+
+# How long rendered fragments stay cached, in seconds
+RENDER_CACHE_TTL = int(os.environ.get('AISPECTRUM_RENDER_CACHE_TTL', 86400))
+# Fragments kept per worker when no shared state backend is configured
+RENDER_CACHE_SIZE = int(os.environ.get('AISPECTRUM_RENDER_CACHE_SIZE', 1000))
+# Pygments style of highlighted code blocks
+CODE_STYLE = os.environ.get('AISPECTRUM_CODE_STYLE', 'monokai')
+# Part of every cache key; bump it when the rendered output changes
+RENDERER_VERSION = 1
+CODE_CSS_CLASS = 'highlight'
+
+_parser = None
+_parser_lock = threading.Lock()
+
+
+def _highlight(code, language, attrs):
+    """Highlight a fenced code block; an empty string leaves it to markdown-it's plain rendering."""
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+    if not language:
+        return ''
+    try:
+        lexer = get_lexer_by_name(language)
+    except ClassNotFound:
+        return ''
+    spans = highlight(code, lexer, HtmlFormatter(nowrap=True))
+    return (f'<pre class="{CODE_CSS_CLASS}"><code class="language-{html.escape(language)}">'
+            f'{spans}</code></pre>\n')
+
+
+def get_parser():
+    """Return the markdown parser, importing markdown-it on first use."""
+    global _parser
+    if _parser is None:
+        with _parser_lock:
+            if _parser is None:
+                from markdown_it import MarkdownIt
+                # 'js-default' is CommonMark plus tables and strikethrough with raw HTML
+                # escaped; markdown-it also drops javascript:, vbscript: and file: links
+                _parser = MarkdownIt('js-default', {'highlight': _highlight})
+    return _parser
+
+
+def fragment_key(text):
+    """Cache key of the rendered fragment for a piece of markdown."""
+    material = f"{RENDERER_VERSION}:{CODE_STYLE}:{text}"
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def render_markdown(text):
+    """
+    Render markdown to sanitized HTML, using the fragment cache
+
+    Args:
+        text (str): Markdown, e.g. a provider response
+
+    Returns:
+        str: The HTML fragment
+    """
+    key = fragment_key(text)
+    fragment = fragment_cache.get(key)
+    metrics.inc('render_cache_requests_total', hit=fragment is not None)
+    if fragment is not None:
+        return fragment
+    started = time.perf_counter()
+    fragment = get_parser().render(text)
+    metrics.observe('render_ms', (time.perf_counter() - started) * 1000)
+    fragment_cache.set(key, fragment)
+    return fragment
+
+
+def render_result(result):
+    """Return a copy of a successful result (and its samples) with 'html' next to 'content'."""
+    if not isinstance(result, dict) or result.get('status') != 'success' or not result.get('content'):
+        return result
+    rendered = dict(result, html=render_markdown(result['content']))
+    if result.get('samples'):
+        rendered['samples'] = [render_result(sample) for sample in result['samples']]
+    return rendered
+
+
+def render_results(results):
+    """
+    Add rendered HTML to a results mapping without changing the original
+
+    Args:
+        results (dict): Result key -> result, as /api/query returns them
+
+    Returns:
+        dict: The same mapping with 'html' on every successful result
+    """
+    return {key: render_result(result) for key, result in results.items()}
+
+
+def render_histories(histories):
+    """Add rendered HTML to the assistant messages of per-provider conversation histories."""
+    return {key: [dict(message, html=render_markdown(message['content']))
+                  if message['role'] == 'assistant' and message.get('content') else message
+                  for message in messages]
+            for key, messages in histories.items()}
+
+
+def code_css():
+    """Stylesheet for highlighted code blocks."""
+    from pygments.formatters import HtmlFormatter
+    return HtmlFormatter(style=CODE_STYLE).get_style_defs(f'.{CODE_CSS_CLASS}')
+
+
+def request_render():
+    """Whether the current request asks for rendered HTML: the body's 'render' or ?render=1."""
+    render = request.args.get('render')
+    if render is None and request.is_json:
+        render = (request.get_json(silent=True) or {}).get('render')
+    return render in (True, 1, '1', 'true')
+
+
+# Rendered fragments shared by every worker when a state backend is configured
+fragment_cache = SharedCache('fragment', ttl_seconds=RENDER_CACHE_TTL,
+                             backend=state if not isinstance(state, MemoryBackend)
+                             else MemoryBackend(max_entries=RENDER_CACHE_SIZE))
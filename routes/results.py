@@ -0,0 +1,111 @@
+"""
+Server-side handles for query results.
+/api/query stores each round of results under a result id, so /api/summarize
+and /api/export can refer to it instead of the browser uploading every
+response again. A summary generated later is stored back into the same
+record, and the endpoints only return what is new.
+"""
+import os
+import time
+import uuid
+
+from .state import MemoryBackend, state
+
+# How long stored results can be referenced after the query, in seconds
+RESULT_TTL_SECONDS = int(os.environ.get('AISPECTRUM_RESULT_TTL', 3600))
+# Maximum number of results kept by the private in-memory store
+MAX_RESULTS = int(os.environ.get('AISPECTRUM_MAX_RESULTS', 500))
+
+
+class ResultStore:
+    """Query results kept in a state backend for a limited time."""
+
+    def __init__(self, ttl_seconds=RESULT_TTL_SECONDS, max_results=MAX_RESULTS, backend=None):
+        """
+        Initialize the store
+
+        Args:
+            ttl_seconds (int): Time after which stored results expire
+            max_results (int): Maximum number of results kept in memory
+            backend (StateBackend): Shared backend, so any worker can resolve a
+                result id; defaults to a private in-memory backend
+        """
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend or MemoryBackend(max_entries=max_results)
+
+    @staticmethod
+    def _key(result_id):
+        return f"result:{result_id}"
+
+    def save(self, query, results):
+        """
+        Store the results of a query
+
+        Args:
+            query (str): The query the results answer
+            results (dict): Results keyed by provider, optionally with 'summary'
+
+        Returns:
+            str: The result id
+        """
+        results = dict(results)
+        record = {
+            'id': str(uuid.uuid4()),
+            'created': time.time(),
+            'query': query,
+            'summary': results.pop('summary', None),
+            'results': results
+        }
+        self.backend.set(self._key(record['id']), record, self.ttl_seconds)
+        return record['id']
+
+    def get(self, result_id):
+        """Return a stored record by id, or None if it does not exist or expired."""
+        if not result_id:
+            return None
+        return self.backend.get(self._key(result_id))
+
+    def set_summary(self, result_id, summary):
+        """Attach a summary to stored results, refreshing their expiry."""
+        def attach(record):
+            if record is not None:
+                record['summary'] = summary
+            return record
+        return self.backend.update(self._key(result_id), attach, self.ttl_seconds) is not None
+
+    def merge_results(self, result_id, results):
+        """
+        Add results to a stored record, e.g. provider calls that finished late
+
+        A result that is already final is never replaced by a pending one,
+        so late results and the query's own results can arrive in any order.
+
+        Args:
+            result_id (str): The result id
+            results (dict): Results keyed by provider, optionally with 'summary'
+
+        Returns:
+            bool: False if the record does not exist or expired
+        """
+        results = dict(results)
+        summary = results.pop('summary', None)
+
+        def merge(record):
+            if record is None:
+                return None
+            for key, result in results.items():
+                stored = record['results'].get(key)
+                if result.get('status') != 'pending' or stored is None:
+                    record['results'][key] = result
+            if summary is not None:
+                record['summary'] = summary
+            return record
+        return self.backend.update(self._key(result_id), merge, self.ttl_seconds) is not None
+
+    def delete(self, result_id):
+        """Delete stored results, returning True if they existed."""
+        return self.backend.delete(self._key(result_id))
+
+
+# Shared result store for the application
+result_store = ResultStore(backend=state if not isinstance(state, MemoryBackend) else None)
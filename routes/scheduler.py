@@ -0,0 +1,358 @@
+"""
+Weighted fair scheduling of provider calls.
+Provider calls pass through a scheduler with a fixed number of slots per
+worker before they reach their provider's pool. Calls that find every slot
+taken wait in a lane (interactive queries or batch work) and, within the
+lane, in a queue per user. Free slots go to lanes in proportion to their
+weights and to the users of a lane in turn (stride scheduling), and batch
+work may only use part of the slots, so one user's large sweep neither
+starves other users nor the interactive comparisons. A provider's calls
+hold at most as many slots as its bulkhead runs at once, and only as many
+of them as its bulkhead queues may wait, so a provider that hangs cannot
+take the slots of the others; calls that wait longer than a timeout are
+rejected instead of waiting forever.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from flask import request
+
+from .auth import may_raise_priority, request_owner
+from .bulkhead import BulkheadFullError
+from .latency import LatencyStats
+from .metrics import metrics
+
+logger = logging.getLogger('aiSpectrum')
+
+
+def _weights(variable, default):
+    """Parse "name=value,..." settings from an environment variable."""
+    return {name.strip(): float(value)
+            for name, value in (item.split('=', 1) for item in
+                                filter(None, os.environ.get(variable, default).split(',')))}
+
+
+# Provider calls running at once across all lanes and users in this worker
+CAPACITY = int(os.environ.get('AISPECTRUM_SCHEDULER_SLOTS', 24))
+# Relative share of free slots each lane gets while several lanes are waiting
+LANE_WEIGHTS = _weights('AISPECTRUM_LANE_WEIGHTS', 'interactive=8,batch=1')
+# Largest fraction of the slots a lane may hold, keeping the rest for the others
+LANE_MAX_SHARE = _weights('AISPECTRUM_LANE_MAX_SHARE', 'batch=0.5')
+# Relative weights of users within a lane (default 1), keyed as request_user names them, e.g. "user:ci=0.5"
+USER_WEIGHTS = _weights('AISPECTRUM_USER_WEIGHTS', '')
+# Longest a call waits for a slot before it is rejected, in seconds (0 waits forever)
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('AISPECTRUM_SCHEDULER_QUEUE_TIMEOUT', 30))
+DEFAULT_LANE = 'interactive'
+
+
+class FairScheduler:
+    """Slots for provider calls, handed out by weighted fair queuing across lanes and users."""
+
+    def __init__(self, capacity=CAPACITY, lane_weights=None, lane_max_share=None, user_weights=None,
+                 queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        """
+        Initialize the scheduler
+
+        Args:
+            capacity (int): Calls allowed to run at once
+            lane_weights (dict): Lane -> weight
+            lane_max_share (dict): Lane -> largest fraction of capacity it may hold
+            user_weights (dict): User -> weight within their lane
+            queue_timeout (float): Seconds a call may wait for a slot (0 waits forever)
+        """
+        self.capacity = max(1, capacity)
+        self.lane_weights = dict(LANE_WEIGHTS if lane_weights is None else lane_weights)
+        self.lane_max_share = dict(LANE_MAX_SHARE if lane_max_share is None else lane_max_share)
+        self.user_weights = dict(USER_WEIGHTS if user_weights is None else user_weights)
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.rejected = 0
+        self.wait_stats = LatencyStats(min_samples=1)
+        self._lanes = {lane: self._new_lane() for lane in dict.fromkeys([DEFAULT_LANE, *self.lane_weights])}
+        # Running and queued calls per provider bulkhead
+        self._providers = collections.Counter()
+        self._provider_queued = collections.Counter()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._watchdog = None
+
+    @staticmethod
+    def _new_lane():
+        return {'pass': 0.0, 'running': 0, 'users': collections.OrderedDict()}
+
+    def lane(self, name):
+        """Return a known lane name, or the default lane for anything else."""
+        return name if name in self._lanes else DEFAULT_LANE
+
+    def _lane_limit(self, lane):
+        return max(1, int(self.capacity * self.lane_max_share.get(lane, 1.0)))
+
+    def _has_room(self, lane):
+        """Whether a call of a lane may start now (lock held)."""
+        return self.running < self.capacity and self._lanes[lane]['running'] < self._lane_limit(lane)
+
+    def _fits(self, entry):
+        """Whether the provider of a call has a slot left for it (lock held)."""
+        bulkhead = entry['bulkhead']
+        return bulkhead is None or self._providers[bulkhead] < bulkhead.max_concurrent
+
+    def _provider_full(self, entry):
+        """Whether a call's provider already has its bulkhead's queue of calls waiting (lock held)."""
+        bulkhead = entry['bulkhead']
+        return bulkhead is not None and self._provider_queued[bulkhead] >= bulkhead.max_queue
+
+    def _startable(self, queue):
+        """Return the first call of a queue whose provider has a slot left, or None (lock held)."""
+        return next((entry for entry in queue if self._fits(entry)), None)
+
+    @staticmethod
+    def _stride_pick(items, weight):
+        """Return the key with the lowest pass among items and advance its pass."""
+        key = min(items, key=lambda k: items[k]['pass'])
+        items[key]['pass'] += 1.0 / max(weight(key), 1e-6)
+        return key
+
+    def _enqueue(self, lane, user, entry):
+        """Queue a call, starting an idle lane or user at the current pass (lock held)."""
+        lanes = self._lanes
+        state = lanes[lane]
+        if not state['users']:
+            busy = [other['pass'] for other in lanes.values() if other['users']]
+            state['pass'] = max(state['pass'], min(busy, default=state['pass']))
+        users = state['users']
+        if user not in users:
+            current = [other['pass'] for other in users.values()]
+            users[user] = {'pass': min(current, default=0.0), 'queue': collections.deque()}
+        users[user]['queue'].append(entry)
+        self._provider_queued[entry['bulkhead']] += 1
+        if self.queue_timeout > 0:
+            if self._watchdog is None or not self._watchdog.is_alive():
+                self._watchdog = threading.Thread(target=self._watch, name='scheduler-watchdog', daemon=True)
+                self._watchdog.start()
+            self._wakeup.notify()
+
+    def _next(self):
+        """Pop the next call that may start, or None (lock held)."""
+        while True:
+            # Only users with a call whose provider has a slot left take part
+            ready = {}
+            for name, state in self._lanes.items():
+                if state['users'] and self._has_room(name):
+                    users = {user: queued for user, queued in state['users'].items()
+                             if self._startable(queued['queue'])}
+                    if users:
+                        ready[name] = users
+            if not ready:
+                return None
+            lane = self._stride_pick({name: self._lanes[name] for name in ready},
+                                     lambda name: self.lane_weights.get(name, 1.0))
+            user = self._stride_pick(ready[lane], lambda name: self.user_weights.get(name, 1.0))
+            users = self._lanes[lane]['users']
+            entry = self._startable(users[user]['queue'])
+            users[user]['queue'].remove(entry)
+            self._provider_queued[entry['bulkhead']] -= 1
+            if not users[user]['queue']:
+                del users[user]
+            # Calls cancelled while queued are dropped
+            if entry['future'].set_running_or_notify_cancel():
+                return entry
+
+    def _take_ready(self):
+        """Start every queued call that may start now and return them (lock held)."""
+        ready = []
+        while True:
+            entry = self._next()
+            if entry is None:
+                return ready
+            self._start(entry)
+            ready.append(entry)
+
+    def _start(self, entry):
+        """Count a call as running (lock held)."""
+        self.running += 1
+        self._lanes[entry['lane']]['running'] += 1
+        self._providers[entry['bulkhead']] += 1
+        self._report()
+
+    def _expire(self, now):
+        """
+        Take the calls that waited longer than the queue timeout off their queues (lock held)
+
+        Returns:
+            tuple: (expired entries, seconds until the next call expires or None)
+        """
+        expired, next_deadline = [], None
+        for state in self._lanes.values():
+            for user, queued in list(state['users'].items()):
+                for entry in list(queued['queue']):
+                    deadline = entry['enqueued'] + self.queue_timeout
+                    if deadline <= now:
+                        queued['queue'].remove(entry)
+                        self._provider_queued[entry['bulkhead']] -= 1
+                        expired.append(entry)
+                    elif next_deadline is None or deadline < next_deadline:
+                        next_deadline = deadline
+                if not queued['queue']:
+                    del state['users'][user]
+        return expired, (None if next_deadline is None else next_deadline - now)
+
+    def _watch(self):
+        """Reject calls that waited too long for a slot (runs on a daemon thread)."""
+        while True:
+            with self._lock:
+                expired, wait = self._expire(time.monotonic())
+                if not expired:
+                    self._wakeup.wait(wait)
+                    continue
+                self.rejected += len(expired)
+                self._report()
+            for entry in expired:
+                metrics.inc('scheduler_rejected_total', lane=entry['lane'])
+                logger.warning(f"Scheduler rejected a call of {getattr(entry['bulkhead'], 'name', 'a provider')} "
+                               f"after waiting {self.queue_timeout:g}s for a slot")
+                if entry['future'].set_running_or_notify_cancel():
+                    entry['future'].set_exception(BulkheadFullError('scheduler', 'queue_timeout'))
+
+    def _report(self):
+        """Publish the scheduler's gauges (lock held)."""
+        metrics.set_gauge('scheduler_running', self.running)
+        for name, state in self._lanes.items():
+            metrics.set_gauge('scheduler_lane_running', state['running'], lane=name)
+            metrics.set_gauge('scheduler_lane_queued', sum(len(u['queue']) for u in state['users'].values()),
+                              lane=name)
+
+    def submit(self, executor, fn, user, lane=DEFAULT_LANE, bulkhead=None):
+        """
+        Schedule a call to run on an executor
+
+        Args:
+            executor: Executor the call runs on once it gets a slot
+            fn (callable): Zero-argument call
+            user (str): User the call is made for
+            lane (str): Lane of the call, e.g. 'interactive' or 'batch'
+            bulkhead (Bulkhead): Bulkhead of the provider the call goes to; its
+                calls hold at most max_concurrent slots and max_queue may wait
+
+        Returns:
+            Future: The call's result; cancelling it while queued drops the call,
+                and it fails with BulkheadFullError if its provider's queue is
+                full or it waits past the queue timeout
+        """
+        lane = self.lane(lane)
+        entry = {'future': Future(), 'executor': executor, 'fn': fn, 'user': user, 'lane': lane,
+                 'bulkhead': bulkhead, 'enqueued': time.monotonic()}
+        with self._lock:
+            full = not self._fits(entry) and self._provider_full(entry)
+            if full:
+                ready = []
+            elif not self._lanes[lane]['users'] and self._has_room(lane) and self._fits(entry):
+                entry['future'].set_running_or_notify_cancel()
+                self._start(entry)
+                ready = [entry]
+            else:
+                self._enqueue(lane, user, entry)
+                # Calls queued for a full provider must not hold up calls to the others
+                ready = self._take_ready()
+                self._report()
+        if full:
+            entry['future'].set_running_or_notify_cancel()
+            entry['future'].set_exception(bulkhead.reject('queue_full'))
+        self._dispatch(ready)
+        return entry['future']
+
+    def _dispatch(self, ready):
+        """Hand started calls to their executors."""
+        for entry in ready:
+            waited = time.monotonic() - entry['enqueued']
+            metrics.observe('scheduler_wait_ms', waited * 1000, lane=entry['lane'])
+            self.wait_stats.record(entry['lane'], waited)
+            entry['executor'].submit(self._run, entry)
+
+    def _run(self, entry):
+        try:
+            entry['future'].set_result(entry['fn']())
+        except BaseException as e:
+            entry['future'].set_exception(e)
+        finally:
+            self._finish(entry)
+
+    def _finish(self, entry):
+        """Free a call's slot and start the calls that now fit."""
+        with self._lock:
+            self.running -= 1
+            self._lanes[entry['lane']]['running'] -= 1
+            self._providers[entry['bulkhead']] -= 1
+            ready = self._take_ready()
+            self._report()
+        self._dispatch(ready)
+
+    def executor(self, executor, user, lane=DEFAULT_LANE, bulkhead=None):
+        """Return an executor-like wrapper scheduling every call for one user, lane and provider bulkhead."""
+        return _ScheduledExecutor(self, executor, user, lane, bulkhead)
+
+    def snapshot(self):
+        """Return running and queued calls and wait-time percentiles per lane."""
+        waits = self.wait_stats.snapshot()
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'running': self.running,
+                'rejected': self.rejected,
+                'providers': {bulkhead.name: count for bulkhead, count in self._providers.items() if bulkhead and count},
+                'lanes': {
+                    name: {
+                        'weight': self.lane_weights.get(name, 1.0),
+                        'max_running': self._lane_limit(name),
+                        'running': state['running'],
+                        'queued': sum(len(u['queue']) for u in state['users'].values()),
+                        'users_waiting': len(state['users']),
+                        'wait_s': waits.get(name)
+                    } for name, state in self._lanes.items()
+                }
+            }
+
+
+class _ScheduledExecutor:
+    """Executor-like handle submitting through a FairScheduler."""
+
+    def __init__(self, scheduler, executor, user, lane, bulkhead):
+        self.scheduler = scheduler
+        self.executor = executor
+        self.user = user
+        self.lane = lane
+        self.bulkhead = bulkhead
+
+    def submit(self, fn, *args, **kwargs):
+        return self.scheduler.submit(self.executor, lambda: fn(*args, **kwargs), self.user, self.lane,
+                                     self.bulkhead)
+
+
+def request_user(api_keys=None):
+    """Identify who the current request is for: the signed-in user or its API keys, else the client address."""
+    return request_owner(api_keys) or f"addr:{request.remote_addr or 'anonymous'}"
+
+
+def request_lane(default=DEFAULT_LANE):
+    """
+    Read the lane of the current request from X-Lane or the body's 'lane'
+
+    Anyone may move their calls to a lane weighted below the default (e.g.
+    batch), but only admins (X-Admin-Token) and the users in
+    AISPECTRUM_PRIORITY_USERS may pick one weighted above it.
+    """
+    lane = request.headers.get('X-Lane')
+    if not lane and request.is_json:
+        lane = (request.get_json(silent=True) or {}).get('lane')
+    lane, default = scheduler.lane(lane or default), scheduler.lane(default)
+    weight = lambda name: scheduler.lane_weights.get(name, 1.0)
+    if weight(lane) > weight(default) and not may_raise_priority():
+        return default
+    return lane
+
+
+# Shared provider-call scheduler for this worker
+scheduler = FairScheduler()
@@ -0,0 +1,252 @@
+"""
+Pairwise similarity and diff analytics over model responses.
+Responses are turned into hashed word-shingle vectors so the whole
+similarity matrix is a single matrix product. Diff hunks are aligned on
+words that occur once in both responses, and difflib only runs on the
+short gaps between those anchors, so long responses diff in a few
+milliseconds. Used by /api/compare, the summarizer and batch jobs.
+"""
+import bisect
+import difflib
+import re
+import time
+import zlib
+from collections import Counter
+
+import numpy as np
+
+# Words per shingle; 1 compares vocabulary, larger values compare phrasing
+DEFAULT_SHINGLE_SIZE = 3
+# Dimension of the hashed feature space (collisions are negligible at this size)
+FEATURE_DIM = 1 << 18
+# Longest word sequence diffed; longer responses are diffed on their prefix
+MAX_DIFF_TOKENS = 5000
+# Gaps between anchors longer than this are one replace hunk rather than aligned word by word
+MAX_GAP_TOKENS = 300
+# Most explicit pairs one comparison diffs
+MAX_PAIRS = 100
+
+_SHINGLE_PRIME = np.uint64(1000003)
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens."""
+    return _WORD_RE.findall(text.lower())
+
+
+def _shingle_ids(words, shingle_size, word_hashes):
+    """Hash each run of shingle_size words into the feature space."""
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    # crc32 rather than hash() so vectors are stable across processes
+    for word in words:
+        if word not in word_hashes:
+            word_hashes[word] = zlib.crc32(word.encode())
+    hashes = np.fromiter((word_hashes[w] for w in words), dtype=np.uint64, count=len(words))
+    size = min(shingle_size, len(hashes))
+    # Polynomial hash over each window, computed for all windows at once
+    combined = np.zeros(len(hashes) - size + 1, dtype=np.uint64)
+    for offset in range(size):
+        combined = combined * _SHINGLE_PRIME + hashes[offset:len(combined) + offset]
+    return combined % FEATURE_DIM
+
+
+def similarity_matrix(texts, shingle_size=DEFAULT_SHINGLE_SIZE):
+    """
+    Compute the cosine similarity between every pair of texts
+
+    Args:
+        texts (list): Response texts
+        shingle_size (int): Words per shingle
+
+    Returns:
+        numpy.ndarray: Symmetric n x n matrix with values in [0, 1]
+
+    Raises:
+        ValueError: If shingle_size is not a whole number of at least 1
+    """
+    if isinstance(shingle_size, bool) or not isinstance(shingle_size, int) or shingle_size < 1:
+        raise ValueError("shingle_size must be a whole number of at least 1")
+    word_hashes = {}
+    ids = [_shingle_ids(tokenize(text), shingle_size, word_hashes) for text in texts]
+    rows = np.repeat(np.arange(len(texts)), [len(row_ids) for row_ids in ids])
+    # Map the hashed ids onto the columns actually used so the matrix stays small
+    used, columns = np.unique(np.concatenate(ids) if ids else np.empty(0, np.uint64), return_inverse=True)
+    vectors = np.bincount(rows * len(used) + columns, minlength=len(texts) * len(used))
+    vectors = vectors.reshape(len(texts), len(used)).astype(np.float32)
+
+    norms = np.linalg.norm(vectors, axis=1)
+    norms[norms == 0] = 1.0
+    vectors /= norms[:, None]
+    matrix = np.clip(vectors @ vectors.T, 0.0, 1.0)
+    # An empty text is identical to itself, not unrelated
+    np.fill_diagonal(matrix, 1.0)
+    return matrix
+
+
+def agreement_scores(matrix):
+    """
+    Score how much each response agrees with the others
+
+    Args:
+        matrix (numpy.ndarray): Similarity matrix from similarity_matrix
+
+    Returns:
+        numpy.ndarray: Mean similarity of each row to every other row
+    """
+    n = matrix.shape[0]
+    if n < 2:
+        return np.ones(n)
+    return (matrix.sum(axis=1) - np.diag(matrix)) / (n - 1)
+
+
+def _anchors(a, b):
+    """
+    Pair up words that occur exactly once in each sequence
+
+    Returns:
+        list: (index in a, index in b) pairs forming the longest run that
+            is in order in both sequences
+    """
+    counts_a, counts_b = Counter(a), Counter(b)
+    positions_b = {word: j for j, word in enumerate(b) if counts_b[word] == 1}
+    candidates = [(i, positions_b[word]) for i, word in enumerate(a)
+                  if counts_a[word] == 1 and word in positions_b]
+    # Longest increasing subsequence of the b positions, by patience sorting
+    tails, tail_indexes, previous = [], [], [None] * len(candidates)
+    for index, (_, j) in enumerate(candidates):
+        slot = bisect.bisect_left(tails, j)
+        if slot:
+            previous[index] = tail_indexes[slot - 1]
+        if slot == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[slot] = j
+            tail_indexes[slot] = index
+    anchors = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        anchors.append(candidates[index])
+        index = previous[index]
+    return anchors[::-1]
+
+
+def _opcodes(a, b):
+    """Yield the non-equal difflib opcodes between two word sequences, aligned on their anchors."""
+    start_a = start_b = 0
+    for anchor_a, anchor_b in _anchors(a, b) + [(len(a), len(b))]:
+        end_a, end_b = anchor_a, anchor_b
+        # Words repeated elsewhere still match when they sit next to an anchor
+        while start_a < end_a and start_b < end_b and a[start_a] == b[start_b]:
+            start_a, start_b = start_a + 1, start_b + 1
+        while start_a < end_a and start_b < end_b and a[end_a - 1] == b[end_b - 1]:
+            end_a, end_b = end_a - 1, end_b - 1
+        gap_a, gap_b = end_a - start_a, end_b - start_b
+        if min(gap_a, gap_b) > 1 and max(gap_a, gap_b) <= MAX_GAP_TOKENS:
+            matcher = difflib.SequenceMatcher(None, a[start_a:end_a], b[start_b:end_b], autojunk=False)
+            for op, a_start, a_end, b_start, b_end in matcher.get_opcodes():
+                if op != 'equal':
+                    yield op, start_a + a_start, start_a + a_end, start_b + b_start, start_b + b_end
+        elif gap_a or gap_b:
+            op = 'replace' if gap_a and gap_b else ('delete' if gap_a else 'insert')
+            yield op, start_a, end_a, start_b, end_b
+        start_a, start_b = anchor_a + 1, anchor_b + 1
+
+
+def _split(text):
+    """Return a text's words as written, and normalized for comparison."""
+    words = text.split()[:MAX_DIFF_TOKENS]
+    return words, [w.lower().strip('.,;:!?()"\'') for w in words]
+
+
+def _hunks(split_a, split_b):
+    """Diff two texts already passed through _split."""
+    (words_a, normalized_a), (words_b, normalized_b) = split_a, split_b
+    # Compare normalized words but report the original spelling
+    return [{
+        'op': op,
+        'a_range': [a_start, a_end],
+        'b_range': [b_start, b_end],
+        'a': ' '.join(words_a[a_start:a_end]),
+        'b': ' '.join(words_b[b_start:b_end])
+    } for op, a_start, a_end, b_start, b_end in _opcodes(normalized_a, normalized_b)]
+
+
+def diff_hunks(text_a, text_b):
+    """
+    Align two texts word by word and return the regions that differ
+
+    Args:
+        text_a (str): First response
+        text_b (str): Second response
+
+    Returns:
+        list: Hunks with op ('replace', 'delete' or 'insert'), the word
+            ranges in each text and the differing text from each side
+    """
+    return _hunks(_split(text_a), _split(text_b))
+
+
+def compare_responses(responses, pairs=None, shingle_size=DEFAULT_SHINGLE_SIZE):
+    """
+    Compare the successful responses of a query
+
+    Without explicit pairs, each response is diffed against the consensus
+    response (the one agreeing most with the rest).
+
+    Args:
+        responses (dict): Result key -> provider result, as returned by /api/query
+        pairs (list): Optional [key_a, key_b] pairs to diff, at most MAX_PAIRS
+        shingle_size (int): Words per shingle
+
+    Returns:
+        dict: models, matrix, agreement, consensus, diffs and elapsed_ms
+
+    Raises:
+        ValueError: For malformed pairs, pairs naming a missing or failed
+            response, or an invalid shingle_size
+    """
+    if pairs is not None and (not isinstance(pairs, list) or len(pairs) > MAX_PAIRS or not all(
+            isinstance(pair, (list, tuple)) and len(pair) == 2 and all(isinstance(key, str) for key in pair)
+            for pair in pairs)):
+        raise ValueError(f"pairs must be a list of at most {MAX_PAIRS} [model, model] pairs")
+    start = time.perf_counter()
+    models = [key for key, result in responses.items()
+              if isinstance(result, dict) and result.get('status') == 'success' and key != 'summary']
+    texts = [responses[key].get('content') or '' for key in models]
+    if not models:
+        return {'models': [], 'matrix': [], 'agreement': {}, 'consensus': None, 'diffs': [],
+                'elapsed_ms': 0.0}
+
+    matrix = similarity_matrix(texts, shingle_size)
+    agreement = agreement_scores(matrix)
+    consensus = models[int(np.argmax(agreement))]
+
+    index = {key: i for i, key in enumerate(models)}
+    if pairs is None:
+        pairs = [(consensus, key) for key in models if key != consensus]
+    diffs, splits = [], {}
+    for key_a, key_b in pairs:
+        if key_a not in index or key_b not in index:
+            raise ValueError(f"Cannot diff {key_a} and {key_b}: both must be successful responses")
+        # The consensus response is in every default pair, so split each text once
+        for key in (key_a, key_b):
+            if key not in splits:
+                splits[key] = _split(texts[index[key]])
+        diffs.append({
+            'a': key_a,
+            'b': key_b,
+            'similarity': round(float(matrix[index[key_a], index[key_b]]), 4),
+            'hunks': _hunks(splits[key_a], splits[key_b])
+        })
+
+    return {
+        'models': models,
+        'matrix': np.round(matrix, 4).tolist(),
+        'agreement': {key: round(float(score), 4) for key, score in zip(models, agreement)},
+        'consensus': consensus,
+        'diffs': diffs,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
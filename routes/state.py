@@ -0,0 +1,628 @@
+"""
+Shared state for caches, rate limits, circuit breakers and metrics.
+Everything that must agree across gunicorn workers (and across hosts) goes
+through a StateBackend: in-process memory for a single worker, SQLite for
+all workers on one host, or an adapter over a Redis-compatible key-value
+store for several hosts. The backend is chosen with AISPECTRUM_STATE_BACKEND.
+"""
+import json
+import logging
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import metrics, merge_snapshots
+
+logger = logging.getLogger('aiSpectrum')
+
+# 'memory', 'sqlite', 'sqlite:///path/to/state.db' or 'redis://host:port/db'
+BACKEND_SPEC = os.environ.get('AISPECTRUM_STATE_BACKEND', 'memory')
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'instance', 'state.sqlite3')
+# How often each worker publishes its metrics for cluster-wide aggregation
+METRICS_PUBLISH_INTERVAL = float(os.environ.get('AISPECTRUM_METRICS_PUBLISH_INTERVAL', 5))
+# Published snapshots of workers that stop publishing expire after this long
+METRICS_TTL = 60
+METRICS_PREFIX = 'metrics:'
+
+
+class StateBackend:
+    """
+    Interface for shared key-value state
+
+    Values are JSON-serializable. update() and incr() are atomic across
+    every process sharing the backend.
+    """
+
+    def get(self, key):
+        """Return the value stored under key, or None."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Store a value, expiring after ttl seconds if given."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Delete a key, returning True if it existed."""
+        raise NotImplementedError
+
+    def update(self, key, fn, ttl=None):
+        """
+        Atomically replace a value with fn(current value)
+
+        Args:
+            key (str): The key
+            fn (callable): Receives the current value (None if missing) and
+                returns the new value, or None to delete the key
+            ttl (float): Optional expiry of the new value in seconds
+
+        Returns:
+            The new value
+        """
+        raise NotImplementedError
+
+    def incr(self, key, amount=1, ttl=None):
+        """Atomically add to a numeric value and return the result."""
+        return self.update(key, lambda current: (current or 0) + amount, ttl)
+
+    def scan(self, prefix):
+        """Return {key: value} for every live key starting with prefix."""
+        raise NotImplementedError
+
+
+class MemoryBackend(StateBackend):
+    """State held in this process only; the default for a single worker."""
+
+    def __init__(self, max_entries=None):
+        """
+        Initialize the backend
+
+        Args:
+            max_entries (int): Optional limit, evicting least recently used keys
+        """
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        """Return the (value, expires) pair of a live key (lock held)."""
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def _store(self, key, value, ttl, now):
+        """Store or delete a value and enforce the size limit (lock held)."""
+        if value is None:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (value, now + ttl if ttl else None)
+        self._data.move_to_end(key)
+        if self.max_entries is not None:
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.time())
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl, time.time())
+
+    def delete(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def update(self, key, fn, ttl=None):
+        now = time.time()
+        with self._lock:
+            item = self._live(key, now)
+            value = fn(item[0] if item is not None else None)
+            self._store(key, value, ttl, now)
+            return value
+
+    def scan(self, prefix):
+        now = time.time()
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+            return {key: item[0] for key in keys if (item := self._live(key, now)) is not None}
+
+
+class SQLiteBackend(StateBackend):
+    """State shared by every worker on one host through a SQLite file in WAL mode."""
+
+    # Expired rows are purged once every this many writes
+    PURGE_EVERY = 1000
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH):
+        """
+        Initialize the backend, creating the database if needed
+
+        Args:
+            path (str): Path of the SQLite database file
+        """
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # A short-lived connection, so a process that forks workers after
+        # creating the backend does not hand them an open SQLite connection
+        conn = sqlite3.connect(self.path, timeout=5)
+        try:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS state "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited through fork must not be used by the child
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit mode; transactions are opened explicitly where needed
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, conn, key, value, ttl, now):
+        """Store or delete a value inside the current transaction."""
+        if value is None:
+            conn.execute("DELETE FROM state WHERE key = ?", (key,))
+        else:
+            conn.execute("INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), now + ttl if ttl else None))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM state WHERE expires IS NOT NULL AND expires <= ?", (now,))
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        self._write(self._connect(), key, value, ttl, time.time())
+
+    def delete(self, key):
+        return self._connect().execute("DELETE FROM state WHERE key = ?", (key,)).rowcount > 0
+
+    def update(self, key, fn, ttl=None):
+        conn = self._connect()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front so concurrent updates serialize
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                               (key, now)).fetchone()
+            value = fn(json.loads(row[0]) if row else None)
+            self._write(conn, key, value, ttl, now)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def scan(self, prefix):
+        rows = self._connect().execute(
+            "SELECT key, value FROM state WHERE key >= ? AND key < ? AND (expires IS NULL OR expires > ?)",
+            (prefix, prefix + '￿', time.time())).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+
+class KeyValueBackend(StateBackend):
+    """
+    Adapter over an external Redis-compatible key-value store
+
+    The client needs get, set(name, value, ex=None), delete, scan_iter(match=)
+    and pipeline() with watch/multi/execute, as redis-py and most compatible
+    clients provide.
+    """
+
+    def __init__(self, client, retry_errors=(), namespace='aispectrum:', max_retries=50):
+        """
+        Initialize the adapter
+
+        Args:
+            client: The key-value store client
+            retry_errors (tuple): Exceptions signalling an optimistic-lock conflict
+            namespace (str): Prefix for every key, so the store can be shared
+            max_retries (int): Attempts at an update before giving up
+        """
+        self.client = client
+        self.retry_errors = tuple(retry_errors)
+        self.namespace = namespace
+        self.max_retries = max_retries
+
+    @staticmethod
+    def _decode(raw):
+        """Decode a stored value."""
+        if raw is None:
+            return None
+        return json.loads(raw.decode() if isinstance(raw, bytes) else raw)
+
+    def get(self, key):
+        return self._decode(self.client.get(self.namespace + key))
+
+    def set(self, key, value, ttl=None):
+        if value is None:
+            self.client.delete(self.namespace + key)
+        else:
+            self.client.set(self.namespace + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        return bool(self.client.delete(self.namespace + key))
+
+    def update(self, key, fn, ttl=None):
+        name = self.namespace + key
+        for _ in range(self.max_retries):
+            with self.client.pipeline() as pipe:
+                try:
+                    # Optimistic locking: the transaction aborts if the key changes
+                    pipe.watch(name)
+                    value = fn(self._decode(pipe.get(name)))
+                    pipe.multi()
+                    if value is None:
+                        pipe.delete(name)
+                    else:
+                        pipe.set(name, json.dumps(value), ex=int(ttl) if ttl else None)
+                    pipe.execute()
+                    return value
+                except self.retry_errors:
+                    continue
+        raise RuntimeError(f"Could not update shared state key {key}: too much contention")
+
+    def scan(self, prefix):
+        names = list(self.client.scan_iter(match=self.namespace + prefix + '*'))
+        values = self.client.mget(names) if names else []
+        result = {}
+        for name, raw in zip(names, values):
+            if raw is not None:
+                name = name.decode() if isinstance(name, bytes) else name
+                result[name[len(self.namespace):]] = self._decode(raw)
+        return result
+
+
+def create_backend(spec=BACKEND_SPEC):
+    """
+    Create a state backend from its configuration string
+
+    Args:
+        spec (str): 'memory', 'sqlite', 'sqlite:///path' or 'redis://...'
+
+    Returns:
+        StateBackend: The backend
+    """
+    if spec == 'memory':
+        return MemoryBackend()
+    if spec == 'sqlite':
+        return SQLiteBackend()
+    if spec.startswith('sqlite:///'):
+        return SQLiteBackend(spec[len('sqlite:///'):])
+    if spec.startswith(('redis://', 'rediss://', 'unix://')):
+        # Imported here so redis is only needed when it is configured
+        import redis
+        return KeyValueBackend(redis.Redis.from_url(spec), retry_errors=(redis.WatchError,))
+    raise ValueError(f"Unknown state backend: {spec}")
+
+
+class SharedCache:
+    """A namespaced cache with expiry stored in the shared backend."""
+
+    def __init__(self, namespace, ttl_seconds=None, backend=None):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or state
+
+    def get(self, key):
+        """Return a cached value, or None."""
+        return self.backend.get(f"{self.namespace}:{key}")
+
+    def set(self, key, value):
+        """Cache a value for the cache's TTL."""
+        self.backend.set(f"{self.namespace}:{key}", value, self.ttl_seconds)
+
+    def delete(self, key):
+        """Remove a cached value."""
+        return self.backend.delete(f"{self.namespace}:{key}")
+
+
+class TokenBucket:
+    """Rate limiter allowing bursts of capacity and refilling at rate per second."""
+
+    def __init__(self, name, rate, capacity, backend=None):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or state
+
+    def acquire(self, tokens=1):
+        """
+        Take tokens from the bucket if enough are available
+
+        Returns:
+            bool: True if the tokens were taken
+        """
+        now = time.time()
+        granted = []
+
+        def take(bucket):
+            available = self.capacity
+            if bucket is not None:
+                elapsed = max(now - bucket['updated'], 0)
+                available = min(self.capacity, bucket['tokens'] + elapsed * self.rate)
+            if available >= tokens:
+                available -= tokens
+                granted.append(True)
+            return {'tokens': available, 'updated': now}
+
+        # A full bucket is the same as no bucket, so idle keys can expire
+        idle_ttl = self.capacity / self.rate + 1 if self.rate else None
+        self.backend.update(f"bucket:{self.name}", take, idle_ttl)
+        return bool(granted)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker whose state is shared by every worker
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    are refused for reset_timeout seconds; then a single trial call is let
+    through, closing the circuit on success or re-opening it on failure.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, backend=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or state
+
+    @property
+    def key(self):
+        return f"breaker:{self.name}"
+
+    def state(self):
+        """Return the breaker's current state name."""
+        breaker = self.backend.get(self.key)
+        return breaker['state'] if breaker else self.CLOSED
+
+    def allow(self):
+        """
+        Check whether a call may proceed
+
+        Returns:
+            bool: False while the circuit is open
+        """
+        current = self.backend.get(self.key)
+        if current is None or current['state'] == self.CLOSED:
+            # Fast path: a healthy provider costs one read, no write
+            return True
+        now = time.time()
+        allowed = []
+
+        def check(breaker):
+            if breaker is None or breaker['state'] == self.CLOSED:
+                allowed.append(True)
+                return breaker
+            if breaker['state'] == self.OPEN and now - breaker['opened_at'] >= self.reset_timeout:
+                # Let exactly one trial call through
+                allowed.append(True)
+                return dict(breaker, state=self.HALF_OPEN, opened_at=now)
+            if breaker['state'] == self.HALF_OPEN and now - breaker['opened_at'] >= self.reset_timeout:
+                # The trial call never reported back; allow another
+                allowed.append(True)
+                return dict(breaker, opened_at=now)
+            return breaker
+
+        self.backend.update(self.key, check)
+        return bool(allowed)
+
+    def record_success(self):
+        """Close the circuit after a successful call."""
+        if self.backend.get(self.key) is not None:
+            self.backend.delete(self.key)
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit at the threshold."""
+        now = time.time()
+
+        def fail(breaker):
+            breaker = breaker or {'state': self.CLOSED, 'failures': 0, 'opened_at': None}
+            failures = breaker['failures'] + 1
+            if breaker['state'] == self.HALF_OPEN or failures >= self.failure_threshold:
+                if breaker['state'] != self.OPEN:
+                    logger.warning(f"Circuit breaker {self.name} opened after {failures} failures")
+                    metrics.inc('circuit_breaker_opened_total', breaker=self.name)
+                return {'state': self.OPEN, 'failures': failures, 'opened_at': now}
+            return dict(breaker, failures=failures)
+
+        self.backend.update(self.key, fail)
+
+
+class SingleFlight:
+    """
+    Computes each cached value once, however many callers ask for it at the same time
+
+    Within a worker, callers of a key already being computed wait for that
+    computation. Across workers, the computing one holds a lease in the
+    backend and the others poll the cache until its result appears, or
+    take over if the lease expires.
+    """
+
+    def __init__(self, cache, lease_seconds=60, poll_interval=0.1, should_cache=None):
+        """
+        Initialize the single-flight group
+
+        Args:
+            cache (SharedCache): Cache the computed values are stored in
+            lease_seconds (float): How long another worker waits for a computation
+            poll_interval (float): Seconds between cache checks while waiting
+            should_cache (callable): Decides whether a value is cached; defaults to all
+        """
+        self.cache = cache
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.should_cache = should_cache or (lambda value: True)
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _claim(self, key, owner):
+        """Take the key's lease unless another worker holds a live one; return its owner."""
+        now = time.time()
+
+        def claim(lease):
+            if lease is not None and lease['until'] > now:
+                return lease
+            return {'owner': owner, 'until': now + self.lease_seconds}
+
+        return self.cache.backend.update(f"{self.cache.namespace}-lease:{key}", claim,
+                                         self.lease_seconds)['owner']
+
+    def do(self, key, fn, refresh=False):
+        """
+        Return the cached value for a key, computing it with fn if needed
+
+        Args:
+            key (str): Cache key
+            fn (callable): Computes the value
+            refresh (bool): Discard any cached value and compute it again
+
+        Returns:
+            tuple: (value, True if it came from the cache or another caller)
+        """
+        if refresh:
+            self.cache.delete(key)
+        else:
+            value = self.cache.get(key)
+            if value is not None:
+                return value, True
+
+        with self._lock:
+            done = self._inflight.get(key)
+            leader = done is None
+            if leader:
+                done = self._inflight[key] = threading.Event()
+        if not leader:
+            metrics.inc('singleflight_waits_total', cache=self.cache.namespace)
+            done.wait(self.lease_seconds)
+            value = self.cache.get(key)
+            if value is not None:
+                return value, True
+            return fn(), False
+
+        try:
+            owner = secrets.token_hex(8)
+            deadline = time.monotonic() + self.lease_seconds
+            while self._claim(key, owner) != owner and time.monotonic() < deadline:
+                # Another worker is computing it
+                time.sleep(self.poll_interval)
+                value = self.cache.get(key)
+                if value is not None:
+                    metrics.inc('singleflight_waits_total', cache=self.cache.namespace)
+                    return value, True
+            try:
+                value = fn()
+                if self.should_cache(value):
+                    self.cache.set(key, value)
+                return value, False
+            finally:
+                self.cache.backend.delete(f"{self.cache.namespace}-lease:{key}")
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+
+def shared_secret_key():
+    """Return the session signing key shared by every worker, creating it once."""
+    return state.update('app:secret_key', lambda current: current or secrets.token_hex(32))
+
+
+_last_publish = 0.0
+_worker = None
+
+
+def worker_id():
+    """Identify this worker process; checked against the pid so workers forked after import differ."""
+    global _worker
+    pid = os.getpid()
+    if _worker is None or _worker[0] != pid:
+        _worker = (pid, f"{socket.gethostname()}:{pid}")
+    return _worker[1]
+
+
+def publish_metrics(force=False):
+    """Publish this worker's metrics snapshot, at most once per publish interval."""
+    global _last_publish
+    now = time.time()
+    if not force and now - _last_publish < METRICS_PUBLISH_INTERVAL:
+        return
+    _last_publish = now
+    try:
+        state.set(METRICS_PREFIX + worker_id(), metrics.snapshot(), METRICS_TTL)
+    except Exception as e:
+        logger.warning(f"Could not publish metrics to shared state: {str(e)}")
+
+
+def cluster_metrics():
+    """
+    Return metrics summed over every worker sharing the backend
+
+    Returns:
+        dict: A merged snapshot plus the list of contributing workers
+    """
+    publish_metrics(force=True)
+    snapshots = state.scan(METRICS_PREFIX)
+    merged = merge_snapshots(list(snapshots.values()))
+    merged['workers'] = sorted(key[len(METRICS_PREFIX):] for key in snapshots)
+    return merged
+
+
+def init_state(app):
+    """
+    Attach shared state to the application
+
+    Uses SECRET_KEY from the environment when set, otherwise a key created
+    once in the shared backend so sessions are valid on every worker, and
+    publishes each worker's metrics after requests.
+    """
+    app.secret_key = os.environ.get('SECRET_KEY') or shared_secret_key()
+
+    @app.after_request
+    def _publish_metrics(response):
+        publish_metrics()
+        return response
+
+
+# Shared backend for the application
+state = create_backend()
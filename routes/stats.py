@@ -0,0 +1,254 @@
+"""
+Historical per-provider performance statistics.
+Every provider call is folded into an hourly rollup per provider target and
+model as it finishes: call and success counts, error codes, a latency
+histogram, token counts and cost. Rolling windows (the last hour, day,
+week...) are sums of the rollups they cover, so /api/stats never scans raw
+call history; the leaderboard is computed from the rollups with pandas.
+"""
+import logging
+import os
+import time
+
+from . import tokens
+from .state import state
+
+logger = logging.getLogger('aiSpectrum')
+
+# How long hourly rollups are kept, in seconds
+STATS_RETENTION_SECONDS = int(os.environ.get('AISPECTRUM_STATS_RETENTION', 30 * 86400))
+ROLLUP_SECONDS = 3600
+# Upper bounds of the latency histogram buckets, in seconds; the last one catches the rest
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0, 8.0, 12.0, 16.0, 24.0, 32.0, 45.0,
+                   60.0, 90.0, 120.0, float('inf'))
+WINDOWS = {'1h': 3600, '24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400}
+DEFAULT_WINDOW = '24h'
+COLUMNS = ('calls', 'success_rate', 'p50_latency_s', 'p95_latency_s', 'mean_latency_s', 'tokens_per_second',
+           'prompt_tokens', 'completion_tokens', 'cost', 'cost_per_call')
+# Leaderboard columns where higher is better; the others sort ascending
+DESCENDING = ('calls', 'success_rate', 'tokens_per_second')
+STATS_PREFIX = 'stats:'
+
+
+def _bucket(seconds):
+    return next(index for index, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)
+
+
+def check_options(window, sort=None):
+    """
+    Validate leaderboard options before any rollup is read or pandas is imported
+
+    Raises:
+        ValueError: For an unknown window or sort column
+    """
+    if window not in WINDOWS:
+        raise ValueError(f"window must be one of {', '.join(WINDOWS)}")
+    if sort is not None and sort not in COLUMNS + ('provider', 'model'):
+        raise ValueError(f"sort must be one of {', '.join(COLUMNS + ('provider', 'model'))}")
+
+
+def call_cost(provider_id, model, prompt_tokens, completion_tokens):
+    """Cost of one call in USD, from the model's per-million-token prices."""
+    profile = tokens.model_profile(provider_id, model)
+    return (prompt_tokens * profile['input_cost'] + completion_tokens * profile['output_cost']) / 1_000_000
+
+
+class ProviderStats:
+    """Hourly rollups of provider calls kept in a state backend."""
+
+    def __init__(self, retention_seconds=STATS_RETENTION_SECONDS, backend=None):
+        """
+        Initialize the statistics
+
+        Args:
+            retention_seconds (int): Time after which a rollup expires
+            backend (StateBackend): Backend holding the rollups; defaults to the
+                shared state backend, so with AISPECTRUM_STATE_BACKEND=memory
+                each worker only sees the calls it made itself
+        """
+        self.retention_seconds = retention_seconds
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend or state
+
+    def record(self, plan, result, seconds, now=None):
+        """
+        Add one finished provider call to its hourly rollup
+
+        Args:
+            plan (dict): Target plan from make_plan
+            result (dict): The call's result; cancelled and skipped calls are not recorded
+            seconds (float): How long the call took
+            now (float): Time of the call, defaults to now
+        """
+        status = result.get('status')
+        if status not in ('success', 'error'):
+            return
+        model = (result.get('model') if status == 'success' else None) or plan['model'] or plan['provider_id']
+        usage = result.get('usage') or {}
+        prompt_tokens = usage.get('prompt_tokens') or (plan['estimate']['prompt_tokens'] if status == 'success' else 0)
+        completion_tokens = usage.get('completion_tokens') or 0
+        if status == 'success' and not completion_tokens:
+            completion_tokens = tokens.get_tokenizer(tokens.model_family(plan['provider_id'], model)).count(
+                result.get('content') or '')
+        hour = int((now or time.time()) // ROLLUP_SECONDS * ROLLUP_SECONDS)
+
+        def add(rollup):
+            rollup = rollup or {
+                'hour': hour, 'provider': plan['result_key'], 'provider_id': plan['provider_id'], 'model': model,
+                'calls': 0, 'successes': 0, 'errors': {}, 'latency_buckets': [0] * len(LATENCY_BUCKETS),
+                'latency_sum': 0.0, 'generation_seconds': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'cost': 0.0
+            }
+            rollup['calls'] += 1
+            if status == 'success':
+                # Latency and throughput describe answers, not failures that return early
+                rollup['successes'] += 1
+                rollup['latency_buckets'][_bucket(seconds)] += 1
+                rollup['latency_sum'] += seconds
+                rollup['generation_seconds'] += seconds if completion_tokens else 0.0
+            else:
+                code = result.get('error_code') or 'unknown'
+                rollup['errors'][code] = rollup['errors'].get(code, 0) + 1
+            rollup['prompt_tokens'] += prompt_tokens
+            rollup['completion_tokens'] += completion_tokens
+            rollup['cost'] += call_cost(plan['provider_id'], model, prompt_tokens, completion_tokens)
+            return rollup
+
+        key = f"{STATS_PREFIX}{hour}:{plan['result_key']}:{model}"
+        try:
+            self.backend.update(key, add, self.retention_seconds)
+        except Exception as e:
+            # Statistics must never fail the call they describe
+            logger.warning(f"Could not record provider stats: {str(e)}")
+
+    def rollups(self, since=0):
+        """Return the stored rollups of hours starting at or after since."""
+        return [rollup for rollup in self.backend.scan(STATS_PREFIX).values() if rollup['hour'] >= since]
+
+    def leaderboard(self, window=DEFAULT_WINDOW, provider=None, sort=None, hourly=False, now=None):
+        """
+        Summarize the rollups of a rolling window per provider target and model
+
+        Args:
+            window (str): One of WINDOWS; rollups are hourly, so the window
+                starts at the beginning of its first hour
+            provider (str): Optional provider target to limit the rows to
+            sort (str): Column to rank by, success rate then p50 latency by default
+            hourly (bool): Also return one row per hour, provider and model
+
+        Returns:
+            dict: 'rows' (and 'hourly') with calls, success_rate,
+                p50/p95 latency, tokens_per_second, tokens and cost
+
+        Raises:
+            ValueError: For an unknown window or sort column
+            ImportError: If pandas is missing or cannot be loaded
+        """
+        check_options(window, sort)
+        now = now or time.time()
+        since = int((now - WINDOWS[window]) // ROLLUP_SECONDS * ROLLUP_SECONDS)
+        rollups = [r for r in self.rollups(since) if provider is None or r['provider'] == provider]
+        result = {'window': window, 'since': since, 'rows': summarize(rollups, ['provider', 'model'], sort)}
+        if hourly:
+            result['hourly'] = summarize(rollups, ['hour', 'provider', 'model'], 'hour')
+        return result
+
+
+def summarize(rollups, keys, sort=None):
+    """
+    Merge rollups by the given keys and compute the leaderboard columns
+
+    Percentiles are read off the merged latency histograms, interpolating
+    within the bucket that holds them; all columns are computed for every
+    group at once.
+
+    Args:
+        rollups (list): Rollup dicts from ProviderStats
+        keys (list): Columns to group by, e.g. ['provider', 'model']
+        sort (str): Column to sort by
+
+    Returns:
+        list: One dict per group
+
+    Raises:
+        ImportError: If pandas is missing or cannot be loaded
+    """
+    # pandas is only imported once statistics are requested
+    try:
+        import numpy as np
+        import pandas as pd
+    except Exception as e:
+        # A broken install can fail with other errors too, e.g. ValueError on a numpy ABI mismatch
+        raise ImportError(f"Statistics dependency unavailable: pandas ({str(e)})") from e
+
+    if sort is not None and sort not in COLUMNS and sort not in keys:
+        raise ValueError(f"sort must be one of {', '.join(COLUMNS + tuple(keys))}")
+    if not rollups:
+        return []
+    buckets = [f"bucket_{index}" for index in range(len(LATENCY_BUCKETS))]
+    frame = pd.DataFrame(rollups)
+    frame = pd.concat([frame.drop(columns=['latency_buckets']),
+                       pd.DataFrame(frame['latency_buckets'].tolist(), columns=buckets, index=frame.index)], axis=1)
+    errors = pd.DataFrame(frame.pop('errors').tolist(), index=frame.index).fillna(0)
+    sums = ['calls', 'successes', 'latency_sum', 'generation_seconds', 'prompt_tokens', 'completion_tokens',
+            'cost'] + buckets
+    grouped = frame.groupby(keys, sort=False)[sums].sum()
+    error_counts = errors.groupby([frame[key] for key in keys], sort=False).sum() if not errors.empty else None
+
+    counts = grouped[buckets].to_numpy(dtype=float)
+    cumulative = counts.cumsum(axis=1)
+    successes = grouped['successes'].to_numpy(dtype=float)
+    lower = np.array((0.0,) + LATENCY_BUCKETS[:-1])
+    # The open last bucket is interpolated as if it ended at twice its lower bound
+    upper = np.array(LATENCY_BUCKETS[:-1] + (LATENCY_BUCKETS[-2] * 2,))
+
+    def percentile(q):
+        target = successes * q
+        index = (cumulative >= target[:, None]).argmax(axis=1)
+        rows = np.arange(len(index))
+        below = np.where(index > 0, cumulative[rows, np.maximum(index - 1, 0)], 0.0)
+        within = counts[rows, index]
+        fraction = np.divide(target - below, within, out=np.zeros_like(target), where=within > 0)
+        value = lower[index] + fraction * (upper[index] - lower[index])
+        return np.where(successes > 0, value.round(3), np.nan)
+
+    table = pd.DataFrame({
+        'calls': grouped['calls'],
+        'success_rate': (grouped['successes'] / grouped['calls']).round(4),
+        'p50_latency_s': percentile(0.5),
+        'p95_latency_s': percentile(0.95),
+        'mean_latency_s': (grouped['latency_sum'] / grouped['successes'].where(grouped['successes'] > 0)).round(3),
+        'tokens_per_second': (grouped['completion_tokens']
+                              / grouped['generation_seconds'].where(grouped['generation_seconds'] > 0)).round(1),
+        'prompt_tokens': grouped['prompt_tokens'],
+        'completion_tokens': grouped['completion_tokens'],
+        'cost': grouped['cost'].round(6),
+        'cost_per_call': (grouped['cost'] / grouped['calls']).round(6)
+    }, index=grouped.index)
+
+    if sort is None:
+        table = table.sort_values(['success_rate', 'p50_latency_s'], ascending=[False, True])
+    elif sort in keys:
+        table = table.sort_index(level=sort, sort_remaining=True)
+    else:
+        table = table.sort_values(sort, ascending=sort not in DESCENDING)
+
+    rows = []
+    for index, row in zip(table.index, table.to_dict('records')):
+        row = {key: (None if pd.isna(value) else value.item() if hasattr(value, 'item') else value)
+               for key, value in row.items()}
+        row.update(zip(keys, index if isinstance(index, tuple) else (index,)))
+        if error_counts is not None:
+            codes = error_counts.loc[index]
+            row['errors'] = {code: int(count) for code, count in codes.items() if count}
+        else:
+            row['errors'] = {}
+        rows.append(row)
+    return rows
+
+
+# Provider statistics, kept in the shared state backend
+provider_stats = ProviderStats()
@@ -3,8 +3,43 @@ Summarizer module that analyzes multiple AI responses and produces a consensus
 summary highlighting the best parts of each.
 """
 
-import openai
+import hashlib
 import json
+import os
+
+from . import tracing
+from .metrics import metrics
+from .state import MemoryBackend, SharedCache, SingleFlight, state
+
+# Bump whenever the summarization prompt changes, so summaries generated with
+# an older prompt are not served from the cache
+PROMPT_VERSION = 2
+SUMMARY_MODEL = "gpt-3.5-turbo"
+# Generated summaries are reused for this long, in seconds
+SUMMARY_CACHE_TTL = int(os.environ.get('AISPECTRUM_SUMMARY_CACHE_TTL', 86400))
+# Maximum number of summaries kept by the private in-memory cache
+SUMMARY_CACHE_SIZE = int(os.environ.get('AISPECTRUM_SUMMARY_CACHE_SIZE', 500))
+
+
+def summary_cache_key(query, responses, backend):
+    """
+    Return the cache key of a summary
+
+    Args:
+        query (str): The original user query
+        responses (dict): Responses keyed by model; only successful ones count
+        backend (str): What generates the summary, e.g. 'openai:gpt-3.5-turbo'
+
+    Returns:
+        str: Hex digest of the prompt version, backend, query and response contents
+    """
+    content_hashes = sorted(
+        (name, hashlib.sha256(response.get("content", "").encode("utf-8")).hexdigest())
+        for name, response in responses.items() if response.get("status") == "success"
+    )
+    material = json.dumps([PROMPT_VERSION, backend, query, content_hashes])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
 
 class ResponseSummarizer:
     """Summarizes multiple AI responses to find consensus and highlight the best answers."""
@@ -22,6 +57,9 @@ I will provide you with responses from different AI models to this query.
 AI Responses:
 {responses}
 
+Measured agreement of each response with the others (0 = unrelated, 1 = identical wording):
+{agreement}
+
 Please analyze these responses and create a summary that:
 1. Identifies the consensus points where models agree
 2. Highlights unique insights from individual models
@@ -41,7 +79,43 @@ Your analysis should be clear, concise, and focused on giving the user the highe
                 formatted += f"{response_data.get('content', 'No content')}\n\n"
         return formatted
     
-    def summarize(self, query, responses):
+    @property
+    def backend(self):
+        """What generates the summaries: the OpenAI model, or the basic summary without a key."""
+        return f"openai:{SUMMARY_MODEL}" if self.api_key else "basic"
+    
+    def summarize(self, query, responses, refresh=False):
+        """
+        Generate a meta-summary of all AI responses, reusing an earlier identical one.
+        
+        Summaries are cached by query, response contents, backend and prompt
+        version, and concurrent requests for the same summary share one call.
+        
+        Args:
+            query (str): The original user query
+            responses (dict): Dictionary of responses from different models
+            refresh (bool): Generate the summary again instead of using the cache
+            
+        Returns:
+            dict: Summarized response with metadata, 'cached' telling whether it was reused
+        """
+        with tracing.start_span("summarize", attributes={'summary.backend': self.backend}) as span:
+            key = summary_cache_key(query, responses, self.backend)
+            summary, cached = summary_flight.do(key, lambda: self._traced_generate(query, responses), refresh)
+            metrics.inc('summary_cache_requests_total', hit=cached)
+            span.set_attribute('summary.cached', cached)
+            span.set_attribute('summary.status', summary.get("status"))
+            return dict(summary, cached=cached)
+    
+    def _traced_generate(self, query, responses):
+        """Generate a summary inside its own span, so the LLM call is timed apart from cache waits."""
+        with tracing.start_span("summarize generate", attributes={'summary.backend': self.backend}) as span:
+            summary = self.generate(query, responses)
+            if summary.get("status") == "error":
+                span.set_error(summary.get("content"))
+            return summary
+    
+    def generate(self, query, responses):
         """
         Generate a meta-summary of all AI responses.
         
@@ -76,18 +150,26 @@ Your analysis should be clear, concise, and focused on giving the user the highe
         try:
             # Format responses for the prompt
             formatted_responses = self._format_responses_for_prompt(responses)
+            # Imported here so numpy only loads when a summary is requested
+            from .similarity import compare_responses
+            comparison = compare_responses(successful_responses, pairs=[])
+            agreement = "\n".join(f"- {model_name}: {score:.2f}"
+                                  for model_name, score in comparison["agreement"].items())
             
             # Prepare the prompt with the query and responses
             formatted_prompt = self.summarization_prompt.format(
                 query=query,
-                responses=formatted_responses
+                responses=formatted_responses,
+                agreement=agreement
             )
             
             # Use OpenAI directly
             if self.api_key:
+                # Imported here so the SDK only loads when a summary is requested
+                import openai
                 client = openai.OpenAI(api_key=self.api_key)
                 completion = client.chat.completions.create(
-                    model="gpt-3.5-turbo",  # Using a capable but cost-effective model
+                    model=SUMMARY_MODEL,  # Using a capable but cost-effective model
                     messages=[
                         {"role": "system", "content": "You are an expert AI model analyst."},
                         {"role": "user", "content": formatted_prompt}
@@ -100,17 +182,22 @@ Your analysis should be clear, concise, and focused on giving the user the highe
                 return {
                     "content": summary,
                     "model": "meta-summarizer (OpenAI)",
+                    "agreement": comparison["agreement"],
+                    "consensus": comparison["consensus"],
                     "status": "success"
                 }
             else:
                 # If no API key, create a simple summary
                 model_names = list(successful_responses.keys())
                 simple_summary = f"Responses received from {', '.join(model_names)}.\n\n"
+                simple_summary += f"Closest to consensus: {comparison['consensus']} (agreement {comparison['agreement'][comparison['consensus']]:.2f}).\n\n"
                 simple_summary += "To see a detailed analysis and comparison of these responses, please add an OpenAI or Gemini API key in the settings."
                 
                 return {
                     "content": simple_summary,
                     "model": "meta-summarizer (basic)",
+                    "agreement": comparison["agreement"],
+                    "consensus": comparison["consensus"],
                     "status": "success"
                 }
                 
@@ -122,6 +209,15 @@ Your analysis should be clear, concise, and focused on giving the user the highe
             }
 
 
+# Summaries shared by every worker when a state backend is configured
+summary_cache = SharedCache('summary', ttl_seconds=SUMMARY_CACHE_TTL,
+                            backend=state if not isinstance(state, MemoryBackend)
+                            else MemoryBackend(max_entries=SUMMARY_CACHE_SIZE))
+# Only successful summaries are cached; a failed call is retried next time
+summary_flight = SingleFlight(summary_cache, lease_seconds=120,
+                              should_cache=lambda summary: summary.get("status") == "success")
+
+
 def summarize_responses(query, responses, api_key=None):
     """Helper function to summarize responses."""
     print("🔍 Summarizer called with API key:", "Available" if api_key else "Not available")
@@ -0,0 +1,268 @@
+"""
+Pre-flight token counting and cost/latency estimation.
+Prompts are measured with a tokenizer for the target model's family before
+any network call, so oversized prompts can be rejected or trimmed and the
+dispatcher can skip models that do not fit a request's budget.
+"""
+import functools
+import math
+import re
+
+# Output tokens assumed for cost/latency estimates when no max_tokens is set
+EXPECTED_OUTPUT_TOKENS = 600
+
+# Tokens added per chat message for role markers and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Approximate characters per token for each model family, used when an exact
+# tokenizer is not installed
+CHARS_PER_TOKEN = {
+    'openai-o200k': 4.0,
+    'openai-cl100k': 4.0,
+    'claude': 3.5,
+    'gemini': 4.0,
+    'llama': 3.8,
+    'mistral': 3.7,
+    'cohere': 4.0,
+    'deepseek': 3.8,
+    'default': 4.0
+}
+
+# tiktoken encodings for families that have one
+TIKTOKEN_ENCODINGS = {
+    'openai-o200k': 'o200k_base',
+    'openai-cl100k': 'cl100k_base'
+}
+
+# Per-model limits, list prices (USD per 1M tokens) and typical speed.
+# These are estimates for planning, not billing.
+MODEL_PROFILES = {
+    'gpt-4o': {'context': 128000, 'max_output': 4096, 'input_cost': 5.0, 'output_cost': 15.0, 'tokens_per_second': 80, 'first_token_s': 0.5},
+    'gpt-4-turbo': {'context': 128000, 'max_output': 4096, 'input_cost': 10.0, 'output_cost': 30.0, 'tokens_per_second': 35, 'first_token_s': 0.8},
+    'gpt-3.5-turbo': {'context': 16385, 'max_output': 4096, 'input_cost': 0.5, 'output_cost': 1.5, 'tokens_per_second': 90, 'first_token_s': 0.4},
+    'claude-3-opus-20240229': {'context': 200000, 'max_output': 4096, 'input_cost': 15.0, 'output_cost': 75.0, 'tokens_per_second': 25, 'first_token_s': 1.5},
+    'claude-3-sonnet-20240229': {'context': 200000, 'max_output': 4096, 'input_cost': 3.0, 'output_cost': 15.0, 'tokens_per_second': 60, 'first_token_s': 0.8},
+    'claude-3-haiku-20240307': {'context': 200000, 'max_output': 4096, 'input_cost': 0.25, 'output_cost': 1.25, 'tokens_per_second': 120, 'first_token_s': 0.4},
+    'deepseek-llm-67b-chat': {'context': 4096, 'max_output': 4096, 'input_cost': 0.14, 'output_cost': 0.28, 'tokens_per_second': 40, 'first_token_s': 0.8},
+    'deepseek-coder-33b-instruct': {'context': 16384, 'max_output': 4096, 'input_cost': 0.14, 'output_cost': 0.28, 'tokens_per_second': 40, 'first_token_s': 0.8},
+    'deepseek-coder-6.7b-instruct': {'context': 16384, 'max_output': 4096, 'input_cost': 0.14, 'output_cost': 0.28, 'tokens_per_second': 60, 'first_token_s': 0.5},
+    'mistral-large-latest': {'context': 32000, 'max_output': 4096, 'input_cost': 4.0, 'output_cost': 12.0, 'tokens_per_second': 35, 'first_token_s': 0.7},
+    'mistral-medium-latest': {'context': 32000, 'max_output': 4096, 'input_cost': 2.7, 'output_cost': 8.1, 'tokens_per_second': 50, 'first_token_s': 0.6},
+    'mistral-small-latest': {'context': 32000, 'max_output': 4096, 'input_cost': 1.0, 'output_cost': 3.0, 'tokens_per_second': 80, 'first_token_s': 0.4},
+    'gemini-1.5-pro': {'context': 1000000, 'max_output': 8192, 'input_cost': 3.5, 'output_cost': 10.5, 'tokens_per_second': 50, 'first_token_s': 1.0},
+    'gemini-1.5-flash': {'context': 1000000, 'max_output': 8192, 'input_cost': 0.35, 'output_cost': 1.05, 'tokens_per_second': 150, 'first_token_s': 0.4},
+    'gemini-1.5-pro-preview': {'context': 1000000, 'max_output': 8192, 'input_cost': 3.5, 'output_cost': 10.5, 'tokens_per_second': 50, 'first_token_s': 1.0},
+    'gemini-1.0-pro-latest': {'context': 30720, 'max_output': 2048, 'input_cost': 0.5, 'output_cost': 1.5, 'tokens_per_second': 70, 'first_token_s': 0.6},
+    'command-r': {'context': 128000, 'max_output': 4000, 'input_cost': 0.5, 'output_cost': 1.5, 'tokens_per_second': 60, 'first_token_s': 0.5},
+    'command-r-plus': {'context': 128000, 'max_output': 4000, 'input_cost': 3.0, 'output_cost': 15.0, 'tokens_per_second': 40, 'first_token_s': 0.8},
+    'command-light': {'context': 4096, 'max_output': 4000, 'input_cost': 0.3, 'output_cost': 0.6, 'tokens_per_second': 90, 'first_token_s': 0.3},
+    'gpt-4': {'context': 8192, 'max_output': 4096, 'input_cost': 30.0, 'output_cost': 60.0, 'tokens_per_second': 20, 'first_token_s': 1.0},
+    'gpt-35-turbo': {'context': 16385, 'max_output': 4096, 'input_cost': 0.5, 'output_cost': 1.5, 'tokens_per_second': 90, 'first_token_s': 0.4}
+}
+
+# Fallback profile per provider for models not listed above
+PROVIDER_PROFILES = {
+    'openai': MODEL_PROFILES['gpt-4o'],
+    'anthropic': MODEL_PROFILES['claude-3-sonnet-20240229'],
+    'deepseek': MODEL_PROFILES['deepseek-coder-33b-instruct'],
+    'mistral': MODEL_PROFILES['mistral-large-latest'],
+    'gemini': MODEL_PROFILES['gemini-1.5-flash'],
+    'cohere': MODEL_PROFILES['command-r'],
+    'azure': MODEL_PROFILES['gpt-35-turbo'],
+    'local': {'context': 8192, 'max_output': 2048, 'input_cost': 0.0, 'output_cost': 0.0, 'tokens_per_second': 30, 'first_token_s': 0.5}
+}
+
+# Output cap sent to providers whose API requires one, when the request
+# does not set max_tokens. Other providers use their own server default.
+DEFAULT_OUTPUT_TOKENS = {
+    'anthropic': 4096,
+    'gemini': 2048,
+    'azure': 2048
+}
+
+
+class BudgetExceededError(ValueError):
+    """Raised when a prompt does not fit a model's context or the request budget."""
+
+
+class HeuristicTokenizer:
+    """Character-ratio tokenizer used when no exact tokenizer is available."""
+
+    def __init__(self, chars_per_token):
+        self.chars_per_token = chars_per_token
+        self.name = f"heuristic-{chars_per_token}"
+
+    def count(self, text):
+        """Estimate the number of tokens in text."""
+        if not text:
+            return 0
+        # Whitespace-heavy text tokenizes closer to one token per word
+        words = len(re.findall(r'\S+', text))
+        return max(math.ceil(len(text) / self.chars_per_token), words)
+
+    def truncate(self, text, max_tokens):
+        """Cut text down to approximately max_tokens tokens."""
+        if self.count(text) <= max_tokens:
+            return text
+        return text[:max(int(max_tokens * self.chars_per_token), 0)]
+
+
+class TiktokenTokenizer:
+    """Exact tokenizer for OpenAI model families."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = encoding.name
+
+    def count(self, text):
+        return len(self.encoding.encode(text or '', disallowed_special=()))
+
+    def truncate(self, text, max_tokens):
+        tokens = self.encoding.encode(text or '', disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(max_tokens, 0)])
+
+
+def model_family(provider_id, model=None):
+    """
+    Map a provider and model to a tokenizer family
+
+    Args:
+        provider_id (str): Provider identifier
+        model (str): Model identifier
+
+    Returns:
+        str: Family name, a key of CHARS_PER_TOKEN
+    """
+    model = (model or '').lower()
+    if provider_id in ('openai', 'azure'):
+        return 'openai-o200k' if 'gpt-4o' in model else 'openai-cl100k'
+    if provider_id == 'anthropic':
+        return 'claude'
+    if provider_id in ('gemini', 'palm'):
+        return 'gemini'
+    if provider_id in CHARS_PER_TOKEN:
+        return provider_id
+    for family in ('llama', 'mistral', 'deepseek'):
+        if family in model:
+            return family
+    return 'default'
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(family):
+    """
+    Return the tokenizer for a model family, loading it once per process
+
+    tiktoken is used for OpenAI families when it is installed; every other
+    family uses a calibrated character heuristic.
+    """
+    encoding_name = TIKTOKEN_ENCODINGS.get(family)
+    if encoding_name:
+        try:
+            import tiktoken
+            return TiktokenTokenizer(tiktoken.get_encoding(encoding_name))
+        except Exception:
+            pass
+    return HeuristicTokenizer(CHARS_PER_TOKEN.get(family, CHARS_PER_TOKEN['default']))
+
+
+def estimate_tokens(text):
+    """Estimate tokens for text without a specific model in mind."""
+    return get_tokenizer('default').count(text)
+
+
+def count_message_tokens(messages, provider_id, model=None):
+    """Count tokens for a list of chat messages, including per-message overhead."""
+    tokenizer = get_tokenizer(model_family(provider_id, model))
+    return sum(tokenizer.count(m['content']) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def model_profile(provider_id, model=None):
+    """Return limits, pricing and speed for a model, falling back to the provider default."""
+    return MODEL_PROFILES.get(model) or PROVIDER_PROFILES.get(provider_id) or PROVIDER_PROFILES['local']
+
+
+def resolve_max_tokens(provider_id, model, requested=None, prompt_tokens=0):
+    """
+    Decide the output token cap to send to a provider
+
+    Args:
+        provider_id (str): Provider identifier
+        model (str): Model identifier
+        requested (int): max_tokens asked for by the client, if any
+        prompt_tokens (int): Estimated prompt size
+
+    Returns:
+        int: Output cap, or None to leave it to the provider's default
+    """
+    limit = requested or DEFAULT_OUTPUT_TOKENS.get(provider_id)
+    if not limit:
+        return None
+    profile = model_profile(provider_id, model)
+    limit = min(int(limit), profile['max_output'])
+    # Never ask for more than the context window has left
+    return max(min(limit, profile['context'] - prompt_tokens), 1)
+
+
+def estimate(query, provider_id, model=None, history=None, max_tokens=None, samples=1, shared_prompt=True):
+    """
+    Estimate prompt size, cost and latency of one provider call
+
+    Args:
+        query (str): The user query
+        provider_id (str): Provider identifier
+        model (str): Model identifier
+        history (list): Prior conversation messages sent with the query
+        max_tokens (int): Output cap requested by the client
+        samples (int): Responses requested; each one's output is paid for
+        shared_prompt (bool): Whether the samples share one prompt (a native
+            multi-candidate request) or each pay for it (parallel calls)
+
+    Returns:
+        dict: Token counts, context fit, expected/max cost (USD) and latency (s)
+    """
+    family = model_family(provider_id, model)
+    tokenizer = get_tokenizer(family)
+    profile = model_profile(provider_id, model)
+
+    prompt_tokens = count_message_tokens((history or []) + [{'content': query or ''}], provider_id, model)
+    output_cap = resolve_max_tokens(provider_id, model, max_tokens, prompt_tokens)
+    max_output = output_cap or profile['max_output']
+    expected_output = min(EXPECTED_OUTPUT_TOKENS, max_output)
+
+    prompt_copies = 1 if shared_prompt else samples
+
+    def cost(output_tokens):
+        return (prompt_tokens * prompt_copies * profile['input_cost']
+                + output_tokens * samples * profile['output_cost']) / 1_000_000
+
+    return {
+        'provider': provider_id,
+        'model': model,
+        'tokenizer': tokenizer.name,
+        'prompt_tokens': prompt_tokens,
+        'max_output_tokens': output_cap,
+        'context_window': profile['context'],
+        'fits_context': prompt_tokens + expected_output <= profile['context'],
+        'samples': samples,
+        'estimated_cost': round(cost(expected_output), 6),
+        'max_cost': round(cost(max_output), 6),
+        'estimated_latency_s': round(profile['first_token_s'] + expected_output / profile['tokens_per_second'], 2)
+    }
+
+
+def trim_query(query, provider_id, model, max_prompt_tokens, history=None):
+    """
+    Trim a query so the whole prompt fits max_prompt_tokens
+
+    Raises:
+        BudgetExceededError: If the history alone leaves no room for the query
+    """
+    tokenizer = get_tokenizer(model_family(provider_id, model))
+    used = count_message_tokens(history or [], provider_id, model) + MESSAGE_OVERHEAD_TOKENS
+    room = max_prompt_tokens - used
+    if room <= 0:
+        raise BudgetExceededError(f"Prompt exceeds the token budget of {max_prompt_tokens} even without the query")
+    return tokenizer.truncate(query, room)
@@ -0,0 +1,369 @@
+"""
+Request tracing.
+Every API request gets a trace id (continued from an incoming W3C
+traceparent header when there is one) and a server span; provider calls,
+their HTTP requests, fallback attempts, summarization and export open child
+spans. The current span lives in a context variable, which the dispatcher
+copies into provider threads, and its ids are added to every log record
+and returned in the X-Trace-Id and traceparent response headers. Finished
+spans are exported as OTLP/JSON to a local file and/or an OpenTelemetry
+collector.
+"""
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+from .metrics import metrics
+
+logger = logging.getLogger('aiSpectrum')
+
+# File that finished spans are appended to, one OTLP/JSON request per line
+TRACE_FILE = os.environ.get('AISPECTRUM_TRACE_FILE', '')
+# OTLP/HTTP collector base URL, e.g. http://localhost:4318
+OTLP_ENDPOINT = os.environ.get('AISPECTRUM_OTLP_ENDPOINT', '')
+SERVICE_NAME = os.environ.get('AISPECTRUM_SERVICE_NAME', 'aiSpectrum')
+# Spans are exported in batches of up to this many, at least this often
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL_SECONDS = float(os.environ.get('AISPECTRUM_TRACE_EXPORT_INTERVAL', 2))
+# Finished spans waiting for export beyond this are dropped
+EXPORT_QUEUE_SIZE = 10000
+
+# OTLP span kinds and status codes
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+# Query strings of URLs in error messages, which can carry API keys
+URL_QUERY_RE = re.compile(r'(https?://[^\s?]+)\?[^\s]*')
+
+_current_span = contextvars.ContextVar('span', default=None)
+_suppressed = contextvars.ContextVar('tracing_suppressed', default=False)
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'status_message')
+
+    def __init__(self, name, trace_id, parent_id=None, kind=INTERNAL, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.status_message = ''
+
+    def set_attribute(self, key, value):
+        """Attach a string, number or boolean attribute."""
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message):
+        """Mark the span as failed."""
+        self.status = STATUS_ERROR
+        self.status_message = URL_QUERY_RE.sub(r'\1', str(message))[:500]
+
+    def end(self):
+        """Finish the span and queue it for export (idempotent)."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        exporter.export(self)
+
+    @property
+    def duration_ms(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    @property
+    def traceparent(self):
+        """The span's W3C traceparent header value."""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self):
+        """Return the span in OTLP/JSON form."""
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': self.status}
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.status_message:
+            span['status']['message'] = self.status_message
+        return span
+
+
+def _otlp_attribute(key, value):
+    """Encode one attribute as an OTLP key/value pair."""
+    if isinstance(value, bool):
+        encoded = {'boolValue': value}
+    elif isinstance(value, int):
+        encoded = {'intValue': str(value)}
+    elif isinstance(value, float):
+        encoded = {'doubleValue': value}
+    else:
+        encoded = {'stringValue': str(value)}
+    return {'key': key, 'value': encoded}
+
+
+def otlp_request(spans):
+    """
+    Wrap spans in an OTLP ExportTraceServiceRequest
+
+    Args:
+        spans (list): Finished Span objects
+
+    Returns:
+        dict: The OTLP/JSON request body
+    """
+    return {
+        'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME),
+                                        _otlp_attribute('process.pid', os.getpid())]},
+            'scopeSpans': [{'scope': {'name': 'aiSpectrum'}, 'spans': [span.to_otlp() for span in spans]}]
+        }]
+    }
+
+
+class SpanExporter:
+    """Batches finished spans in the background and writes them to a file and/or collector."""
+
+    def __init__(self, path=TRACE_FILE, endpoint=OTLP_ENDPOINT, interval=EXPORT_INTERVAL_SECONDS):
+        """
+        Initialize the exporter
+
+        Args:
+            path (str): File to append OTLP/JSON lines to, or '' for none
+            endpoint (str): OTLP/HTTP collector base URL, or '' for none
+            interval (float): Seconds between background flushes
+        """
+        self.path = path
+        self.endpoint = endpoint.rstrip('/')
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path or self.endpoint)
+
+    def export(self, span):
+        """Queue a finished span; spans are discarded when no destination is configured."""
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            metrics.inc('trace_spans_dropped_total')
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='aispectrum-span-exporter', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write out every queued span now."""
+        while True:
+            batch = []
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+
+    def _write(self, batch):
+        body = otlp_request(batch)
+        try:
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with self._lock, open(self.path, 'a') as f:
+                    f.write(json.dumps(body) + '\n')
+            if self.endpoint:
+                # Imported here to avoid a circular import; http_client itself opens spans
+                from . import http_client
+                with suppressed():
+                    http_client.post(f"{self.endpoint}/v1/traces", json=body, timeout=5).raise_for_status()
+            metrics.inc('trace_spans_exported_total', len(batch))
+        except Exception as e:
+            metrics.inc('trace_export_errors_total')
+            logger.warning(f"Could not export {len(batch)} spans: {str(e)}")
+
+
+def current_span():
+    """Return the active span, if any."""
+    return _current_span.get()
+
+
+def current_trace_id():
+    """Return the active trace id, if any."""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+@contextmanager
+def start_span(name, kind=INTERNAL, attributes=None):
+    """
+    Run a block inside a child span of the current span (or a new trace)
+
+    Exceptions leaving the block mark the span as failed and are re-raised.
+
+    Args:
+        name (str): Span name
+        kind (int): INTERNAL, SERVER or CLIENT
+        attributes (dict): Initial attributes
+
+    Yields:
+        Span: The new span, which is current inside the block
+    """
+    if _suppressed.get():
+        # Never exported, so the exporter's own requests do not produce spans
+        yield Span(name, '0' * 32, kind=kind, attributes=attributes)
+        return
+    parent = _current_span.get()
+    span = Span(name, parent.trace_id if parent else secrets.token_hex(16),
+                parent.span_id if parent else None, kind, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(f"{type(e).__name__}: {str(e)}")
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+@contextmanager
+def suppressed():
+    """Run a block without tracing it, e.g. the exporter's own HTTP calls."""
+    token = _suppressed.set(True)
+    try:
+        yield
+    finally:
+        _suppressed.reset(token)
+
+
+def traced(name, kind=INTERNAL):
+    """Decorator running each call of a function inside its own span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with start_span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_error(error):
+    """Mark the current span as failed by an error that is handled rather than raised."""
+    span = _current_span.get()
+    if span is not None:
+        span.set_error(f"{type(error).__name__}: {str(error)}")
+
+
+def parse_traceparent(value):
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+        tuple: (trace id, parent span id), or (None, None) if absent or invalid
+    """
+    match = TRACEPARENT_RE.match((value or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+class TraceContextFilter(logging.Filter):
+    """Adds trace_id and span_id of the current span to log records."""
+
+    def filter(self, record):
+        span = _current_span.get()
+        record.trace_id = span.trace_id if span is not None else '-'
+        record.span_id = span.span_id if span is not None else '-'
+        return True
+
+
+def _begin_trace():
+    trace_id, parent_id = parse_traceparent(request.headers.get('traceparent'))
+    span = Span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+                trace_id or secrets.token_hex(16), parent_id, SERVER,
+                {'http.method': request.method, 'url.path': request.path})
+    g.trace_span = span
+    g.trace_token = _current_span.set(span)
+
+
+def _add_trace_headers(response):
+    span = g.get('trace_span')
+    if span is not None:
+        span.set_attribute('http.status_code', response.status_code)
+        if response.status_code >= 500:
+            span.set_error(f"HTTP {response.status_code}")
+        response.headers['X-Trace-Id'] = span.trace_id
+        response.headers['traceparent'] = span.traceparent
+    return response
+
+
+def _end_trace(exc=None):
+    span = g.pop('trace_span', None)
+    if span is None:
+        return
+    if exc is not None:
+        span.set_error(f"{type(exc).__name__}: {str(exc)}")
+    _current_span.reset(g.pop('trace_token'))
+    span.end()
+
+
+def init_tracing(app):
+    """
+    Trace every request and add trace ids to log output
+
+    Spans are only exported when AISPECTRUM_TRACE_FILE or
+    AISPECTRUM_OTLP_ENDPOINT is set.
+    """
+    app.before_request(_begin_trace)
+    app.after_request(_add_trace_headers)
+    app.teardown_request(_end_trace)
+    trace_filter = TraceContextFilter()
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(trace_filter)
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [trace=%(trace_id)s span=%(span_id)s] %(message)s'))
+    if exporter.enabled:
+        logger.info(f"Exporting trace spans to {' and '.join(filter(None, [exporter.path, exporter.endpoint]))}")
+        atexit.register(exporter.flush)
+
+
+# Shared span exporter for this worker
+exporter = SpanExporter()
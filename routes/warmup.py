@@ -0,0 +1,222 @@
+"""
+Connection and DNS pre-warming at startup.
+When enabled, each worker resolves the provider hostnames into the HTTP
+client's DNS cache and opens keep-alive connections to every provider host
+through the shared HTTP pool before it reports ready, so the first queries
+after a deploy do not pay for DNS, TCP and TLS setup. /api/health/ready
+returns 503 until warm-up has finished, for the load balancer's readiness
+check. Warm-up runs in each worker process, never in a preloading master.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from . import http_client
+from .metrics import metrics
+
+logger = logging.getLogger('aiSpectrum')
+
+WARMUP_ENABLED = os.environ.get('AISPECTRUM_WARMUP', '').lower() in ('1', 'true', 'yes')
+# Keep-alive connections opened per host
+WARMUP_CONNECTIONS = int(os.environ.get('AISPECTRUM_WARMUP_CONNECTIONS', 2))
+WARMUP_TIMEOUT = float(os.environ.get('AISPECTRUM_WARMUP_TIMEOUT', 5))
+
+# Origins each provider sends its requests to
+PROVIDER_ORIGINS = {
+    'openai': 'https://api.openai.com',
+    'anthropic': 'https://api.anthropic.com',
+    'deepseek': 'https://api.deepseek.ai',
+    'mistral': 'https://api.mistral.ai',
+    'gemini': 'https://generativelanguage.googleapis.com',
+    'cohere': 'https://api.cohere.ai'
+}
+
+
+def warmup_origins():
+    """
+    Return the origins to warm, from the environment
+
+    AISPECTRUM_WARMUP_HOSTS lists origins explicitly; otherwise the origins of
+    AISPECTRUM_WARMUP_PROVIDERS (default: all hosted providers) are used, plus
+    AISPECTRUM_LOCAL_ENDPOINTS when it is set.
+
+    Returns:
+        list: Origins such as 'https://api.mistral.ai'
+    """
+    if os.environ.get('AISPECTRUM_WARMUP_HOSTS'):
+        return [origin.strip().rstrip('/') for origin in os.environ['AISPECTRUM_WARMUP_HOSTS'].split(',')
+                if origin.strip()]
+    selected = os.environ.get('AISPECTRUM_WARMUP_PROVIDERS')
+    provider_ids = [p.strip() for p in selected.split(',')] if selected else list(PROVIDER_ORIGINS)
+    origins = [PROVIDER_ORIGINS[p] for p in provider_ids if p in PROVIDER_ORIGINS]
+    for endpoint in filter(None, os.environ.get('AISPECTRUM_LOCAL_ENDPOINTS', '').split(',')):
+        parts = urlsplit(endpoint.strip())
+        origins.append(f"{parts.scheme}://{parts.netloc}")
+    return origins
+
+
+class WarmupState:
+    """Progress and results of this worker's warm-up."""
+
+    def __init__(self):
+        self.status = 'disabled'
+        self.hosts = {}
+        self.started = None
+        self.finished = None
+
+    @property
+    def ready(self):
+        """True once warm-up has finished, or when it is disabled."""
+        return self.status in ('disabled', 'ready')
+
+    def as_dict(self):
+        """Return a JSON-serializable report."""
+        return {
+            'status': self.status,
+            'ready': self.ready,
+            'duration_ms': round((self.finished - self.started) * 1000, 1) if self.finished else None,
+            'hosts': self.hosts
+        }
+
+
+def warm_host(origin, connections=WARMUP_CONNECTIONS, timeout=WARMUP_TIMEOUT):
+    """
+    Resolve one origin and open keep-alive connections to it
+
+    Any HTTP status counts as success: the point is the established
+    (TLS) connection left in the pool, not the response.
+
+    Args:
+        origin (str): Scheme, host and optional port
+        connections (int): Connections to open concurrently
+        timeout (float): Per-request timeout in seconds
+
+    Returns:
+        dict: Report with addresses, timings, connections opened and any error
+    """
+    parts = urlsplit(origin)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    report = {'host': parts.hostname, 'connections': 0, 'error': None}
+    start = time.perf_counter()
+    try:
+        http_client.dns_cache.add_host(parts.hostname)
+        report['addresses'] = sorted(http_client.dns_cache.addresses(parts.hostname, port))
+        report['dns_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    except OSError as e:
+        report['error'] = f"DNS resolution failed: {str(e)}"
+        return report
+
+    # Each request holds its connection until all have one, so the pool ends
+    # up with that many distinct connections rather than one reused
+    barrier = threading.Barrier(connections)
+
+    def connect(_):
+        response = http_client.request('HEAD', f"{origin}/", timeout=timeout, allow_redirects=False, stream=True)
+        try:
+            barrier.wait(timeout)
+        except threading.BrokenBarrierError:
+            pass
+        finally:
+            # Consuming the (empty) body first returns the connection to the pool instead of closing it
+            response.content
+            response.close()
+
+    connect_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        futures = [executor.submit(connect, i) for i in range(connections)]
+        for future in futures:
+            try:
+                future.result()
+                report['connections'] += 1
+            except Exception as e:
+                report['error'] = str(e)
+    report['connect_ms'] = round((time.perf_counter() - connect_start) * 1000, 2)
+    metrics.inc('warmup_connections_total', report['connections'], host=parts.hostname)
+    return report
+
+
+def run_warmup(origins=None, connections=WARMUP_CONNECTIONS, timeout=WARMUP_TIMEOUT):
+    """
+    Warm every origin in parallel and mark the worker ready
+
+    Failing hosts are reported but do not keep the worker out of rotation.
+
+    Args:
+        origins (list): Origins to warm; defaults to warmup_origins()
+        connections (int): Keep-alive connections per host
+        timeout (float): Per-request timeout in seconds
+
+    Returns:
+        WarmupState: The updated warm-up state
+    """
+    origins = warmup_origins() if origins is None else origins
+    warmup_state.status = 'warming'
+    warmup_state.started = time.time()
+    logger.info(f"Warming {len(origins)} provider hosts with {connections} connections each")
+    if origins:
+        with ThreadPoolExecutor(max_workers=len(origins)) as executor:
+            reports = list(executor.map(lambda origin: warm_host(origin, connections, timeout), origins))
+        warmup_state.hosts = dict(zip(origins, reports))
+    warmup_state.finished = time.time()
+    warmup_state.status = 'ready'
+    failed = [origin for origin, report in warmup_state.hosts.items() if report['error']]
+    if failed:
+        logger.warning(f"Warm-up could not reach: {', '.join(failed)}")
+    metrics.observe('warmup_ms', (warmup_state.finished - warmup_state.started) * 1000)
+    logger.info(f"Warm-up finished in {warmup_state.finished - warmup_state.started:.2f}s")
+    return warmup_state
+
+
+def start_warmup():
+    """
+    Start warm-up in the background, once per process
+
+    Call it from a gunicorn post_fork hook to warm each worker as soon as it
+    is forked; otherwise the worker's first request starts it.
+
+    Returns:
+        bool: True if this call started warm-up
+    """
+    global _warmup_pid
+    pid = os.getpid()
+    if _warmup_pid == pid:
+        return False
+    with _warmup_lock:
+        if _warmup_pid == pid:
+            return False
+        _warmup_pid = pid
+    # A forked worker inherits the master's report but none of its connections
+    warmup_state.status = 'pending'
+    warmup_state.hosts = {}
+    threading.Thread(target=run_warmup, name='aispectrum-warmup', daemon=True).start()
+    return True
+
+
+def init_warmup(app):
+    """
+    Warm each worker up in the background if AISPECTRUM_WARMUP is enabled
+
+    Nothing starts at app creation, which a preloading server runs in its
+    master before forking; each worker starts warm-up on its first request
+    (usually the readiness probe) unless a post_fork hook already did. The
+    app serves requests meanwhile, but /api/health/ready answers 503 until
+    warm-up completes.
+    """
+    app.config.setdefault('WARMUP_ENABLED', WARMUP_ENABLED)
+    if not app.config['WARMUP_ENABLED']:
+        return
+    warmup_state.status = 'pending'
+
+    @app.before_request
+    def _start_warmup():
+        start_warmup()
+
+
+_warmup_pid = None
+_warmup_lock = threading.Lock()
+
+# Shared warm-up state for this worker
+warmup_state = WarmupState()
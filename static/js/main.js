@@ -44,6 +44,10 @@ document.addEventListener('DOMContentLoaded', () => {
     // State variables
     let currentLayout = 'grid'; // grid or column
     let currentQuery = '';
+    let currentConversationId = null; // Server-side conversation for follow-ups
+    let currentResultId = null; // Server-side handle for the displayed results
+    let inFlightRequestId = null; // Query still waiting on the server, if any
+    let inFlightApiKeys = null; // Its api_keys, which identify this client to /api/cancel
     let queryHistory = JSON.parse(localStorage.getItem('query-history') || '[]');
     let availableModels = {};
     let activeModels = JSON.parse(localStorage.getItem('active-models') || '["openai", "anthropic", "deepseek"]');
@@ -53,12 +57,28 @@ document.addEventListener('DOMContentLoaded', () => {
     // Initialize the UI
     initializeUI();
     
+    // Stop paying for provider calls nobody will see when the page goes away
+    window.addEventListener('pagehide', () => {
+        if (inFlightRequestId) {
+            const body = new Blob([JSON.stringify({ api_keys: inFlightApiKeys })], { type: 'application/json' });
+            navigator.sendBeacon(`/api/cancel/${inFlightRequestId}`, body);
+        }
+    });
+    
     async function initializeUI() {
-        // Check authentication status
-        await checkAuthStatus();
-        
-        // Fetch available models
-        await fetchAvailableModels();
+        // The index page inlines the auth state and model catalog; fetch them only if it did not
+        const bootstrapElement = document.getElementById('bootstrap-data');
+        const bootstrap = bootstrapElement ? JSON.parse(bootstrapElement.textContent) : null;
+        if (bootstrap) {
+            applyAuthStatus(bootstrap.auth);
+            availableModels = bootstrap.models;
+        } else {
+            // Check authentication status
+            await checkAuthStatus();
+            
+            // Fetch available models
+            await fetchAvailableModels();
+        }
         
         // Render model selectors
         renderModelSelectors();
@@ -99,20 +119,22 @@ document.addEventListener('DOMContentLoaded', () => {
                 credentials: 'include'
             });
             
-            const data = await response.json();
-            
-            if (data.authenticated) {
-                userProfile = data.user;
-                renderUserProfile();
-            } else {
-                renderLoginButton();
-            }
+            applyAuthStatus(await response.json());
         } catch (error) {
             console.error('Error checking auth status:', error);
             renderLoginButton();
         }
     }
     
+    function applyAuthStatus(data) {
+        if (data.authenticated) {
+            userProfile = data.user;
+            renderUserProfile();
+        } else {
+            renderLoginButton();
+        }
+    }
+    
     function renderUserProfile() {
         if (!userProfileElement) return;
         
@@ -807,6 +829,12 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         });
         
+        // A new query supersedes (and cancels) any query still in flight
+        const requestId = window.crypto && crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
+        const supersedes = inFlightRequestId;
+        inFlightRequestId = requestId;
+        inFlightApiKeys = apiKeys;
+        
         try {
             console.log('🚀 Sending API request to /api/query');
             console.log('📦 Request payload:', {
@@ -823,19 +851,37 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({
                     query,
                     api_keys: apiKeys,
-                    summarize: enableSummary
+                    summarize: enableSummary,
+                    // Follow-ups continue the server-side conversation; new queries start one
+                    conversation: true,
+                    conversation_id: isFollowUp ? currentConversationId : null,
+                    request_id: requestId,
+                    supersedes,
+                    // Markdown is rendered (and cached) on the server
+                    render: true
                 }),
                 credentials: 'include'
             });
             
             console.log(`🔄 Response status: ${response.status} ${response.statusText}`);
             
+            if (response.status === 503 && response.headers.get('Retry-After')) {
+                throw new Error(`The server is busy. Please try again in ${response.headers.get('Retry-After')} seconds.`);
+            }
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
+
+            currentConversationId = response.headers.get('X-Conversation-Id') || currentConversationId;
+            currentResultId = response.headers.get('X-Result-Id');
             
             console.log('✅ Response received, parsing JSON');
             const data = await response.json();
+            
+            if (inFlightRequestId !== requestId) {
+                console.log('⏭️ Ignoring response for superseded query');
+                return;
+            }
             console.log('📡 Response data:', data);
             
             // Display responses for each model
@@ -883,8 +929,8 @@ document.addEventListener('DOMContentLoaded', () => {
                             responseElement.parentNode.insertBefore(glowEffect, responseElement);
                         }
                         
-                        // Set the content
-                        responseElement.innerHTML = marked.parse(data[modelId].content);
+                        // Set the content, pre-rendered by the server when available
+                        responseElement.innerHTML = data[modelId].html || marked.parse(data[modelId].content);
                         
                         // Animate in
                         setTimeout(() => {
@@ -981,9 +1027,14 @@ document.addEventListener('DOMContentLoaded', () => {
             });
             
         } finally {
-            console.log('⏳ Hiding loading indicator');
-            // Hide loading indicator
-            loadingIndicator.classList.add('hidden');
+            if (inFlightRequestId === requestId) {
+                inFlightRequestId = null;
+            }
+            // Hide loading indicator unless a newer query is still running
+            if (!inFlightRequestId) {
+                console.log('⏳ Hiding loading indicator');
+                loadingIndicator.classList.add('hidden');
+            }
         }
     }
     
@@ -998,7 +1049,7 @@ document.addEventListener('DOMContentLoaded', () => {
         
         if (summaryData.status === 'success') {
             // Set content
-            summaryContent.innerHTML = marked.parse(summaryData.content);
+            summaryContent.innerHTML = summaryData.html || marked.parse(summaryData.content);
             
             // Add rainbow prism effect
             const prismEffect = document.createElement('div');
@@ -1052,6 +1103,28 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
     
+    // POST a request about the current results, referring to them by result id when the
+    // server still has them and uploading the full payload only when it does not
+    async function postForResults(url, payload, buildFullPayload) {
+        const post = (body) => fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify(body),
+            credentials: 'include'
+        });
+        if (currentResultId) {
+            const response = await post({ ...payload, result_id: currentResultId });
+            if (response.status !== 404) {
+                return response;
+            }
+            console.log('ℹ️ Stored results expired, uploading responses');
+            currentResultId = null;
+        }
+        return post({ ...payload, ...buildFullPayload() });
+    }
+    
     // Export function to download responses in different formats
     async function exportResponses(format = 'json') {
         if (!currentQuery) {
@@ -1097,19 +1170,14 @@ document.addEventListener('DOMContentLoaded', () => {
         
         try {
             // Call the export API
-            const response = await fetch('/api/export', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    query: currentQuery,
-                    responses: currentResponses,
-                    summary: summaryData,
-                    format: format,
-                    include_summary: !!summaryData
-                })
-            });
+            const response = await postForResults('/api/export', {
+                format: format,
+                include_summary: !!summaryData
+            }, () => ({
+                query: currentQuery,
+                responses: currentResponses,
+                summary: summaryData
+            }));
             
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -1243,18 +1311,12 @@ document.addEventListener('DOMContentLoaded', () => {
             }
             
             // Send request to summarize
-            const response = await fetch('/api/summarize', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({
-                    query: currentQuery,
-                    responses: currentResponses,
-                    api_keys: apiKeys
-                }),
-                credentials: 'include'
-            });
+            const response = await postForResults('/api/summarize', {
+                api_keys: apiKeys
+            }, () => ({
+                query: currentQuery,
+                responses: currentResponses
+            }));
             
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Test script for admission control and load shedding
+"""
+
+import unittest
+import json
+import threading
+import time
+from unittest.mock import patch
+from flask import session
+from app import app
+from routes import admission, providers
+from routes.admission import AdaptiveLimit, AdmissionController, OverloadedError, query_admission, request_priority
+from routes.metrics import metrics
+from routes.state import MemoryBackend
+
+
+class TestAdmission(unittest.TestCase):
+    """Test cases for the admission controller"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        metrics.reset()
+
+    def _controller(self, queue_limits=None, max_queue_wait=2):
+        limit = AdaptiveLimit(initial=1, min_limit=1, max_limit=1)
+        return AdmissionController(limit, queue_limits or {'high': 5, 'normal': 5, 'low': 5},
+                                   max_queue_wait=max_queue_wait, name='test')
+
+    def test_full_queue_sheds_immediately(self):
+        """Test that a request is rejected at once when its queue is full"""
+        controller = self._controller(queue_limits={'high': 0, 'normal': 0, 'low': 0})
+        controller.acquire()
+        start = time.monotonic()
+        with self.assertRaises(OverloadedError) as ctx:
+            controller.acquire()
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(ctx.exception.reason, 'queue_full')
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        print("✅ Full queues shed requests immediately")
+
+    def test_queue_timeout_sheds(self):
+        """Test that a queued request is shed when its wait runs out"""
+        controller = self._controller(max_queue_wait=0.1)
+        controller.acquire()
+        with self.assertRaises(OverloadedError) as ctx:
+            controller.acquire()
+        self.assertEqual(ctx.exception.reason, 'queue_timeout')
+        counters = {(c['name'], c['labels'].get('reason')): c['value'] for c in metrics.snapshot()['counters']}
+        self.assertEqual(counters[('admission_shed_total', 'queue_timeout')], 1)
+        print("✅ Queued requests are shed after the maximum wait")
+
+    def test_higher_priority_admitted_first(self):
+        """Test that a freed slot goes to the highest priority waiter"""
+        controller = self._controller()
+        controller.acquire()
+        order = []
+
+        def wait_for_slot(priority):
+            controller.acquire(priority)
+            order.append(priority)
+            controller.release(0.01)
+
+        low = threading.Thread(target=wait_for_slot, args=('low',))
+        low.start()
+        time.sleep(0.05)
+        high = threading.Thread(target=wait_for_slot, args=('high',))
+        high.start()
+        time.sleep(0.05)
+        gauges = {(g['name'], g['labels'].get('priority')): g['value'] for g in metrics.snapshot()['gauges']}
+        self.assertEqual(gauges[('admission_queue_depth', 'low')], 1)
+
+        controller.release(0.01)
+        low.join(timeout=2)
+        high.join(timeout=2)
+        self.assertEqual(order, ['high', 'low'])
+        print("✅ Higher priority requests are admitted first")
+
+    def test_limit_adapts_to_latency(self):
+        """Test that the limit grows under steady latency and shrinks when it climbs"""
+        limit = AdaptiveLimit(initial=10, min_limit=2, max_limit=100)
+        for _ in range(50):
+            limit.update(1.0)
+        grown = int(limit)
+        self.assertGreater(grown, 10)
+        for _ in range(20):
+            limit.update(10.0)
+        self.assertLess(int(limit), grown)
+        print("✅ The concurrency limit adapts to latency")
+
+    def test_query_endpoint_returns_503(self):
+        """Test that /api/query answers 503 with Retry-After when saturated"""
+        with patch.object(query_admission, 'in_flight', int(query_admission.limit)), \
+                patch.dict(query_admission.queue_limits, {'normal': 0}):
+            response = self.client.post('/api/query', data=json.dumps({'query': 'Hi', 'api_keys': {}}),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(json.loads(response.data)['error_code'], 'overloaded')
+        # A shed request can be found in the logs and traces by the id it reports
+        self.assertEqual(json.loads(response.data)['request_id'], response.headers['X-Trace-Id'])
+
+        response = self.client.post('/api/query', data=json.dumps({'query': 'Hi', 'api_keys': {}}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        print("✅ /api/query is shed with 503 and Retry-After under overload")
+
+    def test_raising_priority_needs_authentication(self):
+        """Test that only admins and allow-listed users can raise their priority, but anyone may lower it"""
+        def priority(headers, user=None):
+            with app.test_request_context('/api/query', method='POST', headers=headers):
+                if user:
+                    session['user'] = user
+                return request_priority()
+
+        with patch('routes.profiling.ADMIN_TOKEN', 'admin-secret'):
+            self.assertEqual(priority({'X-Priority': 'high'}), 'normal')
+            self.assertEqual(priority({'X-Priority': 'high', 'X-Admin-Token': 'wrong'}), 'normal')
+            self.assertEqual(priority({'X-Priority': 'high', 'X-Admin-Token': 'admin-secret'}), 'high')
+            self.assertEqual(priority({'X-Priority': 'high'}, user={'id': 'bob', 'email': 'bob@b.com'}), 'normal')
+            with patch('routes.auth.PRIORITY_USERS', {'alice@a.com'}):
+                self.assertEqual(priority({'X-Priority': 'high'}, user={'id': 'alice', 'email': 'Alice@a.com'}),
+                                 'high')
+            self.assertEqual(priority({'X-Priority': 'low'}), 'low')
+            self.assertEqual(priority({'X-Priority': 'urgent'}), 'normal')
+        print("✅ Only admins and allow-listed users can raise their priority")
+
+    def test_query_rate_limit_per_caller(self):
+        """Test that a caller over its rate limit gets 429 while others are still served"""
+        module = providers.get_provider('mistral')
+        result = {'content': 'Paris.', 'model': 'mistral-large-latest', 'status': 'success'}
+
+        def query(key):
+            return self.client.post('/api/query', data=json.dumps({
+                'query': 'Capital of France?', 'api_keys': {'mistral': {'key': key}}
+            }), content_type='application/json')
+
+        with patch('routes.state.state', MemoryBackend()), \
+                patch.object(admission, 'RATE_LIMIT_PER_MINUTE', 1), \
+                patch.object(admission, 'RATE_LIMIT_BURST', 2), \
+                patch.object(module, 'call', return_value=result) as mock_call:
+            statuses = [query('first').status_code for _ in range(3)]
+            limited = query('first')
+            junk = self.client.post('/api/query', data=json.dumps({
+                'query': 'Capital of France?', 'api_keys': {'mistral': {'key': 'first'}, 'zzz': {'key': 'random'}}
+            }), content_type='application/json')
+            other = query('second')
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(limited.headers['Retry-After'], '60')
+        self.assertEqual(json.loads(limited.data)['error_code'], 'rate_limit')
+        # Keys of providers that do not exist are not part of the caller's identity
+        self.assertEqual(junk.status_code, 429)
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(mock_call.call_count, 3)
+        print("✅ /api/query is rate limited per caller")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Admission Control ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestAdmission)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Test script for the batch execution backend against the local stand-in
+"""
+
+import unittest
+import json
+import os
+import tempfile
+from unittest.mock import patch
+from routes import providers
+from routes.batch import run_batch
+from routes.batch_standin import serve
+from routes.evaluate import evaluate
+
+
+def responder(model, messages):
+    """Stand-in answer failing for one prompt."""
+    if 'fail' in messages[-1]['content']:
+        raise RuntimeError("model overloaded")
+    return f"[{model}] {messages[-1]['content']}"
+
+
+class TestBatch(unittest.TestCase):
+    """Test cases for batch submission, polling, result mapping and fallback"""
+
+    def setUp(self):
+        """Start the batch stand-in"""
+        self.server = serve(port=0, delay=0.2, responder=responder)
+        base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.api_keys = {
+            'openai': {'key': 'test', 'model': 'gpt-4o-mini', 'batch_url': f"{base}/openai/v1"},
+            'anthropic': {'key': 'test', 'batch_url': f"{base}/anthropic/v1/messages/batches"},
+            'mistral': {'key': 'test'}
+        }
+        self.live = patch.object(providers.get_provider('mistral'), 'call',
+                                 return_value={'content': 'live', 'model': 'mistral-large-latest', 'status': 'success'})
+        self.live.start()
+        self.addCleanup(self.live.stop)
+
+    def tearDown(self):
+        """Stop the stand-in"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_results_match_query_shape(self):
+        """Test that batch results come back per query in the /api/query result shape"""
+        results = run_batch(['Capital of France?', 'please fail'], self.api_keys, poll_interval=0.05)
+        first, second = results
+        self.assertEqual(list(first), ['openai', 'anthropic', 'mistral'])
+        self.assertEqual(first['openai']['content'], '[gpt-4o-mini] Capital of France?')
+        self.assertEqual(first['openai']['status'], 'success')
+        self.assertGreater(first['openai']['usage']['prompt_tokens'], 0)
+        self.assertTrue(first['anthropic']['batch_id'].startswith('msgbatch_'))
+        self.assertEqual(first['anthropic']['content'], '[claude-3-opus-20240229] Capital of France?')
+        self.assertEqual(first['mistral']['content'], 'live')
+        self.assertNotIn('batch_id', first['mistral'])
+        for key in ('openai', 'anthropic'):
+            self.assertEqual(second[key]['status'], 'error')
+            self.assertIn('model overloaded', second[key]['error_details'])
+        self.assertEqual(len(self.server.service.batches), 2)
+        print("✅ Batch results map back to per-provider results")
+
+    def test_submit_failure_falls_back_to_live(self):
+        """Test that a provider whose batch cannot be submitted is called live"""
+        api_keys = {'anthropic': dict(self.api_keys['anthropic'], batch_url=self.api_keys['openai']['batch_url'])}
+        live = {'content': 'live answer', 'model': 'claude', 'status': 'success'}
+        with patch.object(providers.get_provider('anthropic'), 'call', return_value=live):
+            results = run_batch(['Capital of France?'], api_keys, poll_interval=0.05)
+        self.assertEqual(results[0]['anthropic']['content'], 'live answer')
+        print("✅ Providers fall back to live calls")
+
+    def test_timed_out_batches_are_cancelled(self):
+        """Test that batches still running at the timeout are cancelled upstream and their queries fail"""
+        self.server.service.delay = 30
+        results = run_batch(['Capital of France?'], self.api_keys, poll_interval=0.05, timeout=0.2)
+        for key in ('openai', 'anthropic'):
+            self.assertEqual(results[0][key]['status'], 'error')
+            self.assertIn('was cancelled', results[0][key]['error_details'])
+        self.assertEqual(results[0]['mistral']['content'], 'live')
+        self.assertEqual(len(self.server.service.batches), 2)
+        self.assertTrue(all(batch.get('cancelled') for batch in self.server.service.batches.values()))
+        print("✅ Timed-out batches are cancelled upstream")
+
+    def test_evaluate_resumes_submitted_batches(self):
+        """Test that an interrupted batch evaluation reuses its submitted batches"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dataset = os.path.join(tmpdir, 'prompts.jsonl')
+            with open(dataset, 'w') as f:
+                for i in range(3):
+                    f.write(json.dumps({'id': i, 'prompt': f'Question {i}?'}) + '\n')
+            output = os.path.join(tmpdir, 'out.jsonl')
+            api_keys = {'openai': self.api_keys['openai']}
+
+            with patch('routes.batch.time.sleep', side_effect=KeyboardInterrupt):
+                with self.assertRaises(KeyboardInterrupt):
+                    evaluate(dataset, output, api_keys, chunk_size=10, backend='batch', poll_interval=0.05)
+            with open(output + '.checkpoint.json') as f:
+                self.assertIn('openai', json.load(f)['batches'])
+
+            checkpoint = evaluate(dataset, output, api_keys, chunk_size=10, backend='batch', poll_interval=0.05)
+            self.assertEqual(checkpoint['rows_done'], 3)
+            self.assertEqual(checkpoint['batches'], {})
+            self.assertEqual(len(self.server.service.batches), 1)
+            with open(output) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual([row['openai_content'] for row in rows],
+                             [f'[gpt-4o-mini] Question {i}?' for i in range(3)])
+        print("✅ Resumed evaluations pick up submitted batches")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Batch Backend ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBatch)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
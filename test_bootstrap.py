@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Test script for the bootstrap data inlined into the index page
+"""
+
+import unittest
+import json
+import re
+from app import app
+from routes.api import AVAILABLE_MODELS, MODEL_CATALOG_VERSION
+
+
+def bootstrap_data(html):
+    """Parse the bootstrap JSON out of the index page."""
+    match = re.search(r'<script id="bootstrap-data" type="application/json">(.*?)</script>', html, re.S)
+    return json.loads(match.group(1))
+
+
+class TestBootstrap(unittest.TestCase):
+    """Test cases for the inlined model catalog and auth state"""
+
+    def setUp(self):
+        """Set up a test client"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_index_inlines_catalog_and_auth(self):
+        """Test that the index page carries the catalog, its version and the auth state"""
+        data = bootstrap_data(self.client.get('/').get_data(as_text=True))
+        self.assertEqual(data['models'], AVAILABLE_MODELS)
+        self.assertEqual(data['models_version'], MODEL_CATALOG_VERSION)
+        self.assertEqual(data['auth'], {'authenticated': False})
+
+        user = {'name': '</script><script>alert(1)</script>', 'email': 'a@example.com'}
+        with self.client.session_transaction() as session:
+            session['user'] = user
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertNotIn('<script>alert(1)', html)
+        self.assertEqual(bootstrap_data(html)['auth'], {'authenticated': True, 'user': user})
+        print("✅ Index page inlines the catalog and auth state")
+
+    def test_conditional_requests(self):
+        """Test that an unchanged index page and catalog revalidate with 304"""
+        first = self.client.get('/')
+        self.assertEqual(first.headers['Cache-Control'], 'private, no-cache')
+        again = self.client.get('/', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(again.status_code, 304)
+        with self.client.session_transaction() as session:
+            session['user'] = {'name': 'Ada', 'email': 'ada@example.com'}
+        self.assertEqual(self.client.get('/', headers={'If-None-Match': first.headers['ETag']}).status_code, 200)
+
+        models = self.client.get('/api/models')
+        self.assertEqual(models.headers['ETag'], f'"{MODEL_CATALOG_VERSION}"')
+        self.assertEqual(self.client.get('/api/models', headers={'If-None-Match': models.headers['ETag']}).status_code, 304)
+        print("✅ Index page and catalog are revalidated by ETag")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Index Bootstrap ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBootstrap)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
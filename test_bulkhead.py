@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Test script for per-provider bulkheads
+"""
+
+import unittest
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.bulkhead import Bulkhead, BulkheadFullError, ProviderBulkheads
+
+
+def answer(delay=0.0):
+    """Stand-in provider call answering after a delay."""
+    def call(query, config, history=None):
+        time.sleep(delay)
+        return {'content': 'Paris.', 'model': config.get('model', 'm'), 'status': 'success'}
+    return call
+
+
+class TestBulkhead(unittest.TestCase):
+    """Test cases for bulkhead limits, queueing and isolation between providers"""
+
+    def setUp(self):
+        """Set up a client and small bulkheads"""
+        app.config['TESTING'] = True
+        self.bulkheads = ProviderBulkheads(provider_limits={}, default_limit=1, key_limit=4,
+                                           max_queue=1, queue_timeout=2)
+        patcher = patch('routes.api.bulkheads', self.bulkheads)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _query(self, api_keys):
+        payload = {'query': 'Capital of France?', 'dedup': False, 'api_keys': api_keys}
+        response = app.test_client().post('/api/query', data=json.dumps(payload), content_type='application/json')
+        return json.loads(response.data)
+
+    def test_queue_full_and_timeout(self):
+        """Test that a full bulkhead queues one call and rejects the rest"""
+        bulkhead = Bulkhead('test', max_concurrent=1, max_queue=1)
+        bulkhead.acquire()
+        with self.assertRaises(BulkheadFullError) as timeout:
+            bulkhead.acquire(timeout=0.05)
+        self.assertEqual(timeout.exception.reason, 'queue_timeout')
+
+        waiter = threading.Thread(target=bulkhead.acquire, kwargs={'timeout': 2})
+        waiter.start()
+        time.sleep(0.05)
+        with self.assertRaises(BulkheadFullError) as full:
+            bulkhead.acquire(timeout=1)
+        self.assertEqual(full.exception.reason, 'queue_full')
+        bulkhead.release()
+        waiter.join()
+
+        snapshot = bulkhead.snapshot()
+        self.assertEqual(snapshot['active'], 1)
+        self.assertEqual(snapshot['utilization'], 1.0)
+        self.assertEqual(snapshot['admitted'], 2)
+        self.assertEqual(snapshot['rejected'], {'queue_full': 1, 'queue_timeout': 1})
+        print("✅ Bulkheads queue a bounded number of calls and reject the rest")
+
+    def test_slow_provider_does_not_starve_others(self):
+        """Test that calls to a saturated provider are rejected while other providers stay fast"""
+        with patch.object(providers.get_provider('gemini'), 'call', side_effect=answer(0.5)), \
+                patch.object(providers.get_provider('mistral'), 'call', side_effect=answer()):
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                slow = [pool.submit(self._query, {'gemini': {'key': f'k{i}'}}) for i in range(3)]
+                time.sleep(0.1)
+                started = time.monotonic()
+                fast = self._query({'mistral': {'key': 'k'}})
+                elapsed = time.monotonic() - started
+                results = [future.result()['gemini'] for future in slow]
+
+        self.assertLess(elapsed, 0.3)
+        self.assertEqual(fast['mistral']['status'], 'success')
+        statuses = sorted(result.get('error_code', result['status']) for result in results)
+        self.assertEqual(statuses, ['provider_busy', 'success', 'success'])
+        snapshot = self.bulkheads.snapshot()
+        self.assertEqual(snapshot['gemini']['rejected']['queue_full'], 1)
+        self.assertEqual(snapshot['mistral']['rejected'], {'queue_full': 0, 'queue_timeout': 0})
+        print("✅ A saturated provider does not slow down the others")
+
+    def test_per_key_limit(self):
+        """Test that one API key is limited within its provider"""
+        bulkheads = ProviderBulkheads(provider_limits={}, default_limit=4, key_limit=1, max_queue=0, queue_timeout=1)
+        plan = {'provider_id': 'mistral', 'config': {'key': 'shared'}}
+        with bulkheads.slot(plan):
+            with self.assertRaises(BulkheadFullError):
+                with bulkheads.slot(plan):
+                    pass
+            with bulkheads.slot({'provider_id': 'mistral', 'config': {'key': 'other'}}):
+                pass
+        names = set(bulkheads.snapshot())
+        self.assertIn('mistral', names)
+        self.assertFalse(any('shared' in name for name in names))
+        self.assertEqual(bulkheads.provider('mistral').active, 0)
+        print("✅ API keys have their own limit within a provider")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Bulkheads ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestBulkhead)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+Test script for cancelling in-flight queries
+"""
+
+import unittest
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from app import app
+from routes.cancellation import CancellationRegistry
+from routes.metrics import metrics
+from routes.providers import mistral_provider, openai_provider
+
+
+class SlowStreamHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible stand-in that streams one token every 100 ms"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        try:
+            for _ in range(100):
+                event = {'choices': [{'delta': {'content': 'word '}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(0.1)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.aborted.set()
+        self.close_connection = True
+
+
+class SlowCompletionHandler(BaseHTTPRequestHandler):
+    """Chat completions stand-in that is slow to answer, or slow to send its body"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        try:
+            if payload.get('stream'):
+                # OpenAI SDK: a token every 100 ms
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                for _ in range(50):
+                    chunk = {'id': 'c', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'gpt-4o',
+                             'choices': [{'index': 0, 'delta': {'content': 'word '}, 'finish_reason': None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(0.1)
+                self.wfile.write(b"data: [DONE]\n\n")
+                return
+            body = json.dumps({'choices': [{'message': {'content': 'word ' * 500}}]}).encode()
+            if self.path.endswith('/slow-headers'):
+                # The whole completion is generated before anything is sent
+                time.sleep(5)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            for start in range(0, len(body), 50):
+                self.wfile.write(body[start:start + 50])
+                self.wfile.flush()
+                time.sleep(0.05)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.server.finished.set()
+        self.close_connection = True
+
+
+class TestCancellation(unittest.TestCase):
+    """Test cases for query cancellation"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start a slow streaming stand-in server"""
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), SlowStreamHandler)
+        cls.server.aborted = threading.Event()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the stand-in server"""
+        cls.server.shutdown()
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        metrics.reset()
+
+    def _query(self, request_id, results):
+        endpoint = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        response = app.test_client().post('/api/query', data=json.dumps({
+            'query': 'Write a long essay',
+            'api_keys': {'local': {'endpoint': endpoint, 'model': 'slow'}},
+            'request_id': request_id
+        }), content_type='application/json')
+        results[request_id] = (response.headers.get('X-Request-Id'), json.loads(response.data))
+
+    def test_cancel_endpoint_aborts_stream(self):
+        """Test that /api/cancel stops a query and closes its upstream stream"""
+        results = {}
+        worker = threading.Thread(target=self._query, args=('cancel-me', results))
+        start = time.time()
+        worker.start()
+        time.sleep(0.5)
+
+        # Another caller (other keys) cannot cancel it, even knowing its id
+        other = self.client.post('/api/cancel/cancel-me', data=json.dumps({'api_keys': {'mistral': {'key': 'x'}}}),
+                                 content_type='application/json')
+        self.assertEqual(other.status_code, 404)
+        response = self.client.post('/api/cancel/cancel-me')
+        self.assertEqual(response.status_code, 200)
+        worker.join(timeout=5)
+
+        self.assertLess(time.time() - start, 3)
+        request_id, data = results['cancel-me']
+        self.assertEqual(request_id, 'cancel-me')
+        self.assertEqual(data['local']['status'], 'cancelled')
+        self.assertTrue(self.server.aborted.wait(timeout=3))
+
+        counters = {c['name']: c['value'] for c in metrics.snapshot()['counters']}
+        self.assertEqual(counters.get('provider_cancelled_total'), 1)
+        print("✅ Cancelling a query aborts its in-flight stream")
+
+    def test_superseding_query_cancels_previous(self):
+        """Test that a query naming 'supersedes' cancels the earlier one"""
+        results = {}
+        worker = threading.Thread(target=self._query, args=('first', results))
+        worker.start()
+        time.sleep(0.3)
+
+        self.client.post('/api/query', data=json.dumps({
+            'query': 'Never mind', 'api_keys': {}, 'supersedes': 'first'
+        }), content_type='application/json')
+        worker.join(timeout=5)
+
+        self.assertEqual(results['first'][1]['local']['status'], 'cancelled')
+        print("✅ A superseding query cancels the previous one")
+
+    def _cancel_during(self, module, api_keys):
+        """
+        Run a query against the slow completion stand-in, cancel it after 0.3 s
+        and return how long the provider call itself kept running
+        """
+        results, call = {}, module.call
+
+        def timed_call(*args, **kwargs):
+            try:
+                return call(*args, **kwargs)
+            finally:
+                results['ended'] = time.time()
+
+        def query():
+            response = app.test_client().post('/api/query', data=json.dumps({
+                'query': 'Write a long essay', 'dedup': False, 'api_keys': api_keys, 'request_id': 'slow-call'
+            }), content_type='application/json')
+            results['data'] = json.loads(response.data)
+
+        with patch.object(module, 'call', side_effect=timed_call):
+            worker = threading.Thread(target=query)
+            start = time.time()
+            worker.start()
+            time.sleep(0.3)
+            cancel = self.client.post('/api/cancel/slow-call', data=json.dumps({'api_keys': api_keys}),
+                                      content_type='application/json')
+            self.assertEqual(cancel.status_code, 200)
+            worker.join(timeout=5)
+            deadline = time.time() + 6
+            while 'ended' not in results and time.time() < deadline:
+                time.sleep(0.05)
+        return results['ended'] - start, results['data']
+
+    def test_cancel_interrupts_non_streaming_calls(self):
+        """Test that cancelling aborts a call waiting for headers, and one still receiving its body"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), SlowCompletionHandler)
+        server.finished = threading.Event()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+        for path in ('slow-headers', 'slow-body'):
+            with patch.object(mistral_provider, 'API_URL', f"{base}/{path}"):
+                elapsed, data = self._cancel_during(mistral_provider, {'mistral': {'key': 'k'}})
+            self.assertLess(elapsed, 1.5, path)
+            self.assertEqual(data['mistral']['status'], 'cancelled', path)
+
+        server.finished.clear()
+        with patch.object(openai_provider, 'API_BASE', base):
+            elapsed, data = self._cancel_during(openai_provider, {'openai': {'key': 'k'}})
+        self.assertLess(elapsed, 1.5)
+        self.assertEqual(data['openai']['status'], 'cancelled')
+        # The stand-in stops sending once the closed connection makes its writes fail
+        self.assertTrue(server.finished.wait(timeout=3))
+        print("✅ Cancelling aborts in-flight non-streaming and SDK calls")
+
+    def test_request_ids_are_scoped_to_the_caller(self):
+        """Test that a caller reusing another caller's request id neither cancels nor replaces its token"""
+        registry = CancellationRegistry()
+        alice = registry.start('shared-id', 'key:alice')
+        bob = registry.start('shared-id', 'key:bob')
+        self.assertTrue(registry.cancel('shared-id', 'key:bob'))
+        self.assertTrue(bob.cancelled)
+        self.assertFalse(alice.cancelled)
+
+        # A later query of the same caller with the same id keeps its token when the earlier one finishes
+        newer = registry.start('shared-id', 'key:alice')
+        registry.finish('shared-id', 'key:alice', alice)
+        self.assertTrue(registry.cancel('shared-id', 'key:alice'))
+        self.assertTrue(newer.cancelled)
+        print("✅ Request ids only name queries of the same caller")
+
+    def test_cancel_unknown_request(self):
+        """Test cancelling a query that is not running"""
+        response = self.client.post('/api/cancel/does-not-exist')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(json.loads(response.data)['cancelled'])
+        print("✅ Cancelling an unknown query returns 404")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Cancellation ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCancellation)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Test script for API response compression and the fast JSON provider
+"""
+
+import unittest
+import gzip
+import json
+from app import app
+from routes.metrics import metrics
+
+
+class TestCompression(unittest.TestCase):
+    """Test cases for response compression and JSON serialization"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        app.config['COMPRESS_MIN_SIZE'] = 1024
+        self.client = app.test_client()
+        metrics.reset()
+
+    def test_gzip_negotiated(self):
+        """Test that large API responses are gzip-compressed when accepted"""
+        response = self.client.get('/api/models', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertIn('Accept-Encoding', response.headers.get('Vary', ''))
+
+        data = json.loads(gzip.decompress(response.data))
+        self.assertIn('openai', data)
+
+        names = [o['name'] for o in metrics.snapshot()['observations']]
+        self.assertIn('compression_ratio', names)
+        self.assertIn('compression_encode_ms', names)
+        print("✅ gzip compression is negotiated correctly")
+
+    def test_no_compression_without_accept_encoding(self):
+        """Test that responses stay uncompressed when the client does not ask"""
+        response = self.client.get('/api/models')
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        self.assertIn('openai', json.loads(response.data))
+        print("✅ Uncompressed responses are served by default")
+
+    def test_small_responses_not_compressed(self):
+        """Test that responses under the size threshold are not compressed"""
+        response = self.client.get('/api/auth/status', headers={'Accept-Encoding': 'gzip'})
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+        print("✅ Small responses skip compression")
+
+    def test_json_provider_roundtrip(self):
+        """Test that the JSON provider serializes and parses consistently"""
+        payload = {'b': 1, 'a': [1, 2, {'x': 'é'}], 3: None}
+        encoded = app.json.dumps(payload)
+        decoded = app.json.loads(encoded)
+        self.assertEqual(decoded, {'a': [1, 2, {'x': 'é'}], 'b': 1, '3': None})
+        print("✅ JSON provider round-trips payloads")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Compression ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCompression)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Test script for multi-turn conversations and prompt caching
+"""
+
+import unittest
+import json
+import threading
+import time
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.conversations import ConversationStore, truncate_history
+from routes.latency import LatencyStats, latency_key
+
+
+class TestConversations(unittest.TestCase):
+    """Test cases for server-side conversation sessions"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_truncate_history_drops_whole_turns(self):
+        """Test that truncation drops the oldest turns down to the target"""
+        messages = []
+        for i in range(10):
+            messages.append({'role': 'user', 'content': 'q' * 400})
+            messages.append({'role': 'assistant', 'content': 'a' * 400})
+
+        retained, dropped = truncate_history(messages, 1000)
+
+        self.assertGreater(dropped, 0)
+        self.assertEqual(retained[0]['role'], 'user')
+        self.assertEqual(retained, messages[dropped * 2:])
+        self.assertLessEqual(sum(len(m['content']) for m in retained) / 4, 750)
+        print("✅ truncate_history keeps the newest whole turns")
+
+    def test_store_history_is_per_provider(self):
+        """Test that each provider keeps its own history"""
+        store = ConversationStore()
+        conversation = store.create()
+        store.append_turn(conversation['id'], 'openai', 'Hi', 'Hello from OpenAI')
+        store.append_turn(conversation['id'], 'anthropic', 'Hi', 'Hello from Claude')
+
+        self.assertEqual(store.history(conversation['id'], 'openai')[1]['content'], 'Hello from OpenAI')
+        self.assertEqual(store.history(conversation['id'], 'anthropic')[1]['content'], 'Hello from Claude')
+        self.assertEqual(store.history(conversation['id'], 'mistral'), [])
+        print("✅ Conversation histories are kept per provider")
+
+    def test_follow_up_sends_history(self):
+        """Test that a follow-up query sends the previous turn to the provider"""
+        module = providers.get_provider('mistral')
+        result = {'content': 'Paris', 'model': 'mistral-small-latest', 'status': 'success'}
+        api_keys = {'mistral': {'key': 'k'}}
+
+        with patch.object(module, 'call', return_value=result) as mock_call:
+            first = self.client.post('/api/query', data=json.dumps({
+                'query': 'Capital of France?', 'api_keys': api_keys, 'conversation': True
+            }), content_type='application/json')
+            conversation_id = first.headers['X-Conversation-Id']
+
+            self.client.post('/api/query', data=json.dumps({
+                'query': 'And its population?', 'api_keys': api_keys, 'conversation_id': conversation_id
+            }), content_type='application/json')
+
+        history = mock_call.call_args.kwargs['history']
+        self.assertEqual([m['content'] for m in history], ['Capital of France?', 'Paris'])
+
+        conversation = json.loads(self.client.get(f'/api/conversations/{conversation_id}').data)
+        self.assertEqual(conversation['turns'], 2)
+        self.assertEqual(self.client.delete(f'/api/conversations/{conversation_id}').status_code, 200)
+        print("✅ Follow-up queries include server-side history")
+
+    def test_truncation_kept_only_after_a_turn(self):
+        """Test that estimating or failing with a small history budget never erases the stored history"""
+        module = providers.get_provider('mistral')
+        api_keys = {'mistral': {'key': 'k'}}
+        store = ConversationStore()
+        conversation = store.create()
+        for turn in range(4):
+            store.append_turn(conversation['id'], 'mistral', f'Question {turn}?', f'Answer {turn}.')
+
+        def query(path, **extra):
+            return self.client.post(path, data=json.dumps(dict({
+                'query': 'And then?', 'api_keys': api_keys, 'conversation_id': conversation['id'],
+                'history_token_budget': 12}, **extra)), content_type='application/json')
+
+        def stored():
+            return [m['content'] for m in store.get(conversation['id'])['histories']['mistral']]
+
+        with patch('routes.api.conversations', store):
+            self.assertEqual(query('/api/estimate').status_code, 200)
+            self.assertEqual(len(stored()), 8)
+            with patch.object(module, 'call', side_effect=Exception('Upstream failure')):
+                query('/api/query')
+            self.assertEqual(len(stored()), 8)
+
+            with patch.object(module, 'call', return_value={'content': 'Done.', 'model': 'm',
+                                                            'status': 'success'}) as mock_call:
+                query('/api/query')
+        sent = [m['content'] for m in mock_call.call_args.kwargs['history']]
+        self.assertLess(len(sent), 8)
+        self.assertEqual(stored(), sent + ['And then?', 'Done.'])
+        self.assertEqual(store.get(conversation['id'])['truncated_turns']['mistral'], (8 - len(sent)) // 2)
+        print("✅ History truncation is only kept once a turn succeeds")
+
+    def test_hedged_turn_is_recorded_once(self):
+        """Test that only the returned answer of a hedged query enters the history"""
+        latency = LatencyStats(min_samples=1)
+        latency.record(latency_key({'result_key': 'mistral', 'model': 'mistral-large-latest'}), 0.05)
+        attempts, lock = [], threading.Lock()
+
+        def call(query, config, history=None):
+            with lock:
+                attempts.append(config)
+                first = len(attempts) == 1
+            # The slow primary loses the race but still finishes afterwards
+            time.sleep(0.5 if first else 0.0)
+            return {'content': 'Slow Paris' if first else 'Fast Paris', 'model': config['model'], 'status': 'success'}
+
+        with patch('routes.api.provider_latency', latency), \
+                patch.object(providers.get_provider('mistral'), 'call', side_effect=call):
+            response = self.client.post('/api/query', data=json.dumps({
+                'query': 'Capital of France?', 'mode': 'hedged', 'conversation': True,
+                'api_keys': {'mistral': {'key': 'k', 'model': 'mistral-large-latest'}}
+            }), content_type='application/json')
+            time.sleep(0.7)
+        self.assertEqual(len(attempts), 2)
+
+        conversation = json.loads(self.client.get(f"/api/conversations/{response.headers['X-Conversation-Id']}").data)
+        self.assertEqual([m['content'] for m in conversation['histories']['mistral']],
+                         ['Capital of France?', 'Fast Paris'])
+        print("✅ A hedged query records its turn once")
+
+    def test_anthropic_cache_breakpoint(self):
+        """Test that Anthropic history gets a cache_control breakpoint"""
+        module = providers.get_provider('anthropic')
+        messages = [
+            {'role': 'user', 'content': 'Q1'},
+            {'role': 'assistant', 'content': 'A1'},
+            {'role': 'user', 'content': 'Q2'}
+        ]
+        marked = module.with_cache_breakpoint(messages)
+
+        self.assertEqual(marked[1]['content'][0]['cache_control'], {'type': 'ephemeral'})
+        self.assertEqual(marked[2], messages[2])
+        print("✅ Anthropic requests mark the cached history prefix")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Conversations ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestConversations)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Test script for near-duplicate query detection
+"""
+
+import unittest
+import json
+import os
+import tempfile
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.dedup import DedupIndex
+from routes.state import SQLiteBackend
+
+
+class TestDedup(unittest.TestCase):
+    """Test cases for the dedup index and its use in /api/query"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'state.sqlite3')
+        self.index = DedupIndex()
+        self.result = {'content': 'Paris.', 'model': 'mistral-large-latest', 'status': 'success'}
+
+    def tearDown(self):
+        """Remove the temporary state database"""
+        self.tmpdir.cleanup()
+
+    def _query(self, payload, client=None):
+        response = (client or self.client).post('/api/query', data=json.dumps(payload),
+                                                content_type='application/json')
+        return response, json.loads(response.data)
+
+    def _owner(self, client):
+        with client.session_transaction() as session:
+            return f"user:{session['user']['id']}"
+
+    def test_finds_near_duplicates(self):
+        """Test that trivial rewording matches and a different question does not"""
+        entry = self.index.add('What is the capital of France?', {'mistral': self.result}, {'mistral': None}, 'key:a')
+        match, similarity = self.index.find("  what's the CAPITAL of france ", 'key:a')
+        self.assertEqual(match['id'], entry['id'])
+        self.assertGreaterEqual(similarity, 0.7)
+        self.assertIsNone(self.index.find('What is the capital of Spain?', 'key:a', threshold=0.9)[0])
+        self.assertIsNone(self.index.find('Explain how a hash map works', 'key:a')[0])
+        print("✅ Near-duplicate queries are found")
+
+    def test_index_is_shared_between_workers(self):
+        """Test that an index over the shared state backend sees entries added by another worker"""
+        worker = DedupIndex(backend=SQLiteBackend(self.path))
+        entry = worker.add('How do I reverse a list in Python?', {'mistral': self.result}, {'mistral': None}, 'key:a')
+        other_worker = DedupIndex(backend=SQLiteBackend(self.path))
+        match, _ = other_worker.find('how do I reverse a list in python', 'key:a')
+        self.assertEqual(match['id'], entry['id'])
+        self.assertEqual(match['results']['mistral']['content'], 'Paris.')
+        self.assertEqual(other_worker.get(entry['id'], 'key:a')['query'], 'How do I reverse a list in Python?')
+        print("✅ The dedup index is shared through the state backend")
+
+    def test_serve_mode_skips_providers(self):
+        """Test that serve mode answers a near-duplicate from earlier responses"""
+        module = providers.get_provider('mistral')
+        payload = {'query': 'What is the capital of France?', 'api_keys': {'mistral': {'key': 'k'}}, 'dedup': 'offer'}
+        with patch('routes.api.dedup_index', self.index), \
+                patch.object(module, 'call', return_value=self.result) as mock_call:
+            first, _ = self._query(payload)
+            payload['query'] = 'what is the capital of france'
+            payload['dedup'] = 'serve'
+            second, data = self._query(payload)
+            entry = self.client.post(f"/api/dedup/{second.headers['X-Dedup-Match']}",
+                                     data=json.dumps({'api_keys': payload['api_keys']}),
+                                     content_type='application/json')
+
+        self.assertEqual(mock_call.call_count, 1)
+        self.assertNotIn('X-Dedup-Match', first.headers)
+        self.assertEqual(second.headers['X-Dedup-Served'], 'true')
+        self.assertTrue(data['mistral']['deduplicated'])
+        self.assertEqual(json.loads(entry.data)['query'], 'What is the capital of France?')
+        print("✅ Serve mode returns earlier responses without calling providers")
+
+    def test_serve_needs_the_same_parameters(self):
+        """Test that an earlier answer is not served to a request asking for more samples or tokens"""
+        module = providers.get_provider('mistral')
+        payload = {'query': 'What is the capital of France?', 'api_keys': {'mistral': {'key': 'k'}},
+                   'dedup': 'serve', 'max_tokens': 50}
+        samples = {'samples': [{'content': 'Paris.'}, {'content': 'It is Paris.'}], 'model': 'm', 'status': 'success',
+                   'content': 'Paris.'}
+        with patch('routes.api.dedup_index', self.index), \
+                patch.object(module, 'call', return_value=self.result) as mock_call, \
+                patch('routes.api.call_samples', return_value=samples):
+            self._query(payload)
+            more_tokens, _ = self._query(dict(payload, max_tokens=500))
+            more_samples, _ = self._query(dict(payload, samples=2))
+            same, _ = self._query(payload)
+
+        self.assertEqual(mock_call.call_count, 2)
+        self.assertEqual(more_tokens.headers['X-Dedup-Served'], 'false')
+        self.assertEqual(more_samples.headers['X-Dedup-Served'], 'false')
+        self.assertEqual(same.headers['X-Dedup-Served'], 'true')
+        print("✅ Earlier answers are only served for the same request parameters")
+
+    def test_off_unless_requested(self):
+        """Test that queries are neither looked up nor recorded without dedup, or with dedup=false"""
+        module = providers.get_provider('mistral')
+        payload = {'query': 'What is the capital of France?', 'api_keys': {'mistral': {'key': 'k'}}}
+        with patch('routes.api.dedup_index', self.index), \
+                patch.object(module, 'call', return_value=self.result) as mock_call:
+            self._query(payload)
+            response, _ = self._query(payload)
+            payload['dedup'] = False
+            self._query(payload)
+
+        self.assertEqual(mock_call.call_count, 3)
+        self.assertNotIn('X-Dedup-Match', response.headers)
+        self.assertEqual(self.index.backend.scan('dedup:'), {})
+        print("✅ Deduplication is opt-in")
+
+    def test_scoped_to_owner(self):
+        """Test that one user's or API key's queries are never matched or served to another"""
+        module = providers.get_provider('mistral')
+        payload = {'query': 'What is the capital of France?', 'api_keys': {'mistral': {'key': 'k1'}}, 'dedup': 'serve'}
+        alice, bob = app.test_client(), app.test_client()
+        with alice.session_transaction() as session:
+            session['user'] = {'id': 'alice'}
+        with bob.session_transaction() as session:
+            session['user'] = {'id': 'bob'}
+
+        with patch('routes.api.dedup_index', self.index), \
+                patch.object(module, 'call', return_value=self.result) as mock_call:
+            first, _ = self._query(payload)
+            other_key, _ = self._query(dict(payload, api_keys={'mistral': {'key': 'k2'}}))
+            same_key, _ = self._query(payload)
+            self._query(payload, alice)
+            as_bob, _ = self._query(payload, bob)
+            as_alice, _ = self._query(payload, alice)
+            stolen = self.client.post(f"/api/dedup/{same_key.headers['X-Dedup-Match']}",
+                                      data=json.dumps({'api_keys': {'mistral': {'key': 'k2'}}}),
+                                      content_type='application/json')
+            by_id = bob.get(f"/api/dedup/{as_alice.headers['X-Dedup-Match']}")
+
+        # k1, k2, alice and bob each reach the provider once; k1 and alice are then served
+        self.assertEqual(mock_call.call_count, 4)
+        self.assertNotIn('X-Dedup-Match', other_key.headers)
+        self.assertNotIn('X-Dedup-Match', as_bob.headers)
+        self.assertEqual(same_key.headers['X-Dedup-Served'], 'true')
+        self.assertEqual(as_alice.headers['X-Dedup-Served'], 'true')
+        self.assertEqual(stolen.status_code, 404)
+        self.assertEqual(by_id.status_code, 404)
+        print("✅ Deduplication never crosses users or API keys")
+
+    def test_signed_in_users_are_kept_apart(self):
+        """Test that two users signed in through /auth/login never see each other's dedup entries"""
+        module = providers.get_provider('mistral')
+        alice, bob = app.test_client(), app.test_client()
+        for client, email in ((alice, 'alice@a.com'), (bob, 'bob@b.com')):
+            client.post('/api/auth/login', data=json.dumps({'email': email, 'password': 'pw'}),
+                        content_type='application/json')
+
+        payload = {'query': 'What is my secret?', 'api_keys': {'mistral': {'key': 'alice-key'}}, 'dedup': 'serve'}
+        with patch('routes.api.dedup_index', self.index), \
+                patch.object(module, 'call', return_value=dict(self.result, content='secret for alice')):
+            first, _ = self._query(payload, alice)
+        bob_payload = dict(payload, api_keys={'mistral': {'key': 'bob-key'}})
+        with patch('routes.api.dedup_index', self.index), \
+                patch.object(module, 'call', return_value=dict(self.result, content='answer for bob')):
+            response, data = self._query(bob_payload, bob)
+            by_id = bob.post(f"/api/dedup/{self.index.find(payload['query'], self._owner(alice))[0]['id']}",
+                             data=json.dumps({}), content_type='application/json')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('X-Dedup-Match', response.headers)
+        self.assertEqual(data['mistral']['content'], 'answer for bob')
+        self.assertEqual(by_id.status_code, 404)
+        print("✅ Signed-in users each get their own dedup entries")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Near-Duplicate Detection ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDedup)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Test script for the offline dataset evaluation CLI
+"""
+
+import unittest
+import csv
+import json
+import os
+import tempfile
+import time
+from unittest.mock import patch
+from routes import providers
+from routes.bulkhead import BulkheadFullError, ProviderBulkheads
+from routes.evaluate import evaluate, main, read_rows
+
+
+def has_parquet():
+    """Whether pandas and pyarrow are importable."""
+    try:
+        import pandas  # noqa: F401
+        import pyarrow  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+class TestEvaluate(unittest.TestCase):
+    """Test cases for dataset input, chunked output and checkpoint/resume"""
+
+    def setUp(self):
+        """Create a temporary dataset"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dataset = self._path('prompts.jsonl')
+        with open(self.dataset, 'w') as f:
+            for i in range(5):
+                f.write(json.dumps({'id': f'q{i}', 'prompt': f'Question {i}?'}) + '\n')
+        self.api_keys = {'mistral': {'key': 'k'}, 'cohere': {'key': 'k'}}
+        self.calls = []
+
+    def tearDown(self):
+        """Remove the temporary files"""
+        self.tmpdir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def _answer(self, fail_on=None):
+        def call(query, config, history=None):
+            if query == fail_on:
+                raise KeyboardInterrupt()
+            self.calls.append(query)
+            return {'content': f'Answer to {query}', 'model': 'm', 'status': 'success',
+                    'usage': {'prompt_tokens': 5, 'completion_tokens': 3}}
+        return call
+
+    def _run(self, output, fail_on=None, **kwargs):
+        with patch.object(providers.get_provider('mistral'), 'call', side_effect=self._answer(fail_on)), \
+                patch.object(providers.get_provider('cohere'), 'call', side_effect=self._answer()):
+            return evaluate(self.dataset, output, self.api_keys, concurrency=2, chunk_size=2, **kwargs)
+
+    def test_resume_after_interruption(self):
+        """Test that an interrupted run resumes with the first unfinished chunk"""
+        output = self._path('results.jsonl')
+        with self.assertRaises(KeyboardInterrupt):
+            self._run(output, fail_on='Question 2?')
+        with open(output) as f:
+            self.assertEqual([json.loads(line)['id'] for line in f], ['q0', 'q1'])
+
+        self.calls.clear()
+        checkpoint = self._run(output)
+        self.assertEqual(checkpoint['rows_done'], 5)
+        self.assertEqual(sorted(set(self.calls)), ['Question 2?', 'Question 3?', 'Question 4?'])
+        with open(output) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row['id'] for row in rows], ['q0', 'q1', 'q2', 'q3', 'q4'])
+        self.assertEqual(rows[4]['mistral_content'], 'Answer to Question 4?')
+        self.assertEqual(rows[4]['cohere_completion_tokens'], 3)
+        self.assertIsNotNone(rows[4]['mistral_latency_s'])
+
+        self.calls.clear()
+        self.assertEqual(self._run(output)['rows_done'], 5)
+        self.assertEqual(self.calls, [])
+        print("✅ Interrupted evaluations resume where they stopped")
+
+    def test_csv_input_and_cli(self):
+        """Test CSV input without an id column through the command line entry point"""
+        dataset = self._path('prompts.csv')
+        with open(dataset, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['question'])
+            writer.writeheader()
+            writer.writerows([{'question': 'Capital of France?'}, {'question': 'Capital of Spain?'}])
+        self.assertEqual([row['id'] for row in read_rows(dataset, 'question')], ['0', '1'])
+
+        keys = self._path('keys.json')
+        with open(keys, 'w') as f:
+            json.dump({'mistral': {'key': 'k'}}, f)
+        output = self._path('out.jsonl')
+        with patch.object(providers.get_provider('mistral'), 'call', side_effect=self._answer()):
+            self.assertEqual(main([dataset, '--keys', keys, '--output', output, '--prompt-column', 'question']), 0)
+        with open(output) as f:
+            self.assertEqual([json.loads(line)['mistral_status'] for line in f], ['success', 'success'])
+        with self.assertRaises(ValueError):
+            list(read_rows(self._path('prompts.txt')))
+        print("✅ CSV datasets run through the CLI")
+
+    def test_concurrency_fits_the_bulkheads(self):
+        """Test that a run's concurrency is not turned away by the per-provider and per-key limits"""
+        def slow(query, config, history=None):
+            time.sleep(0.1)
+            return self._answer()(query, config)
+
+        bulkheads = ProviderBulkheads(provider_limits={}, default_limit=1, key_limit=1, max_queue=0,
+                                      queue_timeout=0.01)
+        output = self._path('results.jsonl')
+        with patch('routes.api.bulkheads', bulkheads), patch('routes.evaluate.bulkheads', bulkheads), \
+                patch.object(providers.get_provider('mistral'), 'call', side_effect=slow):
+            evaluate(self.dataset, output, {'mistral': {'key': 'k'}}, concurrency=5, chunk_size=5)
+        with open(output) as f:
+            self.assertEqual([json.loads(line)['mistral_status'] for line in f], ['success'] * 5)
+        self.assertEqual(bulkheads.key('mistral', 'k').snapshot()['rejected'], {'queue_full': 0, 'queue_timeout': 0})
+        print("✅ Evaluation makes room for its concurrency in the bulkheads")
+
+    def test_busy_rows_are_not_done(self):
+        """Test that a row a busy provider turned away is evaluated again before the checkpoint passes it"""
+        turned_away = []
+
+        def busy_once(query, config, history=None):
+            if query == 'Question 2?' and not turned_away:
+                turned_away.append(query)
+                raise BulkheadFullError('mistral', 'queue_full')
+            return self._answer()(query, config)
+
+        output = self._path('results.jsonl')
+        with patch('routes.evaluate.BUSY_BACKOFF_SECONDS', 0), \
+                patch.object(providers.get_provider('mistral'), 'call', side_effect=busy_once), \
+                patch.object(providers.get_provider('cohere'), 'call', side_effect=self._answer()):
+            checkpoint = evaluate(self.dataset, output, self.api_keys, concurrency=2, chunk_size=2)
+        self.assertEqual(checkpoint['rows_done'], 5)
+        with open(output) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual([row['id'] for row in rows], ['q0', 'q1', 'q2', 'q3', 'q4'])
+        self.assertEqual({row['mistral_status'] for row in rows}, {'success'})
+        print("✅ Rows turned away by a busy provider are retried")
+
+    @unittest.skipUnless(has_parquet(), "Skipping Parquet test (pandas/pyarrow not available)")
+    def test_parquet_output(self):
+        """Test that chunks are written as Parquet parts with one schema"""
+        import pandas as pd
+        output = self._path('results')
+        self._run(output)
+        self.assertEqual(len([name for name in os.listdir(output) if name.endswith('.parquet')]), 3)
+        frame = pd.read_parquet(output)
+        self.assertEqual(list(frame['id']), ['q0', 'q1', 'q2', 'q3', 'q4'])
+        self.assertEqual(str(frame['mistral_prompt_tokens'].dtype), 'Int64')
+        print("✅ Results are written as Parquet parts")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Evaluation CLI ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestEvaluate)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Test script for response size caps, run against a rambling stand-in server
+"""
+
+import unittest
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.limits import MAX_RESPONSE_TOKENS, response_limits
+from routes.http_client import MAX_RESPONSE_BYTES, close_json
+
+WORDS = 20000
+
+
+class RamblingHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible server whose model does not stop talking"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.send_response(200)
+        if not payload.get('stream'):
+            body = json.dumps({'choices': [{'message': {'content': ' word' * WORDS}}]}).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        # No Content-Length: the body ends when the connection closes
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        chunk = {'id': 'c', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'rambler',
+                 'choices': [{'index': 0, 'delta': {'content': ' word'}, 'finish_reason': None}]}
+        event = f"data: {json.dumps(chunk)}\n\n".encode()
+        try:
+            for _ in range(WORDS):
+                self.wfile.write(event)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class TestLimits(unittest.TestCase):
+    """Test cases for byte and token caps on provider responses"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start the rambling stand-in"""
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), RamblingHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.endpoint = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the stand-in"""
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """Set up a test client"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def _query(self, api_keys):
+        response = self.client.post('/api/query', data=json.dumps({
+            'query': 'Say something', 'dedup': False, 'api_keys': api_keys
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_stream_stops_at_caps(self):
+        """Test that a streamed response is cut off at the token and the byte cap"""
+        result = self._query({'local': {'endpoint': self.endpoint, 'model': 'rambler',
+                                        'max_response_tokens': 50}})['local']
+        self.assertEqual(result['status'], 'success')
+        self.assertTrue(result['truncated'])
+        self.assertLessEqual(len(result['content'].split()), 50)
+
+        result = self._query({'local': {'endpoint': self.endpoint, 'model': 'rambler',
+                                        'max_response_bytes': 4096}})['local']
+        self.assertTrue(result['truncated'])
+        self.assertLess(len(result['content']), 4096)
+
+        with patch.object(providers.get_provider('openai'), 'API_BASE', f"{self.endpoint}/v1"):
+            result = self._query({'openai': {'key': 'k', 'max_response_tokens': 50}})['openai']
+            self.assertTrue(result['truncated'])
+            self.assertLessEqual(len(result['content'].split()), 50)
+            result = self._query({'openai': {'key': 'k', 'max_response_bytes': 4096}})['openai']
+            self.assertEqual(result['status'], 'success')
+            self.assertTrue(result['truncated'])
+            self.assertLessEqual(len(result['content']), 4096 + len(' word'))
+        print("✅ Streamed responses stop at the token and byte caps")
+
+    def test_json_body_over_byte_cap(self):
+        """Test that a JSON body over the byte cap is cut at the cap and returned as truncated"""
+        result = self._query({'local': {'endpoint': self.endpoint, 'model': 'rambler', 'stream': False,
+                                        'max_response_bytes': 10000}})['local']
+        self.assertEqual(result['status'], 'success')
+        self.assertTrue(result['truncated'])
+        self.assertTrue(result['content'].startswith(' word word'))
+        self.assertLess(len(result['content']), 10000)
+
+        with patch.object(providers.get_provider('mistral'), 'API_URL', self.endpoint):
+            result = self._query({'mistral': {'key': 'k', 'max_response_bytes': 10000}})['mistral']
+        self.assertEqual(result['status'], 'success')
+        self.assertTrue(result['truncated'])
+        self.assertGreater(len(result['content']), 9000)
+
+        result = self._query({'local': {'endpoint': self.endpoint, 'model': 'rambler', 'stream': False}})['local']
+        self.assertEqual(result['status'], 'success')
+        self.assertNotIn('truncated', result)
+        print("✅ Oversized JSON bodies are cut at the byte cap")
+
+    def test_close_json(self):
+        """Test that JSON cut at any point keeps the complete members and the open string"""
+        document = json.dumps({'choices': [{'message': {'content': 'Caf\u00e9 "ok" \\ \U0001F600 done'}}],
+                               'usage': {'total': [1, 2]}})
+        content = json.loads(document)['choices'][0]['message']['content']
+        for cut in range(len(document)):
+            value = close_json(document[:cut])
+            message = ((value or {}).get('choices') or [{}])[0].get('message') or {}
+            self.assertTrue(content.startswith(message.get('content', '')), cut)
+        self.assertEqual(close_json(document), json.loads(document))
+        self.assertEqual(close_json('{"a": [1, 2'), {'a': [1]})
+        self.assertIsNone(close_json('{"ke'))
+        print("✅ Cut JSON is closed at its last complete value")
+
+    def test_token_cap_on_complete_responses(self):
+        """Test that responses read in full are capped and that requests can only lower the caps"""
+        answer = {'content': 'word ' * 500, 'model': 'mistral-large-latest', 'status': 'success'}
+        with patch.object(providers.get_provider('mistral'), 'call', return_value=answer):
+            result = self._query({'mistral': {'key': 'k', 'max_response_tokens': 20}})['mistral']
+        self.assertTrue(result['truncated'])
+        self.assertLessEqual(len(result['content'].split()), 20)
+
+        self.assertEqual(response_limits('mistral', {'max_response_bytes': 1000}), (1000, MAX_RESPONSE_TOKENS))
+        self.assertEqual(response_limits('mistral', {'max_response_bytes': MAX_RESPONSE_BYTES * 2}),
+                         (MAX_RESPONSE_BYTES, MAX_RESPONSE_TOKENS))
+        print("✅ Complete responses are capped by tokens")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Response Limits ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLimits)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Test script for the local OpenAI-compatible provider, run against an
+in-process stand-in server
+"""
+
+import unittest
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from app import app
+from routes import http_client
+from routes.providers import local_provider
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible server with streaming chat completions"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/v1/models':
+            self._send(json.dumps({'data': [{'id': self.server.model_name}]}).encode())
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(payload)
+        if payload.get('model') == 'missing':
+            body = b'{"error": {"message": "model not found"}}'
+            self.send_response(404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        words = ['Hello', ' from', f' {self.server.model_name}', ' ✓']
+        if payload.get('stream'):
+            events = [{'model': payload.get('model'), 'choices': [{'delta': {'content': w}}]} for w in words]
+            body = ''.join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+            self._send(body.encode('utf-8'), 'text/event-stream')
+        else:
+            self._send(json.dumps({'choices': [{'message': {'content': ''.join(words)}}]}).encode())
+
+
+def start_stand_in(model_name):
+    """Start a stand-in server on a free port and return it"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.model_name = model_name
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestLocalProvider(unittest.TestCase):
+    """Test cases for the local model provider"""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start two stand-in local model servers"""
+        cls.llama = start_stand_in('llama-3-8b')
+        cls.qwen = start_stand_in('qwen2-7b')
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the stand-in servers"""
+        cls.llama.shutdown()
+        cls.qwen.shutdown()
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def _url(self, server):
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def _query(self, local_config):
+        response = self.client.post('/api/query', data=json.dumps({
+            'query': 'Say hello',
+            'api_keys': {'local': local_config}
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)
+
+    def test_single_endpoint_streams(self):
+        """Test a streamed response from one endpoint, resolving the served model"""
+        data = self._query({'endpoint': self._url(self.llama), 'model': 'localhost'})
+
+        self.assertEqual(data['local']['status'], 'success')
+        self.assertEqual(data['local']['content'], 'Hello from llama-3-8b ✓')
+        self.assertEqual(data['local']['model'], 'llama-3-8b')
+        self.assertTrue(self.llama.requests[-1]['stream'])
+        print("✅ Local provider streams from an OpenAI-compatible endpoint")
+
+    def test_multiple_endpoints(self):
+        """Test that several endpoints are compared as separate results"""
+        data = self._query({'endpoints': [
+            {'url': f"{self._url(self.llama)}/v1", 'name': 'llama'},
+            {'url': f"{self._url(self.qwen)}/v1/chat/completions", 'name': 'qwen', 'stream': False}
+        ]})
+
+        self.assertEqual(data['local:llama']['content'], 'Hello from llama-3-8b ✓')
+        self.assertEqual(data['local:qwen']['content'], 'Hello from qwen2-7b ✓')
+        print("✅ Several local endpoints are queried in one request")
+
+    def test_duplicate_names_keep_both_results(self):
+        """Test that endpoints sharing a name get distinct result keys"""
+        data = self._query({'endpoints': [
+            {'url': self._url(self.llama), 'name': 'box'},
+            {'url': self._url(self.qwen), 'name': 'box'}
+        ]})
+        self.assertEqual(data['local:box']['content'], 'Hello from llama-3-8b ✓')
+        self.assertEqual(data['local:box#2']['content'], 'Hello from qwen2-7b ✓')
+        print("✅ Duplicate endpoint names are suffixed")
+
+    def test_invalid_endpoint(self):
+        """Test that malformed endpoints and hosts outside the allowlist produce error results"""
+        for endpoint in ('localhost:1234', 'file:///etc/passwd', 'http://169.254.169.254/latest'):
+            data = self._query({'endpoint': endpoint})
+            self.assertEqual(data['local']['status'], 'error')
+        self.assertEqual(data['local']['error_code'], 'invalid_request')
+        with patch.object(local_provider, 'ALLOWED_HOSTS', {'*'}):
+            self.assertEqual(local_provider.base_url('http://10.0.0.5:8000'), 'http://10.0.0.5:8000/v1')
+        print("✅ Invalid local endpoints are reported as errors")
+
+    def test_error_response_is_closed(self):
+        """Test that a failed streamed request still closes its response"""
+        opened = []
+        post = http_client.post
+
+        def tracking_post(*args, **kwargs):
+            response = post(*args, **kwargs)
+            opened.append(response)
+            return response
+
+        with patch.object(http_client, 'post', side_effect=tracking_post):
+            data = self._query({'endpoint': self._url(self.llama), 'model': 'missing'})
+        self.assertEqual(data['local']['status'], 'error')
+        self.assertTrue(opened[0].raw.closed)
+        print("✅ Failed local requests release their connection")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Local Provider ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLocalProvider)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
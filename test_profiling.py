@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Test script for per-request profiling
+"""
+
+import unittest
+import json
+import tempfile
+import time
+from unittest.mock import patch
+from flask import Flask
+from app import app
+from routes import providers
+from routes.api import api_bp
+from routes.profiling import init_profiling, to_folded
+
+
+def slow_provider_call(*args, **kwargs):
+    """Stand-in provider call that is easy to find in a profile."""
+    time.sleep(0.1)
+    return {'content': 'Paris.', 'model': 'mistral-large-latest', 'status': 'success'}
+
+
+class TestProfiling(unittest.TestCase):
+    """Test cases for profiling hooks and the admin endpoints"""
+
+    def setUp(self):
+        """Set up an app with profiling enabled and a temporary profile directory"""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.profiled_app = Flask(__name__)
+        self.profiled_app.config['TESTING'] = True
+        self.profiled_app.config['PROFILING_ENABLED'] = True
+        init_profiling(self.profiled_app)
+        self.profiled_app.register_blueprint(api_bp)
+        self.client = self.profiled_app.test_client()
+        for patcher in (patch('routes.profiling.PROFILE_DIR', self.tmpdir.name),
+                        patch('routes.profiling.ADMIN_TOKEN', 'secret')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.admin = {'X-Admin-Token': 'secret'}
+
+    def tearDown(self):
+        """Remove the temporary profiles"""
+        self.tmpdir.cleanup()
+
+    def _query(self, headers):
+        payload = {'query': 'Capital of France?', 'dedup': False,
+                   'api_keys': {'mistral': {'key': 'k'}, 'cohere': {'key': 'k'}}}
+        with patch.object(providers.get_provider('mistral'), 'call', side_effect=slow_provider_call), \
+                patch.object(providers.get_provider('cohere'), 'call', side_effect=slow_provider_call):
+            return self.client.post('/api/query', data=json.dumps(payload), content_type='application/json',
+                                    headers=headers)
+
+    def test_admin_header_profiles_request(self):
+        """Test that an admin X-Profile request is profiled, including provider threads"""
+        response = self._query(dict(self.admin, **{'X-Profile': '1'}))
+        profile_id = response.headers['X-Profile-Id']
+
+        listing = json.loads(self.client.get('/api/admin/profiles', headers=self.admin).data)
+        self.assertEqual([p['id'] for p in listing['profiles']], [profile_id])
+        self.assertGreater(listing['profiles'][0]['samples'], 0)
+
+        profile = json.loads(self.client.get(f'/api/admin/profiles/{profile_id}', headers=self.admin).data)
+        names = {p['name'].rsplit('[', 1)[-1].rstrip(']'): p for p in profile['profiles']}
+        self.assertIn('request', names)
+        self.assertEqual(names['allocations']['unit'], 'bytes')
+        frames = profile['shared']['frames']
+        provider_frames = {frames[i]['name'] for sample in names['mistral']['samples'] for i in sample}
+        self.assertIn('slow_provider_call', provider_frames)
+
+        folded = self.client.get(f'/api/admin/profiles/{profile_id}?format=folded', headers=self.admin)
+        self.assertIn('slow_provider_call', folded.get_data(as_text=True))
+        self.assertTrue(to_folded(profile, 'alloc').strip())
+        print("✅ Admin-requested profiles capture request and provider threads")
+
+    def test_requests_without_admin_token_are_not_profiled(self):
+        """Test that X-Profile without the admin token is ignored and admin endpoints refuse"""
+        response = self._query({'X-Profile': '1', 'X-Admin-Token': 'wrong'})
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(self.client.get('/api/admin/profiles').status_code, 403)
+        self.assertEqual(self.client.get('/api/admin/profiles/abc', headers=self.admin).status_code, 404)
+        print("✅ Profiling requires the admin token")
+
+    def test_sample_rate(self):
+        """Test that the sample rate profiles requests without a header"""
+        with patch('routes.profiling.SAMPLE_RATE', 1.0):
+            response = self._query({})
+        self.assertIn('X-Profile-Id', response.headers)
+        print("✅ Sampled requests are profiled")
+
+    def test_disabled_installs_no_hooks(self):
+        """Test that no hooks are installed when profiling is not configured"""
+        hooks = [f.__module__ for f in app.before_request_funcs.get(None, [])]
+        self.assertNotIn('routes.profiling', hooks)
+        print("✅ Profiling costs nothing when disabled")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Profiling ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestProfiling)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Test script for the lazily loaded provider registry
+"""
+
+import unittest
+import json
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.importtime import measure, build_report
+
+
+class TestProviders(unittest.TestCase):
+    """Test cases for the provider registry and lazy imports"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def test_startup_does_not_import_sdks(self):
+        """Test that importing the app does not load any provider SDK"""
+        report = build_report(measure('app'))
+        self.assertEqual(report['provider_sdks_loaded'], [])
+        self.assertGreater(report['total_ms'], 0)
+        print("✅ Provider SDKs are not imported at startup")
+
+    def test_get_provider_loads_module(self):
+        """Test that get_provider imports and caches provider modules"""
+        module = providers.get_provider('mistral')
+        self.assertEqual(module.DISPLAY_NAME, 'Mistral AI')
+        self.assertIs(providers.get_provider('mistral'), module)
+        self.assertIn('mistral', providers.loaded_providers())
+        print("✅ get_provider loads provider modules on demand")
+
+    def test_query_dispatches_to_provider(self):
+        """Test that /api/query routes each keyed provider through the registry"""
+        module = providers.get_provider('cohere')
+        result = {'content': 'Paris', 'model': 'command-r', 'status': 'success'}
+        with patch.object(module, 'call', return_value=result) as mock_call:
+            response = self.client.post(
+                '/api/query',
+                data=json.dumps({'query': 'Capital of France?', 'api_keys': {'cohere': {'key': 'k'}}}),
+                content_type='application/json'
+            )
+        data = json.loads(response.data)
+        self.assertEqual(data['cohere'], result)
+        mock_call.assert_called_once()
+        print("✅ /api/query dispatches through the provider registry")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Provider Registry ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestProviders)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
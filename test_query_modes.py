@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Test script for first_k and hedged query modes
+"""
+
+import unittest
+import json
+import threading
+import time
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.latency import LatencyStats, latency_key
+from routes.results import ResultStore
+
+
+def answer(model, delay=0.0):
+    """Stand-in provider call answering after a delay."""
+    def call(query, config, history=None):
+        time.sleep(delay)
+        return {'content': f'Paris ({model}).', 'model': config.get('model', model), 'status': 'success'}
+    return call
+
+
+class TestQueryModes(unittest.TestCase):
+    """Test cases for first_k and hedged queries and the latency statistics behind them"""
+
+    def setUp(self):
+        """Set up a client, a private result store and fresh latency statistics"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.store = ResultStore(ttl_seconds=60)
+        self.latency = LatencyStats(min_samples=1)
+        for patcher in (patch('routes.api.result_store', self.store),
+                        patch('routes.api.provider_latency', self.latency)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _query(self, payload, calls):
+        payload = dict({'query': 'Capital of France?', 'dedup': False,
+                        'api_keys': {key: {'key': 'k'} for key in calls}}, **payload)
+        patchers = [patch.object(providers.get_provider(key), 'call', side_effect=call) for key, call in calls.items()]
+        for patcher in patchers:
+            patcher.start()
+        try:
+            started = time.monotonic()
+            response = self.client.post('/api/query', data=json.dumps(payload), content_type='application/json')
+            return response, json.loads(response.data), time.monotonic() - started
+        finally:
+            for patcher in patchers:
+                patcher.stop()
+
+    def test_first_k_cancels_the_rest(self):
+        """Test that first_k returns after k successes and cancels slower providers"""
+        response, data, elapsed = self._query({'mode': 'first_k', 'k': 2}, {
+            'mistral': answer('mistral'), 'cohere': answer('cohere'), 'gemini': answer('gemini', 1.0)})
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(data['mistral']['status'], 'success')
+        self.assertEqual(data['cohere']['status'], 'success')
+        self.assertEqual(data['gemini']['status'], 'cancelled')
+        print("✅ first_k returns after k successes and cancels the rest")
+
+    def test_first_k_delivers_late_results(self):
+        """Test that on_rest=deliver keeps slower providers running and stores their results"""
+        response, data, elapsed = self._query({'mode': 'first_k', 'k': 1, 'on_rest': 'deliver'}, {
+            'mistral': answer('mistral'), 'cohere': answer('cohere', 0.3)})
+        self.assertLess(elapsed, 0.25)
+        self.assertEqual(data['cohere']['status'], 'pending')
+        result_id = response.headers['X-Result-Id']
+
+        follow_up = json.loads(self.client.get(f'/api/results/{result_id}').data)
+        self.assertEqual(follow_up['results']['mistral']['status'], 'success')
+        deadline = time.monotonic() + 2
+        while follow_up['pending'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+            follow_up = json.loads(self.client.get(f'/api/results/{result_id}').data)
+        self.assertEqual(follow_up['pending'], [])
+        self.assertEqual(follow_up['results']['cohere']['content'], 'Paris (cohere).')
+        self.assertEqual(self.client.get('/api/results/missing').status_code, 404)
+        print("✅ first_k delivers late results through the result handle")
+
+    def test_hedge_wins_over_slow_primary(self):
+        """Test that a provider slower than its p95 gets a duplicate request to its backup"""
+        self.latency.record(latency_key({'result_key': 'mistral', 'model': 'mistral-large-latest'}), 0.05)
+        configs = []
+        lock = threading.Lock()
+
+        def call(query, config, history=None):
+            with lock:
+                configs.append(config)
+                first = len(configs) == 1
+            return answer('mistral', 1.0 if first else 0.0)(query, config, history)
+
+        response, data, elapsed = self._query({
+            'mode': 'hedged',
+            'api_keys': {'mistral': {'key': 'k', 'model': 'mistral-large-latest',
+                                     'backup': {'model': 'mistral-small-latest'}}}
+        }, {'mistral': call})
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(data['mistral']['status'], 'success')
+        self.assertTrue(data['mistral']['hedged'])
+        self.assertTrue(data['mistral']['hedge_won'])
+        self.assertEqual(data['mistral']['model'], 'mistral-small-latest')
+        self.assertEqual([c['model'] for c in configs], ['mistral-large-latest', 'mistral-small-latest'])
+        print("✅ Hedged requests win over a slow primary")
+
+    def test_latency_percentiles(self):
+        """Test rolling percentiles and the estimate-based hedge delay"""
+        stats = LatencyStats(window=100, min_samples=10)
+        plan = {'result_key': 'mistral', 'model': 'm', 'estimate': {'estimated_latency_s': 1.5}}
+        for i in range(5):
+            stats.record('mistral/m', i / 10)
+        self.assertIsNone(stats.percentile('mistral/m', 95))
+        self.assertEqual(stats.hedge_delay(plan), 3.0)
+        for i in range(5, 100):
+            stats.record('mistral/m', i / 10)
+        self.assertAlmostEqual(stats.percentile('mistral/m', 50), 5.0)
+        self.assertAlmostEqual(stats.hedge_delay(plan), 9.5)
+        self.assertEqual(stats.snapshot()['mistral/m']['count'], 100)
+        print("✅ Latency percentiles drive the hedge delay")
+
+    def test_invalid_mode(self):
+        """Test that unknown modes and options are rejected"""
+        for payload in ({'mode': 'fastest'}, {'mode': 'first_k', 'k': 0}, {'mode': 'first_k', 'on_rest': 'keep'}):
+            response, data, _ = self._query(payload, {'mistral': answer('mistral')})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Invalid request', data['error_details'])
+        print("✅ Invalid query modes are rejected")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Query Modes ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestQueryModes)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
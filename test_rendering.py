@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Test script for server-side markdown rendering and the fragment cache
+"""
+
+import unittest
+import json
+from unittest.mock import patch
+from app import app
+from routes import providers, rendering
+from routes.rendering import render_markdown, render_results
+from routes.state import MemoryBackend, SharedCache
+
+RESPONSE = "## Answer\n\n```python\nprint('<b>hi</b>')\n```\n\n<script>alert(1)</script> [x](javascript:alert(1))"
+
+
+class TestRendering(unittest.TestCase):
+    """Test cases for sanitized, highlighted rendering and cached fragments"""
+
+    def setUp(self):
+        """Set up a client and an empty fragment cache"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        patcher = patch('routes.rendering.fragment_cache', SharedCache('fragment', backend=MemoryBackend()))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sanitized_and_highlighted(self):
+        """Test that raw HTML and script links are neutralized and code is highlighted"""
+        fragment = render_markdown(RESPONSE)
+        self.assertIn('<h2>Answer</h2>', fragment)
+        self.assertIn('<pre class="highlight"><code class="language-python">', fragment)
+        self.assertIn('<span class="nb">print</span>', fragment)
+        self.assertNotIn('<script>', fragment)
+        self.assertIn('&lt;script&gt;', fragment)
+        self.assertNotIn('href="javascript:', fragment)
+        print("✅ Rendered markdown is sanitized and highlighted")
+
+    def test_fragments_are_cached(self):
+        """Test that rendering the same content again is served from the cache"""
+        results = {'mistral': {'content': RESPONSE, 'model': 'm', 'status': 'success'},
+                   'cohere': {'content': 'Error: quota', 'model': 'c', 'status': 'error'}}
+        with patch.object(rendering, 'get_parser', wraps=rendering.get_parser) as parser:
+            first = render_results(results)
+            second = render_results(results)
+        self.assertEqual(parser.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertNotIn('html', results['mistral'])
+        self.assertNotIn('html', first['cohere'])
+        print("✅ Repeated renders come from the fragment cache")
+
+    def test_query_and_history_endpoints(self):
+        """Test that /api/query and the stored results return HTML next to the content on request"""
+        answer = {'content': RESPONSE, 'model': 'mistral-large-latest', 'status': 'success'}
+        with patch.object(providers.get_provider('mistral'), 'call', return_value=answer):
+            response = self.client.post('/api/query', data=json.dumps({
+                'query': 'Print bold text', 'dedup': False, 'render': True, 'conversation': True,
+                'api_keys': {'mistral': {'key': 'k'}}}), content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual(data['mistral']['content'], RESPONSE)
+        self.assertIn('<h2>Answer</h2>', data['mistral']['html'])
+
+        result_id = response.headers['X-Result-Id']
+        stored = json.loads(self.client.get(f'/api/results/{result_id}').data)
+        self.assertNotIn('html', stored['results']['mistral'])
+        stored = json.loads(self.client.get(f'/api/results/{result_id}?render=1').data)
+        self.assertEqual(stored['results']['mistral']['html'], data['mistral']['html'])
+
+        conversation_id = response.headers['X-Conversation-Id']
+        conversation = json.loads(self.client.get(f'/api/conversations/{conversation_id}?render=1').data)
+        user, assistant = conversation['histories']['mistral']
+        self.assertNotIn('html', user)
+        self.assertEqual(assistant['html'], data['mistral']['html'])
+
+        css = self.client.get('/api/render/code.css')
+        self.assertEqual(css.mimetype, 'text/css')
+        self.assertIn(b'.highlight', css.data)
+        print("✅ Query and history endpoints return rendered HTML")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Markdown Rendering ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRendering)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+"""
+Test script for server-side result handles
+"""
+
+import unittest
+import json
+import time
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.results import ResultStore
+
+
+class TestResults(unittest.TestCase):
+    """Test cases for the result store and its use by summarize and export"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.store = ResultStore(ttl_seconds=60)
+        self.results = {
+            'mistral': {'content': 'Paris is the capital.', 'model': 'mistral-large-latest', 'status': 'success'},
+            'cohere': {'content': 'The capital is Paris.', 'model': 'command-r', 'status': 'success'}
+        }
+
+    def _post(self, path, payload):
+        response = self.client.post(path, data=json.dumps(payload), content_type='application/json')
+        return response, json.loads(response.data)
+
+    def test_store_and_expiry(self):
+        """Test that results are stored with their summary and expire"""
+        result_id = self.store.save('Capital of France?', dict(self.results, summary={'status': 'error'}))
+        record = self.store.get(result_id)
+        self.assertEqual(record['query'], 'Capital of France?')
+        self.assertEqual(set(record['results']), {'mistral', 'cohere'})
+        self.assertEqual(record['summary'], {'status': 'error'})
+
+        self.assertTrue(self.store.set_summary(result_id, {'status': 'success', 'content': 'Both agree.'}))
+        self.assertEqual(self.store.get(result_id)['summary']['content'], 'Both agree.')
+
+        expiring = ResultStore(ttl_seconds=0.05)
+        short_id = expiring.save('Hi', self.results)
+        time.sleep(0.1)
+        self.assertIsNone(expiring.get(short_id))
+        self.assertFalse(expiring.set_summary(short_id, {}))
+        print("✅ Results are stored with their summary and expire")
+
+    def test_query_returns_result_id(self):
+        """Test that /api/query stores its results and returns their id"""
+        module = providers.get_provider('mistral')
+        with patch('routes.api.result_store', self.store), \
+                patch.object(module, 'call', return_value=self.results['mistral']):
+            response, data = self._post('/api/query', {'query': 'Capital of France?',
+                                                       'api_keys': {'mistral': {'key': 'k'}}})
+        record = self.store.get(response.headers['X-Result-Id'])
+        self.assertEqual(record['query'], 'Capital of France?')
+        self.assertEqual(record['results']['mistral'], data['mistral'])
+        print("✅ /api/query returns an X-Result-Id handle")
+
+    def test_export_by_result_id(self):
+        """Test that /api/export reads the stored results and summary"""
+        result_id = self.store.save('Capital of France?', self.results)
+        self.store.set_summary(result_id, {'status': 'success', 'content': 'Both agree.'})
+        with patch('routes.api.result_store', self.store):
+            _, data = self._post('/api/export', {'result_id': result_id, 'format': 'markdown'})
+            missing, _ = self._post('/api/export', {'result_id': 'expired', 'format': 'json'})
+        self.assertIn('Paris is the capital.', data['data'])
+        self.assertIn('Both agree.', data['data'])
+        self.assertEqual(missing.status_code, 404)
+        print("✅ /api/export accepts a result id")
+
+    def test_summarize_by_result_id(self):
+        """Test that /api/summarize reads stored results and stores the summary"""
+        result_id = self.store.save('Capital of France?', self.results)
+        summary = {'status': 'success', 'content': 'Both agree.', 'model': 'meta-summarizer'}
+        with patch('routes.api.result_store', self.store), \
+                patch('routes.api.ResponseSummarizer') as summarizer:
+            summarizer.return_value.summarize.return_value = dict(summary)
+            _, data = self._post('/api/summarize', {'result_id': result_id,
+                                                    'api_keys': {'openai': {'key': 'k'}}})
+            missing, missing_data = self._post('/api/summarize', {'result_id': 'expired',
+                                                                  'api_keys': {'openai': {'key': 'k'}}})
+
+        query, responses = summarizer.return_value.summarize.call_args[0]
+        self.assertEqual(query, 'Capital of France?')
+        self.assertEqual(set(responses), {'mistral', 'cohere'})
+        self.assertEqual(list(data), ['summary'])
+        self.assertEqual(self.store.get(result_id)['summary']['content'], 'Both agree.')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing_data['summary']['status'], 'error')
+        print("✅ /api/summarize accepts a result id and stores the summary")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Result Handles ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestResults)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Test script for multi-sample queries
+"""
+
+import unittest
+import json
+import threading
+import time
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.bulkhead import ProviderBulkheads
+
+
+def gemini_response(texts):
+    """Decoded Gemini response with one candidate per text."""
+    return {
+        'candidates': [{'content': {'parts': [{'text': text}]}} for text in texts],
+        'usageMetadata': {'promptTokenCount': 12, 'candidatesTokenCount': 9}
+    }
+
+
+class TestSamples(unittest.TestCase):
+    """Test cases for native multi-candidate requests and parallel sampling"""
+
+    def setUp(self):
+        """Set up a test client"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def _post(self, path, payload):
+        response = self.client.post(path, data=json.dumps(payload), content_type='application/json')
+        return response, json.loads(response.data)
+
+    def test_native_candidates(self):
+        """Test that Gemini draws all samples from one request with candidateCount"""
+        response = gemini_response(['Paris.', 'It is Paris.', 'Paris, France.'])
+        with patch('routes.providers.gemini_provider.http_client.post_json_prefix',
+                   return_value=(response, False)) as post:
+            status, data = self._post('/api/query', {'query': 'Capital of France?', 'dedup': False, 'samples': 3,
+                                                     'api_keys': {'gemini': {'key': 'k'}}})
+        self.assertEqual(status.status_code, 200)
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(post.call_args.kwargs['json']['generationConfig']['candidateCount'], 3)
+        result = data['gemini']
+        self.assertEqual(result['sampling'], 'native')
+        self.assertEqual([s['content'] for s in result['samples']], ['Paris.', 'It is Paris.', 'Paris, France.'])
+        self.assertEqual(result['content'], 'Paris.')
+        self.assertEqual(result['usage']['prompt_tokens'], 12)
+        print("✅ Native providers return every sample from one request")
+
+    def test_parallel_calls(self):
+        """Test that providers without a native parameter get one call per sample"""
+        calls, lock = [], threading.Lock()
+
+        def call(query, config, history=None):
+            with lock:
+                calls.append(query)
+                attempt = len(calls)
+            if attempt == 2:
+                raise Exception("500 Server Error")
+            return {'content': f'Paris #{attempt}', 'model': 'mistral-large-latest', 'status': 'success',
+                    'usage': {'prompt_tokens': 10, 'completion_tokens': 2, 'cached_tokens': 0}}
+
+        with patch.object(providers.get_provider('mistral'), 'call', side_effect=call):
+            status, data = self._post('/api/query', {'query': 'Capital of France?', 'dedup': False, 'samples': 3,
+                                                     'api_keys': {'mistral': {'key': 'k'}}})
+        result = data['mistral']
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['sampling'], 'parallel')
+        self.assertEqual(sorted(s['status'] for s in result['samples']), ['error', 'success', 'success'])
+        self.assertEqual(result['usage']['prompt_tokens'], 20)
+        self.assertEqual(result['usage']['completion_tokens'], 4)
+        print("✅ Other providers are sampled with parallel calls")
+
+    def test_samples_stay_within_bulkhead(self):
+        """Test that extra samples only run alongside the first on free bulkhead slots"""
+        state, lock = {'running': 0, 'peak': 0, 'calls': 0}, threading.Lock()
+
+        def call(query, config, history=None):
+            with lock:
+                state['running'] += 1
+                state['calls'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.05)
+            with lock:
+                state['running'] -= 1
+            return {'content': 'Paris.', 'model': 'mistral-large-latest', 'status': 'success'}
+
+        for limit, peak in ((2, 2), (1, 1)):
+            state.update(peak=0, calls=0)
+            bulkheads = ProviderBulkheads(provider_limits={}, default_limit=limit)
+            with patch('routes.api.bulkheads', bulkheads), \
+                    patch.object(providers.get_provider('mistral'), 'call', side_effect=call):
+                _, data = self._post('/api/query', {'query': 'Capital of France?', 'dedup': False, 'samples': 4,
+                                                    'api_keys': {'mistral': {'key': 'k'}}})
+            self.assertEqual(len(data['mistral']['samples']), 4)
+            self.assertEqual(state['calls'], 4)
+            self.assertEqual(state['peak'], peak)
+            self.assertEqual(bulkheads.provider('mistral').active, 0)
+        print("✅ Samples never run beyond the provider's bulkhead")
+
+    def test_validation_and_estimate(self):
+        """Test that invalid sample counts are rejected and estimates count every sample"""
+        for samples in (0, 'three', 100):
+            status, _ = self._post('/api/query', {'query': 'Hi', 'samples': samples,
+                                                  'api_keys': {'mistral': {'key': 'k'}}})
+            self.assertEqual(status.status_code, 400)
+
+        api_keys = {'openai': {'key': 'k'}, 'mistral': {'key': 'k'}}
+        _, single = self._post('/api/estimate', {'query': 'Capital of France?', 'api_keys': api_keys})
+        _, triple = self._post('/api/estimate', {'query': 'Capital of France?', 'api_keys': api_keys, 'samples': 3})
+        for key in api_keys:
+            self.assertGreater(triple['estimates'][key]['estimated_cost'], single['estimates'][key]['estimated_cost'])
+        # A native request pays for the prompt once, parallel calls once per sample
+        prompt_share = {key: 3 * single['estimates'][key]['estimated_cost'] - triple['estimates'][key]['estimated_cost']
+                        for key in api_keys}
+        self.assertGreater(prompt_share['openai'], 0)
+        self.assertAlmostEqual(prompt_share['mistral'], 0, places=5)
+        print("✅ Sample counts are validated and estimated")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Multi-Sample Queries ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSamples)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
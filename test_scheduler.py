@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+Test script for weighted fair scheduling of provider calls
+"""
+
+import unittest
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from flask import session
+from app import app
+from routes import providers
+from routes.bulkhead import Bulkhead, BulkheadFullError
+from routes.cancellation import CancelToken
+from routes.dispatch import run_all
+from routes.scheduler import FairScheduler, request_lane, request_user
+
+
+class InlineExecutor:
+    """Executor running each call right away in the submitting thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+class TestScheduler(unittest.TestCase):
+    """Test cases for lanes, per-user fairness and the scheduler in front of /api/query"""
+
+    def _blocked(self, scheduler, lane='interactive', user='blocker', bulkhead=None):
+        """Take a slot with a call that runs until the returned event is set."""
+        release = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(pool.shutdown)
+        self.addCleanup(release.set)
+        scheduler.submit(pool, release.wait, user, lane, bulkhead)
+        time.sleep(0.02)
+        return release
+
+    def _drain(self, scheduler, release, calls):
+        """Queue calls recording their start order, then free the blocked slot."""
+        order = []
+        for user, lane in calls:
+            scheduler.submit(InlineExecutor(), lambda u=user, l=lane: order.append((u, l)), user, lane)
+        release.set()
+        deadline = time.monotonic() + 2
+        while len(order) < len(calls) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return order
+
+    def test_lane_weights(self):
+        """Test that free slots go to lanes in proportion to their weights"""
+        scheduler = FairScheduler(capacity=1, lane_weights={'interactive': 3, 'batch': 1}, lane_max_share={})
+        release = self._blocked(scheduler)
+        order = self._drain(scheduler, release, [('a', 'batch')] * 4 + [('b', 'interactive')] * 4)
+        self.assertEqual([lane for _, lane in order[:4]].count('interactive'), 3)
+        self.assertEqual(len(order), 8)
+        print("✅ Lanes share slots by weight")
+
+    def test_users_take_turns(self):
+        """Test that users of a lane are served in turn rather than first come, first served"""
+        scheduler = FairScheduler(capacity=1, lane_weights={'batch': 1}, lane_max_share={})
+        release = self._blocked(scheduler)
+        order = self._drain(scheduler, release, [('sweep', 'batch')] * 4 + [('other', 'batch')] * 2)
+        self.assertEqual([user for user, _ in order], ['sweep', 'other', 'sweep', 'other', 'sweep', 'sweep'])
+        print("✅ Users of a lane take turns")
+
+    def test_batch_share_and_cancellation(self):
+        """Test that batch work leaves slots for interactive calls and cancelled calls are dropped"""
+        scheduler = FairScheduler(capacity=4, lane_weights={'interactive': 8, 'batch': 1},
+                                  lane_max_share={'batch': 0.5})
+        releases = [self._blocked(scheduler, 'batch', 'sweep') for _ in range(2)]
+        queued = scheduler.submit(InlineExecutor(), lambda: 'batch', 'sweep', 'batch')
+        self.assertEqual(scheduler.snapshot()['lanes']['batch']['queued'], 1)
+        interactive = scheduler.submit(InlineExecutor(), lambda: 'interactive', 'user', 'interactive')
+        self.assertEqual(interactive.result(timeout=1), 'interactive')
+
+        self.assertTrue(queued.cancel())
+        for release in releases:
+            release.set()
+        time.sleep(0.05)
+        snapshot = scheduler.snapshot()
+        self.assertEqual(snapshot['running'], 0)
+        self.assertEqual(snapshot['lanes']['batch']['queued'], 0)
+        self.assertEqual(snapshot['lanes']['batch']['max_running'], 2)
+        self.assertEqual(snapshot['lanes']['interactive']['wait_s']['count'], 1)
+        print("✅ Batch work cannot take every slot")
+
+    def test_hung_provider_cannot_take_every_slot(self):
+        """Test that a provider's calls hold no more slots than its bulkhead runs, and queue no more than it queues"""
+        scheduler = FairScheduler(capacity=4, lane_max_share={})
+        slow, fast = Bulkhead('slow', max_concurrent=2, max_queue=1), Bulkhead('fast', max_concurrent=2)
+        releases = [self._blocked(scheduler, bulkhead=slow) for _ in range(2)]
+        queued = scheduler.submit(InlineExecutor(), lambda: 'slow', 'blocker', bulkhead=slow)
+        self.assertFalse(queued.done())
+        with self.assertRaises(BulkheadFullError):
+            scheduler.submit(InlineExecutor(), lambda: 'slow', 'blocker', bulkhead=slow).result(timeout=1)
+        self.assertEqual(slow.snapshot()['rejected']['queue_full'], 1)
+        other = scheduler.submit(InlineExecutor(), lambda: 'fast', 'blocker', bulkhead=fast)
+        self.assertEqual(other.result(timeout=1), 'fast')
+        self.assertEqual(scheduler.snapshot()['providers'], {'slow': 2})
+
+        releases[0].set()
+        self.assertEqual(queued.result(timeout=1), 'slow')
+        print("✅ A hung provider cannot take the slots of the others")
+
+    def test_queue_timeout(self):
+        """Test that a call waiting too long for a slot is rejected, and becomes a provider_busy result"""
+        scheduler = FairScheduler(capacity=1, lane_max_share={}, queue_timeout=0.2)
+        self._blocked(scheduler)
+        started = time.monotonic()
+        queued = scheduler.submit(InlineExecutor(), lambda: 'late', 'user')
+        with self.assertRaises(BulkheadFullError):
+            queued.result(timeout=2)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(scheduler.snapshot()['rejected'], 1)
+        self.assertEqual(scheduler.snapshot()['lanes']['interactive']['queued'], 0)
+
+        results = run_all({'mistral': lambda: {'status': 'success'}}, CancelToken('queued'),
+                          executors={'mistral': scheduler.executor(InlineExecutor(), 'user')})
+        self.assertEqual(results['mistral']['error_code'], 'provider_busy')
+        print("✅ Calls waiting too long for a slot are rejected")
+
+    def test_user_and_lane_not_taken_from_client(self):
+        """Test that the user comes from the session or keys and only allow-listed users pick a higher lane"""
+        scheduler = FairScheduler(lane_weights={'interactive': 8, 'batch': 1, 'priority': 16})
+
+        def identify(headers, user=None, api_keys=None):
+            with app.test_request_context('/api/query', method='POST', headers=headers,
+                                          environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+                if user:
+                    session['user'] = user
+                return request_user(api_keys), request_lane()
+
+        with patch('routes.scheduler.scheduler', scheduler):
+            owner, lane = identify({'X-User-Id': 'alice', 'X-Lane': 'priority'}, api_keys={'mistral': {'key': 'k'}})
+            self.assertTrue(owner.startswith('key:'))
+            self.assertEqual(lane, 'interactive')
+            self.assertEqual(identify({'X-User-Id': 'alice'})[0], 'addr:10.0.0.1')
+            # Junk entries for providers that do not exist cannot mint new identities
+            self.assertEqual(identify({}, api_keys={'mistral': {'key': 'k'}, 'zzz': {'key': 'junk'}})[0], owner)
+            self.assertEqual(identify({}, api_keys={'zzz': {'key': 'junk'}})[0], 'addr:10.0.0.1')
+            self.assertEqual(identify({'X-Lane': 'batch'})[1], 'batch')
+            alice = {'id': 'alice', 'email': 'alice@a.com'}
+            self.assertEqual(identify({'X-Lane': 'priority'}, user=alice), ('user:alice', 'interactive'))
+            with patch('routes.auth.PRIORITY_USERS', {'alice@a.com'}):
+                self.assertEqual(identify({'X-Lane': 'priority'}, user=alice), ('user:alice', 'priority'))
+        print("✅ Users and lanes are not taken from client headers")
+
+    def test_interactive_query_not_held_up_by_batch(self):
+        """Test that /api/query stays fast while batch queries fill their lane"""
+        app.config['TESTING'] = True
+        scheduler = FairScheduler(capacity=2, lane_weights={'interactive': 8, 'batch': 1},
+                                  lane_max_share={'batch': 0.5})
+
+        def slow(query, config, history=None):
+            time.sleep(0.3)
+            return {'content': 'Paris.', 'model': 'gemini-1.5-flash', 'status': 'success'}
+
+        def query(api_keys, headers):
+            payload = {'query': 'Capital of France?', 'dedup': False, 'api_keys': api_keys}
+            response = app.test_client().post('/api/query', data=json.dumps(payload),
+                                              content_type='application/json', headers=headers)
+            return json.loads(response.data)
+
+        with patch('routes.api.scheduler', scheduler), \
+                patch.object(providers.get_provider('gemini'), 'call', side_effect=slow), \
+                patch.object(providers.get_provider('mistral'), 'call',
+                             return_value={'content': 'Paris.', 'model': 'm', 'status': 'success'}):
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                batch = [pool.submit(query, {'gemini': {'key': 'k'}}, {'X-Lane': 'batch', 'X-User-Id': 'sweep'})
+                         for _ in range(3)]
+                time.sleep(0.1)
+                started = time.monotonic()
+                interactive = query({'mistral': {'key': 'k'}}, {'X-User-Id': 'alice'})
+                elapsed = time.monotonic() - started
+                batch_results = [future.result() for future in batch]
+
+        self.assertEqual(interactive['mistral']['status'], 'success')
+        self.assertLess(elapsed, 0.2)
+        self.assertTrue(all(result['gemini']['status'] == 'success' for result in batch_results))
+        waits = scheduler.snapshot()['lanes']['batch']['wait_s']
+        self.assertEqual(waits['count'], 3)
+        self.assertGreater(waits['p99'], 0.25)
+        print("✅ Interactive queries are not held up by batch work")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Scheduler ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestScheduler)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Test script for response similarity and /api/compare
+"""
+
+import unittest
+import json
+import random
+import time
+from app import app
+from routes.similarity import similarity_matrix, agreement_scores, diff_hunks, compare_responses
+
+
+class TestSimilarity(unittest.TestCase):
+    """Test cases for the similarity module and /api/compare"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.responses = {
+            'openai': {'content': 'The capital of France is Paris. It lies on the Seine.', 'status': 'success'},
+            'anthropic': {'content': 'The capital of France is Paris, which lies on the Seine.', 'status': 'success'},
+            'mistral': {'content': 'Bananas are a good source of potassium.', 'status': 'success'},
+            'cohere': {'content': 'Error: rate limited', 'status': 'error'}
+        }
+
+    def test_similarity_matrix(self):
+        """Test that similar texts score higher than unrelated ones"""
+        matrix = similarity_matrix([r['content'] for r in list(self.responses.values())[:3]], shingle_size=1)
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertAlmostEqual(matrix[0, 0], 1.0, places=5)
+        self.assertAlmostEqual(matrix[0, 1], matrix[1, 0], places=5)
+        self.assertGreater(matrix[0, 1], 0.8)
+        self.assertLess(matrix[0, 2], 0.2)
+        agreement = agreement_scores(matrix)
+        self.assertLess(agreement[2], agreement[0])
+        print("✅ Similarity matrix separates agreeing and unrelated responses")
+
+    def test_diff_hunks(self):
+        """Test word-level diff hunks between two responses"""
+        hunks = diff_hunks('Paris is the capital of France.', 'Paris is the largest city of France.')
+        self.assertEqual(len(hunks), 1)
+        self.assertEqual(hunks[0]['op'], 'replace')
+        self.assertEqual(hunks[0]['a'], 'capital')
+        self.assertEqual(hunks[0]['b'], 'largest city')
+        print("✅ Diff hunks align the differing words")
+
+    def test_compare_endpoint(self):
+        """Test /api/compare over query results"""
+        response = self.client.post('/api/compare', data=json.dumps({'responses': self.responses}),
+                                    content_type='application/json')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['models'], ['openai', 'anthropic', 'mistral'])
+        self.assertEqual(len(data['matrix']), 3)
+        self.assertIn(data['consensus'], ('openai', 'anthropic'))
+        self.assertEqual(len(data['diffs']), 2)
+
+        response = self.client.post('/api/compare', data=json.dumps({
+            'responses': self.responses, 'pairs': [['openai', 'cohere']]
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        print("✅ /api/compare returns matrix, agreement and diffs")
+
+    def test_malformed_pairs(self):
+        """Test that pairs other than a short list of [model, model] are rejected with a 400"""
+        for pairs in ('openai', {'openai': 'anthropic'}, [['openai']], [['openai', 'anthropic', 'gemini']],
+                      [None], [[1, 2]], [['openai', 'anthropic']] * 101):
+            response = self.client.post('/api/compare', data=json.dumps({
+                'responses': self.responses, 'pairs': pairs
+            }), content_type='application/json')
+            self.assertEqual(response.status_code, 400, pairs)
+            self.assertEqual(json.loads(response.data)['error_code'], 'invalid_request')
+        print("✅ Malformed pairs are rejected with a 400")
+
+    def test_invalid_shingle_size(self):
+        """Test that a shingle size below one is rejected"""
+        for shingle_size in (0, -2, 1.5, True):
+            with self.assertRaises(ValueError):
+                compare_responses(self.responses, shingle_size=shingle_size)
+            response = self.client.post('/api/compare', data=json.dumps({
+                'responses': self.responses, 'shingle_size': shingle_size
+            }), content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        print("✅ Shingle sizes below one are rejected with a 400")
+
+    def test_hunks_rebuild_the_other_response(self):
+        """Test that applying the hunks to one text yields the other, repeated words included"""
+        rng = random.Random(11)
+        for _ in range(200):
+            words = [str(n) for n in range(rng.choice((3, 30, 300)))]
+            a = [rng.choice(words) for _ in range(rng.randint(0, 60))]
+            b = list(a) if rng.random() < 0.7 else [rng.choice(words) for _ in range(rng.randint(0, 60))]
+            for _ in range(rng.randint(0, 8)):
+                b.insert(rng.randint(0, len(b)), rng.choice(words))
+                del b[rng.randrange(len(b))]
+            rebuilt, position = [], 0
+            for hunk in diff_hunks(' '.join(a), ' '.join(b)):
+                start, end = hunk['a_range']
+                rebuilt += a[position:start] + b[hunk['b_range'][0]:hunk['b_range'][1]]
+                position = end
+            self.assertEqual(rebuilt + a[position:], b)
+        print("✅ Diff hunks rebuild the other response")
+
+    def test_scales_to_many_long_responses(self):
+        """Test that ten 3000-word responses compare well under 100 ms"""
+        # Word frequencies follow Zipf's law, as in natural text
+        rng = random.Random(7)
+        vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10)))
+                      for _ in range(8000)]
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+        base = rng.choices(vocabulary, weights, k=3000)
+        responses = {}
+        for i in range(10):
+            text = list(base)
+            for position, word in zip(rng.sample(range(len(text)), 300), rng.choices(vocabulary, weights, k=300)):
+                text[position] = word
+            responses[f'model{i}'] = {'content': ' '.join(text), 'status': 'success'}
+
+        # Best of five, so a busy test machine does not decide the outcome
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            result = compare_responses(responses)
+            timings.append(time.perf_counter() - start)
+        self.assertLess(min(timings), 0.1)
+        self.assertGreater(min(result['agreement'].values()), 0.5)
+        self.assertEqual(len(result['diffs']), 9)
+        self.assertTrue(all(diff['hunks'] for diff in result['diffs']))
+        print("✅ Ten 3000-word responses compare in under 100 ms")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Response Similarity ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSimilarity)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
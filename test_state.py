@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+Test script for the shared state backends
+"""
+
+import unittest
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch
+from app import app
+from routes import providers, state as state_module
+from routes.conversations import ConversationStore
+from routes.metrics import merge_snapshots
+from routes.state import MemoryBackend, SQLiteBackend, TokenBucket, CircuitBreaker, SharedCache, SingleFlight
+
+
+def _increment(path, times):
+    """Increment a shared counter from a separate process."""
+    backend = SQLiteBackend(path)
+    for _ in range(times):
+        backend.incr('counter')
+
+
+class TestState(unittest.TestCase):
+    """Test cases for shared state, limits and breakers"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'state.sqlite3')
+
+    def tearDown(self):
+        """Remove the temporary database"""
+        self.tmpdir.cleanup()
+
+    def test_backends_share_the_interface(self):
+        """Test get/set/update/scan and expiry on both local backends"""
+        for backend in (MemoryBackend(), SQLiteBackend(self.path)):
+            backend.set('a:1', {'x': 1})
+            backend.set('a:2', 2, ttl=-1)
+            self.assertEqual(backend.get('a:1'), {'x': 1})
+            self.assertIsNone(backend.get('a:2'))
+            self.assertEqual(backend.update('a:1', lambda v: dict(v, y=2)), {'x': 1, 'y': 2})
+            self.assertEqual(backend.incr('n', 5), 5)
+            self.assertEqual(backend.scan('a:'), {'a:1': {'x': 1, 'y': 2}})
+            self.assertTrue(backend.delete('a:1'))
+            self.assertFalse(backend.delete('a:1'))
+        print("✅ Memory and SQLite backends behave alike")
+
+    def test_sqlite_updates_are_atomic_across_processes(self):
+        """Test that concurrent workers never lose an increment"""
+        SQLiteBackend(self.path)
+        workers = [multiprocessing.Process(target=_increment, args=(self.path, 50)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(timeout=30)
+        self.assertEqual(SQLiteBackend(self.path).get('counter'), 200)
+        print("✅ SQLite state is shared atomically by several processes")
+
+    def test_token_bucket(self):
+        """Test that a bucket allows its burst and then refuses"""
+        backend = SQLiteBackend(self.path)
+        bucket = TokenBucket('client', rate=0.001, capacity=3, backend=backend)
+        self.assertEqual([bucket.acquire() for _ in range(4)], [True, True, True, False])
+        # Another worker sees the same bucket
+        other = TokenBucket('client', rate=0.001, capacity=3, backend=SQLiteBackend(self.path))
+        self.assertFalse(other.acquire())
+        print("✅ Token buckets are shared between workers")
+
+    def test_worker_id_per_process(self):
+        """Test that the worker id follows the process, so workers forked after import differ"""
+        first = state_module.worker_id()
+        self.assertEqual(state_module.worker_id(), first)
+        with patch('os.getpid', return_value=os.getpid() + 1):
+            forked = state_module.worker_id()
+        self.assertNotEqual(forked, first)
+        self.assertTrue(forked.endswith(f":{os.getpid() + 1}"))
+        self.assertEqual(state_module.worker_id(), first)
+        print("✅ Each worker process gets its own id")
+
+    def test_circuit_breaker(self):
+        """Test that repeated failures open the circuit and a trial call closes it"""
+        backend = MemoryBackend()
+        breaker = CircuitBreaker('provider', failure_threshold=2, reset_timeout=0, backend=backend)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state(), CircuitBreaker.OPEN)
+        # reset_timeout=0, so one trial call goes through
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state(), CircuitBreaker.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state(), CircuitBreaker.CLOSED)
+
+        slow_reset = CircuitBreaker('provider', failure_threshold=1, reset_timeout=60, backend=backend)
+        slow_reset.record_failure()
+        self.assertFalse(slow_reset.allow())
+        print("✅ Circuit breakers open, half-open and close")
+
+    def test_single_flight_across_workers(self):
+        """Test that two workers computing the same value make one call"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.3)
+            return {'summary': 'done'}
+
+        workers = [SingleFlight(SharedCache('summary', 60, SQLiteBackend(self.path)), poll_interval=0.02)
+                   for _ in range(2)]
+        results = []
+        threads = [threading.Thread(target=lambda flight=flight: results.append(flight.do('k', compute)))
+                   for flight in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True])
+        self.assertEqual(workers[1].do('k', compute), ({'summary': 'done'}, True))
+        print("✅ Single-flight computations are shared between workers")
+
+    def test_breaker_skips_failing_provider(self):
+        """Test that /api/query stops calling a provider whose circuit is open"""
+        module = providers.get_provider('mistral')
+        payload = {'query': 'Hello', 'api_keys': {'mistral': {'key': 'k'}}, 'dedup': False}
+        with patch('routes.state.state', MemoryBackend()), \
+                patch.object(module, 'call', side_effect=ConnectionError('connection refused')) as mock_call:
+            for _ in range(6):
+                response = self.client.post('/api/query', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(mock_call.call_count, 5)
+        self.assertEqual(json.loads(response.data)['mistral']['error_code'], 'provider_unavailable')
+        print("✅ An open circuit short-circuits provider calls")
+
+    def test_conversations_shared_through_backend(self):
+        """Test that two stores on one backend see the same conversation"""
+        first = ConversationStore(backend=SQLiteBackend(self.path))
+        second = ConversationStore(backend=SQLiteBackend(self.path))
+        conversation = first.create()
+        first.append_turn(conversation['id'], 'openai', 'Hi', 'Hello!')
+        second.finish_turn(conversation['id'])
+        self.assertEqual(second.history(conversation['id'], 'openai')[1]['content'], 'Hello!')
+        self.assertEqual(first.get(conversation['id'])['turns'], 1)
+        print("✅ Conversations are visible to every worker")
+
+    def test_shared_cache_and_metrics_merge(self):
+        """Test the namespaced cache and merging of worker metrics"""
+        cache = SharedCache('models', ttl_seconds=60, backend=MemoryBackend())
+        cache.set('http://localhost:8080/v1', {'model': 'llama'})
+        self.assertEqual(cache.get('http://localhost:8080/v1'), {'model': 'llama'})
+
+        snapshot = {'counters': [{'name': 'q', 'labels': {}, 'value': 2}], 'gauges': [],
+                    'observations': [{'name': 'ms', 'labels': {}, 'count': 1, 'sum': 5, 'min': 5, 'max': 5}]}
+        merged = merge_snapshots([snapshot, snapshot])
+        self.assertEqual(merged['counters'][0]['value'], 4)
+        self.assertEqual(merged['observations'][0]['count'], 2)
+        self.assertEqual(merged['observations'][0]['avg'], 5)
+
+        response = self.client.get('/api/metrics?scope=cluster')
+        self.assertEqual(len(json.loads(response.data)['workers']), 1)
+        print("✅ Shared cache works and worker metrics merge")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Shared State ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestState)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
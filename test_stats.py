@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+"""
+Test script for the provider performance leaderboard
+"""
+
+import unittest
+import json
+import sys
+import time
+from unittest.mock import patch
+from app import app
+from routes import providers
+from routes.dispatch import make_plan
+from routes.state import MemoryBackend, state
+from routes.stats import LATENCY_BUCKETS, ProviderStats, provider_stats
+
+
+def has_pandas():
+    """Whether pandas is importable."""
+    try:
+        import pandas  # noqa: F401
+    except Exception:
+        return False
+    return True
+
+
+def success(content='Paris is the capital of France.', usage=None):
+    """Successful provider result."""
+    return {'content': content, 'model': 'mistral-large-latest', 'status': 'success',
+            'usage': usage or {'prompt_tokens': 100, 'completion_tokens': 20}}
+
+
+class TestStats(unittest.TestCase):
+    """Test cases for hourly rollups and the /api/stats leaderboard"""
+
+    def setUp(self):
+        """Set up a test client and an empty store"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.stats = ProviderStats(backend=MemoryBackend())
+        self.plan = make_plan('mistral', 'mistral', {'key': 'k'}, 'Capital of France?')
+        self.now = time.time()
+
+    def test_rollups(self):
+        """Test that calls are folded into one rollup per hour, target and model"""
+        self.stats.record(self.plan, success(), 0.8, now=self.now)
+        self.stats.record(self.plan, success(), 1.2, now=self.now)
+        self.stats.record(self.plan, {'status': 'error', 'error_code': 'rate_limit'}, 0.1, now=self.now)
+        self.stats.record(self.plan, {'status': 'cancelled'}, 0.1, now=self.now)
+        self.stats.record(self.plan, success(), 2.0, now=self.now - 7200)
+
+        rollups = sorted(self.stats.rollups(), key=lambda rollup: rollup['hour'])
+        self.assertEqual(len(rollups), 2)
+        current = rollups[1]
+        self.assertEqual((current['provider'], current['model']), ('mistral', 'mistral-large-latest'))
+        self.assertEqual((current['calls'], current['successes']), (3, 2))
+        self.assertEqual(current['errors'], {'rate_limit': 1})
+        self.assertEqual(sum(current['latency_buckets']), 2)
+        self.assertEqual(len(current['latency_buckets']), len(LATENCY_BUCKETS))
+        self.assertEqual((current['prompt_tokens'], current['completion_tokens']), (200, 40))
+        self.assertGreater(current['cost'], 0)
+        print("✅ Calls are rolled up hourly")
+
+    def test_calls_are_recorded(self):
+        """Test that provider calls made by /api/query reach the shared rollups"""
+        def totals():
+            rollups = provider_stats.rollups()
+            return (sum(rollup['calls'] for rollup in rollups),
+                    sum(rollup['completion_tokens'] for rollup in rollups))
+
+        calls, completion_tokens = totals()
+        with patch.object(providers.get_provider('mistral'), 'call', return_value=success(usage={})):
+            self.client.post('/api/query', data=json.dumps({
+                'query': 'Capital of France?', 'dedup': False, 'api_keys': {'mistral': {'key': 'k'}}
+            }), content_type='application/json')
+        after_calls, after_tokens = totals()
+        self.assertEqual(after_calls, calls + 1)
+        # Without usage the tokens are counted from the content
+        self.assertGreater(after_tokens, completion_tokens)
+        print("✅ Provider calls are recorded")
+
+    @unittest.skipUnless(has_pandas(), "pandas is not installed")
+    def test_leaderboard(self):
+        """Test the leaderboard columns and rolling windows"""
+        for seconds in [0.3] * 18 + [5.0, 50.0]:
+            self.stats.record(self.plan, success(), seconds, now=self.now)
+        self.stats.record(self.plan, {'status': 'error', 'error_code': 'timeout'}, 30.0, now=self.now)
+        self.stats.record(self.plan, success(), 1.0, now=self.now - 3 * 86400)
+
+        row, = self.stats.leaderboard('24h', now=self.now)['rows']
+        self.assertEqual(row['calls'], 21)
+        self.assertAlmostEqual(row['success_rate'], 20 / 21, places=3)
+        self.assertTrue(0.25 <= row['p50_latency_s'] <= 0.5)
+        self.assertTrue(4.0 <= row['p95_latency_s'] <= 6.0)
+        self.assertEqual(row['errors'], {'timeout': 1})
+        self.assertGreater(row['tokens_per_second'], 0)
+        self.assertAlmostEqual(row['cost_per_call'], row['cost'] / 21, places=6)
+
+        self.assertEqual(self.stats.leaderboard('7d', now=self.now)['rows'][0]['calls'], 22)
+        self.assertEqual(len(self.stats.leaderboard('7d', hourly=True, now=self.now)['hourly']), 2)
+        self.assertEqual(self.stats.leaderboard('24h', provider='openai', now=self.now)['rows'], [])
+        with self.assertRaises(ValueError):
+            self.stats.leaderboard('1y')
+        print("✅ Leaderboard is computed from the rollups")
+
+    @unittest.skipUnless(has_pandas(), "pandas is not installed")
+    def test_endpoint(self):
+        """Test /api/stats and its validation"""
+        response = self.client.get('/api/stats?window=1h&hourly=1')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['window'], '1h')
+        self.assertIn('hourly', data)
+        print("✅ /api/stats serves the leaderboard")
+
+    def test_endpoint_errors(self):
+        """Test that bad options are rejected before pandas loads, and a missing pandas is a 503"""
+        self.assertIs(provider_stats.backend, state)
+        with patch.dict(sys.modules, {'pandas': None}):
+            self.assertEqual(self.client.get('/api/stats?window=1y').status_code, 400)
+            self.assertEqual(self.client.get('/api/stats?sort=color').status_code, 400)
+            response = self.client.get('/api/stats?window=1h')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(json.loads(response.data)['error_code'], 'dependency_unavailable')
+        print("✅ /api/stats separates bad options from a missing pandas")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Provider Stats ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStats)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
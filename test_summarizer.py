@@ -4,8 +4,11 @@ Test script for the aiSpectrum summarizer module
 """
 
 import unittest
+import threading
+import time
 from unittest.mock import patch, MagicMock
 from routes.summarizer import ResponseSummarizer, summarize_responses
+from routes.state import MemoryBackend, SharedCache, SingleFlight
 import os
 from dotenv import load_dotenv
 
@@ -31,6 +34,12 @@ class TestSummarizer(unittest.TestCase):
                 "status": "success"
             }
         }
+        # A private summary cache for each test
+        flight = SingleFlight(SharedCache('summary', 60, MemoryBackend()),
+                              should_cache=lambda summary: summary.get("status") == "success")
+        patcher = patch('routes.summarizer.summary_flight', flight)
+        patcher.start()
+        self.addCleanup(patcher.stop)
     
     def test_format_responses(self):
         """Test the _format_responses_for_prompt method"""
@@ -116,6 +125,55 @@ class TestSummarizer(unittest.TestCase):
             self.assertEqual(result["content"], "Summary content")
             print("✅ summarize_responses helper function works correctly")
 
+    def test_summaries_are_cached(self):
+        """Test that identical summaries are reused until the responses change or a refresh"""
+        summary = {"content": "Paris.", "model": "meta-summarizer", "status": "success"}
+        with patch.object(ResponseSummarizer, 'generate', return_value=summary) as mock_generate:
+            summarizer = ResponseSummarizer("mock_key")
+            first = summarizer.summarize(self.test_query, self.test_responses)
+            second = summarizer.summarize(self.test_query, dict(reversed(list(self.test_responses.items()))))
+            self.assertEqual(mock_generate.call_count, 1)
+            self.assertFalse(first["cached"])
+            self.assertTrue(second["cached"])
+            self.assertEqual(second["content"], "Paris.")
+            
+            changed = dict(self.test_responses, model2=dict(self.test_responses["model2"], content="Lyon."))
+            summarizer.summarize(self.test_query, changed)
+            ResponseSummarizer(None).summarize(self.test_query, self.test_responses)
+            summarizer.summarize(self.test_query, self.test_responses, refresh=True)
+            self.assertEqual(mock_generate.call_count, 4)
+        print("✅ Summaries are cached by content, backend and refresh")
+    
+    def test_failed_summaries_not_cached(self):
+        """Test that a failed summary is generated again on the next request"""
+        error = {"content": "Error generating summary", "model": "meta-summarizer", "status": "error"}
+        with patch.object(ResponseSummarizer, 'generate', return_value=error) as mock_generate:
+            summarizer = ResponseSummarizer("mock_key")
+            summarizer.summarize(self.test_query, self.test_responses)
+            summarizer.summarize(self.test_query, self.test_responses)
+        self.assertEqual(mock_generate.call_count, 2)
+        print("✅ Failed summaries are not cached")
+    
+    def test_concurrent_summaries_share_one_call(self):
+        """Test that simultaneous identical requests make a single summarizer call"""
+        def slow_generate(query, responses):
+            time.sleep(0.2)
+            return {"content": "Paris.", "model": "meta-summarizer", "status": "success"}
+        
+        results = []
+        with patch.object(ResponseSummarizer, 'generate', side_effect=slow_generate) as mock_generate:
+            threads = [threading.Thread(target=lambda: results.append(
+                ResponseSummarizer("mock_key").summarize(self.test_query, self.test_responses)))
+                for _ in range(5)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(mock_generate.call_count, 1)
+        self.assertEqual([r["content"] for r in results], ["Paris."] * 5)
+        self.assertEqual(sum(not r["cached"] for r in results), 1)
+        print("✅ Concurrent identical summaries share one call")
+
 def run_tests():
     """Run the test cases"""
     print("\n=== Testing Summarizer Module ===")
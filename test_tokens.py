@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Test script for pre-flight token estimation and request budgets
+"""
+
+import unittest
+import json
+from unittest.mock import patch
+from app import app
+from routes import providers, tokens
+
+
+class TestTokens(unittest.TestCase):
+    """Test cases for token estimation, budgets and /api/estimate"""
+
+    def setUp(self):
+        """Set up test fixtures"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def _post(self, path, payload):
+        response = self.client.post(path, data=json.dumps(payload), content_type='application/json')
+        return response.status_code, json.loads(response.data)
+
+    def test_tokenizers_are_cached_per_family(self):
+        """Test tokenizer lookup and caching by model family"""
+        self.assertEqual(tokens.model_family('openai', 'gpt-4o'), 'openai-o200k')
+        self.assertEqual(tokens.model_family('anthropic', 'claude-3-haiku-20240307'), 'claude')
+        self.assertEqual(tokens.model_family('local', 'llama-3-8b-instruct'), 'llama')
+        self.assertIs(tokens.get_tokenizer('claude'), tokens.get_tokenizer('claude'))
+        self.assertGreater(tokens.get_tokenizer('claude').count('Hello there, how are you?'), 0)
+        print("✅ Tokenizers resolve and cache per model family")
+
+    def test_resolve_max_tokens(self):
+        """Test output caps come from the model table instead of hard-coded values"""
+        self.assertEqual(tokens.resolve_max_tokens('anthropic', 'claude-3-opus-20240229'), 4096)
+        self.assertEqual(tokens.resolve_max_tokens('anthropic', 'claude-3-opus-20240229', 100000), 4096)
+        self.assertEqual(tokens.resolve_max_tokens('azure', 'gpt-4', 4096, prompt_tokens=6000), 2192)
+        self.assertIsNone(tokens.resolve_max_tokens('openai', 'gpt-4o'))
+        print("✅ max_tokens is resolved per model")
+
+    def test_estimate_endpoint(self):
+        """Test /api/estimate returns per-model estimates and totals"""
+        status, data = self._post('/api/estimate', {
+            'query': 'Explain quicksort in detail.',
+            'api_keys': {'openai': {'model': 'gpt-4o'}, 'anthropic': {'model': 'claude-3-haiku-20240307'}}
+        })
+        self.assertEqual(status, 200)
+        self.assertEqual(set(data['estimates']), {'openai', 'anthropic'})
+        self.assertEqual(data['estimates']['openai']['plan'], 'run')
+        self.assertGreater(data['totals']['estimated_cost'], 0)
+        print("✅ /api/estimate reports tokens, cost and latency")
+
+    def test_cost_budget_skips_expensive_models(self):
+        """Test that the cost budget keeps the cheapest models"""
+        status, data = self._post('/api/estimate', {
+            'query': 'Hello',
+            'api_keys': {'anthropic': {'model': 'claude-3-opus-20240229'}, 'gemini': {'model': 'gemini-1.5-flash'}},
+            'budget': {'max_cost': 0.005}
+        })
+        self.assertEqual(data['estimates']['gemini']['plan'], 'run')
+        self.assertEqual(data['estimates']['anthropic']['plan'], 'skipped')
+        print("✅ Cost budgets skip expensive models")
+
+    def test_oversized_prompt_rejected_before_network(self):
+        """Test that an oversized prompt is rejected without calling the provider"""
+        module = providers.get_provider('mistral')
+        with patch.object(module, 'call') as mock_call:
+            status, data = self._post('/api/query', {
+                'query': 'word ' * 5000,
+                'api_keys': {'mistral': {'key': 'k'}},
+                'budget': {'max_prompt_tokens': 1000}
+            })
+        mock_call.assert_not_called()
+        self.assertEqual(data['mistral']['status'], 'error')
+        self.assertEqual(data['mistral']['error_code'], 'budget_exceeded')
+        print("✅ Oversized prompts are rejected before any network call")
+
+    def test_oversized_prompt_trimmed(self):
+        """Test that on_overflow='trim' shortens the query to fit"""
+        module = providers.get_provider('mistral')
+        result = {'content': 'ok', 'model': 'mistral-large-latest', 'status': 'success'}
+        with patch.object(module, 'call', return_value=result) as mock_call:
+            self._post('/api/query', {
+                'query': 'word ' * 5000,
+                'api_keys': {'mistral': {'key': 'k'}},
+                'budget': {'max_prompt_tokens': 1000, 'on_overflow': 'trim'}
+            })
+        sent_query = mock_call.call_args.args[0]
+        self.assertLessEqual(tokens.get_tokenizer('mistral').count(sent_query), 1000)
+        print("✅ Oversized prompts can be trimmed to the budget")
+
+    def test_trim_that_misses_the_budget_is_rejected(self):
+        """Test that a trimmed prompt is re-estimated and rejected if it still does not fit"""
+        with patch.object(tokens, 'trim_query', side_effect=lambda query, *args: query[:len(query) * 9 // 10]):
+            status, data = self._post('/api/estimate', {
+                'query': 'word ' * 5000,
+                'api_keys': {'mistral': {'key': 'k'}},
+                'budget': {'max_prompt_tokens': 1000, 'on_overflow': 'trim'}
+            })
+        self.assertEqual(status, 200)
+        self.assertEqual(data['estimates']['mistral']['plan'], 'error')
+        self.assertIn('after trimming', data['estimates']['mistral']['reason'])
+        print("✅ Trimmed prompts are checked against the budget again")
+
+    def test_invalid_numeric_options(self):
+        """Test that malformed numeric options are rejected with 400 instead of failing"""
+        api_keys = {'mistral': {'key': 'k'}}
+        invalid = [
+            {'max_tokens': 'lots'}, {'max_tokens': -5}, {'history_token_budget': 'x'},
+            {'dedup_threshold': 'high'}, {'dedup_threshold': 2}, {'budget': {'max_cost': 'cheap'}},
+            {'budget': {'max_prompt_tokens': 0}}, {'budget': {'on_overflow': 'explode'}}, {'budget': 5},
+            {'api_keys': {'mistral': {'key': 'k', 'max_response_bytes': 'big'}}}
+        ]
+        for path in ('/api/query', '/api/estimate'):
+            for options in invalid:
+                status, data = self._post(path, dict({'query': 'Hi', 'api_keys': api_keys}, **options))
+                self.assertEqual(status, 400, (path, options))
+                self.assertEqual(data['error_code'], 'invalid_request')
+        print("✅ Malformed numeric options are rejected")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Token Estimation ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTokens)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
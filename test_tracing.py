@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Test script for request tracing
+"""
+
+import unittest
+import json
+import logging
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from app import app
+from routes import http_client, providers, tracing
+from routes.error_handler import handle_api_error
+from routes.tracing import SpanExporter, TraceContextFilter
+
+
+class JSONHandler(BaseHTTPRequestHandler):
+    """Stand-in provider host answering every GET with a small JSON body"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestTracing(unittest.TestCase):
+    """Test cases for spans, propagation and export"""
+
+    def setUp(self):
+        """Set up a client and an exporter writing to a temporary file"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.exporter = SpanExporter(path=os.path.join(self.tmpdir.name, 'spans.jsonl'), interval=60)
+        patcher = patch('routes.tracing.exporter', self.exporter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Remove the exported spans"""
+        self.tmpdir.cleanup()
+
+    def _spans(self):
+        self.exporter.flush()
+        spans = []
+        with open(self.exporter.path) as f:
+            for line in f:
+                for resource in json.loads(line)['resourceSpans']:
+                    for scope in resource['scopeSpans']:
+                        spans.extend(scope['spans'])
+        return spans
+
+    def test_query_spans_link_provider_calls(self):
+        """Test that provider calls and their HTTP requests are children of the request span"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), JSONHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/v1/chat"
+
+        def fake_call(query, config, history=None):
+            http_client.get(url, timeout=5).json()
+            return {'content': 'Paris.', 'model': 'm', 'status': 'success'}
+
+        parent = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+        payload = {'query': 'Capital of France?', 'dedup': False,
+                   'api_keys': {'mistral': {'key': 'k'}, 'cohere': {'key': 'k'}}}
+        try:
+            with patch.object(providers.get_provider('mistral'), 'call', side_effect=fake_call), \
+                    patch.object(providers.get_provider('cohere'), 'call', side_effect=fake_call):
+                response = self.client.post('/api/query', data=json.dumps(payload), content_type='application/json',
+                                            headers={'traceparent': parent})
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        trace_id = response.headers['X-Trace-Id']
+        self.assertEqual(trace_id, '0af7651916cd43dd8448eb211c80319c')
+        exported = self._spans()
+        spans = {span['name']: span for span in exported}
+        root = spans['POST /api/query']
+        self.assertEqual(root['parentSpanId'], 'b7ad6b7169203331')
+        self.assertTrue(response.headers['traceparent'].endswith(f"{root['spanId']}-01"))
+        for key in ('mistral', 'cohere'):
+            self.assertEqual(spans[f'provider {key}']['traceId'], trace_id)
+            self.assertEqual(spans[f'provider {key}']['parentSpanId'], root['spanId'])
+        http_spans = [span for span in exported if span['name'].startswith('HTTP GET')]
+        provider_ids = {spans['provider mistral']['spanId'], spans['provider cohere']['spanId']}
+        self.assertEqual(len(http_spans), 2)
+        self.assertTrue(all(span['parentSpanId'] in provider_ids for span in http_spans))
+        print("✅ Provider calls and HTTP requests are spans of the request's trace")
+
+    def test_gemini_fallback_attempts(self):
+        """Test that each Gemini model attempt is a span and keys never reach the exported errors"""
+        module = providers.get_provider('gemini')
+        failure = Exception("404 Client Error for url: https://example.com/v1/models/x:generateContent?key=SECRET")
+        success = {'candidates': [{'content': {'parts': [{'text': 'Paris.'}]}}]}
+        with patch.object(module.http_client, 'post_json_prefix', side_effect=[failure, (success, False)]), \
+                tracing.start_span('test'):
+            result = module.call('Capital of France?', {'key': 'SECRET', 'model': 'gemini-1.5-pro'})
+        self.assertEqual(result['status'], 'success')
+
+        attempts = [span for span in self._spans() if span['name'] == 'gemini model attempt']
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(attempts[0]['status']['code'], tracing.STATUS_ERROR)
+        self.assertNotIn('SECRET', attempts[0]['status']['message'])
+        self.assertEqual(attempts[1]['status']['code'], tracing.STATUS_UNSET)
+        print("✅ Gemini fallbacks are traced without leaking keys")
+
+    def test_trace_ids_in_logs_and_errors(self):
+        """Test that log records and error results carry the current trace id"""
+        trace_filter = TraceContextFilter()
+        with tracing.start_span('work') as span:
+            record = logging.LogRecord('aiSpectrum', logging.INFO, __file__, 1, 'message', None, None)
+            trace_filter.filter(record)
+            error = handle_api_error(Exception("boom"), 'openai', 'OpenAI')
+        self.assertEqual(record.trace_id, span.trace_id)
+        self.assertEqual(record.span_id, span.span_id)
+        self.assertEqual(error['request_id'], span.trace_id)
+        print("✅ Logs and error results carry the trace id")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Tracing ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTracing)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Test script for connection and DNS pre-warming
+"""
+
+import unittest
+import json
+import os
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+from app import app
+from routes import http_client, warmup
+from routes.http_client import DNSCache
+from routes.warmup import run_warmup, start_warmup, warmup_state
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Stand-in provider host that counts the TCP connections it accepts"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _reply(self, body=b''):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        return body
+
+    def do_HEAD(self):
+        self._reply()
+
+    def do_GET(self):
+        self.wfile.write(self._reply(json.dumps({'host': self.headers['Host']}).encode()))
+
+
+class TestWarmup(unittest.TestCase):
+    """Test cases for warm-up and readiness"""
+
+    def setUp(self):
+        """Start a stand-in host"""
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        self.server.connections = 0
+        self.server.lock = threading.Lock()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.origin = f"http://localhost:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        """Stop the stand-in host and reset warm-up state"""
+        self.server.shutdown()
+        self.server.server_close()
+        warmup_state.status = 'disabled'
+        warmup_state.hosts = {}
+
+    def test_warmup_opens_reusable_connections(self):
+        """Test that warm-up leaves keep-alive connections for later requests"""
+        getaddrinfo = socket.getaddrinfo
+        state = run_warmup([self.origin], connections=3, timeout=5)
+        self.assertIs(socket.getaddrinfo, getaddrinfo)
+        report = state.hosts[self.origin]
+        self.assertIsNone(report['error'])
+        self.assertEqual(report['connections'], 3)
+        self.assertEqual(self.server.connections, 3)
+
+        # Requests after warm-up reuse the pooled connections
+        for _ in range(3):
+            http_client.get(f"{self.origin}/v1/models", timeout=5).json()
+        self.assertEqual(self.server.connections, 3)
+        print("✅ Warm-up opens keep-alive connections that later requests reuse")
+
+    def test_dns_cache(self):
+        """Test that lookups of warmed hosts are cached and others are not"""
+        calls = []
+
+        def resolve(host, *args):
+            calls.append(host)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.0.2.1', 443))]
+
+        cache = DNSCache(ttl_seconds=60, resolver=resolve)
+        cache.add_host('api.example.com')
+        self.assertEqual(cache.addresses('api.example.com', 443), ['192.0.2.1'])
+        self.assertEqual(cache.addresses('api.example.com', 443), ['192.0.2.1'])
+        self.assertIsNone(cache.addresses('other.example.com', 443))
+        self.assertEqual(calls, ['api.example.com'])
+        print("✅ DNS lookups of warmed hosts are cached")
+
+    def test_pooled_connections_use_cached_addresses(self):
+        """Test that the HTTP client connects a registered host to its cached address, keeping its name"""
+        def resolve(host, port, *args):
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+
+        cache = DNSCache(resolver=resolve)
+        cache.add_host('provider.invalid')
+        port = self.server.server_address[1]
+        with patch.object(http_client, 'dns_cache', cache):
+            response = http_client.get(f"http://provider.invalid:{port}/v1/models", timeout=5)
+        # .invalid never resolves, so the connection can only have come from the cache
+        self.assertEqual(response.json()['host'], f"provider.invalid:{port}")
+        print("✅ Pooled connections use the DNS cache without patching socket")
+
+    def test_warmup_starts_once_per_worker(self):
+        """Test that warm-up starts in each worker process, not in the process that created the app"""
+        with patch.object(warmup, 'run_warmup') as mock_run, patch.object(warmup, '_warmup_pid', None):
+            self.assertTrue(start_warmup())
+            self.assertFalse(start_warmup())
+            # A worker forked from it has a new pid and warms itself
+            with patch('os.getpid', return_value=os.getpid() + 1):
+                self.assertTrue(start_warmup())
+            deadline = time.time() + 2
+            while mock_run.call_count < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(mock_run.call_count, 2)
+        print("✅ Warm-up starts once in each worker process")
+
+    def test_readiness_endpoint(self):
+        """Test that readiness is 503 until warm-up finishes"""
+        warmup_state.status = 'warming'
+        response = self.client.get('/api/health/ready')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.client.get('/api/health').status_code, 200)
+
+        run_warmup([self.origin, 'http://127.0.0.1:9'], connections=1, timeout=1)
+        response = self.client.get('/api/health/ready')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['ready'])
+        self.assertIsNone(data['hosts'][self.origin]['error'])
+        self.assertIsNotNone(data['hosts']['http://127.0.0.1:9']['error'])
+        print("✅ /api/health/ready reports readiness once warm")
+
+
+def run_tests():
+    """Run the test cases"""
+    print("\n=== Testing Warm-up ===")
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestWarmup)
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+if __name__ == "__main__":
+    run_tests()